@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+import numpy as np
 from app.database import get_db
 from app.models.user import User
 from app.models.realization import Realization, RealizationItem
@@ -13,80 +14,86 @@ from app.models.shipment import Shipment
 from app.models.inventory import Inventory
 from app.auth.security import get_current_user
 from app.auth.permissions import get_user_companies
+from app.services.revenue_forecast import (
+    get_company_forecasts, forecast_months, CONFIDENCE_Z, MAX_HORIZON, TOTAL
+)
+from app.services.abc_xyz import abc_xyz_analysis as analyze_abc_xyz
+from app.services.period_comparison import period_metrics, metric_changes, shift_year
+from app.schemas.analytics import PeriodComparisonRequest
+from app.utils.periods import PERIOD_WEEK, PERIOD_MONTH, whole_months
+from app.services.cohorts import cohort_analysis, SOURCE_REALIZATIONS
 
 router = APIRouter()
 
 @router.get("/forecast/revenue")
 def forecast_revenue(
-    months: int = Query(3, ge=1, le=12),
+    months: int = Query(3, ge=1, le=MAX_HORIZON),
     company_id: Optional[int] = Query(None),
+    confidence: float = Query(0.95),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Прогноз выручки на основе исторических данных"""
-    # Получаем данные за последние N месяцев
-    end_date = date.today()
-    start_date = end_date - timedelta(days=months * 30)
-    
-    query = db.query(Realization).filter(
-        Realization.date >= start_date,
-        Realization.date <= end_date
-    )
+    """Прогноз выручки по месяцам (Холт-Винтерс) с доверительными интервалами, в целом и по каналам продаж"""
+    if confidence not in CONFIDENCE_Z:
+        raise HTTPException(status_code=400, detail=f"confidence должен быть одним из: {sorted(CONFIDENCE_Z)}")
+    z = CONFIDENCE_Z[confidence]
     
+    company_ids = None
     if current_user.role.value != "ADMIN":
-        user_company_ids = get_user_companies(current_user.id, db)
-        query = query.filter(Realization.company_id.in_(user_company_ids))
-    
+        company_ids = get_user_companies(current_user.id, db)
     if company_id:
-        query = query.filter(Realization.company_id == company_id)
+        company_ids = [company_id] if company_ids is None or company_id in company_ids else []
     
-    realizations = query.all()
+    forecasts = get_company_forecasts(db, company_ids)
     
-    # Группируем по месяцам
-    monthly_data: dict = {}
-    for r in realizations:
-        month_key = r.date.strftime('%Y-%m')
-        if month_key not in monthly_data:
-            monthly_data[month_key] = []
-        monthly_data[month_key].append(float(r.total_revenue))
+    # Сумма прогнозов по организациям; дисперсии ошибок складываются (ряды независимы)
+    def combine(key_models):
+        key_models = [model for model in key_models if model["method"] != "insufficient_data"]
+        if not key_models:
+            return None
+        forecast = sum(model["forecast"][:months] for model in key_models)
+        std = np.sqrt(sum(model["std"][:months] ** 2 for model in key_models))
+        history = sum(model["history"] for model in key_models)
+        return {
+            "forecast": forecast,
+            "lower": np.maximum(forecast - z * std, 0.0),
+            "upper": forecast + z * std,
+            "last_month_revenue": float(history[-1]),
+            "methods": sorted({model["method"] for model in key_models})
+        }
     
-    # Рассчитываем средний рост
-    months_list = sorted(monthly_data.keys())
-    if len(months_list) < 2:
+    total = combine([company["models"][TOTAL] for company in forecasts.values() if TOTAL in company["models"]])
+    if total is None:
         return {"forecast": [], "method": "insufficient_data", "message": "Недостаточно данных для прогноза"}
     
-    # Простое линейное прогнозирование
-    monthly_totals = [sum(monthly_data[m]) for m in months_list]
-    if len(monthly_totals) < 2:
-        return {"forecast": [], "method": "insufficient_data"}
-    
-    # Средний рост
-    growth_rates = []
-    for i in range(1, len(monthly_totals)):
-        if monthly_totals[i-1] > 0:
-            growth = (monthly_totals[i] - monthly_totals[i-1]) / monthly_totals[i-1]
-            growth_rates.append(growth)
+    target_months = forecast_months(date.today(), months)
     
-    avg_growth = sum(growth_rates) / len(growth_rates) if growth_rates else 0
-    last_month_revenue = monthly_totals[-1]
+    def rows(combined):
+        return [
+            {
+                "month": month.strftime('%Y-%m'),
+                "forecasted_revenue": round(float(combined["forecast"][i]), 2),
+                "lower_bound": round(float(combined["lower"][i]), 2),
+                "upper_bound": round(float(combined["upper"][i]), 2)
+            }
+            for i, month in enumerate(target_months)
+        ]
     
-    # Прогноз на следующие месяцы
-    forecast = []
-    current_date = datetime.strptime(months_list[-1], '%Y-%m').date()
-    for i in range(1, months + 1):
-        forecast_month = current_date + timedelta(days=30 * i)
-        forecast_revenue = last_month_revenue * (1 + avg_growth) ** i
-        forecast.append({
-            "month": forecast_month.strftime('%Y-%m'),
-            "forecasted_revenue": round(forecast_revenue, 2),
-            "growth_rate": round(avg_growth * 100, 2)
-        })
+    channel_ids = sorted({
+        key for company in forecasts.values() for key in company["models"] if key is not TOTAL
+    })
+    channels = []
+    for channel_id in channel_ids:
+        combined = combine([company["models"][channel_id] for company in forecasts.values() if channel_id in company["models"]])
+        if combined:
+            channels.append({"sales_channel_id": channel_id, "forecast": rows(combined)})
     
     return {
-        "forecast": forecast,
-        "method": "linear",
-        "average_growth": round(avg_growth * 100, 2),
-        "last_month_revenue": last_month_revenue
+        "forecast": rows(total),
+        "channels": channels,
+        "method": total["methods"][0] if len(total["methods"]) == 1 else "mixed",
+        "confidence": confidence,
+        "last_month_revenue": total["last_month_revenue"]
     }
 
 @router.get("/forecast/inventory")
@@ -132,6 +139,17 @@ def forecast_inventory(
     
     return {"forecasts": forecasts}
 
+MAX_COMPARISON_PERIODS = 60
+
+def _comparison_scope(company_id: Optional[int], current_user: User, db: Session) -> Optional[List[int]]:
+    """Организации для сравнения периодов (None - все, для администратора)"""
+    company_ids = None
+    if current_user.role.value != "ADMIN":
+        company_ids = get_user_companies(current_user.id, db)
+    if company_id:
+        company_ids = [company_id] if company_ids is None or company_id in company_ids else []
+    return company_ids
+
 @router.get("/comparison/periods")
 def compare_periods(
     period1_start: date = Query(...),
@@ -143,49 +161,11 @@ def compare_periods(
     current_user: User = Depends(get_current_user)
 ):
     """Сравнение двух периодов"""
-    def get_period_data(start: date, end: date):
-        # Выручка
-        revenue_query = db.query(func.sum(Realization.total_revenue)).filter(
-            Realization.date >= start,
-            Realization.date <= end
-        )
-        
-        # Расходы
-        expense_query = db.query(func.sum(MoneyMovement.amount)).filter(
-            MoneyMovement.date >= start,
-            MoneyMovement.date <= end,
-            MoneyMovement.movement_type == 'expense',
-            MoneyMovement.is_business == True
-        )
-        
-        if current_user.role.value != "ADMIN":
-            user_company_ids = get_user_companies(current_user.id, db)
-            revenue_query = revenue_query.filter(Realization.company_id.in_(user_company_ids))
-            expense_query = expense_query.filter(MoneyMovement.company_id.in_(user_company_ids))
-        
-        if company_id:
-            revenue_query = revenue_query.filter(Realization.company_id == company_id)
-            expense_query = expense_query.filter(MoneyMovement.company_id == company_id)
-        
-        revenue = revenue_query.scalar() or 0
-        expenses = expense_query.scalar() or 0
-        profit = float(revenue) - float(expenses)
-        
-        return {
-            "revenue": float(revenue),
-            "expenses": float(expenses),
-            "profit": profit,
-            "margin": (profit / float(revenue) * 100) if revenue > 0 else 0
-        }
-    
-    period1 = get_period_data(period1_start, period1_end)
-    period2 = get_period_data(period2_start, period2_end)
-    
-    # Рассчитываем изменения
-    def calc_change(old_val: float, new_val: float):
-        if old_val == 0:
-            return 100 if new_val > 0 else 0
-        return ((new_val - old_val) / old_val) * 100
+    period1, period2 = period_metrics(
+        db,
+        _comparison_scope(company_id, current_user, db),
+        [(period1_start, period1_end), (period2_start, period2_end)]
+    )
     
     return {
         "period1": {
@@ -198,110 +178,108 @@ def compare_periods(
             "start": period2_start.isoformat(),
             "end": period2_end.isoformat()
         },
-        "changes": {
-            "revenue": round(calc_change(period1["revenue"], period2["revenue"]), 2),
-            "expenses": round(calc_change(period1["expenses"], period2["expenses"]), 2),
-            "profit": round(calc_change(period1["profit"], period2["profit"]), 2),
-            "margin": round(period2["margin"] - period1["margin"], 2)
-        }
+        "changes": metric_changes(period1, period2)
     }
 
+@router.post("/comparison/periods")
+def compare_many_periods(
+    request: PeriodComparisonRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Сравнение произвольного набора периодов (например, 12 месяцев с теми же месяцами прошлого года).
+    Все показатели всех периодов считаются одним запросом.
+    """
+    if not request.periods:
+        raise HTTPException(status_code=400, detail="Не указаны периоды")
+    if len(request.periods) * (2 if request.previous_year else 1) > MAX_COMPARISON_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Слишком много периодов (не более {MAX_COMPARISON_PERIODS})")
+    if not 0 <= request.base_index < len(request.periods):
+        raise HTTPException(status_code=400, detail="base_index вне списка периодов")
+    for period in request.periods:
+        if period.start > period.end:
+            raise HTTPException(status_code=400, detail=f"Дата начала позже даты окончания: {period.start} - {period.end}")
+    
+    bounds = [(period.start, period.end) for period in request.periods]
+    if request.previous_year:
+        bounds += [(shift_year(start), shift_year(end)) for start, end in bounds]
+    metrics = period_metrics(db, _comparison_scope(request.company_id, current_user, db), bounds)
+    
+    base = metrics[request.base_index]
+    periods = []
+    for index, period in enumerate(request.periods):
+        current = metrics[index]
+        row = {
+            "label": period.label or f"{period.start.isoformat()} - {period.end.isoformat()}",
+            "start": period.start.isoformat(),
+            "end": period.end.isoformat(),
+            **current,
+            "changes": metric_changes(base, current)
+        }
+        if request.previous_year:
+            previous = metrics[len(request.periods) + index]
+            start, end = bounds[len(request.periods) + index]
+            row["previous_year"] = {**previous, "start": start.isoformat(), "end": end.isoformat()}
+            row["previous_year_changes"] = metric_changes(previous, current)
+        periods.append(row)
+    
+    return {"periods": periods, "base_index": request.base_index}
+
 @router.get("/abc-xyz-analysis")
 def abc_xyz_analysis(
     company_id: Optional[int] = Query(None),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    period: str = Query(PERIOD_WEEK, pattern="^(week|month)$"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """ABC/XYZ анализ товаров"""
-    if not start_date:
-        start_date = date.today() - timedelta(days=90)
-    if not end_date:
-        end_date = date.today()
-    
-    # Получаем данные о продажах товаров
-    query = db.query(
-        Product.id,
-        Product.name,
-        Product.sku,
-        func.sum(RealizationItem.quantity).label('total_quantity'),
-        func.sum(RealizationItem.price * RealizationItem.quantity).label('total_revenue')
-    ).join(
-        RealizationItem, Product.id == RealizationItem.product_id
-    ).join(
-        Realization, RealizationItem.realization_id == Realization.id
-    ).filter(
-        Realization.date >= start_date,
-        Realization.date <= end_date
-    ).group_by(Product.id, Product.name, Product.sku)
+    """ABC/XYZ анализ товаров: ABC по доле выручки, XYZ по коэффициенту вариации спроса по неделям или месяцам"""
+    # По умолчанию - 13 полных недель до сегодняшнего дня или 3 полных прошедших месяца
+    if period == PERIOD_MONTH:
+        if not end_date:
+            end_date = date.today().replace(day=1) - timedelta(days=1)
+        if not start_date:
+            start_date = whole_months(end_date, 3)[0]
+    else:
+        if not end_date:
+            end_date = date.today()
+        if not start_date:
+            start_date = end_date - timedelta(days=90)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="Дата начала позже даты окончания")
     
+    company_ids = None
     if current_user.role.value != "ADMIN":
-        user_company_ids = get_user_companies(current_user.id, db)
-        query = query.filter(Realization.company_id.in_(user_company_ids))
-    
+        company_ids = get_user_companies(current_user.id, db)
     if company_id:
-        query = query.filter(Realization.company_id == company_id)
+        company_ids = [company_id] if company_ids is None or company_id in company_ids else []
     
-    products_data = query.all()
-    
-    if not products_data:
+    result = analyze_abc_xyz(db, company_ids, start_date, end_date, period)
+    if not result["analysis"]:
         return {"analysis": [], "message": "Нет данных для анализа"}
     
-    # Рассчитываем общую выручку
-    total_revenue = sum(float(p.total_revenue) for p in products_data)
-    
-    # ABC анализ (по выручке)
-    products_with_abc = []
-    cumulative_percent = 0
-    
-    sorted_by_revenue = sorted(products_data, key=lambda x: float(x.total_revenue), reverse=True)
-    
-    for i, product in enumerate(sorted_by_revenue):
-        revenue = float(product.total_revenue)
-        percent = (revenue / total_revenue * 100) if total_revenue > 0 else 0
-        cumulative_percent += percent
-        
-        # Классификация ABC
-        if cumulative_percent <= 80:
-            abc_class = 'A'
-        elif cumulative_percent <= 95:
-            abc_class = 'B'
-        else:
-            abc_class = 'C'
-        
-        products_with_abc.append({
-            "product_id": product.id,
-            "name": product.name,
-            "sku": product.sku,
-            "revenue": revenue,
-            "quantity": float(product.total_quantity),
-            "revenue_percent": round(percent, 2),
-            "cumulative_percent": round(cumulative_percent, 2),
-            "abc_class": abc_class
-        })
-    
-    # XYZ анализ (по стабильности спроса) - упрощенный
-    # В реальности нужен расчет коэффициента вариации
-    for product in products_with_abc:
-        # Упрощенная классификация XYZ
-        if product["revenue_percent"] > 5:
-            xyz_class = 'X'  # Стабильный спрос
-        elif product["revenue_percent"] > 1:
-            xyz_class = 'Y'  # Нестабильный спрос
-        else:
-            xyz_class = 'Z'  # Нерегулярный спрос
-        
-        product["xyz_class"] = xyz_class
-        product["abc_xyz"] = f"{product['abc_class']}{xyz_class}"
-    
     return {
-        "analysis": products_with_abc,
-        "total_products": len(products_with_abc),
-        "total_revenue": total_revenue,
+        **result,
         "period": {
             "start": start_date.isoformat(),
-            "end": end_date.isoformat()
+            "end": end_date.isoformat(),
+            "granularity": period
         }
     }
 
+@router.get("/cohorts")
+def customer_cohorts(
+    company_id: int = Query(...),
+    cohorts: int = Query(12, ge=1, le=60),
+    period: str = Query(PERIOD_MONTH, pattern="^(week|month)$"),
+    source: str = Query(SOURCE_REALIZATIONS, pattern="^(realizations|purchases)$"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Когортный анализ: удержание клиентов и выручка по когортам первой покупки"""
+    if current_user.role.value != "ADMIN" and company_id not in get_user_companies(current_user.id, db):
+        raise HTTPException(status_code=403, detail="Нет доступа к организации")
+    
+    return cohort_analysis(db, company_id, cohort_count=cohorts, source=source, period=period)
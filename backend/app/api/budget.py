@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import and_, or_, func as sql_func
 from datetime import datetime, date
 from typing import List, Optional
@@ -12,6 +12,9 @@ from app.models.reference import Company, IncomeItem, ExpenseItem
 from app.schemas.budget import BudgetCreate, BudgetUpdate, BudgetResponse, BudgetComparison
 from app.auth.security import get_current_user
 from app.utils.audit_logger import log_create, log_update, log_delete
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_BUDGET
+from app.services.budget_actuals import budget_actual_amounts
 
 router = APIRouter()
 
@@ -44,19 +47,22 @@ def get_budgets(
         except ValueError:
             raise HTTPException(status_code=400, detail=f"Invalid budget_type: {budget_type}")
     
-    budgets = query.order_by(Budget.period_value.desc(), Budget.created_at.desc()).offset(skip).limit(limit).all()
+    # Организация и статьи загружаются вместе с бюджетами (без запросов на каждую строку)
+    budgets = query.options(
+        joinedload(Budget.company),
+        joinedload(Budget.income_item),
+        joinedload(Budget.expense_item)
+    ).order_by(Budget.period_value.desc(), Budget.created_at.desc()).offset(skip).limit(limit).all()
     
     result = []
     for budget in budgets:
         try:
-            company = db.query(Company).filter(Company.id == budget.company_id).first()
+            company = budget.company
             item_name = None
             if budget.income_item_id:
-                item = db.query(IncomeItem).filter(IncomeItem.id == budget.income_item_id).first()
-                item_name = item.name if item else None
+                item_name = budget.income_item.name if budget.income_item else None
             elif budget.expense_item_id:
-                item = db.query(ExpenseItem).filter(ExpenseItem.id == budget.expense_item_id).first()
-                item_name = item.name if item else None
+                item_name = budget.expense_item.name if budget.expense_item else None
             
             # Безопасное получение значений enum'ов
             # Enum'ы не должны быть None в БД, но на всякий случай проверяем
@@ -85,6 +91,7 @@ def get_budgets(
                 income_item_id=budget.income_item_id,
                 expense_item_id=budget.expense_item_id,
                 planned_amount=float(budget.planned_amount) if budget.planned_amount is not None else 0.0,
+                actual_amount=float(budget.actual_amount) if budget.actual_amount is not None else None,
                 description=budget.description,
                 created_at=budget.created_at,
                 updated_at=budget.updated_at,
@@ -151,6 +158,7 @@ def create_budget(
             description=budget.description
         )
         db.add(db_budget)
+        mark_recommendations_dirty(db, db_budget.company_id, DOMAIN_BUDGET)
         db.commit()
         db.refresh(db_budget)
     except HTTPException:
@@ -227,6 +235,7 @@ def update_budget(
     if budget.description is not None:
         db_budget.description = budget.description
     
+    mark_recommendations_dirty(db, db_budget.company_id, DOMAIN_BUDGET)
     db.commit()
     db.refresh(db_budget)
     
@@ -279,6 +288,7 @@ def delete_budget(
                description=f"Удален бюджет ID: {budget_id}",
                ip_address=ip_address)
     
+    mark_recommendations_dirty(db, db_budget.company_id, DOMAIN_BUDGET)
     db.delete(db_budget)
     db.commit()
     return {"message": "Budget deleted"}
@@ -301,54 +311,28 @@ def get_budget_comparison(
     if period_value:
         query = query.filter(Budget.period_value == period_value)
     
-    budgets = query.all()
+    budgets = query.options(
+        joinedload(Budget.income_item),
+        joinedload(Budget.expense_item)
+    ).all()
+    # Факт по всем бюджетам - одним агрегирующим запросом
+    actuals = budget_actual_amounts(db, budgets)
     result = []
     
     for budget in budgets:
-        # Определяем период для факта
-        start_date, end_date = _get_period_dates(budget.period_type, budget.period_value)
-        
-        # Получаем фактические данные
-        actual_query = db.query(sql_func.coalesce(sql_func.sum(MoneyMovement.amount), 0))
-        
-        if budget.budget_type == BudgetType.INCOME:
-            actual_query = actual_query.filter(
-                and_(
-                    MoneyMovement.movement_type == "income",
-                    MoneyMovement.company_id == budget.company_id,
-                    MoneyMovement.date >= start_date,
-                    MoneyMovement.date <= end_date
-                )
-            )
-            if budget.income_item_id:
-                actual_query = actual_query.filter(MoneyMovement.income_item_id == budget.income_item_id)
-        else:  # EXPENSE
-            actual_query = actual_query.filter(
-                and_(
-                    MoneyMovement.movement_type == "expense",
-                    MoneyMovement.company_id == budget.company_id,
-                    MoneyMovement.date >= start_date,
-                    MoneyMovement.date <= end_date
-                )
-            )
-            if budget.expense_item_id:
-                actual_query = actual_query.filter(MoneyMovement.expense_item_id == budget.expense_item_id)
-        
-        actual_amount = float(actual_query.scalar() or 0)
+        actual_amount = actuals[budget.id]
         planned_amount = float(budget.planned_amount)
         deviation = actual_amount - planned_amount
         deviation_percent = (deviation / planned_amount * 100) if planned_amount > 0 else 0
         
-        # Получаем название статьи
+        # Название статьи
         item_name = None
         item_id = None
         if budget.income_item_id:
-            item = db.query(IncomeItem).filter(IncomeItem.id == budget.income_item_id).first()
-            item_name = item.name if item else None
+            item_name = budget.income_item.name if budget.income_item else None
             item_id = budget.income_item_id
         elif budget.expense_item_id:
-            item = db.query(ExpenseItem).filter(ExpenseItem.id == budget.expense_item_id).first()
-            item_name = item.name if item else None
+            item_name = budget.expense_item.name if budget.expense_item else None
             item_id = budget.expense_item_id
         
         result.append(BudgetComparison(
@@ -366,38 +350,3 @@ def get_budget_comparison(
     
     return result
 
-def _get_period_dates(period_type: BudgetPeriod, period_value: str) -> tuple[date, date]:
-    """Получить начальную и конечную даты периода"""
-    if period_type == BudgetPeriod.MONTH:
-        # period_value = "2024-01"
-        year, month = map(int, period_value.split("-"))
-        start_date = date(year, month, 1)
-        if month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, month + 1, 1)
-        # Вычитаем один день для конечной даты
-        from datetime import timedelta
-        end_date = end_date - timedelta(days=1)
-    elif period_type == BudgetPeriod.QUARTER:
-        # period_value = "2024-Q1"
-        year, quarter = period_value.split("-Q")
-        year = int(year)
-        quarter = int(quarter)
-        start_month = (quarter - 1) * 3 + 1
-        end_month = quarter * 3
-        start_date = date(year, start_month, 1)
-        if end_month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, end_month + 1, 1)
-        from datetime import timedelta
-        end_date = end_date - timedelta(days=1)
-    else:  # YEAR
-        # period_value = "2024"
-        year = int(period_value)
-        start_date = date(year, 1, 1)
-        end_date = date(year, 12, 31)
-    
-    return start_date, end_date
-
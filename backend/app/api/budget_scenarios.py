@@ -5,9 +5,10 @@ from app.database import get_db
 from app.models.user import User
 from app.models.budget_scenario import BudgetScenario
 from app.schemas.budget_scenario import (
-    BudgetScenarioCreate, BudgetScenarioUpdate, BudgetScenarioResponse
+    BudgetScenarioCreate, BudgetScenarioUpdate, BudgetScenarioResponse, ScenarioSimulationRequest
 )
 from app.auth.security import get_current_user
+from app.services.budget_simulation import simulate_scenarios, SOURCES, MAX_SCENARIOS
 
 router = APIRouter()
 
@@ -46,6 +47,39 @@ def create_scenario(
     db.refresh(db_scenario)
     return db_scenario
 
+@router.post("/simulate")
+def simulate(
+    request: ScenarioSimulationRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Рассчитать ОПУ и денежный поток года для набора сценариев за один вызов"""
+    if request.source not in SOURCES:
+        raise HTTPException(status_code=400, detail=f"Invalid source: {request.source}")
+    if not request.scenarios or len(request.scenarios) > MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Number of scenarios must be between 1 and {MAX_SCENARIOS}")
+
+    # Названия сохраненных сценариев
+    scenario_ids = {drivers.scenario_id for drivers in request.scenarios if drivers.scenario_id}
+    saved = {
+        scenario.id: scenario
+        for scenario in db.query(BudgetScenario).filter(BudgetScenario.id.in_(scenario_ids))
+    } if scenario_ids else {}
+    scenarios = []
+    for drivers in request.scenarios:
+        data = drivers.dict()
+        if drivers.scenario_id:
+            scenario = saved.get(drivers.scenario_id)
+            if not scenario or scenario.company_id != request.company_id:
+                raise HTTPException(status_code=404, detail="Scenario not found")
+            data["name"] = data["name"] or scenario.name
+        scenarios.append(data)
+
+    try:
+        return simulate_scenarios(db, request.company_id, request.year, scenarios, request.source)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.put("/{scenario_id}", response_model=BudgetScenarioResponse)
 def update_scenario(
     scenario_id: int,
@@ -15,7 +15,10 @@ from app.schemas.customer import (
     CustomerInteractionCreate, CustomerInteractionResponse
 )
 from app.auth.security import get_current_user
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_PARTNERS
 from app.auth.permissions import get_user_companies
+from app.services.customer_metrics import recompute_customer_metrics
 
 router = APIRouter()
 
@@ -148,6 +151,7 @@ def create_customer(
     
     db_customer = Customer(**customer.dict())
     db.add(db_customer)
+    mark_recommendations_dirty(db, db_customer.company_id, DOMAIN_PARTNERS)
     db.commit()
     db.refresh(db_customer)
     return db_customer
@@ -185,10 +189,12 @@ def update_customer(
         if customer.company_id not in user_company_ids:
             raise HTTPException(status_code=403, detail="No access to this customer")
     
+    old_company_id = customer.company_id
     update_data = customer_update.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(customer, key, value)
     
+    mark_recommendations_dirty(db, [old_company_id, customer.company_id], DOMAIN_PARTNERS)
     db.commit()
     db.refresh(customer)
     return customer
@@ -209,10 +215,26 @@ def delete_customer(
             raise HTTPException(status_code=403, detail="No access to this customer")
     
     customer.is_active = False
+    mark_recommendations_dirty(db, customer.company_id, DOMAIN_PARTNERS)
     db.commit()
     return {"message": "Customer deleted"}
 
 # Customer Analytics - обновление метрик
+@router.post("/recompute-metrics")
+def recompute_company_customer_metrics(
+    company_id: int = Query(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Пересчитать метрики и RFM-оценки всех клиентов организации"""
+    if current_user.role.value != "ADMIN":
+        user_company_ids = get_user_companies(current_user.id, db)
+        if company_id not in user_company_ids:
+            raise HTTPException(status_code=403, detail="No access to this company")
+    
+    result = recompute_customer_metrics(db, company_id=company_id)
+    return {"message": "Metrics updated", **result}
+
 @router.post("/{customer_id}/update-metrics")
 def update_customer_metrics(
     customer_id: int,
@@ -223,42 +245,7 @@ def update_customer_metrics(
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    # Получаем все покупки клиента
-    purchases = db.query(CustomerPurchase).filter(
-        CustomerPurchase.customer_id == customer_id
-    ).all()
-    
-    if purchases:
-        total_purchases = sum(float(p.amount) for p in purchases)
-        purchase_count = len(purchases)
-        average_check = total_purchases / purchase_count if purchase_count > 0 else 0
-        last_purchase_date = max(p.purchase_date for p in purchases)
-        
-        # RFM метрики
-        today = date.today()
-        recency = (today - last_purchase_date).days if last_purchase_date else None
-        frequency = purchase_count
-        monetary = total_purchases
-        
-        customer.total_purchases = Decimal(str(total_purchases))
-        customer.purchase_count = purchase_count
-        customer.average_check = Decimal(str(average_check))
-        customer.last_purchase_date = last_purchase_date
-        customer.recency = recency
-        customer.frequency = frequency
-        customer.monetary = Decimal(str(monetary))
-        customer.ltv = Decimal(str(monetary))  # Упрощенный LTV
-    else:
-        customer.total_purchases = Decimal('0')
-        customer.purchase_count = 0
-        customer.average_check = Decimal('0')
-        customer.last_purchase_date = None
-        customer.recency = None
-        customer.frequency = 0
-        customer.monetary = Decimal('0')
-        customer.ltv = Decimal('0')
-    
-    db.commit()
+    recompute_customer_metrics(db, customer_ids=[customer_id])
     db.refresh(customer)
     return {"message": "Metrics updated", "customer": CustomerResponse.from_orm(customer)}
 
@@ -309,28 +296,7 @@ def create_customer_purchase(
     db.commit()
     
     # Обновляем метрики клиента
-    purchases = db.query(CustomerPurchase).filter(
-        CustomerPurchase.customer_id == customer_id
-    ).all()
-    
-    if purchases:
-        total_purchases = sum(float(p.amount) for p in purchases)
-        purchase_count = len(purchases)
-        average_check = total_purchases / purchase_count if purchase_count > 0 else 0
-        last_purchase_date = max(p.purchase_date for p in purchases)
-        
-        today = date.today()
-        recency = (today - last_purchase_date).days if last_purchase_date else None
-        
-        customer.total_purchases = Decimal(str(total_purchases))
-        customer.purchase_count = purchase_count
-        customer.average_check = Decimal(str(average_check))
-        customer.last_purchase_date = last_purchase_date
-        customer.recency = recency
-        customer.frequency = purchase_count
-        customer.monetary = Decimal(str(total_purchases))
-        customer.ltv = Decimal(str(total_purchases))
-        db.commit()
+    recompute_customer_metrics(db, customer_ids=[customer_id])
     
     db.refresh(db_purchase)
     return db_purchase
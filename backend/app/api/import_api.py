@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
 from sqlalchemy.orm import Session
 import pandas as pd
 from io import BytesIO
@@ -11,16 +11,27 @@ from app.models.shipment import Shipment
 from app.models.product import Product
 from app.models.reference import IncomeItem, ExpenseItem, PaymentPlace, Company, SalesChannel
 from app.auth.security import get_current_user
+from app.utils.fingerprint import movement_fingerprint, normalize_text
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_MONEY
+from app.services.notification_service import budget_change_key, mark_budget_changes
 
 router = APIRouter()
 
+IMPORT_CHUNK_SIZE = 1000
+
 @router.post("/money-movements")
 async def import_money_movements(
     file: UploadFile = File(...),
+    company_id: int | None = Query(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Импорт движения денег"""
+    """
+    Импорт движения денег.
+    Повторная загрузка той же выписки (в т.ч. с пересекающимися периодами)
+    не создает дубликатов: уже импортированные строки определяются по отпечатку.
+    """
     if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
         raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
     
@@ -36,9 +47,13 @@ async def import_money_movements(
         income_items = {item.name: item.id for item in db.query(IncomeItem).all()}
         expense_items = {item.name: item.id for item in db.query(ExpenseItem).all()}
         payment_places = {place.name: place.id for place in db.query(PaymentPlace).all()}
+        companies = {company.name: company.id for company in db.query(Company).all()}
         
-        imported = 0
         errors = []
+        # Разобранные строки: (номер строки, поля движения, отпечаток)
+        parsed_rows = []
+        # Счетчик одинаковых строк внутри файла - одинаковые платежи не схлопываются
+        occurrences = {}
         
         for index, row in df.iterrows():
             try:
@@ -50,10 +65,16 @@ async def import_money_movements(
                 income_item_name = str(row.get('Статья дохода', row.get('income_item', ''))).strip()
                 expense_item_name = str(row.get('Статья расхода', row.get('expense_item', ''))).strip()
                 payment_place_name = str(row.get('Место оплаты', row.get('payment_place', ''))).strip()
+                company_name = str(row.get('Организация', row.get('company', ''))).strip()
                 
                 income_item_id = income_items.get(income_item_name) if income_item_name and income_item_name != 'nan' else None
                 expense_item_id = expense_items.get(expense_item_name) if expense_item_name and expense_item_name != 'nan' else None
                 payment_place_id = payment_places.get(payment_place_name)
+                row_company_id = companies.get(company_name) if company_name and company_name != 'nan' else company_id
+                
+                if not row_company_id:
+                    errors.append(f"Строка {index + 2}: Организация '{company_name}' не найдена")
+                    continue
                 
                 if not payment_place_id:
                     errors.append(f"Строка {index + 2}: Место оплаты '{payment_place_name}' не найдено")
@@ -69,28 +90,68 @@ async def import_money_movements(
                 
                 is_business = str(row.get('Бизнес', row.get('is_business', 'Да'))).lower() in ['да', 'yes', 'true', '1']
                 description = str(row.get('Описание', row.get('description', ''))).strip()
+                description = description if description != 'nan' else None
                 
-                movement = MoneyMovement(
-                    date=date,
-                    amount=amount,
-                    movement_type=movement_type,
-                    income_item_id=income_item_id,
-                    expense_item_id=expense_item_id,
-                    payment_place_id=payment_place_id,
-                    is_business=is_business,
-                    description=description if description != 'nan' else None
+                item_id = income_item_id if movement_type == "income" else expense_item_id
+                key = (row_company_id, date, round(amount, 2), movement_type, item_id, payment_place_id, normalize_text(description))
+                occurrence = occurrences.get(key, 0)
+                occurrences[key] = occurrence + 1
+                
+                fingerprint = movement_fingerprint(
+                    row_company_id, date, amount, movement_type,
+                    item_id, payment_place_id, description, occurrence
                 )
-                db.add(movement)
-                imported += 1
+                
+                parsed_rows.append((index, {
+                    "date": date,
+                    "amount": amount,
+                    "movement_type": movement_type,
+                    "company_id": row_company_id,
+                    "income_item_id": income_item_id,
+                    "expense_item_id": expense_item_id,
+                    "payment_place_id": payment_place_id,
+                    "is_business": is_business,
+                    "description": description,
+                    "fingerprint": fingerprint
+                }))
             except Exception as e:
                 errors.append(f"Строка {index + 2}: {str(e)}")
         
+        imported = 0
+        skipped = 0
+        imported_company_ids = set()
+        
+        # Проверяем известные отпечатки одним запросом на пачку строк
+        for chunk_start in range(0, len(parsed_rows), IMPORT_CHUNK_SIZE):
+            chunk = parsed_rows[chunk_start:chunk_start + IMPORT_CHUNK_SIZE]
+            fingerprints = [fields["fingerprint"] for _, fields in chunk]
+            known = {
+                fp for (fp,) in db.query(MoneyMovement.fingerprint).filter(
+                    MoneyMovement.fingerprint.in_(fingerprints)
+                ).all()
+            }
+            
+            new_movements = []
+            for _, fields in chunk:
+                if fields["fingerprint"] in known:
+                    skipped += 1
+                    continue
+                new_movements.append(MoneyMovement(**fields))
+            
+            db.add_all(new_movements)
+            db.flush()
+            imported += len(new_movements)
+            imported_company_ids.update(movement.company_id for movement in new_movements)
+            mark_budget_changes(db, [budget_change_key(movement) for movement in new_movements])
+        
+        mark_recommendations_dirty(db, imported_company_ids, DOMAIN_MONEY)
         db.commit()
         
         return {
             "imported": imported,
+            "skipped": skipped,
             "errors": errors,
-            "message": f"Импортировано {imported} записей"
+            "message": f"Импортировано {imported} записей, пропущено ранее загруженных: {skipped}"
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка при обработке файла: {str(e)}")
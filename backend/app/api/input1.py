@@ -9,6 +9,9 @@ from app.schemas.input1 import MoneyMovementCreate, MoneyMovementResponse
 from app.schemas.common import PaginatedResponse
 from app.auth.security import get_current_user
 from app.utils.audit_logger import log_create, log_update, log_delete, model_to_dict
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_MONEY
+from app.services.notification_service import budget_change_key, mark_budget_changes
 
 router = APIRouter()
 
@@ -91,6 +94,8 @@ def create_money_movement(
     
     db_movement = MoneyMovement(**movement_data)
     db.add(db_movement)
+    mark_recommendations_dirty(db, db_movement.company_id, DOMAIN_MONEY)
+    mark_budget_changes(db, [budget_change_key(db_movement)])
     db.commit()
     db.refresh(db_movement)
     
@@ -146,6 +151,7 @@ def update_money_movement(
     
     # Сохраняем старые значения для логирования
     old_values = model_to_dict(db_movement)
+    old_change_key = budget_change_key(db_movement)
     
     movement_data = movement.dict()
     # Для expense очищаем supplier_id, если он был передан
@@ -154,6 +160,9 @@ def update_money_movement(
     
     for key, value in movement_data.items():
         setattr(db_movement, key, value)
+    mark_recommendations_dirty(db, [old_values.get("company_id"), db_movement.company_id], DOMAIN_MONEY)
+    # Прежние организация, статья и месяц тоже изменились (движение из них ушло)
+    mark_budget_changes(db, [old_change_key, budget_change_key(db_movement)])
     db.commit()
     db.refresh(db_movement)
     
@@ -203,6 +212,8 @@ def delete_money_movement(
                description=f"Удалено движение денег ID: {movement_id}",
                ip_address=ip_address)
     
+    mark_recommendations_dirty(db, db_movement.company_id, DOMAIN_MONEY)
+    mark_budget_changes(db, [budget_change_key(db_movement)])
     db.delete(db_movement)
     db.commit()
     return {"message": "Money movement deleted"}
@@ -226,6 +237,8 @@ def delete_multiple_movements(
                   description=f"Групповое удаление движения денег ID: {movement.id}",
                   ip_address=ip_address)
     
+    mark_recommendations_dirty(db, [movement.company_id for movement in movements], DOMAIN_MONEY)
+    mark_budget_changes(db, [budget_change_key(movement) for movement in movements])
     deleted_count = db.query(MoneyMovement).filter(MoneyMovement.id.in_(ids)).delete(synchronize_session=False)
     db.commit()
     
@@ -7,6 +7,8 @@ from app.models.user import User
 from app.models.input2 import Asset, Liability
 from app.schemas.input2 import AssetCreate, AssetResponse, LiabilityCreate, LiabilityResponse
 from app.auth.security import get_current_user
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_BALANCE
 
 router = APIRouter()
 
@@ -44,6 +46,7 @@ def create_asset(
 ):
     db_asset = Asset(**asset.dict())
     db.add(db_asset)
+    mark_recommendations_dirty(db, db_asset.company_id, DOMAIN_BALANCE)
     db.commit()
     db.refresh(db_asset)
     return db_asset
@@ -58,8 +61,10 @@ def update_asset(
     db_asset = db.query(Asset).filter(Asset.id == asset_id).first()
     if not db_asset:
         raise HTTPException(status_code=404, detail="Asset not found")
+    old_company_id = db_asset.company_id
     for key, value in asset.dict().items():
         setattr(db_asset, key, value)
+    mark_recommendations_dirty(db, [old_company_id, db_asset.company_id], DOMAIN_BALANCE)
     db.commit()
     db.refresh(db_asset)
     return db_asset
@@ -74,6 +79,7 @@ def delete_asset(
     if not db_asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     db.delete(db_asset)
+    mark_recommendations_dirty(db, db_asset.company_id, DOMAIN_BALANCE)
     db.commit()
     return {"message": "Asset deleted"}
 
@@ -111,6 +117,7 @@ def create_liability(
 ):
     db_liability = Liability(**liability.dict())
     db.add(db_liability)
+    mark_recommendations_dirty(db, db_liability.company_id, DOMAIN_BALANCE)
     db.commit()
     db.refresh(db_liability)
     return db_liability
@@ -125,8 +132,10 @@ def update_liability(
     db_liability = db.query(Liability).filter(Liability.id == liability_id).first()
     if not db_liability:
         raise HTTPException(status_code=404, detail="Liability not found")
+    old_company_id = db_liability.company_id
     for key, value in liability.dict().items():
         setattr(db_liability, key, value)
+    mark_recommendations_dirty(db, [old_company_id, db_liability.company_id], DOMAIN_BALANCE)
     db.commit()
     db.refresh(db_liability)
     return db_liability
@@ -141,6 +150,7 @@ def delete_liability(
     if not db_liability:
         raise HTTPException(status_code=404, detail="Liability not found")
     db.delete(db_liability)
+    mark_recommendations_dirty(db, db_liability.company_id, DOMAIN_BALANCE)
     db.commit()
     return {"message": "Liability deleted"}
 
@@ -22,6 +22,8 @@ from app.services.inventory_service import (
     get_low_stock_alerts, calculate_average_cost,
     update_inventory_transaction, delete_inventory_transaction
 )
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_INVENTORY
 
 router = APIRouter()
 
@@ -101,6 +103,7 @@ def create_inventory(
     db_inventory.quantity = inventory.quantity
     db_inventory.min_stock_level = inventory.min_stock_level
     
+    mark_recommendations_dirty(db, warehouse.company_id, DOMAIN_INVENTORY)
     db.commit()
     db.refresh(db_inventory)
     
@@ -142,7 +145,8 @@ def create_transaction(
     except:
         transaction_date = date.today()
     
-    # Создаем транзакцию
+    # Создаем транзакцию (отметка для рекомендаций сохраняется ее коммитом)
+    mark_recommendations_dirty(db, warehouse.company_id, DOMAIN_INVENTORY)
     db_transaction = add_inventory_transaction(
         transaction_type=transaction.transaction_type,
         product_id=transaction.product_id,
@@ -288,7 +292,10 @@ def update_transaction(
         except:
             transaction_date = db_transaction.date
     
-    # Обновляем транзакцию
+    # Обновляем транзакцию (отметка для рекомендаций сохраняется ее коммитом)
+    mark_recommendations_dirty(
+        db, [warehouse.company_id, new_warehouse.company_id if transaction.warehouse_id else None], DOMAIN_INVENTORY
+    )
     updated_transaction = update_inventory_transaction(
         transaction_id=transaction_id,
         transaction_type=transaction.transaction_type if transaction.transaction_type else db_transaction.transaction_type,
@@ -346,7 +353,8 @@ def delete_transaction(
     if not can_write(current_user, warehouse.company_id, db):
         raise HTTPException(status_code=403, detail="No write access to this company")
     
-    # Удаляем транзакцию
+    # Удаляем транзакцию (отметка для рекомендаций сохраняется ее коммитом)
+    mark_recommendations_dirty(db, warehouse.company_id, DOMAIN_INVENTORY)
     delete_inventory_transaction(transaction_id, db)
     
     return {"message": "Transaction deleted successfully"}
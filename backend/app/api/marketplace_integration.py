@@ -1,3 +1,4 @@
+import threading
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.orm import Session
@@ -5,8 +6,7 @@ from datetime import date, datetime, timedelta
 from app.database import get_db
 from app.models.user import User
 from app.models.marketplace_integration import MarketplaceIntegration
-from app.models.realization import Realization
-from app.models.reference import SalesChannel, Company
+from app.models.reference import Company
 from app.schemas.marketplace_integration import (
     MarketplaceIntegrationCreate,
     MarketplaceIntegrationUpdate,
@@ -17,6 +17,15 @@ from app.schemas.marketplace_integration import (
 from app.auth.security import get_current_user
 from app.services.ozon_api import OzonAPI
 from app.services.wb_api import WildberriesAPI
+from app.services.marketplace_staging import (
+    get_sync_context,
+    stage_payload,
+    process_payload,
+    process_staged_payloads,
+    iter_ozon_pages,
+    iter_wb_pages
+)
+from app.services.sync_lease import new_lease_owner, acquire_lease, release_lease, LeaseHeartbeat, SyncCancelled
 
 router = APIRouter()
 
@@ -146,10 +155,10 @@ def sync_marketplace(
     else:
         end_date = date.today()
     
-    # Обновляем статус
-    integration.last_sync_status = "in_progress"
-    integration.last_sync_error = None
-    db.commit()
+    # Захватываем аренду синхронизации (статус становится in_progress)
+    lease_owner = new_lease_owner()
+    if not acquire_lease(db, integration.id, lease_owner):
+        raise HTTPException(status_code=409, detail="Синхронизация уже выполняется")
     
     # Запускаем синхронизацию в фоне
     background_tasks.add_task(
@@ -157,7 +166,10 @@ def sync_marketplace(
         integration.id,
         integration.marketplace_name.lower(),
         start_date,
-        end_date
+        end_date,
+        # Явно указанный период загружается целиком
+        sync_request.start_date is None,
+        lease_owner
     )
     
     return SyncResponse(
@@ -166,116 +178,195 @@ def sync_marketplace(
         imported_count=0
     )
 
-def perform_sync(integration_id: int, marketplace_name: str, start_date: date, end_date: date):
-    """Выполнить синхронизацию (вызывается в фоне)"""
+def perform_sync(
+    integration_id: int,
+    marketplace_name: str,
+    start_date: date,
+    end_date: date,
+    incremental: bool = True,
+    lease_owner: str = None,
+    cancel_event: threading.Event = None
+) -> bool:
+    """
+    Выполнить синхронизацию (вызывается в фоне).
+    Каждая страница ответа API сначала сохраняется в marketplace_payloads,
+    затем преобразуется в реализации (см. app.services.marketplace_staging).
+    incremental=False принудительно перезагружает весь период start_date..end_date
+    без учета сохраненных курсоров.
+    Синхронизация выполняется под арендой интеграции (app.services.sync_lease):
+    lease_owner - владелец уже захваченной аренды, иначе аренда захватывается здесь.
+    Возвращает False, если интеграцию уже синхронизирует другой процесс.
+    cancel_event проверяется между страницами: если оно выставлено (планировщик
+    по истечении времени), синхронизация прерывается исключением SyncCancelled,
+    курсоры после последней сохраненной страницы не сдвигаются.
+    """
     from app.database import SessionLocal
     
     db = SessionLocal()
+    lease_owner = lease_owner or new_lease_owner()
     try:
+        if not acquire_lease(db, integration_id, lease_owner):
+            print(f"[SYNC] Интеграция {integration_id} уже синхронизируется другим процессом")
+            return False
+        
         integration = db.query(MarketplaceIntegration).filter(
             MarketplaceIntegration.id == integration_id
         ).first()
         
         if not integration:
-            return
-        
-        sales_data = []
-        errors = []
+            return False
         
+        heartbeat = LeaseHeartbeat(integration_id, lease_owner)
         try:
+            raw_pages = []
+            api_client = None
+            
             if "ozon" in marketplace_name.lower():
                 if not integration.ozon_client_id or not integration.ozon_api_key:
                     raise Exception("Не указаны учетные данные OZON")
                 
                 ozon = OzonAPI(integration.ozon_client_id, integration.ozon_api_key)
-                sales_data = ozon.get_sales(start_date, end_date)
+                raw_pages = iter_ozon_pages(ozon, start_date, end_date)
+                api_client = ozon
             
             elif "wildberries" in marketplace_name.lower() or "wb" in marketplace_name.lower():
                 if not integration.wb_api_key:
                     raise Exception("Не указан API ключ Wildberries")
                 
                 wb = WildberriesAPI(integration.wb_api_key, integration.wb_stat_api_key)
-                # Пробуем получить продажи
-                try:
-                    sales_data = wb.get_sales(start_date, end_date)
-                except Exception as e:
-                    # Если не получилось, пробуем заказы
-                    try:
-                        sales_data = wb.get_orders(start_date, end_date)
-                    except Exception as e2:
-                        raise Exception(f"Не удалось получить данные: {str(e)}; {str(e2)}")
+                raw_pages = iter_wb_pages(wb, integration, start_date, end_date, incremental)
+                api_client = wb
             
-            # Находим или создаем канал продаж в справочнике
-            sales_channel = db.query(SalesChannel).filter(
-                SalesChannel.name.ilike(f"%{integration.marketplace_name}%")
-            ).first()
+            context = get_sync_context(db, integration)
             
-            if not sales_channel:
-                # Создаем канал продаж в справочнике, если его нет
-                sales_channel = SalesChannel(
-                    name=integration.marketplace_name,
-                    description=f"Автоматически создан из интеграции",
-                    is_active=True
-                )
-                db.add(sales_channel)
-                db.commit()
-                db.refresh(sales_channel)
-            
-            # Сохраняем данные о реализациях
             imported = 0
+            staged = 0
+            def ensure_active():
+                # Аренду перехватил другой процесс - прекращаем, не сдвигая курсоры
+                if heartbeat.lost:
+                    raise Exception("Аренда синхронизации истекла и перешла к другому процессу")
+                if cancel_event is not None and cancel_event.is_set():
+                    raise SyncCancelled("Синхронизация прервана: превышено время синхронизации")
             
-            for sale in sales_data:
-                try:
-                    # Проверяем, нет ли уже такой записи
-                    existing = db.query(Realization).filter(
-                        Realization.date == sale["date"],
-                        Realization.sales_channel_id == sales_channel.id,
-                        Realization.company_id == integration.company_id,
-                        Realization.revenue == sale["revenue"]
-                    ).first()
-                    
-                    if existing:
-                        continue
-                    
-                    # SQLAlchemy автоматически конвертирует float в Numeric
-                    realization = Realization(
-                        date=sale["date"],
-                        sales_channel_id=sales_channel.id,
-                        company_id=integration.company_id,
-                        revenue=float(sale["revenue"]),
-                        quantity=sale.get("quantity", 1),
-                        description=sale.get("description", f"Синхронизация с {integration.marketplace_name}")
-                    )
-                    db.add(realization)
-                    imported += 1
-                except Exception as e:
-                    errors.append(f"Ошибка при сохранении записи: {str(e)}")
-            
-            db.commit()
+            with heartbeat:
+                ensure_active()
+                for source, page_key, rows, cursors in raw_pages:
+                    ensure_active()
+                    if rows:
+                        # Сначала сохраняем сырой ответ, затем преобразуем его в реализации
+                        payload = stage_payload(
+                            db, integration.id, source, page_key, start_date, end_date, rows,
+                            next_cursor=next(iter(cursors.values()), None)
+                        )
+                        staged += 1
+                        imported += process_payload(db, payload, context)
+                    # Курсор сдвигаем только после сохранения страницы
+                    if cursors:
+                        for key, value in cursors.items():
+                            setattr(integration, key, value)
+                        db.commit()
+                    # Следующую страницу не запрашиваем, если синхронизацию пора остановить
+                    ensure_active()
             
             # Обновляем статус
             integration.last_sync_at = datetime.now()
-            integration.last_sync_status = "success" if not errors else "error"
-            if errors:
-                # Ограничиваем количество ошибок в сообщении
-                error_msg = "; ".join(errors[:5])
-                if len(errors) > 5:
-                    error_msg += f" ... и еще {len(errors) - 5} ошибок"
-                integration.last_sync_error = error_msg
-            else:
-                integration.last_sync_error = None
+            integration.last_sync_status = "success"
+            integration.last_sync_error = None
             db.commit()
             
-            print(f"[SYNC] Синхронизация завершена. Импортировано: {imported}, Ошибок: {len(errors)}")
+            print(f"[SYNC] Синхронизация завершена. Страниц сохранено: {staged}, реализаций: {imported}")
+            if api_client:
+                print(f"[SYNC] Запросы к API: {api_client.request_stats()}")
+            return True
             
         except Exception as e:
-            integration.last_sync_status = "error"
-            integration.last_sync_error = str(e)
-            db.commit()
+            db.rollback()
+            # Статус чужой синхронизации не перезаписываем
+            if not heartbeat.lost:
+                integration.last_sync_status = "error"
+                integration.last_sync_error = str(e)
+                db.commit()
             raise
     
     finally:
-        db.close()
+        try:
+            release_lease(db, integration_id, lease_owner)
+        finally:
+            db.close()
+
+@router.post("/{integration_id}/reprocess")
+def reprocess_payloads(
+    integration_id: int,
+    background_tasks: BackgroundTasks,
+    start_date: date | None = Query(None),
+    end_date: date | None = Query(None),
+    only_unprocessed: bool = Query(False),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Повторно преобразовать сохраненные ответы API в реализации (без запросов к маркетплейсу)"""
+    integration = db.query(MarketplaceIntegration).filter(
+        MarketplaceIntegration.id == integration_id
+    ).first()
+    
+    if not integration:
+        raise HTTPException(status_code=404, detail="Интеграция не найдена")
+    
+    background_tasks.add_task(process_staged_payloads, integration_id, start_date, end_date, only_unprocessed)
+    return {"message": "Повторная обработка запущена"}
+
+@router.post("/{integration_id}/backfill")
+def start_backfill(
+    integration_id: int,
+    background_tasks: BackgroundTasks,
+    start_date: date = Query(...),
+    end_date: date | None = Query(None),
+    window_days: int = Query(7, ge=1, le=90),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Запустить (или продолжить) историческую загрузку за период по окнам.
+    Без end_date период для Wildberries заканчивается днем до курсора инкрементальной синхронизации.
+    Загрузка считается выполняющейся, пока действует аренда интеграции: задачу, прерванную
+    сбоем (аренда истекла), можно продолжить повторным запросом.
+    """
+    from app.services.marketplace_backfill import create_backfill, run_backfill, backfill_progress
+    
+    integration = db.query(MarketplaceIntegration).filter(
+        MarketplaceIntegration.id == integration_id
+    ).first()
+    
+    if not integration:
+        raise HTTPException(status_code=404, detail="Интеграция не найдена")
+    
+    try:
+        backfill = create_backfill(db, integration_id, start_date, end_date, window_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Захватываем аренду: если она действует, загрузку (или синхронизацию) выполняет другой процесс
+    lease_owner = new_lease_owner()
+    if not acquire_lease(db, integration_id, lease_owner):
+        raise HTTPException(status_code=409, detail="Синхронизация или историческая загрузка уже выполняется")
+    
+    background_tasks.add_task(run_backfill, backfill.id, lease_owner=lease_owner)
+    return backfill_progress(backfill)
+
+@router.get("/backfills/{backfill_id}")
+def get_backfill(
+    backfill_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Прогресс исторической загрузки: окна, строки, скорость и оценка оставшегося времени"""
+    from app.services.marketplace_backfill import backfill_progress
+    from app.models.marketplace_backfill import MarketplaceBackfill
+    
+    backfill = db.query(MarketplaceBackfill).filter(MarketplaceBackfill.id == backfill_id).first()
+    if not backfill:
+        raise HTTPException(status_code=404, detail="Историческая загрузка не найдена")
+    return backfill_progress(backfill)
 
 @router.post("/test-connection")
 def test_connection(
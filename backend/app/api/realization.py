@@ -15,6 +15,8 @@ from app.schemas.common import PaginatedResponse
 from app.auth.security import get_current_user
 from app.utils.audit_logger import log_create, log_update, log_delete, model_to_dict
 from app.services.inventory_service import add_inventory_transaction
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_SALES, DOMAIN_INVENTORY
 
 router = APIRouter()
 
@@ -174,6 +176,7 @@ def create_realization(
             db.rollback()
             raise HTTPException(status_code=400, detail=str(e))
     
+    mark_recommendations_dirty(db, db_realization.company_id, DOMAIN_SALES, DOMAIN_INVENTORY)
     db.commit()
     db.refresh(db_realization)
     
@@ -288,6 +291,7 @@ def update_realization(
             db.rollback()
             raise HTTPException(status_code=400, detail=str(e))
     
+    mark_recommendations_dirty(db, [old_values.get("company_id"), db_realization.company_id], DOMAIN_SALES, DOMAIN_INVENTORY)
     db.commit()
     
     # Логирование обновления
@@ -324,6 +328,7 @@ def delete_realization(
                description=f"Удалена реализация ID: {realization_id}",
                ip_address=ip_address)
     
+    mark_recommendations_dirty(db, db_realization.company_id, DOMAIN_SALES, DOMAIN_INVENTORY)
     db.delete(db_realization)
     db.commit()
     return {"message": "Realization deleted"}
@@ -347,6 +352,7 @@ def delete_multiple_realizations(
                    description=f"Удалена реализация ID: {realization.id}",
                    ip_address=ip_address)
     
+    mark_recommendations_dirty(db, [realization.company_id for realization in realizations], DOMAIN_SALES, DOMAIN_INVENTORY)
     deleted_count = db.query(Realization).filter(Realization.id.in_(ids)).delete(synchronize_session=False)
     db.commit()
     
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, func
 from typing import List, Optional
@@ -208,6 +208,19 @@ def mark_recommendation_as_read(
     
     return {"message": "Recommendation marked as read"}
 
+def _companies_for_generation(company_id: Optional[int], current_user: User, db: Session) -> List[int]:
+    """Организации для генерации рекомендаций с проверкой доступа"""
+    from app.auth.permissions import get_user_companies
+    
+    if company_id:
+        if current_user.role.value != "ADMIN":
+            user_companies = get_user_companies(current_user.id, db)
+            if company_id not in user_companies:
+                raise HTTPException(status_code=403, detail="No access to this company")
+        return [company_id]
+    # Все доступные организации
+    return get_user_companies(current_user.id, db)
+
 @router.post("/generate")
 def generate_recommendations(
     company_id: Optional[int] = Query(None),
@@ -215,42 +228,60 @@ def generate_recommendations(
     current_user: User = Depends(get_current_user)
 ):
     """Сгенерировать новые рекомендации на основе текущих данных"""
-    from app.services.recommendation_service import RecommendationService
+    from app.services.recommendation_jobs import generate_for_companies
     
+    companies = _companies_for_generation(company_id, current_user, db)
     try:
-        service = RecommendationService(db)
-        companies = []
-        
-        if company_id:
-            from app.auth.permissions import get_user_companies
-            if current_user.role.value != "ADMIN":
-                user_companies = get_user_companies(current_user.id, db)
-                if company_id not in user_companies:
-                    raise HTTPException(status_code=403, detail="No access to this company")
-            companies = [company_id]
-        else:
-            # Получаем все доступные компании
-            from app.auth.permissions import get_user_companies
-            companies = get_user_companies(current_user.id, db)
-        
-        generated = 0
-        for comp_id in companies:
-            # Создаем общие рекомендации (user_id=None), чтобы они были видны всем пользователям компании
-            try:
-                count = service.generate_recommendations(comp_id, user_id=None)
-                generated += count
-            except Exception as e:
-                import traceback
-                error_detail = traceback.format_exc()
-                print(f"Error generating recommendations for company {comp_id}: {str(e)}")
-                print(error_detail)
-                # Продолжаем для других компаний, но логируем ошибку
-                continue
-        
-        return {"message": f"Generated {generated} recommendations", "count": generated}
+        # Организации обрабатываются параллельно, каждая в своей сессии.
+        # Создаем общие рекомендации (user_id=None), чтобы они были видны всем пользователям компании
+        result = generate_for_companies(companies, user_id=None)
+        generated = result["generated"]
+        return {"message": f"Generated {generated} recommendations", "count": generated, "errors": result["errors"]}
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
         print(f"Error in generate_recommendations endpoint: {str(e)}")
         print(error_detail)
         raise HTTPException(status_code=500, detail=f"Ошибка при генерации рекомендаций: {str(e)}")
+
+@router.post("/generate/jobs", status_code=202)
+def start_generation_job(
+    background_tasks: BackgroundTasks,
+    company_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Запустить генерацию рекомендаций в фоне; прогресс - GET /generate/jobs/{job_id}"""
+    from app.services.recommendation_jobs import create_generation_job, run_generation_job
+    
+    companies = _companies_for_generation(company_id, current_user, db)
+    job = create_generation_job(companies, requested_by=current_user.id)
+    background_tasks.add_task(run_generation_job, job["id"])
+    return job
+
+@router.post("/refresh", status_code=202)
+def refresh_recommendations(
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Обновить рекомендации организаций с измененными данными (только затронутые правила)"""
+    from app.services.recommendation_refresh import pending_refresh, refresh_dirty_recommendations
+    
+    pending = pending_refresh(db)
+    if pending:
+        background_tasks.add_task(refresh_dirty_recommendations)
+    return {"message": "Обновление рекомендаций запущено" if pending else "Изменений нет", "companies": len(pending)}
+
+@router.get("/generate/jobs/{job_id}")
+def get_generation_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Прогресс фоновой генерации рекомендаций"""
+    from app.services.recommendation_jobs import get_generation_job
+    
+    job = get_generation_job(job_id)
+    if not job or (job["requested_by"] != current_user.id and current_user.role.value != "ADMIN"):
+        raise HTTPException(status_code=404, detail="Задача генерации не найдена")
+    return job
@@ -9,6 +9,8 @@ from app.schemas.shipment import ShipmentCreate, ShipmentResponse
 from app.schemas.common import PaginatedResponse
 from app.auth.security import get_current_user
 from app.utils.audit_logger import log_create, log_update, log_delete, model_to_dict
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_SALES
 
 router = APIRouter()
 
@@ -56,6 +58,7 @@ def create_shipment(
 ):
     db_shipment = Shipment(**shipment.dict())
     db.add(db_shipment)
+    mark_recommendations_dirty(db, db_shipment.company_id, DOMAIN_SALES)
     db.commit()
     db.refresh(db_shipment)
     
@@ -85,6 +88,7 @@ def update_shipment(
     
     for key, value in shipment.dict().items():
         setattr(db_shipment, key, value)
+    mark_recommendations_dirty(db, [old_values.get("company_id"), db_shipment.company_id], DOMAIN_SALES)
     db.commit()
     db.refresh(db_shipment)
     
@@ -116,6 +120,7 @@ def delete_shipment(
                ip_address=ip_address)
     
     db.delete(db_shipment)
+    mark_recommendations_dirty(db, db_shipment.company_id, DOMAIN_SALES)
     db.commit()
     return {"message": "Shipment deleted"}
 
@@ -139,6 +144,7 @@ def delete_multiple_shipments(
                    ip_address=ip_address)
     
     deleted_count = db.query(Shipment).filter(Shipment.id.in_(ids)).delete(synchronize_session=False)
+    mark_recommendations_dirty(db, [shipment.company_id for shipment in shipments], DOMAIN_SALES)
     db.commit()
     
     return {
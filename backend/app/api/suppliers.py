@@ -11,6 +11,8 @@ from app.schemas.supplier import (
     SupplierContractCreate, SupplierContractUpdate, SupplierContractResponse
 )
 from app.auth.security import get_current_user
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_PARTNERS
 from app.auth.permissions import get_user_companies, filter_by_user_companies
 
 router = APIRouter()
@@ -63,6 +65,7 @@ def create_supplier(
     
     db_supplier = Supplier(**supplier.dict())
     db.add(db_supplier)
+    mark_recommendations_dirty(db, db_supplier.company_id, DOMAIN_PARTNERS)
     db.commit()
     db.refresh(db_supplier)
     return db_supplier
@@ -102,10 +105,12 @@ def update_supplier(
         if supplier.company_id not in user_company_ids:
             raise HTTPException(status_code=403, detail="No access to this supplier")
     
+    old_company_id = supplier.company_id
     update_data = supplier_update.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(supplier, key, value)
     
+    mark_recommendations_dirty(db, [old_company_id, supplier.company_id], DOMAIN_PARTNERS)
     db.commit()
     db.refresh(supplier)
     return supplier
@@ -127,6 +132,7 @@ def delete_supplier(
             raise HTTPException(status_code=403, detail="No access to this supplier")
     
     supplier.is_active = False
+    mark_recommendations_dirty(db, supplier.company_id, DOMAIN_PARTNERS)
     db.commit()
     return {"message": "Supplier deleted"}
 
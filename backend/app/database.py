@@ -8,6 +8,9 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # Адреса API маркетплейсов (можно направить на локальный симулятор marketplace_simulator.py)
+    ozon_api_url: str = "https://api-seller.ozon.ru"
+    wb_statistics_api_url: str = "https://statistics-api.wildberries.ru"
 
     class Config:
         env_file = ".env"
@@ -16,8 +16,12 @@ import app.models.realization
 import app.models.shipment
 import app.models.product
 import app.models.marketplace_integration
+import app.models.marketplace_payload
+import app.models.marketplace_product
+import app.models.marketplace_backfill
 import app.models.audit
 import app.models.budget
+import app.models.budget_scenario
 import app.models.notification
 import app.models.warehouse
 import app.models.inventory
@@ -34,13 +38,14 @@ from app.models import (
     PaymentPlace, Company, ExpenseCategory, SalesChannel,
     MoneyMovement, Asset, Liability,
     Realization, RealizationItem, Shipment, Product,
-    MarketplaceIntegration, AuditLog, Budget, Notification,
+    MarketplaceIntegration, MarketplacePayload, MarketplaceProduct,
+    MarketplaceBackfill, MarketplaceBackfillWindow, AuditLog, Budget, BudgetScenario, Notification,
     Warehouse, Inventory, InventoryTransaction, ProductCost,
     Customer, CustomerSegment, CustomerPurchase, CustomerInteraction,
     Supplier, SupplierOrder, SupplierOrderItem, SupplierContract
 )
 
-from app.api import auth, users, reference, input1, input2, balance, cash_flow, profit_loss, cash_flow_analysis, profit_loss_analysis, realization, shipment, products, dashboard, export, import_api, marketplace_integration, audit, budget, notification, warehouses, inventory, customers, suppliers, recommendations, bank_cash
+from app.api import auth, users, reference, input1, input2, balance, cash_flow, profit_loss, cash_flow_analysis, profit_loss_analysis, realization, shipment, products, dashboard, export, import_api, marketplace_integration, audit, budget, notification, warehouses, inventory, customers, suppliers, recommendations, bank_cash, analytics, budget_calculation, budget_scenarios
 
 # Явно настраиваем мапперы после импорта всех моделей
 # Это гарантирует, что все отношения (back_populates) настроены правильно
@@ -129,9 +134,12 @@ app.include_router(export.router, prefix="/api/export", tags=["export"])
 app.include_router(import_api.router, prefix="/api/import", tags=["import"])
 app.include_router(marketplace_integration.router, prefix="/api/marketplace-integration", tags=["marketplace-integration"])
 app.include_router(budget.router, prefix="/api/budget", tags=["budget"])
+app.include_router(budget_calculation.router, prefix="/api/budget-calculation", tags=["budget"])
+app.include_router(budget_scenarios.router, prefix="/api/budget-scenarios", tags=["budget"])
 app.include_router(audit.router, prefix="/api", tags=["audit"])
 app.include_router(notification.router, prefix="/api/notifications", tags=["notifications"])
 app.include_router(recommendations.router, prefix="/api/recommendations", tags=["recommendations"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
 
 @app.get("/")
 async def root():
@@ -12,16 +12,20 @@ from .realization import Realization, RealizationItem
 from .shipment import Shipment
 from .product import Product
 from .marketplace_integration import MarketplaceIntegration
+from .marketplace_payload import MarketplacePayload
+from .marketplace_product import MarketplaceProduct
+from .marketplace_backfill import MarketplaceBackfill, MarketplaceBackfillWindow
 from .audit import AuditLog
 from .budget import Budget
-from .notification import Notification
+from .budget_scenario import BudgetScenario
+from .notification import Notification, NotificationCheck, BudgetChangeMark
 from .warehouse import Warehouse
 from .inventory import Inventory
 from .inventory_transaction import InventoryTransaction
 from .product_cost import ProductCost
 from .customer import Customer, CustomerSegment, CustomerPurchase, CustomerInteraction
 from .supplier import Supplier, SupplierOrder, SupplierOrderItem, SupplierContract
-from .recommendation import Recommendation, RecommendationType, RecommendationPriority, RecommendationCategory
+from .recommendation import Recommendation, RecommendationType, RecommendationPriority, RecommendationCategory, RecommendationDirtyMark
 
 __all__ = [
     "User",
@@ -43,9 +47,16 @@ __all__ = [
     "Shipment",
     "Product",
     "MarketplaceIntegration",
+    "MarketplacePayload",
+    "MarketplaceProduct",
+    "MarketplaceBackfill",
+    "MarketplaceBackfillWindow",
     "AuditLog",
     "Budget",
+    "BudgetScenario",
     "Notification",
+    "NotificationCheck",
+    "BudgetChangeMark",
     "Warehouse",
     "Inventory",
     "InventoryTransaction",
@@ -62,5 +73,6 @@ __all__ = [
     "RecommendationType",
     "RecommendationPriority",
     "RecommendationCategory",
+    "RecommendationDirtyMark",
 ]
 
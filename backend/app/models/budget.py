@@ -24,6 +24,7 @@ class Budget(Base):
     income_item_id = Column(Integer, ForeignKey("income_items.id"), nullable=True)
     expense_item_id = Column(Integer, ForeignKey("expense_items.id"), nullable=True)
     planned_amount = Column(Numeric(15, 2), nullable=False)
+    actual_amount = Column(Numeric(15, 2), nullable=True)  # Факт, сохраненный пересчетом (budget_actuals.refresh_budget_actuals)
     description = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
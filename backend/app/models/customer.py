@@ -37,6 +37,10 @@ class Customer(Base):
     recency = Column(Integer)  # Дней с последней покупки
     frequency = Column(Integer)  # Частота покупок
     monetary = Column(Numeric(12, 2))  # Денежная ценность
+    r_score = Column(Integer)  # Оценка давности 1-5 (квинтили по организации, 5 - недавние)
+    f_score = Column(Integer)  # Оценка частоты 1-5
+    m_score = Column(Integer)  # Оценка суммы 1-5
+    rfm_segment = Column(String(3))  # Код RFM, например "545"
     
     # Дополнительная информация
     notes = Column(Text)
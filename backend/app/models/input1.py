@@ -17,6 +17,7 @@ class MoneyMovement(Base):
     supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=True, index=True)  # Только для income
     description = Column(String)
     is_business = Column(Boolean, default=True)  # True - бизнес, False - личное
+    fingerprint = Column(String(64), nullable=True, index=True)  # Хеш ключевых полей для идемпотентного импорта
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -0,0 +1,47 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.database import Base
+
+class MarketplaceBackfill(Base):
+    """Историческая загрузка данных маркетплейса за длинный период (по окнам)"""
+    __tablename__ = "marketplace_backfills"
+
+    id = Column(Integer, primary_key=True, index=True)
+    integration_id = Column(Integer, ForeignKey("marketplace_integrations.id", ondelete="CASCADE"), nullable=False, index=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    window_days = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, in_progress, success, error
+    windows_total = Column(Integer, default=0)
+    windows_done = Column(Integer, default=0)
+    rows_fetched = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)  # Начало последнего запуска
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    integration = relationship("MarketplaceIntegration", foreign_keys=[integration_id])
+    windows = relationship("MarketplaceBackfillWindow", back_populates="backfill", cascade="all, delete-orphan")
+
+
+class MarketplaceBackfillWindow(Base):
+    """Окно исторической загрузки - контрольная точка для продолжения после сбоя"""
+    __tablename__ = "marketplace_backfill_windows"
+
+    id = Column(Integer, primary_key=True, index=True)
+    backfill_id = Column(Integer, ForeignKey("marketplace_backfills.id", ondelete="CASCADE"), nullable=False, index=True)
+    window_start = Column(Date, nullable=False)
+    window_end = Column(Date, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, success, error
+    rows_fetched = Column(Integer, default=0)
+    pages = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_marketplace_backfill_windows_backfill_start', 'backfill_id', 'window_start', unique=True),
+    )
+
+    backfill = relationship("MarketplaceBackfill", back_populates="windows")
@@ -17,14 +17,19 @@ class MarketplaceIntegration(Base):
     # Wildberries API credentials
     wb_api_key = Column(Text, nullable=True)
     wb_stat_api_key = Column(Text, nullable=True)  # Для статистики
+    wb_sales_cursor = Column(String, nullable=True)  # lastChangeDate последней загруженной продажи WB
+    wb_orders_cursor = Column(String, nullable=True)  # lastChangeDate последнего загруженного заказа WB
     
     # Общие настройки
     is_active = Column(Boolean, default=True)
     auto_sync = Column(Boolean, default=False)  # Автоматическая синхронизация
     sync_interval_hours = Column(Integer, default=24)  # Интервал синхронизации в часах
+    post_inventory = Column(Boolean, default=False)  # Списывать проданные товары со склада маркетплейса
     last_sync_at = Column(DateTime(timezone=True), nullable=True)
     last_sync_status = Column(String, nullable=True)  # 'success', 'error', 'in_progress'
     last_sync_error = Column(Text, nullable=True)
+    sync_lease_owner = Column(String, nullable=True)  # Процесс, выполняющий синхронизацию (хост:pid:суффикс)
+    sync_lease_expires_at = Column(DateTime, nullable=True)  # Срок аренды синхронизации (продлевается heartbeat)
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
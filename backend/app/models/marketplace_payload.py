@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Text, LargeBinary, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.database import Base
+
+class MarketplacePayload(Base):
+    """Сырой ответ API маркетплейса (страница), сохраненный до преобразования в реализации"""
+    __tablename__ = "marketplace_payloads"
+
+    id = Column(Integer, primary_key=True, index=True)
+    integration_id = Column(Integer, ForeignKey("marketplace_integrations.id", ondelete="CASCADE"), nullable=False, index=True)
+    source = Column(String, nullable=False)  # ozon_transactions, ozon_analytics, wb_sales, wb_orders
+    page_key = Column(String, nullable=False)  # window:<с>:<по>[:page:<n>], cursor:<lastChangeDate> или archive:<месяц>
+    window_start = Column(Date, nullable=False, index=True)
+    window_end = Column(Date, nullable=False, index=True)
+    next_cursor = Column(String, nullable=True)  # Курсор после страницы (для WB)
+    row_count = Column(Integer, default=0)
+    payload = Column(LargeBinary, nullable=False)  # JSON строк ответа, сжатый gzip
+    fetched_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    process_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_marketplace_payloads_integration_source_page', 'integration_id', 'source', 'page_key', unique=True),
+    )
+
+    integration = relationship("MarketplaceIntegration", foreign_keys=[integration_id])
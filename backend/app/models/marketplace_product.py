@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.database import Base
+
+class MarketplaceProduct(Base):
+    """Соответствие артикула маркетплейса товару из справочника"""
+    __tablename__ = "marketplace_products"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, index=True)
+    marketplace = Column(String, nullable=False)  # ozon, wildberries
+    article = Column(String, nullable=False)  # Артикул маркетплейса: SKU OZON, nmId Wildberries
+    seller_article = Column(String, nullable=True)  # Артикул продавца (supplierArticle / offer_id)
+    name = Column(String, nullable=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_marketplace_products_company_marketplace_article', 'company_id', 'marketplace', 'article', unique=True),
+    )
+
+    company = relationship("Company", foreign_keys=[company_id])
+    product = relationship("Product", foreign_keys=[product_id])
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -16,3 +16,33 @@ class Notification(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     read_at = Column(DateTime(timezone=True), nullable=True)
 
+
+class NotificationCheck(Base):
+    """
+    Отметка последнего запуска автоматической проверки (например, отклонений от бюджета):
+    следующий запуск обрабатывает только данные, измененные после checked_at.
+    """
+    __tablename__ = "notification_checks"
+
+    name = Column(String(100), primary_key=True)  # budget_deviations
+    checked_at = Column(DateTime(timezone=True), nullable=False)  # Время БД на начало последней проверки
+
+
+class BudgetChangeMark(Base):
+    """
+    Месяц движений денег организации по типу и статье, измененный после последней проверки
+    отклонений от бюджета. Записывается в той же транзакции, что и изменение: при удалении
+    движения и для прежних организации, статьи и месяца при его изменении тоже.
+    """
+    __tablename__ = "budget_change_marks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    movement_type = Column(String(20), nullable=False)  # income, expense
+    item_id = Column(Integer, nullable=False)  # Статья доходов или расходов (0 - без статьи)
+    month = Column(Date, nullable=False)  # Первое число месяца
+    marked_at = Column(DateTime, nullable=False)  # Время последнего изменения (локальное, без зоны)
+
+    __table_args__ = (
+        Index('ix_budget_change_marks_key', 'company_id', 'movement_type', 'item_id', 'month', unique=True),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, Date, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Numeric, Date, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -15,9 +15,14 @@ class Realization(Base):
     revenue = Column(Numeric(15, 2), nullable=False)  # Общая выручка (сумма всех items)
     quantity = Column(Integer, default=0)  # Общее количество (сумма всех items)
     description = Column(String)
+    external_id = Column(String, nullable=True)  # Внешний ключ синхронизации: маркетплейс + номер отправления или день
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        Index('ix_realizations_company_external_id', 'company_id', 'external_id', unique=True),
+    )
+
     company = relationship("Company", foreign_keys=[company_id])
     sales_channel = relationship("SalesChannel", foreign_keys=[sales_channel_id])
     customer = relationship("Customer", foreign_keys=[customer_id])
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Index, Enum as SQLEnum
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -60,3 +60,19 @@ class Recommendation(Base):
     # Связи
     company = relationship("Company", foreign_keys=[company_id])
     user = relationship("User", foreign_keys=[user_id])
+
+class RecommendationDirtyMark(Base):
+    """
+    Отметка об изменении данных компании в области правил рекомендаций (деньги, продажи,
+    склад, бюджет). Обновление рекомендаций перезапускает только затронутые правила.
+    """
+    __tablename__ = "recommendation_dirty_marks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, index=True)
+    domain = Column(String(50), nullable=False)  # money, sales, inventory, budget, balance, partners
+    marked_at = Column(DateTime, nullable=False)  # Время последнего изменения (локальное, без зоны)
+
+    __table_args__ = (
+        Index('ix_recommendation_dirty_marks_company_domain', 'company_id', 'domain', unique=True),
+    )
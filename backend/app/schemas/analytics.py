@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from datetime import date
+from typing import List, Optional
+
+class PeriodRange(BaseModel):
+    start: date
+    end: date
+    label: Optional[str] = None
+
+class PeriodComparisonRequest(BaseModel):
+    periods: List[PeriodRange]
+    company_id: Optional[int] = None
+    base_index: int = 0  # Период, относительно которого считаются изменения
+    previous_year: bool = False  # Добавить сравнение с теми же периодами прошлого года
@@ -25,6 +25,7 @@ class BudgetResponse(BaseModel):
     income_item_id: Optional[int] = None
     expense_item_id: Optional[int] = None
     planned_amount: float
+    actual_amount: Optional[float] = None  # Факт, сохраненный пересчетом (/api/budget-calculation/calculate-actuals)
     description: Optional[str] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, confloat
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 class BudgetScenarioCreate(BaseModel):
     company_id: int
@@ -27,3 +27,23 @@ class BudgetScenarioResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+class ItemMultiplier(BaseModel):
+    budget_type: str  # "income" or "expense"
+    item_id: int
+    multiplier: float
+
+class ScenarioDrivers(BaseModel):
+    scenario_id: Optional[int] = None  # Сохраненный сценарий (название берется из него)
+    name: Optional[str] = None
+    sales_growth_percent: float = 0  # Рост выручки от реализации
+    income_growth_percent: float = 0  # Рост поступлений по статьям доходов
+    expense_growth_percent: float = 0  # Рост расходов
+    item_multipliers: List[ItemMultiplier] = []
+    channel_shares: Dict[int, confloat(ge=0, le=100)] = {}  # Целевая доля канала продаж в выручке, % (остальные каналы - пропорционально)
+
+class ScenarioSimulationRequest(BaseModel):
+    company_id: int
+    year: int
+    source: str = "budgets"  # "budgets" - плановые бюджеты года, "actuals" - факт предыдущего года
+    scenarios: List[ScenarioDrivers]
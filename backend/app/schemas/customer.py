@@ -87,6 +87,10 @@ class CustomerResponse(BaseModel):
     recency: Optional[int]
     frequency: Optional[int]
     monetary: Optional[Decimal]
+    r_score: Optional[int] = None
+    f_score: Optional[int] = None
+    m_score: Optional[int] = None
+    rfm_segment: Optional[str] = None
     notes: Optional[str]
     is_active: bool
     created_at: datetime
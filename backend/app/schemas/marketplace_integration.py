@@ -11,6 +11,7 @@ class MarketplaceIntegrationCreate(BaseModel):
     is_active: bool = True
     auto_sync: bool = False
     sync_interval_hours: int = 24
+    post_inventory: bool = False
 
 class MarketplaceIntegrationUpdate(BaseModel):
     ozon_client_id: str | None = None
@@ -20,6 +21,7 @@ class MarketplaceIntegrationUpdate(BaseModel):
     is_active: bool | None = None
     auto_sync: bool | None = None
     sync_interval_hours: int | None = None
+    post_inventory: bool | None = None
 
 class MarketplaceIntegrationResponse(BaseModel):
     id: int
@@ -32,6 +34,7 @@ class MarketplaceIntegrationResponse(BaseModel):
     is_active: bool
     auto_sync: bool
     sync_interval_hours: int
+    post_inventory: bool | None = False
     last_sync_at: datetime | None
     last_sync_status: str | None
     last_sync_error: str | None
@@ -0,0 +1,182 @@
+"""
+ABC/XYZ-анализ товаров
+
+Продажи товаров за период загружаются одним агрегирующим запросом
+(товар × неделя или месяц: количество и выручка) в матрицу NumPy.
+ABC-класс определяется по накопленной доле выручки, XYZ-класс - по
+коэффициенту вариации спроса (стандартное отклонение количества по периодам,
+включая периоды без продаж, к среднему). Границы анализа не обязаны совпадать
+с границами недель и месяцев, поэтому спрос периода считается в среднем за день
+из дней периода внутри интервала: неполные крайние периоды (и месяцы разной
+длины) не выглядят провалами спроса.
+
+Результат кешируется в памяти процесса по набору организаций, периоду и
+гранулярности; перед выдачей из кеша проверяется версия данных (количество,
+последний id и сумма позиций реализаций за период) - при изменениях анализ
+пересчитывается.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.product import Product
+from app.models.realization import Realization, RealizationItem
+from app.utils.periods import period_index, period_count, period_days, PERIOD_WEEK
+
+# Границы ABC по накопленной доле выручки (%)
+ABC_THRESHOLDS = (80, 95)
+# Границы XYZ по коэффициенту вариации спроса
+XYZ_THRESHOLDS = (0.1, 0.25)
+# Сколько результатов анализа хранить в кеше
+MAX_CACHED_ANALYSES = 200
+
+_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _sales_query(db: Session, company_ids: Optional[Iterable[int]], start_date: date, end_date: date, *columns):
+    """Позиции реализаций организаций за период"""
+    query = db.query(*columns).join(
+        Realization, RealizationItem.realization_id == Realization.id
+    ).filter(
+        Realization.date >= start_date,
+        Realization.date <= end_date
+    )
+    if company_ids is not None:
+        query = query.filter(Realization.company_id.in_(list(company_ids)))
+    return query
+
+def _data_version(db: Session, company_ids, start_date: date, end_date: date) -> tuple:
+    """Версия данных периода: меняется при добавлении, удалении и изменении позиций"""
+    row = _sales_query(
+        db, company_ids, start_date, end_date,
+        func.count(RealizationItem.id),
+        func.max(RealizationItem.id),
+        func.sum(RealizationItem.quantity),
+        func.sum(RealizationItem.price * RealizationItem.quantity)
+    ).one()
+    return tuple(str(value) for value in row)
+
+def load_sales_matrix(db: Session, company_ids, start_date: date, end_date: date, period: str = PERIOD_WEEK) -> Dict:
+    """
+    Матрицы продаж товаров по периодам: {"product_ids", "quantity", "revenue", "days"}
+    (строки - товары, столбцы - периоды от start_date; days - дней каждого периода в интервале)
+    """
+    bucket = period_index(db, Realization.date, start_date, period).label('period')
+    rows = _sales_query(
+        db, company_ids, start_date, end_date,
+        RealizationItem.product_id,
+        bucket,
+        func.sum(RealizationItem.quantity),
+        func.sum(RealizationItem.price * RealizationItem.quantity)
+    ).group_by(RealizationItem.product_id, bucket).all()
+
+    n_periods = period_count(start_date, end_date, period)
+    product_ids = np.array(sorted({row[0] for row in rows}), dtype=np.int64)
+    quantity = np.zeros((len(product_ids), n_periods))
+    revenue = np.zeros((len(product_ids), n_periods))
+    if rows:
+        row_index = np.searchsorted(product_ids, np.array([row[0] for row in rows], dtype=np.int64))
+        column_index = np.clip(np.array([int(row[1]) for row in rows]), 0, n_periods - 1)
+        np.add.at(quantity, (row_index, column_index), np.array([float(row[2] or 0) for row in rows]))
+        np.add.at(revenue, (row_index, column_index), np.array([float(row[3] or 0) for row in rows]))
+    days = np.array(period_days(start_date, end_date, period), dtype=float)
+    return {"product_ids": product_ids, "quantity": quantity, "revenue": revenue, "days": days}
+
+def classify(quantity: np.ndarray, revenue: np.ndarray, days: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """
+    ABC/XYZ-классы для строк матриц продаж. Строки результата упорядочены
+    по убыванию выручки (order - индексы исходных строк). days - дней каждого
+    периода в интервале: вариация считается по спросу в среднем за день.
+    """
+    total_revenue = revenue.sum(axis=1)
+    order = np.argsort(-total_revenue, kind="stable")
+    grand_total = total_revenue.sum()
+    percent = total_revenue[order] / grand_total * 100 if grand_total > 0 else np.zeros(len(order))
+    cumulative = np.cumsum(percent)
+    # Класс по доле до товара: товар, пересекающий границу, остается в старшем классе
+    before = cumulative - percent
+    abc = np.where(before < ABC_THRESHOLDS[0], "A", np.where(before < ABC_THRESHOLDS[1], "B", "C"))
+
+    quantity = quantity[order]
+    demand = quantity / days if days is not None else quantity
+    mean = demand.mean(axis=1) if demand.shape[1] else np.zeros(len(order))
+    std = demand.std(axis=1) if demand.shape[1] else np.zeros(len(order))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cv = np.where(mean > 0, std / mean, np.inf)
+    xyz = np.where(cv <= XYZ_THRESHOLDS[0], "X", np.where(cv <= XYZ_THRESHOLDS[1], "Y", "Z"))
+    return {
+        "order": order,
+        "revenue": total_revenue[order],
+        "quantity": quantity.sum(axis=1),
+        "percent": percent,
+        "cumulative": cumulative,
+        "abc": abc,
+        "cv": cv,
+        "xyz": xyz
+    }
+
+def abc_xyz_analysis(
+    db: Session,
+    company_ids: Optional[Iterable[int]],
+    start_date: date,
+    end_date: date,
+    period: str = PERIOD_WEEK
+) -> Dict:
+    """
+    ABC/XYZ-анализ товаров организаций за период (company_ids=None - все организации).
+    Возвращает {"analysis": [...], "total_products", "total_revenue", "periods"}.
+    """
+    scope = None if company_ids is None else tuple(sorted(set(company_ids)))
+    key = (scope, start_date, end_date, period)
+    version = _data_version(db, scope, start_date, end_date)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached["version"] == version:
+            _cache.move_to_end(key)
+            return cached["result"]
+
+    matrix = load_sales_matrix(db, scope, start_date, end_date, period)
+    classes = classify(matrix["quantity"], matrix["revenue"], matrix["days"])
+    product_ids = matrix["product_ids"][classes["order"]]
+
+    products = {}
+    if len(product_ids):
+        sold = _sales_query(db, scope, start_date, end_date, RealizationItem.product_id).distinct()
+        products = {
+            row.id: row
+            for row in db.query(Product.id, Product.name, Product.sku).filter(Product.id.in_(sold.subquery().select()))
+        }
+
+    analysis = []
+    for index, product_id in enumerate(product_ids.tolist()):
+        product = products.get(product_id)
+        cv = float(classes["cv"][index])
+        analysis.append({
+            "product_id": product_id,
+            "name": product.name if product else None,
+            "sku": product.sku if product else None,
+            "revenue": float(classes["revenue"][index]),
+            "quantity": float(classes["quantity"][index]),
+            "revenue_percent": round(float(classes["percent"][index]), 2),
+            "cumulative_percent": round(float(classes["cumulative"][index]), 2),
+            "abc_class": str(classes["abc"][index]),
+            "coefficient_of_variation": round(cv, 4) if np.isfinite(cv) else None,
+            "xyz_class": str(classes["xyz"][index]),
+            "abc_xyz": f"{classes['abc'][index]}{classes['xyz'][index]}"
+        })
+
+    result = {
+        "analysis": analysis,
+        "total_products": len(analysis),
+        "total_revenue": float(classes["revenue"].sum()),
+        "periods": matrix["quantity"].shape[1]
+    }
+    with _cache_lock:
+        _cache[key] = {"version": version, "result": result}
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_ANALYSES:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,209 @@
+"""
+Выявление аномалий в месячных рядах (статьи расходов, товары, выручка)
+
+Данные компании загружаются одним сгруппированным запросом в матрицу
+"ряд × месяц" (строка - статья или товар, столбец - календарный месяц), и
+показатели считаются сразу для всех рядов средствами NumPy:
+- сезонный z-score: значение последнего месяца очищается от сезонности
+  (средний уровень того же календарного месяца относительно среднего ряда,
+  если месяц встречался в истории не менее SEASONAL_MIN_YEARS раз) и
+  сравнивается со средним и стандартным отклонением очищенной истории;
+- робастная оценка по медиане и MAD очищенной истории (модифицированный
+  z-score), устойчивая к единичным выбросам;
+- рост к предыдущему месяцу (%).
+
+Оценивается последний завершенный месяц: неполный текущий месяц искажает
+сравнение с историей. История ряда начинается с его первого ненулевого месяца.
+"""
+import warnings
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import func, extract
+from sqlalchemy.orm import Session
+from app.models.input1 import MoneyMovement
+from app.models.realization import Realization, RealizationItem
+
+# Глубина матрицы (завершенных месяцев): оцениваемый месяц и два года истории,
+# чтобы тот же календарный месяц встретился в истории дважды
+ANOMALY_MONTHS = 25
+# Минимум месяцев истории ряда для статистических оценок
+MIN_HISTORY_MONTHS = 6
+# Сколько раз календарный месяц должен встретиться в истории для сезонной поправки
+SEASONAL_MIN_YEARS = 2
+# Пороги: z-score, модифицированный z-score по MAD
+Z_THRESHOLD = 2.0
+MAD_THRESHOLD = 3.5
+# Минимальный разброс относительно среднего уровня ряда: почти постоянные ряды
+# (аренда, подписки) не дают аномалий на копеечных изменениях
+MIN_RELATIVE_SPREAD = 0.05
+# Коэффициент приведения MAD к стандартному отклонению нормального распределения
+MAD_SCALE = 0.6745
+
+def month_starts(last_month: date, count: int) -> List[date]:
+    """Первые дни count календарных месяцев, заканчивая месяцем last_month"""
+    months = []
+    year, month = last_month.year, last_month.month
+    for _ in range(count):
+        months.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+class SeriesMatrix:
+    """Матрица значений: строки - ряды (keys), столбцы - месяцы (months)"""
+
+    def __init__(self, keys: List, months: List[date], values: np.ndarray):
+        self.keys = keys
+        self.months = months
+        self.values = values
+
+    @classmethod
+    def from_rows(cls, rows, months: List[date]) -> "SeriesMatrix":
+        """Собрать матрицу из строк (key, year, month, value); строки вне периода отбрасываются"""
+        column_by_month = {(month.year, month.month): index for index, month in enumerate(months)}
+        keys = []
+        row_by_key = {}
+        row_index, column_index, amounts = [], [], []
+        for key, year, month, value in rows:
+            column = column_by_month.get((int(year), int(month)))
+            if column is None:
+                continue
+            if key not in row_by_key:
+                row_by_key[key] = len(keys)
+                keys.append(key)
+            row_index.append(row_by_key[key])
+            column_index.append(column)
+            amounts.append(float(value or 0))
+        values = np.zeros((len(keys), len(months)))
+        np.add.at(values, (row_index, column_index), amounts)
+        return cls(keys, months, values)
+
+    def row(self, key) -> Optional[np.ndarray]:
+        if key not in self.keys:
+            return None
+        return self.values[self.keys.index(key)]
+
+def finite_or_none(value) -> Optional[float]:
+    """Число для сохранения в JSON: NaN и бесконечность заменяются на None"""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def _monthly_query(db: Session, key_column, value_column, date_column, months: List[date], *filters, join=None):
+    """Сгруппированный запрос (ключ, год, месяц, сумма) за период матрицы"""
+    next_month = (months[-1] + timedelta(days=32)).replace(day=1)
+    year = extract('year', date_column)
+    month = extract('month', date_column)
+    query = db.query(key_column, year, month, func.sum(value_column))
+    if join is not None:
+        query = query.join(join)
+    return query.filter(
+        date_column >= months[0],
+        date_column < next_month,
+        *filters
+    ).group_by(key_column, year, month).all()
+
+def evaluation_months(today: date, count: int = ANOMALY_MONTHS) -> List[date]:
+    """Месяцы матрицы: count завершенных месяцев до текущего"""
+    return month_starts(today.replace(day=1) - timedelta(days=1), count)
+
+def load_expense_matrix(db: Session, company_id: int, today: date, count: int = ANOMALY_MONTHS) -> SeriesMatrix:
+    """Бизнес-расходы по статьям и месяцам"""
+    months = evaluation_months(today, count)
+    rows = _monthly_query(
+        db, MoneyMovement.expense_item_id, MoneyMovement.amount, MoneyMovement.date, months,
+        MoneyMovement.company_id == company_id,
+        MoneyMovement.movement_type == "expense",
+        MoneyMovement.is_business == True,
+        MoneyMovement.expense_item_id.isnot(None)
+    )
+    return SeriesMatrix.from_rows(rows, months)
+
+def load_product_matrix(db: Session, company_id: int, today: date, count: int = ANOMALY_MONTHS) -> SeriesMatrix:
+    """Выручка по товарам (позиции реализаций) и месяцам"""
+    months = evaluation_months(today, count)
+    rows = _monthly_query(
+        db, RealizationItem.product_id, RealizationItem.price * RealizationItem.quantity, Realization.date, months,
+        Realization.company_id == company_id,
+        join=Realization
+    )
+    return SeriesMatrix.from_rows(rows, months)
+
+def load_revenue_matrix(db: Session, company_id: int, today: date, count: int = ANOMALY_MONTHS) -> SeriesMatrix:
+    """Общая выручка компании по месяцам (матрица из одного ряда с ключом company_id)"""
+    months = evaluation_months(today, count)
+    rows = _monthly_query(
+        db, Realization.company_id, Realization.revenue, Realization.date, months,
+        Realization.company_id == company_id
+    )
+    return SeriesMatrix.from_rows(rows, months)
+
+def detect_anomalies(matrix: SeriesMatrix) -> Dict[str, np.ndarray]:
+    """
+    Показатели последнего месяца для всех рядов матрицы:
+    value, history_months, mean, z_score, mad_score, growth_percent.
+    Показатель равен NaN, если его нельзя посчитать (мало истории, нулевой разброс).
+    """
+    values = matrix.values
+    n_series, n_months = values.shape
+    empty = np.full(n_series, np.nan)
+    if n_series == 0 or n_months < 2:
+        return {
+            "value": values[:, -1] if n_months else empty, "history_months": np.zeros(n_series, dtype=int),
+            "mean": empty, "z_score": empty, "mad_score": empty, "growth_percent": empty
+        }
+
+    last = values[:, -1]
+    previous = values[:, -2]
+    history = values[:, :-1].copy()
+
+    # История ряда начинается с первого ненулевого месяца
+    started = np.cumsum(history > 0, axis=1) > 0
+    history[~started] = np.nan
+    history_months = started.sum(axis=1)
+    enough = history_months >= MIN_HISTORY_MONTHS
+
+    # Пустые срезы (ряды без истории) дают NaN, предупреждения NumPy о них не нужны
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        series_mean = np.nanmean(np.where(enough[:, None], history, np.nan), axis=1)
+
+        # Сезонные коэффициенты календарных месяцев
+        calendar = np.array([month.month - 1 for month in matrix.months])
+        one_hot = np.eye(12)[calendar[:-1]]
+        observed = ~np.isnan(history)
+        month_sums = np.nan_to_num(history) @ one_hot
+        month_counts = observed.astype(float) @ one_hot
+        seasonal = (month_sums / month_counts) / series_mean[:, None]
+        valid = (month_counts >= SEASONAL_MIN_YEARS) & np.isfinite(seasonal) & (seasonal > 0)
+        seasonal = np.where(valid, seasonal, 1.0)
+
+        adjusted_history = history / seasonal[:, calendar[:-1]]
+        adjusted_last = last / seasonal[:, calendar[-1]]
+        adjusted_mean = np.nanmean(adjusted_history, axis=1)
+
+        # Разброс очищенной истории занижен на подобранные коэффициенты: делим сумму
+        # квадратов на число степеней свободы и учитываем ошибку коэффициента
+        # оцениваемого месяца (прогнозная дисперсия)
+        degrees = observed.sum(axis=1) - 1 - valid.sum(axis=1)
+        last_counts = np.where(valid[:, calendar[-1]], month_counts[:, calendar[-1]], np.inf)
+        inflation = np.sqrt(observed.sum(axis=1) / degrees * (1 + 1 / last_counts))
+        residual_var = np.nansum((adjusted_history - adjusted_mean[:, None]) ** 2, axis=1) / degrees
+        floor = MIN_RELATIVE_SPREAD * np.abs(adjusted_mean)
+        spread = np.fmax(np.sqrt(residual_var * (1 + 1 / last_counts)), floor)
+        usable = enough & (degrees >= MIN_HISTORY_MONTHS - 1)
+        z_score = np.where(usable & (spread > 0), (adjusted_last - adjusted_mean) / spread, np.nan)
+
+        median = np.nanmedian(np.where(usable[:, None], adjusted_history, np.nan), axis=1)
+        mad = np.fmax(np.nanmedian(np.abs(adjusted_history - median[:, None]), axis=1) * inflation, MAD_SCALE * floor)
+        mad_score = np.where(usable & (mad > 0), MAD_SCALE * (adjusted_last - median) / mad, np.nan)
+
+        growth_percent = np.where((previous > 0) & (last > 0), (last - previous) / previous * 100, np.nan)
+
+    return {
+        "value": last,
+        "history_months": history_months,
+        "mean": series_mean,
+        "z_score": z_score,
+        "mad_score": mad_score,
+        "growth_percent": growth_percent
+    }
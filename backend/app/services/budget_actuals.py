@@ -0,0 +1,145 @@
+"""
+Фактические суммы по бюджетам (план-факт)
+
+Границы периодов выбранных бюджетов передаются в запрос как подзапрос
+(UNION ALL строк бюджет/организация/тип/статья/начало/конец), и факт по всем
+бюджетам считается одним сгруппированным запросом: движения денег
+соединяются с бюджетами по организации, типу движения, статье (если статья
+в бюджете не указана - все статьи типа) и попаданию даты в период бюджета.
+
+SQLite ограничивает число частей составного SELECT (500), поэтому бюджеты
+передаются пачками по BOUNDS_CHUNK_SIZE - для тысяч бюджетов это единицы
+запросов вместо запроса на каждый бюджет.
+
+refresh_budget_actuals сохраняет факт в budgets.actual_amount пакетными
+UPDATE по id (по пачке на каждый запрос факта) - вызывается из API и из
+планировщика после загрузки данных (refresh_budget_actuals.py). Пересчет
+факта не меняет budgets.updated_at: по нему проверка отклонений
+(notification_service.check_budget_deviations) находит измененные планы.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import Date, Integer, String, and_, bindparam, func, literal, or_, select, union_all, update
+from sqlalchemy.orm import Session
+from app.models.budget import Budget, BudgetPeriod, BudgetType
+from app.models.input1 import MoneyMovement
+
+# Сколько бюджетов передавать в одном подзапросе границ
+BOUNDS_CHUNK_SIZE = 400
+
+def budget_period_dates(period_type: BudgetPeriod, period_value: str) -> tuple[date, date]:
+    """Начальная и конечная даты периода бюджета ("2024-01", "2024-Q1", "2024")"""
+    if period_type == BudgetPeriod.MONTH:
+        year, month = map(int, period_value.split("-"))
+        start_date = date(year, month, 1)
+        end_month = month
+    elif period_type == BudgetPeriod.QUARTER:
+        year, quarter = map(int, period_value.split("-Q"))
+        start_date = date(year, (quarter - 1) * 3 + 1, 1)
+        end_month = quarter * 3
+    else:  # YEAR
+        year = int(period_value)
+        start_date = date(year, 1, 1)
+        end_month = 12
+    next_month = date(year + 1, 1, 1) if end_month == 12 else date(year, end_month + 1, 1)
+    return start_date, next_month - timedelta(days=1)
+
+def _bounds_subquery(budgets: List):
+    """Подзапрос границ бюджетов: (budget_id, company_id, movement_type, item_id, start, end)"""
+    rows = []
+    for budget in budgets:
+        start_date, end_date = budget_period_dates(budget.period_type, budget.period_value)
+        if budget.budget_type == BudgetType.INCOME:
+            movement_type, item_id = "income", budget.income_item_id
+        else:
+            movement_type, item_id = "expense", budget.expense_item_id
+        rows.append(select(
+            literal(budget.id, Integer).label("budget_id"),
+            literal(budget.company_id, Integer).label("company_id"),
+            literal(movement_type, String).label("movement_type"),
+            literal(item_id, Integer).label("item_id"),
+            literal(start_date, Date).label("start"),
+            literal(end_date, Date).label("end")
+        ))
+    return (union_all(*rows) if len(rows) > 1 else rows[0]).subquery("bounds")
+
+def _chunk_actuals(db: Session, budgets: List) -> Dict[int, float]:
+    """Факт по пачке бюджетов одним запросом"""
+    bounds = _bounds_subquery(budgets)
+    periods = [budget_period_dates(budget.period_type, budget.period_value) for budget in budgets]
+    rows = db.execute(
+        select(bounds.c.budget_id, func.sum(MoneyMovement.amount))
+        .select_from(bounds)
+        .join(MoneyMovement, and_(
+            MoneyMovement.company_id == bounds.c.company_id,
+            MoneyMovement.movement_type == bounds.c.movement_type,
+            MoneyMovement.date >= bounds.c.start,
+            MoneyMovement.date <= bounds.c.end,
+            or_(
+                bounds.c.item_id.is_(None),
+                and_(bounds.c.movement_type == "income", MoneyMovement.income_item_id == bounds.c.item_id),
+                and_(bounds.c.movement_type == "expense", MoneyMovement.expense_item_id == bounds.c.item_id)
+            )
+        ))
+        # Ограничение по организациям и датам позволяет использовать индексы движений
+        .where(
+            MoneyMovement.company_id.in_({budget.company_id for budget in budgets}),
+            MoneyMovement.date >= min(start for start, _ in periods),
+            MoneyMovement.date <= max(end for _, end in periods)
+        )
+        .group_by(bounds.c.budget_id)
+    ).all()
+    return {budget_id: float(amount or 0) for budget_id, amount in rows}
+
+def budget_actual_amounts(db: Session, budgets: Iterable) -> Dict[int, float]:
+    """
+    Фактические суммы бюджетов: {budget_id: сумма движений за период} (0 - движений нет).
+    budgets - объекты Budget или строки с теми же полями (см. _budget_rows).
+    """
+    budgets = list(budgets)
+    actuals = {budget.id: 0.0 for budget in budgets}
+    for offset in range(0, len(budgets), BOUNDS_CHUNK_SIZE):
+        actuals.update(_chunk_actuals(db, budgets[offset:offset + BOUNDS_CHUNK_SIZE]))
+    return actuals
+
+def _budget_rows(db: Session, budget_id: Optional[int], company_id: Optional[int], period_value: Optional[str]):
+    """Поля бюджетов, нужные для расчета факта (без загрузки объектов Budget)"""
+    query = db.query(
+        Budget.id, Budget.company_id, Budget.period_type, Budget.period_value,
+        Budget.budget_type, Budget.income_item_id, Budget.expense_item_id
+    )
+    if budget_id:
+        query = query.filter(Budget.id == budget_id)
+    if company_id:
+        query = query.filter(Budget.company_id == company_id)
+    if period_value:
+        query = query.filter(Budget.period_value == period_value)
+    return query.order_by(Budget.id).all()
+
+def refresh_budget_actuals(
+    db: Session,
+    budget_id: Optional[int] = None,
+    company_id: Optional[int] = None,
+    period_value: Optional[str] = None
+) -> int:
+    """
+    Пересчитать и сохранить budgets.actual_amount для выбранных бюджетов
+    (без фильтров - для всех). Возвращает количество обновленных бюджетов.
+    """
+    budgets = _budget_rows(db, budget_id, company_id, period_value)
+    # UPDATE таблицы, а не ORM: updated_at остается прежним (onupdate не срабатывает)
+    table = Budget.__table__
+    stmt = update(table).where(table.c.id == bindparam("budget_id")).values(
+        actual_amount=bindparam("actual"), updated_at=table.c.updated_at
+    )
+    for offset in range(0, len(budgets), BOUNDS_CHUNK_SIZE):
+        chunk = budgets[offset:offset + BOUNDS_CHUNK_SIZE]
+        actuals = _chunk_actuals(db, chunk)
+        db.execute(stmt, [
+            {"budget_id": budget.id, "actual": Decimal(str(actuals.get(budget.id, 0.0))).quantize(Decimal("0.01"))}
+            for budget in chunk
+        ])
+    db.commit()
+    print(f"[BUDGET] Пересчитан факт {len(budgets)} бюджетов")
+    return len(budgets)
@@ -0,0 +1,273 @@
+"""
+Моделирование сценариев бюджета (what-if)
+
+База сценариев загружается агрегирующими запросами в массивы NumPy:
+- денежные строки "статья × месяц" года - плановые бюджеты (квартальные и
+  годовые бюджеты распределяются по месяцам равномерно, пересекающиеся бюджеты
+  не складываются - см. load_cash_base) или факт движений денег предыдущего года;
+- продажи "канал × месяц" - выручка и себестоимость реализаций
+  предыдущего года (в бюджетах нет разреза по каналам).
+
+Драйверы сценария (рост выручки, доходов и расходов в %, множители статей,
+целевые доли каналов продаж) превращаются в массивы коэффициентов
+"сценарий × статья" и "сценарий × канал × месяц", поэтому все сценарии
+считаются одной серией векторных операций без циклов по месяцам и статьям.
+Результат - ОПУ (выручка, себестоимость, валовая и операционная прибыль)
+и денежный поток (поступления, выплаты, помесячное и накопленное сальдо)
+по каждому сценарию.
+"""
+from datetime import date
+from typing import Dict, List
+import numpy as np
+from sqlalchemy import Integer, cast, extract, func
+from sqlalchemy.orm import Session
+from app.models.budget import Budget, BudgetPeriod, BudgetType
+from app.models.input1 import MoneyMovement
+from app.models.realization import Realization, RealizationItem
+
+SOURCE_BUDGETS = "budgets"
+SOURCE_ACTUALS = "actuals"
+SOURCES = (SOURCE_BUDGETS, SOURCE_ACTUALS)
+MONTHS = 12
+# Максимум сценариев в одном расчете
+MAX_SCENARIOS = 100
+# Детальность бюджетов: ячейка "статья × месяц" берется из самого детального бюджета
+BUDGET_GRANULARITY = {BudgetPeriod.MONTH: 0, BudgetPeriod.QUARTER: 1, BudgetPeriod.YEAR: 2}
+
+def _line_matrix(rows) -> Dict:
+    """Матрица "строка × месяц" из (movement_type, item_id, month_index, amount); строка - (тип, статья)"""
+    lines = sorted({(row[0], row[1]) for row in rows}, key=lambda line: (line[0], line[1] is not None, line[1] or 0))
+    index = {line: position for position, line in enumerate(lines)}
+    values = np.zeros((len(lines), MONTHS))
+    if rows:
+        np.add.at(
+            values,
+            (np.array([index[(row[0], row[1])] for row in rows]), np.array([row[2] for row in rows])),
+            np.array([float(row[3] or 0) for row in rows])
+        )
+    return {"lines": lines, "index": index, "values": values}
+
+def load_cash_base(db: Session, company_id: int, year: int, source: str = SOURCE_BUDGETS) -> Dict:
+    """
+    Денежные строки года: {"lines": [(movement_type, item_id)], "index", "values" (строки × 12 месяцев)}.
+    item_id=None - бюджет/движения без статьи.
+
+    Бюджеты одной статьи разной детальности пересекаются (бюджет месяца входит в бюджет
+    квартала и года), поэтому ячейка "статья × месяц" берется из самого детального бюджета.
+    Бюджет без статьи - план по всем статьям типа: в месяцах, где есть бюджеты статей
+    этого типа, он не учитывается, иначе статьи были бы посчитаны дважды.
+    """
+    rows = []
+    if source == SOURCE_ACTUALS:
+        month = cast(extract('month', MoneyMovement.date), Integer)
+        query = db.query(
+            MoneyMovement.movement_type, MoneyMovement.income_item_id, MoneyMovement.expense_item_id,
+            month, func.sum(MoneyMovement.amount)
+        ).filter(
+            MoneyMovement.company_id == company_id,
+            MoneyMovement.date >= date(year - 1, 1, 1),
+            MoneyMovement.date <= date(year - 1, 12, 31)
+        ).group_by(
+            MoneyMovement.movement_type, MoneyMovement.income_item_id, MoneyMovement.expense_item_id, month
+        )
+        for movement_type, income_item_id, expense_item_id, month_number, amount in query:
+            item_id = income_item_id if movement_type == "income" else expense_item_id
+            rows.append((movement_type, item_id, int(month_number) - 1, amount))
+    else:
+        budgets = db.query(
+            Budget.budget_type, Budget.income_item_id, Budget.expense_item_id,
+            Budget.period_type, Budget.period_value, Budget.planned_amount
+        ).filter(
+            Budget.company_id == company_id,
+            Budget.period_value.like(f"{year}%")
+        )
+        # (тип, статья, месяц) -> (детальность, сумма)
+        cells = {}
+        for budget_type, income_item_id, expense_item_id, period_type, period_value, planned in budgets:
+            if budget_type == BudgetType.INCOME:
+                line = ("income", income_item_id)
+            else:
+                line = ("expense", expense_item_id)
+            if period_type == BudgetPeriod.MONTH:
+                months = [int(period_value.split("-")[1]) - 1]
+            elif period_type == BudgetPeriod.QUARTER:
+                quarter = int(period_value.split("-Q")[1])
+                months = list(range((quarter - 1) * 3, quarter * 3))
+            else:
+                months = list(range(MONTHS))
+            granularity = BUDGET_GRANULARITY.get(period_type, len(BUDGET_GRANULARITY))
+            for month_index in months:
+                key = (line[0], line[1], month_index)
+                amount = float(planned or 0) / len(months)
+                current = cells.get(key)
+                if current is None or granularity < current[0]:
+                    cells[key] = (granularity, amount)
+                elif granularity == current[0]:
+                    cells[key] = (granularity, current[1] + amount)
+        itemized = {(movement_type, month_index) for movement_type, item_id, month_index in cells if item_id is not None}
+        rows = [
+            (movement_type, item_id, month_index, amount)
+            for (movement_type, item_id, month_index), (_, amount) in cells.items()
+            if item_id is not None or (movement_type, month_index) not in itemized
+        ]
+    return _line_matrix(rows)
+
+def load_sales_base(db: Session, company_id: int, year: int) -> Dict:
+    """
+    Продажи предыдущего года по каналам: {"channel_ids", "revenue", "cost"} (каналы × 12 месяцев).
+    Себестоимость - по позициям реализаций.
+    """
+    month = cast(extract('month', Realization.date), Integer)
+    period = (
+        Realization.company_id == company_id,
+        Realization.date >= date(year - 1, 1, 1),
+        Realization.date <= date(year - 1, 12, 31)
+    )
+    revenue_rows = db.query(
+        Realization.sales_channel_id, month, func.sum(Realization.revenue)
+    ).filter(*period).group_by(Realization.sales_channel_id, month).all()
+    cost_rows = db.query(
+        Realization.sales_channel_id, month, func.sum(RealizationItem.cost_price * RealizationItem.quantity)
+    ).join(
+        RealizationItem, RealizationItem.realization_id == Realization.id
+    ).filter(*period).group_by(Realization.sales_channel_id, month).all()
+
+    channel_ids = np.array(sorted({row[0] for row in revenue_rows + cost_rows}), dtype=np.int64)
+    matrices = {}
+    for name, rows in (("revenue", revenue_rows), ("cost", cost_rows)):
+        values = np.zeros((len(channel_ids), MONTHS))
+        if rows:
+            np.add.at(
+                values,
+                (np.searchsorted(channel_ids, [row[0] for row in rows]), np.array([int(row[1]) - 1 for row in rows])),
+                np.array([float(row[2] or 0) for row in rows])
+            )
+        matrices[name] = values
+    return {"channel_ids": channel_ids, **matrices}
+
+def _with_channels(sales: Dict, channel_ids) -> Dict:
+    """Добавить в базу продаж каналы без истории (для целевых долей новых каналов)"""
+    missing = sorted(set(channel_ids) - set(sales["channel_ids"].tolist()))
+    if not missing:
+        return sales
+    ids = np.concatenate([sales["channel_ids"], np.array(missing, dtype=np.int64)])
+    order = np.argsort(ids)
+    pad = ((0, len(missing)), (0, 0))
+    return {
+        "channel_ids": ids[order],
+        "revenue": np.pad(sales["revenue"], pad)[order],
+        "cost": np.pad(sales["cost"], pad)[order]
+    }
+
+def simulate(cash: Dict, sales: Dict, scenarios: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Расчет сценариев над базой. scenarios - словари драйверов (поля ScenarioDrivers).
+    Возвращает массивы "сценарий × ..." : income, expenses (сценарий × месяц),
+    channel_revenue, channel_cost (сценарий × канал × месяц).
+    """
+    n = len(scenarios)
+    sales = _with_channels(sales, [channel for drivers in scenarios for channel in (drivers.get("channel_shares") or {})])
+
+    # Денежные строки: рост по типу строки × множитель статьи
+    is_income = np.array([line[0] == "income" for line in cash["lines"]], dtype=bool)
+    income_growth = 1 + np.array([drivers.get("income_growth_percent") or 0 for drivers in scenarios], dtype=float) / 100
+    expense_growth = 1 + np.array([drivers.get("expense_growth_percent") or 0 for drivers in scenarios], dtype=float) / 100
+    factors = np.where(is_income[None, :], income_growth[:, None], expense_growth[:, None])
+    for position, drivers in enumerate(scenarios):
+        for multiplier in drivers.get("item_multipliers") or []:
+            line = cash["index"].get((multiplier["budget_type"], multiplier["item_id"]))
+            if line is not None:
+                factors[position, line] *= multiplier["multiplier"]
+    projected = factors[:, :, None] * cash["values"][None, :, :]
+    income = projected[:, is_income, :].sum(axis=1)
+    expenses = projected[:, ~is_income, :].sum(axis=1)
+
+    # Продажи: выручка месяца с ростом, распределенная по каналам
+    revenue, cost = sales["revenue"], sales["cost"]
+    channel_ids = sales["channel_ids"].tolist()
+    month_total = revenue.sum(axis=0)
+    base_share = np.divide(revenue, month_total[None, :], out=np.zeros_like(revenue), where=month_total[None, :] > 0)
+    targets = np.full((n, len(channel_ids)), np.nan)
+    for position, drivers in enumerate(scenarios):
+        for channel_id, share in (drivers.get("channel_shares") or {}).items():
+            targets[position, channel_ids.index(int(channel_id))] = share / 100
+    fixed = np.isfinite(targets)
+    fixed_total = np.where(fixed, targets, 0).sum(axis=1)
+    if (fixed_total > 1 + 1e-9).any():
+        raise ValueError("Сумма целевых долей каналов превышает 100%")
+    # Каналы без целевой доли делят остаток пропорционально своим базовым долям;
+    # в месяцах без их продаж - пропорционально долям за год
+    channel_totals = revenue.sum(axis=1)
+    year_share = channel_totals / channel_totals.sum() if channel_totals.sum() > 0 else np.zeros(len(channel_ids))
+    free_year = np.where(fixed, 0, year_share[None, :])
+    if month_total.sum() > 0 and ((fixed_total < 1 - 1e-9) & (free_year.sum(axis=1) <= 0)).any():
+        raise ValueError("Сумма целевых долей каналов меньше 100%, а каналов без целевой доли с выручкой нет")
+    free_share = np.where(fixed[:, :, None], 0, base_share[None, :, :])
+    free_share = np.where(free_share.sum(axis=1, keepdims=True) > 0, free_share, free_year[:, :, None])
+    free_total = free_share.sum(axis=1)
+    scale = np.divide(
+        (1 - fixed_total)[:, None] * np.ones_like(free_total), free_total,
+        out=np.zeros_like(free_total), where=free_total > 0
+    )
+    share = np.where(fixed[:, :, None], np.nan_to_num(targets)[:, :, None], free_share * scale[:, None, :])
+    sales_growth = 1 + np.array([drivers.get("sales_growth_percent") or 0 for drivers in scenarios], dtype=float) / 100
+    channel_revenue = share * month_total[None, None, :] * sales_growth[:, None, None]
+
+    # Себестоимость - по доле себестоимости канала (новые каналы - по средней)
+    overall_ratio = cost.sum() / channel_totals.sum() if channel_totals.sum() > 0 else 0.0
+    cost_ratio = np.divide(cost.sum(axis=1), channel_totals, out=np.full(len(channel_ids), overall_ratio), where=channel_totals > 0)
+    channel_cost = channel_revenue * cost_ratio[None, :, None]
+    return {
+        "channel_ids": sales["channel_ids"],
+        "income": income,
+        "expenses": expenses,
+        "channel_revenue": channel_revenue,
+        "channel_cost": channel_cost
+    }
+
+def _round(values) -> List[float]:
+    return [round(float(value), 2) for value in values]
+
+def simulate_scenarios(db: Session, company_id: int, year: int, scenarios: List[Dict], source: str = SOURCE_BUDGETS) -> Dict:
+    """
+    Рассчитать сценарии для организации на год. Первым в результате идет базовый
+    вариант без драйверов ("base"), затем сценарии в порядке запроса.
+    """
+    cash = load_cash_base(db, company_id, year, source)
+    sales = load_sales_base(db, company_id, year)
+    result = simulate(cash, sales, [{}] + list(scenarios))
+
+    revenue = result["channel_revenue"].sum(axis=1)
+    cost = result["channel_cost"].sum(axis=1)
+    net_cash = result["income"] - result["expenses"]
+    rows = []
+    for position in range(revenue.shape[0]):
+        total_revenue = float(revenue[position].sum())
+        gross_profit = total_revenue - float(cost[position].sum())
+        operating_profit = gross_profit - float(result["expenses"][position].sum())
+        drivers = ({}, *scenarios)[position]
+        rows.append({
+            "scenario_id": drivers.get("scenario_id"),
+            "name": drivers.get("name") or ("Базовый" if position == 0 else f"Сценарий {position}"),
+            "profit_loss": {
+                "revenue": round(total_revenue, 2),
+                "cost_of_goods_sold": round(float(cost[position].sum()), 2),
+                "gross_profit": round(gross_profit, 2),
+                "expenses": round(float(result["expenses"][position].sum()), 2),
+                "operating_profit": round(operating_profit, 2),
+                "operating_margin": round(operating_profit / total_revenue * 100, 2) if total_revenue else 0.0,
+                "monthly_revenue": _round(revenue[position])
+            },
+            "cash_flow": {
+                "income": round(float(result["income"][position].sum()), 2),
+                "expenses": round(float(result["expenses"][position].sum()), 2),
+                "net_cash_flow": round(float(net_cash[position].sum()), 2),
+                "monthly_net": _round(net_cash[position]),
+                "cumulative": _round(np.cumsum(net_cash[position]))
+            },
+            "channels": [
+                {"sales_channel_id": int(channel_id), "revenue": round(float(value), 2)}
+                for channel_id, value in zip(result["channel_ids"].tolist(), result["channel_revenue"][position].sum(axis=1))
+            ]
+        })
+    return {"year": year, "source": source, "base": rows[0], "scenarios": rows[1:]}
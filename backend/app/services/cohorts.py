@@ -0,0 +1,174 @@
+"""
+Когортный анализ клиентов (удержание и выручка)
+
+Продажи организации проецируются одним сгруппированным запросом в массив
+(клиент, номер периода, выручка) - по одной строке на клиента и период
+активности за всю историю, поэтому когорта клиента определяется по его
+первой покупке, даже если она раньше анализируемого интервала. Матрицы
+"когорта × возраст" (число активных клиентов и выручка) строятся средствами
+NumPy за один проход по массиву.
+
+Источник - реализации (Realization.customer_id) или покупки клиентов
+(CustomerPurchase). Результат кешируется в памяти процесса по организации,
+источнику и периоду; кеш сбрасывается при изменении данных (версия -
+количество, последний id и сумма строк источника).
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.customer import Customer, CustomerPurchase
+from app.models.realization import Realization
+from app.utils.periods import period_index, PERIOD_WEEK, PERIOD_MONTH
+
+SOURCE_REALIZATIONS = "realizations"
+SOURCE_PURCHASES = "purchases"
+# Начало отсчета номеров периодов (понедельник - недели начинаются с понедельника)
+PERIOD_ORIGIN = date(2000, 1, 3)
+# Сколько результатов хранить в кеше
+MAX_CACHED_COHORTS = 200
+
+_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _source_columns(source: str):
+    """Колонки источника: id строки, клиент, дата, сумма"""
+    if source == SOURCE_PURCHASES:
+        return CustomerPurchase.id, CustomerPurchase.customer_id, CustomerPurchase.purchase_date, CustomerPurchase.amount
+    return Realization.id, Realization.customer_id, Realization.date, Realization.revenue
+
+def _source_query(db: Session, company_id: int, source: str, *columns):
+    """Запрос строк источника организации"""
+    query = db.query(*columns)
+    if source == SOURCE_PURCHASES:
+        return query.join(Customer, CustomerPurchase.customer_id == Customer.id).filter(Customer.company_id == company_id)
+    return query.filter(Realization.company_id == company_id, Realization.customer_id.isnot(None))
+
+def _data_version(db: Session, company_id: int, source: str) -> tuple:
+    """Версия данных источника: меняется при добавлении, удалении и изменении сумм"""
+    row_id, _, _, amount = _source_columns(source)
+    row = _source_query(db, company_id, source, func.count(row_id), func.max(row_id), func.sum(amount)).one()
+    return tuple(str(value) for value in row)
+
+def period_start(index: int, period: str) -> date:
+    """Дата начала периода по его номеру от PERIOD_ORIGIN"""
+    if period == PERIOD_WEEK:
+        return PERIOD_ORIGIN + timedelta(days=7 * index)
+    month = PERIOD_ORIGIN.month - 1 + index
+    return date(PERIOD_ORIGIN.year + month // 12, month % 12 + 1, 1)
+
+def period_number(day: date, period: str) -> int:
+    """Номер периода даты от PERIOD_ORIGIN (как period_index в SQL)"""
+    if period == PERIOD_WEEK:
+        return (day - PERIOD_ORIGIN).days // 7
+    return (day.year - PERIOD_ORIGIN.year) * 12 + day.month - PERIOD_ORIGIN.month
+
+def load_activity(db: Session, company_id: int, source: str = SOURCE_REALIZATIONS, period: str = PERIOD_MONTH) -> Dict[str, np.ndarray]:
+    """Активность клиентов: массивы customer, period, revenue (строка - клиент в периоде)"""
+    _, customer_id, day, amount = _source_columns(source)
+    bucket = period_index(db, day, PERIOD_ORIGIN, period).label('period')
+    rows = _source_query(
+        db, company_id, source, customer_id, bucket, func.sum(amount)
+    ).group_by(customer_id, bucket).all()
+    return {
+        "customer": np.array([row[0] for row in rows], dtype=np.int64),
+        "period": np.array([int(row[1]) for row in rows], dtype=np.int64),
+        "revenue": np.array([float(row[2] or 0) for row in rows])
+    }
+
+def build_cohort_matrices(activity: Dict[str, np.ndarray]) -> Dict:
+    """
+    Матрицы "когорта × возраст" (возраст - периодов с первой покупки):
+    active - число активных клиентов, revenue - выручка; cohorts - номера периодов когорт.
+    """
+    customers, periods, revenue = activity["customer"], activity["period"], activity["revenue"]
+    if len(customers) == 0:
+        return {"cohorts": np.zeros(0, dtype=np.int64), "active": np.zeros((0, 0)), "revenue": np.zeros((0, 0))}
+
+    # Первый период каждого клиента
+    customer_ids, customer_index = np.unique(customers, return_inverse=True)
+    first_period = np.full(len(customer_ids), np.iinfo(np.int64).max)
+    np.minimum.at(first_period, customer_index, periods)
+    first = first_period[customer_index]
+
+    cohorts, cohort_index = np.unique(first, return_inverse=True)
+    age = periods - first
+    n_ages = int(periods.max() - cohorts.min()) + 1
+    active = np.zeros((len(cohorts), n_ages))
+    cohort_revenue = np.zeros((len(cohorts), n_ages))
+    np.add.at(active, (cohort_index, age), 1)
+    np.add.at(cohort_revenue, (cohort_index, age), revenue)
+    return {"cohorts": cohorts, "active": active, "revenue": cohort_revenue}
+
+def cohort_analysis(
+    db: Session,
+    company_id: int,
+    cohort_count: int = 12,
+    source: str = SOURCE_REALIZATIONS,
+    period: str = PERIOD_MONTH,
+    today: date = None
+) -> Dict:
+    """
+    Удержание и выручка последних cohort_count когорт организации.
+    Возвращает {"cohorts": [...], "average_retention": [...], "period", "source"}.
+    """
+    key = (company_id, source, period)
+    version = _data_version(db, company_id, source)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached["version"] == version:
+            _cache.move_to_end(key)
+            matrices = cached["matrices"]
+        else:
+            matrices = None
+
+    if matrices is None:
+        matrices = build_cohort_matrices(load_activity(db, company_id, source, period))
+        with _cache_lock:
+            _cache[key] = {"version": version, "matrices": matrices}
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_CACHED_COHORTS:
+                _cache.popitem(last=False)
+
+    cohorts = matrices["cohorts"][-cohort_count:]
+    active = matrices["active"][-cohort_count:]
+    revenue = matrices["revenue"][-cohort_count:]
+    if not len(cohorts):
+        return {"cohorts": [], "average_retention": [], "period": period, "source": source}
+
+    # Когорта наблюдается до текущего периода; старшие когорты наблюдаются дольше
+    observed_ages = max(period_number(today or date.today(), period), int(matrices["cohorts"].max())) - cohorts + 1
+    n_ages = int(observed_ages.max())
+    pad = max(0, n_ages - active.shape[1])
+    active = np.pad(active, ((0, 0), (0, pad)))[:, :n_ages]
+    revenue = np.pad(revenue, ((0, 0), (0, pad)))[:, :n_ages]
+    sizes = active[:, 0]
+    observed = np.arange(n_ages)[None, :] < observed_ages[:, None]
+    retention = np.where(observed, active / sizes[:, None] * 100, np.nan)
+    # Среднее удержание по возрасту взвешено размерами когорт, наблюдавшихся в этом возрасте
+    weights = np.where(observed, sizes[:, None], 0)
+    average = np.where(weights.sum(axis=0) > 0, np.nansum(retention * weights, axis=0) / np.maximum(weights.sum(axis=0), 1), np.nan)
+
+    def values(row, mask, digits):
+        return [round(float(value), digits) for value, seen in zip(row, mask) if seen]
+
+    rows = []
+    for index, cohort in enumerate(cohorts.tolist()):
+        mask = observed[index]
+        rows.append({
+            "cohort": period_start(cohort, period).isoformat(),
+            "customers": int(sizes[index]),
+            "active": [int(value) for value, seen in zip(active[index], mask) if seen],
+            "retention": values(retention[index], mask, 2),
+            "revenue": values(revenue[index], mask, 2),
+            "revenue_per_customer": values(revenue[index] / sizes[index], mask, 2)
+        })
+    return {
+        "cohorts": rows,
+        "average_retention": [round(float(value), 2) for value in average],
+        "period": period,
+        "source": source
+    }
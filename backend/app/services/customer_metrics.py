@@ -0,0 +1,127 @@
+"""
+Пересчет метрик и RFM-оценок клиентов
+
+Итоги покупок всех клиентов организации считаются одним агрегирующим
+запросом (клиенты LEFT JOIN сгруппированные покупки), метрики и оценки
+вычисляются в памяти, а клиенты обновляются одним пакетным UPDATE по id.
+
+RFM-оценки 1-5 - квинтили по клиентам организации с покупками: давность
+(меньше дней - выше оценка), частота и сумма покупок (больше - выше).
+Одинаковые значения получают одинаковую оценку. Оценки относительны,
+поэтому пересчитываются только для организации целиком; пересчет
+по отдельным клиентам обновляет итоги и давность, сохраняя оценки.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from app.models.customer import Customer, CustomerPurchase
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_PARTNERS
+
+# Количество градаций RFM-оценки
+RFM_BINS = 5
+
+def rfm_scores(values: np.ndarray, higher_is_better: bool = True) -> np.ndarray:
+    """Квантильные оценки 1..RFM_BINS; одинаковые значения получают одинаковую оценку"""
+    if len(values) == 0:
+        return np.zeros(0, dtype=int)
+    edges = np.quantile(values, np.linspace(0, 1, RFM_BINS + 1)[1:-1])
+    if higher_is_better:
+        return 1 + np.searchsorted(edges, values, side="left")
+    return RFM_BINS - np.searchsorted(edges, values, side="right")
+
+def _customer_totals(db: Session, company_id: Optional[int], customer_ids: Optional[List[int]]):
+    """Итоги покупок клиентов (включая клиентов без покупок)"""
+    totals = db.query(
+        CustomerPurchase.customer_id.label('customer_id'),
+        func.sum(CustomerPurchase.amount).label('total'),
+        func.count(CustomerPurchase.id).label('purchases'),
+        func.max(CustomerPurchase.purchase_date).label('last_date')
+    ).group_by(CustomerPurchase.customer_id)
+    if customer_ids is not None:
+        totals = totals.filter(CustomerPurchase.customer_id.in_(customer_ids))
+    totals = totals.subquery()
+
+    query = db.query(
+        Customer.id, totals.c.total, totals.c.purchases, totals.c.last_date
+    ).outerjoin(totals, totals.c.customer_id == Customer.id)
+    if company_id is not None:
+        query = query.filter(Customer.company_id == company_id)
+    if customer_ids is not None:
+        query = query.filter(Customer.id.in_(customer_ids))
+    return query.all()
+
+def recompute_customer_metrics(
+    db: Session,
+    company_id: Optional[int] = None,
+    customer_ids: Optional[Iterable[int]] = None,
+    today: date = None
+) -> Dict:
+    """
+    Пересчитать метрики клиентов организации (или только указанных клиентов) и сохранить.
+    RFM-оценки пересчитываются, только если пересчитывается организация целиком.
+    Возвращает {"customers": обновлено клиентов, "with_purchases": из них с покупками}.
+    """
+    today = today or date.today()
+    customer_ids = list(customer_ids) if customer_ids is not None else None
+    rows = _customer_totals(db, company_id, customer_ids)
+
+    updates = []
+    for customer_id, total, purchases, last_date in rows:
+        if purchases:
+            total = Decimal(total or 0)
+            if isinstance(last_date, str):
+                last_date = date.fromisoformat(last_date)
+            updates.append({
+                "id": customer_id,
+                "total_purchases": total,
+                "purchase_count": purchases,
+                "average_check": (total / purchases).quantize(Decimal("0.01")),
+                "last_purchase_date": last_date,
+                "recency": (today - last_date).days,
+                "frequency": purchases,
+                "monetary": total,
+                "ltv": total  # Упрощенный LTV
+            })
+        else:
+            updates.append({
+                "id": customer_id,
+                "total_purchases": Decimal("0"),
+                "purchase_count": 0,
+                "average_check": Decimal("0"),
+                "last_purchase_date": None,
+                "recency": None,
+                "frequency": 0,
+                "monetary": Decimal("0"),
+                "ltv": Decimal("0"),
+                "r_score": None,
+                "f_score": None,
+                "m_score": None,
+                "rfm_segment": None
+            })
+
+    buying = [row for row in updates if row["purchase_count"]]
+    if customer_ids is None and buying:
+        r_scores = rfm_scores(np.array([row["recency"] for row in buying], dtype=float), higher_is_better=False)
+        f_scores = rfm_scores(np.array([row["frequency"] for row in buying], dtype=float))
+        m_scores = rfm_scores(np.array([float(row["monetary"]) for row in buying]))
+        for row, r, f, m in zip(buying, r_scores.tolist(), f_scores.tolist(), m_scores.tolist()):
+            row.update({"r_score": r, "f_score": f, "m_score": m, "rfm_segment": f"{r}{f}{m}"})
+
+    # Строки с разным набором колонок обновляются отдельными пакетами
+    for batch in (buying, [row for row in updates if not row["purchase_count"]]):
+        if batch:
+            db.execute(update(Customer), batch)
+    # Давность покупок и LTV используются правилами рекомендаций по клиентам
+    if company_id is not None:
+        mark_recommendations_dirty(db, company_id, DOMAIN_PARTNERS)
+    elif updates:
+        query = db.query(Customer.company_id).distinct()
+        if customer_ids is not None:
+            query = query.filter(Customer.id.in_(customer_ids))
+        mark_recommendations_dirty(db, [row.company_id for row in query], DOMAIN_PARTNERS)
+    db.commit()
+    return {"customers": len(updates), "with_purchases": len(buying)}
@@ -0,0 +1,164 @@
+"""
+HTTP-клиент для API маркетплейсов: пул соединений с keep-alive,
+повторы с экспоненциальной задержкой и учетом Retry-After, замер времени запросов
+
+Клиент общий для всех синхронизаций с теми же учетными данными, поэтому статистика
+одного запуска считается от снимка счетчиков, сделанного при его начале (snapshot/stats(since)).
+Клиенты, которые не использовались дольше CLIENT_IDLE_SECONDS, закрываются.
+"""
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+REQUEST_TIMEOUT_SECONDS = 30
+POOL_SIZE = 10
+# Сколько последних замеров хранить для статистики
+TIMINGS_HISTORY = 1000
+# Через сколько секунд без запросов общий клиент закрывается
+CLIENT_IDLE_SECONDS = 30 * 60
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разобрать заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Задержка перед повтором: Retry-After сервера или экспоненциальная с джиттером"""
+    delay = parse_retry_after(retry_after)
+    if delay is None:
+        delay = BACKOFF_BASE_SECONDS * (2 ** attempt) * (0.5 + random.random() / 2)
+    return min(delay, MAX_BACKOFF_SECONDS)
+
+class MarketplaceHTTPClient:
+    """Сессия с пулом соединений к одному API и статистика времени запросов"""
+
+    def __init__(self, base_url: str, headers: Dict, max_retries: int = MAX_RETRIES, pool_size: int = POOL_SIZE):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.timings = deque(maxlen=TIMINGS_HISTORY)
+        # Накопленные счетчики (для статистики отдельного запуска)
+        self.requests = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.last_used = time.monotonic()
+
+    def record(self, method: str, endpoint: str, status: Optional[int], seconds: float, attempt: int):
+        """Сохранить замер одного запроса (attempt - номер попытки, начиная с 0)"""
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += seconds
+            self.last_used = time.monotonic()
+            self.timings.append({
+                "number": self.requests,
+                "method": method,
+                "endpoint": endpoint,
+                "status": status,
+                "seconds": seconds,
+                "attempt": attempt
+            })
+            if attempt > 0:
+                self.retries += 1
+
+    def snapshot(self) -> Dict:
+        """Снимок накопленных счетчиков (начало запуска для stats(since=...))"""
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "total_seconds": self.total_seconds}
+
+    def stats(self, since: Dict = None) -> Dict:
+        """
+        Статистика запросов: с момента снимка since (запросы одного запуска)
+        или, без него, по последним TIMINGS_HISTORY запросам
+        """
+        with self._lock:
+            if since is None:
+                durations = [timing["seconds"] for timing in self.timings]
+                requests_count, retries, total_seconds = len(durations), self.retries, sum(durations)
+            else:
+                durations = [timing["seconds"] for timing in self.timings if timing["number"] > since["requests"]]
+                requests_count = self.requests - since["requests"]
+                retries = self.retries - since["retries"]
+                total_seconds = self.total_seconds - since["total_seconds"]
+            return {
+                "requests": requests_count,
+                "retries": retries,
+                "total_seconds": round(total_seconds, 3),
+                "avg_seconds": round(total_seconds / requests_count, 3) if requests_count else 0.0,
+                "max_seconds": round(max(durations), 3) if durations else 0.0
+            }
+
+    def request(self, method: str, endpoint: str, json: Dict = None, params: Dict = None) -> requests.Response:
+        """Выполнить запрос с повторами при 429/5xx и сетевых ошибках"""
+        url = f"{self.base_url}{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, json=json, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.record(method, endpoint, None, time.monotonic() - started, attempt)
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(retry_delay(attempt))
+                continue
+
+            self.record(method, endpoint, response.status_code, time.monotonic() - started, attempt)
+            if response.status_code in RETRYABLE_STATUSES and attempt < self.max_retries:
+                time.sleep(retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            response.raise_for_status()
+            return response
+
+    def close(self):
+        self.session.close()
+
+_clients: Dict[str, MarketplaceHTTPClient] = {}
+_clients_lock = threading.Lock()
+
+def _evict_idle_clients(now: float):
+    """Закрыть клиенты, которые не использовались дольше CLIENT_IDLE_SECONDS (под _clients_lock)"""
+    for key, client in list(_clients.items()):
+        if now - client.last_used > CLIENT_IDLE_SECONDS:
+            del _clients[key]
+            client.close()
+
+def get_http_client(key: str, base_url: str, headers: Dict) -> MarketplaceHTTPClient:
+    """
+    Общий клиент для интеграции (key - маркетплейс и идентификатор учетных данных),
+    чтобы повторные синхронизации переиспользовали открытые соединения
+    """
+    with _clients_lock:
+        now = time.monotonic()
+        _evict_idle_clients(now)
+        client = _clients.get(key)
+        if client is None or client.base_url != base_url:
+            client = MarketplaceHTTPClient(base_url, headers)
+            _clients[key] = client
+        client.last_used = now
+        return client
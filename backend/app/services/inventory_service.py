@@ -3,7 +3,7 @@
 """
 from decimal import Decimal
 from datetime import date
-from typing import List
+from typing import Iterable, List
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.models.inventory import Inventory
@@ -332,3 +332,151 @@ def get_low_stock_alerts(company_id: int, db: Session) -> List[dict]:
     
     return result
 
+
+def _refill_batches(to_return: dict, warehouse_id: int, db: Session):
+    """
+    Вернуть в партии товар, списание которого уменьшилось: партии пополняются с самых новых
+    (FIFO списывает старые партии первыми, поэтому последними списаны единицы новых),
+    но не больше количества прихода партии.
+    """
+    batches = db.query(ProductCost, InventoryTransaction.quantity.label("received")).join(
+        InventoryTransaction, InventoryTransaction.id == ProductCost.transaction_id
+    ).filter(
+        ProductCost.product_id.in_(to_return),
+        ProductCost.warehouse_id == warehouse_id,
+        ProductCost.quantity < InventoryTransaction.quantity
+    ).order_by(ProductCost.product_id, ProductCost.date.desc(), ProductCost.id.desc()).all()
+    for batch, received in batches:
+        remaining_quantity = to_return[batch.product_id]
+        if remaining_quantity <= 0:
+            continue
+        returned = min(received - batch.quantity, remaining_quantity)
+        batch.quantity += returned
+        to_return[batch.product_id] = remaining_quantity - returned
+
+def post_outcome_batch(
+    lines: List[dict],
+    warehouse_id: int,
+    document_type: str,
+    db: Session,
+    document_ids: Iterable[int] = None
+) -> int:
+    """
+    Пакетное списание товаров по документам (например, реализациям маркетплейса).
+    lines: {"document_id", "product_id", "quantity", "cost_price", "date", "description"}.
+    Прежние списания по тем же документам откатываются, поэтому повторная
+    обработка документа не списывает товар дважды. Партии (FIFO) меняются только
+    на разницу между новым и прежним списанием: при увеличении списываются,
+    при уменьшении пополняются (_refill_batches).
+    Если остатка товара не хватает, его строки пропускаются (прежние списания
+    этого товара по документам сохраняются), остальные товары списываются.
+    document_ids - дополнительные документы, списания по которым нужно только откатить
+    (например, удаляемые документы без строк).
+    Выполняется фиксированным числом запросов независимо от количества строк; commit - на вызывающем.
+    Возвращает количество записанных строк списания.
+    """
+    document_ids = {line["document_id"] for line in lines} | set(document_ids or ())
+    if not document_ids:
+        return 0
+    
+    product_ids = {line["product_id"] for line in lines}
+    
+    # Прежние списания по этим документам
+    previous_query = db.query(InventoryTransaction).filter(
+        InventoryTransaction.transaction_type == "OUTCOME",
+        InventoryTransaction.document_type == document_type,
+        InventoryTransaction.document_id.in_(document_ids),
+        InventoryTransaction.warehouse_id == warehouse_id
+    )
+    returned = {
+        row.product_id: row.quantity
+        for row in previous_query.with_entities(
+            InventoryTransaction.product_id,
+            func.sum(InventoryTransaction.quantity).label('quantity')
+        ).group_by(InventoryTransaction.product_id).all()
+    }
+    
+    required = {}
+    for line in lines:
+        required[line["product_id"]] = required.get(line["product_id"], Decimal('0')) + Decimal(line["quantity"])
+    
+    # Остатки по всем товарам одним запросом, недостающие записи создаем
+    inventories = {
+        inventory.product_id: inventory
+        for inventory in db.query(Inventory).filter(
+            Inventory.warehouse_id == warehouse_id,
+            Inventory.product_id.in_(product_ids | set(returned))
+        ).all()
+    }
+    for product_id in (product_ids | set(returned)) - set(inventories):
+        inventories[product_id] = Inventory(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            quantity=Decimal('0'),
+            min_stock_level=Decimal('0')
+        )
+        db.add(inventories[product_id])
+    
+    shortages = {}
+    for product_id, inventory in inventories.items():
+        available = inventory.quantity + returned.get(product_id, Decimal('0'))
+        if available < required.get(product_id, Decimal('0')):
+            shortages[product_id] = f"товар {product_id}: доступно {available}, требуется {required[product_id]}"
+    if shortages:
+        print(f"[INVENTORY] Недостаточно остатка, списание товаров пропущено: {'; '.join(shortages.values())}")
+        for product_id in shortages:
+            inventories.pop(product_id)
+            returned.pop(product_id, None)
+            required.pop(product_id, None)
+        previous_query = previous_query.filter(InventoryTransaction.product_id.notin_(list(shortages)))
+        lines = [line for line in lines if line["product_id"] not in shortages]
+    previous_query.delete(synchronize_session=False)
+    
+    for product_id, inventory in inventories.items():
+        inventory.quantity += returned.get(product_id, Decimal('0')) - required.get(product_id, Decimal('0'))
+    
+    # Списываем из партий (FIFO) только дополнительно проданное количество
+    to_write_off = {
+        product_id: quantity - returned.get(product_id, Decimal('0'))
+        for product_id, quantity in required.items()
+        if quantity > returned.get(product_id, Decimal('0'))
+    }
+    if to_write_off:
+        batches = db.query(ProductCost).filter(
+            ProductCost.product_id.in_(to_write_off),
+            ProductCost.warehouse_id == warehouse_id,
+            ProductCost.quantity > 0
+        ).order_by(ProductCost.product_id, ProductCost.date.asc()).all()
+        for batch in batches:
+            remaining_quantity = to_write_off[batch.product_id]
+            if remaining_quantity <= 0:
+                continue
+            written_off = min(batch.quantity, remaining_quantity)
+            batch.quantity -= written_off
+            to_write_off[batch.product_id] = remaining_quantity - written_off
+    
+    # Списание уменьшилось (или документ удален) - возвращаем разницу в партии
+    to_return = {
+        product_id: quantity - required.get(product_id, Decimal('0'))
+        for product_id, quantity in returned.items()
+        if quantity > required.get(product_id, Decimal('0'))
+    }
+    if to_return:
+        _refill_batches(to_return, warehouse_id, db)
+    
+    if not lines:
+        db.flush()
+        return 0
+    db.execute(InventoryTransaction.__table__.insert(), [{
+        "transaction_type": "OUTCOME",
+        "product_id": line["product_id"],
+        "warehouse_id": warehouse_id,
+        "quantity": Decimal(line["quantity"]),
+        "cost_price": line["cost_price"],
+        "date": line["date"],
+        "document_type": document_type,
+        "document_id": line["document_id"],
+        "description": line.get("description")
+    } for line in lines])
+    db.flush()
+    return len(lines)
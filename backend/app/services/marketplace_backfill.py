@@ -0,0 +1,313 @@
+"""
+Историческая загрузка (backfill) данных маркетплейса
+
+Период делится на окна по window_days дней. Окна загружаются параллельно
+в ограниченном пуле потоков через один клиент API (общий лимит запросов),
+а запуск окон дополнительно ограничен по частоте. Каждое окно сохраняется
+через промежуточное хранение ответов (app.services.marketplace_staging) и
+отмечается в marketplace_backfill_windows, поэтому после сбоя загрузка
+продолжается с незавершенных окон.
+
+На время загрузки интеграция находится под арендой (app.services.sync_lease),
+и плановая синхронизация ее пропускает. Выполняется ли загрузка, определяется
+по аренде: задача со статусом in_progress и истекшей арендой (процесс упал) продолжается.
+
+Период исторической загрузки Wildberries заканчивается днем до сохраненного курсора
+инкрементальной синхронизации (backfill_end_date) - более поздние дни загружает она.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models.marketplace_integration import MarketplaceIntegration
+from app.models.marketplace_backfill import MarketplaceBackfill, MarketplaceBackfillWindow
+from app.services.ozon_api import OzonAPI
+from app.services.wb_api import WildberriesAPI, parse_change_date
+from app.services.marketplace_staging import (
+    get_sync_context,
+    stage_payload,
+    process_payload,
+    iter_ozon_pages,
+    iter_wb_pages
+)
+from app.services.sync_lease import new_lease_owner, acquire_lease, release_lease, LeaseHeartbeat
+
+# Размер окна по умолчанию
+BACKFILL_WINDOW_DAYS = 7
+# Параллельные окна и запуск окон в минуту по маркетплейсам
+BACKFILL_LIMITS = {
+    "ozon": {"workers": 3, "windows_per_minute": 30},
+    # Статистика WB допускает около одного запроса в минуту на отчет
+    "wildberries": {"workers": 1, "windows_per_minute": 1},
+}
+
+class WindowPacer:
+    """Равномерный запуск окон: не чаще per_minute в минуту (потокобезопасный)"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def _marketplace(integration: MarketplaceIntegration) -> str:
+    return "ozon" if "ozon" in integration.marketplace_name.lower() else "wildberries"
+
+def _api_client(integration: MarketplaceIntegration):
+    """Клиент API интеграции (один на все окна загрузки)"""
+    if _marketplace(integration) == "ozon":
+        if not integration.ozon_client_id or not integration.ozon_api_key:
+            raise Exception("Не указаны учетные данные OZON")
+        return OzonAPI(integration.ozon_client_id, integration.ozon_api_key)
+    if not integration.wb_api_key:
+        raise Exception("Не указан API ключ Wildberries")
+    return WildberriesAPI(integration.wb_api_key, integration.wb_stat_api_key)
+
+def backfill_end_date(integration: MarketplaceIntegration, end_date: Optional[date] = None) -> date:
+    """
+    Конец периода исторической загрузки (по умолчанию - сегодня). Для Wildberries с сохраненным
+    курсором - день до курсора: начиная с него данные загружает инкрементальная синхронизация,
+    поэтому явно указанный более поздний конец отклоняется (ValueError).
+    """
+    cursor = None
+    if _marketplace(integration) == "wildberries":
+        cursor = parse_change_date(integration.wb_sales_cursor or integration.wb_orders_cursor)
+    if cursor is None:
+        return end_date or date.today()
+    latest = cursor.date() - timedelta(days=1)
+    if end_date is None:
+        return latest
+    if end_date > latest:
+        raise ValueError(
+            f"Период пересекается с инкрементальной синхронизацией (курсор {cursor.isoformat()}), "
+            f"дата окончания должна быть не позже {latest.isoformat()}"
+        )
+    return end_date
+
+def create_backfill(
+    db: Session,
+    integration_id: int,
+    start_date: date,
+    end_date: Optional[date] = None,
+    window_days: int = BACKFILL_WINDOW_DAYS
+) -> MarketplaceBackfill:
+    """
+    Создать задачу исторической загрузки с окнами. Если незавершенная задача
+    с тем же периодом уже есть, возвращается она (загрузка продолжится с нее).
+    Конец периода проверяется и по умолчанию выбирается backfill_end_date (ValueError,
+    если период пересекается с инкрементальной синхронизацией или пуст).
+    """
+    integration = db.query(MarketplaceIntegration).filter(MarketplaceIntegration.id == integration_id).first()
+    if not integration:
+        raise ValueError(f"Интеграция {integration_id} не найдена")
+    end_date = backfill_end_date(integration, end_date)
+    if start_date > end_date:
+        raise ValueError(f"Дата начала {start_date.isoformat()} позже даты окончания {end_date.isoformat()}")
+    
+    existing = db.query(MarketplaceBackfill).filter(
+        MarketplaceBackfill.integration_id == integration_id,
+        MarketplaceBackfill.start_date == start_date,
+        MarketplaceBackfill.end_date == end_date,
+        MarketplaceBackfill.status != "success"
+    ).first()
+    if existing:
+        return existing
+
+    backfill = MarketplaceBackfill(
+        integration_id=integration_id,
+        start_date=start_date,
+        end_date=end_date,
+        window_days=window_days,
+        status="pending"
+    )
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        backfill.windows.append(MarketplaceBackfillWindow(window_start=window_start, window_end=window_end))
+        window_start = window_end + timedelta(days=1)
+    backfill.windows_total = len(backfill.windows)
+    db.add(backfill)
+    db.commit()
+    db.refresh(backfill)
+    return backfill
+
+def backfill_progress(backfill: MarketplaceBackfill, run_started: float = None, windows_at_start: int = 0) -> Dict:
+    """
+    Прогресс загрузки: выполненные окна, строки, скорость (строк/с) и оценка оставшегося времени.
+    Скорость и ETA считаются по текущему запуску (run_started - time.monotonic() его начала),
+    иначе - по времени с started_at.
+    """
+    if run_started is not None:
+        elapsed = time.monotonic() - run_started
+    elif backfill.started_at:
+        finished = backfill.finished_at or datetime.now(backfill.started_at.tzinfo)
+        elapsed = (finished - backfill.started_at).total_seconds()
+    else:
+        elapsed = 0.0
+    windows_done = backfill.windows_done or 0
+    windows_this_run = windows_done - windows_at_start if run_started is not None else windows_done
+    remaining = (backfill.windows_total or 0) - windows_done
+    eta = elapsed / windows_this_run * remaining if windows_this_run > 0 and elapsed > 0 else None
+    return {
+        "id": backfill.id,
+        "integration_id": backfill.integration_id,
+        "status": backfill.status,
+        "start_date": backfill.start_date.isoformat(),
+        "end_date": backfill.end_date.isoformat(),
+        "windows_total": backfill.windows_total,
+        "windows_done": windows_done,
+        "rows_fetched": backfill.rows_fetched or 0,
+        "elapsed_seconds": round(elapsed, 1),
+        "rows_per_second": round((backfill.rows_fetched or 0) / elapsed, 1) if elapsed > 0 else 0.0,
+        "eta_seconds": round(eta, 1) if eta is not None else None,
+        "last_error": backfill.last_error
+    }
+
+def _load_window(window_id: int, integration_id: int, api_client, context: Dict, pacer: WindowPacer) -> int:
+    """Загрузить и обработать одно окно в собственной сессии, вернуть количество строк"""
+    pacer.wait()
+    db = SessionLocal()
+    try:
+        window = db.query(MarketplaceBackfillWindow).filter(MarketplaceBackfillWindow.id == window_id).first()
+        integration = db.query(MarketplaceIntegration).filter(MarketplaceIntegration.id == integration_id).first()
+        try:
+            if isinstance(api_client, OzonAPI):
+                pages = iter_ozon_pages(api_client, window.window_start, window.window_end)
+            else:
+                pages = iter_wb_pages(api_client, integration, window.window_start, window.window_end, incremental=False)
+
+            rows_fetched = 0
+            page_count = 0
+            for source, page_key, rows, _ in pages:
+                if not rows:
+                    continue
+                payload = stage_payload(db, integration_id, source, page_key, window.window_start, window.window_end, rows)
+                process_payload(db, payload, context)
+                rows_fetched += len(rows)
+                page_count += 1
+
+            # Контрольная точка окна и счетчики задачи одной транзакцией
+            window.status = "success"
+            window.rows_fetched = rows_fetched
+            window.pages = page_count
+            window.error = None
+            window.finished_at = datetime.now()
+            db.query(MarketplaceBackfill).filter(MarketplaceBackfill.id == window.backfill_id).update({
+                MarketplaceBackfill.windows_done: MarketplaceBackfill.windows_done + 1,
+                MarketplaceBackfill.rows_fetched: MarketplaceBackfill.rows_fetched + rows_fetched
+            }, synchronize_session=False)
+            db.commit()
+            return rows_fetched
+        except Exception as e:
+            db.rollback()
+            window.status = "error"
+            window.error = str(e)
+            db.commit()
+            raise
+    finally:
+        db.close()
+
+def run_backfill(
+    backfill_id: int,
+    workers: Optional[int] = None,
+    windows_per_minute: Optional[float] = None,
+    lease_owner: Optional[str] = None
+) -> Dict:
+    """
+    Выполнить (или продолжить) историческую загрузку: обрабатываются окна,
+    не завершенные успешно. Возвращает итоговый прогресс.
+    lease_owner - владелец уже захваченной аренды, иначе аренда захватывается здесь.
+    """
+    db = SessionLocal()
+    lease_owner = lease_owner or new_lease_owner()
+    backfill = db.query(MarketplaceBackfill).filter(MarketplaceBackfill.id == backfill_id).first()
+    if not backfill:
+        db.close()
+        raise ValueError(f"Историческая загрузка {backfill_id} не найдена")
+    integration_id = backfill.integration_id
+
+    if not acquire_lease(db, integration_id, lease_owner):
+        db.close()
+        raise ValueError(f"Интеграция {integration_id} уже синхронизируется другим процессом")
+
+    try:
+        integration = db.query(MarketplaceIntegration).filter(MarketplaceIntegration.id == integration_id).first()
+        limits = BACKFILL_LIMITS[_marketplace(integration)]
+        workers = workers or limits["workers"]
+        pacer = WindowPacer(windows_per_minute or limits["windows_per_minute"])
+
+        window_ids = [row.id for row in db.query(MarketplaceBackfillWindow.id).filter(
+            MarketplaceBackfillWindow.backfill_id == backfill_id,
+            MarketplaceBackfillWindow.status != "success"
+        ).order_by(MarketplaceBackfillWindow.window_start).all()]
+
+        backfill.status = "in_progress"
+        backfill.started_at = datetime.now()
+        backfill.finished_at = None
+        backfill.last_error = None
+        db.commit()
+        windows_at_start = backfill.windows_done or 0
+        run_started = time.monotonic()
+        print(f"[BACKFILL] Загрузка {backfill_id}: окон к загрузке {len(window_ids)} из {backfill.windows_total}, потоков {workers}")
+
+        errors = []
+        api_client = None
+        try:
+            api_client = _api_client(integration)
+            context = get_sync_context(db, integration)
+            with LeaseHeartbeat(integration_id, lease_owner) as heartbeat:
+                with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="marketplace-backfill") as pool:
+                    futures = {
+                        pool.submit(_load_window, window_id, integration_id, api_client, context, pacer): window_id
+                        for window_id in window_ids
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            errors.append(str(e))
+                            print(f"[BACKFILL] Ошибка окна {futures[future]}: {str(e)}")
+                        if heartbeat.lost:
+                            # Оставшиеся окна не запускаем: интеграцию синхронизирует другой процесс
+                            for pending in futures:
+                                pending.cancel()
+                            errors.append("Аренда синхронизации истекла и перешла к другому процессу")
+                            break
+                        db.refresh(backfill)
+                        progress = backfill_progress(backfill, run_started, windows_at_start)
+                        print(
+                            f"[BACKFILL] Окон {progress['windows_done']}/{progress['windows_total']}, "
+                            f"строк {progress['rows_fetched']}, {progress['rows_per_second']} строк/с, "
+                            f"осталось ~{progress['eta_seconds']} с"
+                        )
+        except Exception as e:
+            errors.append(str(e))
+
+        db.refresh(backfill)
+        backfill.status = "error" if errors else "success"
+        backfill.last_error = "; ".join(errors[:5]) if errors else None
+        backfill.finished_at = datetime.now()
+        integration.last_sync_status = backfill.status
+        integration.last_sync_error = backfill.last_error
+        db.commit()
+
+        progress = backfill_progress(backfill, run_started, windows_at_start)
+        print(f"[BACKFILL] Загрузка {backfill_id} завершена: {progress}")
+        if api_client:
+            print(f"[BACKFILL] Запросы к API: {api_client.request_stats()}")
+        return progress
+    finally:
+        try:
+            release_lease(db, integration_id, lease_owner)
+        finally:
+            db.close()
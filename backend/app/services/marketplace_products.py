@@ -0,0 +1,132 @@
+"""
+Сопоставление артикулов маркетплейсов товарам справочника
+
+Артикул ищется в таблице marketplace_products, затем среди товаров по SKU, равному
+артикулу продавца; если товар не найден, он создается автоматически (с нулевой
+себестоимостью). Найденные соответствия (артикул -> id товара) кэшируются в памяти
+процесса, поэтому при синхронизации запросы к БД выполняются только для новых артикулов.
+Себестоимость в кэш не попадает: она меняется в справочнике и читается из БД
+при каждой обработке страницы (product_cost_prices).
+"""
+import threading
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.marketplace_product import MarketplaceProduct
+from app.models.product import Product
+from app.utils.bulk import dialect_insert
+
+# (company_id, маркетплейс) -> {артикул: product_id}
+_cache: Dict[Tuple[int, str], Dict[str, int]] = {}
+_cache_lock = threading.Lock()
+
+def clear_product_cache():
+    """Сбросить кэш соответствий (например, после ручного изменения marketplace_products)"""
+    with _cache_lock:
+        _cache.clear()
+
+def _product_sku(marketplace: str, article: str) -> str:
+    """SKU автоматически созданного товара (уникален среди всех маркетплейсов)"""
+    return f"{marketplace}:{article}"
+
+def _resolve_missing(db: Session, company_id: int, marketplace: str, articles: Dict[str, Dict], missing: List[str]) -> Dict[str, int]:
+    """Найти или создать товары для артикулов, которых нет в кэше"""
+    # 1. Уже сопоставленные артикулы
+    rows = db.query(MarketplaceProduct.article, MarketplaceProduct.product_id).filter(
+        MarketplaceProduct.company_id == company_id,
+        MarketplaceProduct.marketplace == marketplace,
+        MarketplaceProduct.article.in_(missing)
+    ).all()
+    found = {row.article: row.product_id for row in rows}
+    missing = [article for article in missing if article not in found]
+
+    if missing:
+        # 2. Товары справочника с SKU, равным артикулу продавца или ранее созданным SKU
+        sku_by_article = {}
+        for article in missing:
+            seller_article = articles[article].get("seller_article")
+            sku_by_article[article] = [_product_sku(marketplace, article)] + ([seller_article] if seller_article else [])
+        all_skus = {sku for skus in sku_by_article.values() for sku in skus}
+        products_by_sku = {
+            product.sku: product
+            for product in db.query(Product).filter(Product.sku.in_(all_skus)).all()
+        }
+
+        # 3. Остальные товары создаем одним пакетным INSERT
+        new_products = []
+        for article in missing:
+            product = next((products_by_sku[sku] for sku in sku_by_article[article] if sku in products_by_sku), None)
+            if product is None:
+                new_products.append({
+                    "name": articles[article].get("name") or f"{marketplace} {article}",
+                    "sku": _product_sku(marketplace, article),
+                    "cost_price": Decimal("0"),
+                    "description": "Автоматически создан из интеграции",
+                    "is_active": True
+                })
+            else:
+                found[article] = product.id
+        if new_products:
+            created = db.execute(
+                insert(Product).returning(Product.id, Product.sku),
+                new_products
+            ).all()
+            created_by_sku = {row.sku: row.id for row in created}
+            for article in missing:
+                if article not in found:
+                    found[article] = created_by_sku[_product_sku(marketplace, article)]
+
+        mapping_rows = [{
+            "company_id": company_id,
+            "marketplace": marketplace,
+            "article": article,
+            "seller_article": articles[article].get("seller_article"),
+            "name": articles[article].get("name"),
+            "product_id": found[article]
+        } for article in missing]
+        stmt = dialect_insert(db, MarketplaceProduct).values(mapping_rows).on_conflict_do_nothing(
+            index_elements=["company_id", "marketplace", "article"]
+        )
+        db.execute(stmt)
+        db.commit()
+    return found
+
+def resolve_products(db: Session, company_id: int, marketplace: str, items: List[Dict]) -> Dict[str, int]:
+    """
+    Найти товары для позиций продаж (article, name, seller_article).
+    Возвращает {артикул: product_id}.
+    """
+    articles = {}
+    for item in items:
+        articles.setdefault(item["article"], item)
+
+    with _cache_lock:
+        cached = _cache.setdefault((company_id, marketplace), {})
+        result = {article: cached[article] for article in articles if article in cached}
+    missing = [article for article in articles if article not in result]
+    if not missing:
+        return result
+
+    try:
+        found = _resolve_missing(db, company_id, marketplace, articles, missing)
+    except IntegrityError:
+        # Тот же товар одновременно создал другой поток - повторяем поиск
+        db.rollback()
+        found = _resolve_missing(db, company_id, marketplace, articles, missing)
+
+    with _cache_lock:
+        cached.update(found)
+    result.update(found)
+    return result
+
+def product_cost_prices(db: Session, product_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """Текущая себестоимость товаров из справочника: {product_id: себестоимость}"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    return {
+        row.id: row.cost_price or Decimal("0")
+        for row in db.query(Product.id, Product.cost_price).filter(Product.id.in_(product_ids)).all()
+    }
@@ -0,0 +1,570 @@
+"""
+Промежуточное хранение сырых ответов API маркетплейсов
+
+Синхронизация разделена на два этапа:
+1. загрузка - каждая страница ответа API сохраняется как есть (сжатый JSON) в marketplace_payloads;
+2. обработка - сохраненные страницы преобразуются в реализации.
+
+Обработку можно повторить без обращения к API (после исправления маппинга
+или для пересчета периода), в том числе параллельно по страницам.
+
+Позиции продаж (артикулы маркетплейса) сохраняются строками RealizationItem,
+артикулы сопоставляются товарам через marketplace_products (app.services.marketplace_products).
+
+Wildberries хранит итог дня одной реализацией wb:<вид>:<дата>. Страница WB (инкрементальная
+или за период) содержит только часть строк дня, поэтому при ее обработке итоги ее дней
+пересчитываются по всем сохраненным строкам этих дней без повторов (wb_day_rows) -
+оба пути загрузки записывают одну и ту же реализацию, и выручка не удваивается.
+Так же операции одного отправления OZON могут попасть на разные страницы: реализация
+отправления пересчитывается по его операциям из всех страниц периода (ozon_posting_rows),
+иначе INSERT ... ON CONFLICT оставил бы сумму только последней обработанной страницы.
+
+Хранение страниц ограничено (purge_staged_payloads): обработанные страницы старше
+PAYLOAD_RETENTION_DAYS удаляются, а страницы WB, по строкам которых пересчитываются
+итоги дней, сворачиваются в архивную страницу месяца со строками без повторов.
+"""
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from app.database import SessionLocal
+from app.models.marketplace_integration import MarketplaceIntegration
+from app.models.marketplace_payload import MarketplacePayload
+from app.models.realization import Realization, RealizationItem
+from app.models.reference import SalesChannel
+from app.models.customer import Customer
+from app.models.warehouse import Warehouse
+from app.services.ozon_api import OzonAPI, SOURCE_TRANSACTIONS, SOURCE_ANALYTICS
+from app.services.wb_api import WildberriesAPI, SOURCE_SALES, SOURCE_ORDERS, REPORTS, parse_change_date
+from app.services.marketplace_products import resolve_products, product_cost_prices
+from app.services.inventory_service import post_outcome_batch
+from app.services.recommendation_refresh import mark_recommendations_dirty
+from app.services.recommendation_service import DOMAIN_SALES, DOMAIN_INVENTORY
+from app.utils.bulk import dialect_insert
+
+# Количество реализаций в одном INSERT ... ON CONFLICT
+SYNC_BATCH_SIZE = 1000
+# Потоков при повторной обработке сохраненных страниц
+REPLAY_WORKERS = 4
+# Тип документа списаний со склада по реализациям маркетплейса
+INVENTORY_DOCUMENT_TYPE = "MARKETPLACE_REALIZATION"
+# Сколько дней хранить обработанные страницы ответов API
+PAYLOAD_RETENTION_DAYS = 90
+
+def window_page_key(window_start: date, window_end: date, page: Optional[int] = None) -> str:
+    """Ключ страницы, загруженной за период (для постраничной выдачи - с номером страницы)"""
+    key = f"window:{window_start.isoformat()}:{window_end.isoformat()}"
+    return f"{key}:page:{page}" if page is not None else key
+
+def cursor_page_key(cursor: str) -> str:
+    """Ключ страницы, загруженной инкрементально начиная с курсора"""
+    return f"cursor:{cursor}"
+
+def archive_page_key(month_start: date) -> str:
+    """Ключ архивной страницы WB: строки месяца из свернутых старых страниц"""
+    return f"archive:{month_start.strftime('%Y-%m')}"
+
+def encode_rows(rows: List[Dict]) -> bytes:
+    return gzip.compress(json.dumps(rows, ensure_ascii=False, default=str).encode("utf-8"))
+
+def decode_rows(payload: MarketplacePayload) -> List[Dict]:
+    return json.loads(gzip.decompress(payload.payload).decode("utf-8"))
+
+def is_wb_source(source: str) -> bool:
+    return source in (SOURCE_SALES, SOURCE_ORDERS)
+
+def wb_rows_window(source: str, rows: List[Dict]) -> Optional[Tuple[date, date]]:
+    """Диапазон дат строк отчета WB (None - строк нет)"""
+    days = [WildberriesAPI.row_date(source, row) for row in rows]
+    return (min(days), max(days)) if days else None
+
+def stage_payload(
+    db: Session,
+    integration_id: int,
+    source: str,
+    page_key: str,
+    window_start: date,
+    window_end: date,
+    rows: List[Dict],
+    next_cursor: str = None
+) -> MarketplacePayload:
+    """
+    Сохранить сырую страницу ответа API.
+    Повторная загрузка той же страницы заменяет сохраненные строки и сбрасывает отметку обработки.
+    """
+    payload = db.query(MarketplacePayload).filter(
+        MarketplacePayload.integration_id == integration_id,
+        MarketplacePayload.source == source,
+        MarketplacePayload.page_key == page_key
+    ).first()
+    if not payload:
+        payload = MarketplacePayload(integration_id=integration_id, source=source, page_key=page_key)
+        db.add(payload)
+    
+    if is_wb_source(source) and page_key.startswith("cursor:") and rows:
+        # Изменения WB относятся к любым датам: период страницы - даты ее строк (см. wb_day_rows)
+        window_start, window_end = wb_rows_window(source, rows)
+
+    payload.window_start = window_start
+    payload.window_end = window_end
+    payload.next_cursor = next_cursor
+    payload.row_count = len(rows)
+    payload.payload = encode_rows(rows)
+    payload.fetched_at = datetime.now()
+    payload.processed_at = None
+    payload.process_error = None
+    db.commit()
+    return payload
+
+def iter_ozon_pages(ozon: OzonAPI, start_date: date, end_date: date):
+    """Сырые страницы OZON за период: (источник, ключ страницы, строки, обновления курсоров)"""
+    for source, page, rows in ozon.iter_raw_pages(start_date, end_date):
+        yield source, window_page_key(start_date, end_date, page), rows, {}
+
+def iter_wb_pages(wb: WildberriesAPI, integration: MarketplaceIntegration, start_date: date, end_date: date, incremental: bool):
+    """
+    Сырые страницы Wildberries: (источник, ключ страницы, строки, обновления курсоров).
+    В инкрементальном режиме загружаются только строки, измененные после сохраненного
+    курсора lastChangeDate (при первом запуске - начиная с start_date); иначе - весь период.
+    """
+    if not incremental:
+        # Пробуем получить продажи
+        try:
+            rows, source = wb.fetch_window(SOURCE_SALES, start_date, end_date), SOURCE_SALES
+        except Exception as e:
+            # Если не получилось, пробуем заказы
+            try:
+                rows, source = wb.fetch_window(SOURCE_ORDERS, start_date, end_date), SOURCE_ORDERS
+            except Exception as e2:
+                raise Exception(f"Не удалось получить данные: {str(e)}; {str(e2)}")
+        yield source, window_page_key(start_date, end_date), rows, {}
+        return
+    
+    initial_cursor = start_date.isoformat() + "T00:00:00"
+    sales_loaded = False
+    try:
+        page_cursor = integration.wb_sales_cursor or initial_cursor
+        for rows, cursor in wb.iter_changes(SOURCE_SALES, page_cursor, include_cursor=not integration.wb_sales_cursor):
+            sales_loaded = True
+            yield SOURCE_SALES, cursor_page_key(page_cursor), rows, {"wb_sales_cursor": cursor}
+            page_cursor = cursor
+    except Exception as e:
+        if sales_loaded:
+            raise
+        # Если продажи недоступны, пробуем заказы
+        try:
+            page_cursor = integration.wb_orders_cursor or initial_cursor
+            for rows, cursor in wb.iter_changes(SOURCE_ORDERS, page_cursor, include_cursor=not integration.wb_orders_cursor):
+                yield SOURCE_ORDERS, cursor_page_key(page_cursor), rows, {"wb_orders_cursor": cursor}
+                page_cursor = cursor
+        except Exception as e2:
+            raise Exception(f"Не удалось получить данные: {str(e)}; {str(e2)}")
+
+def payload_marketplace(payload: MarketplacePayload) -> str:
+    """Маркетплейс страницы по источнику данных"""
+    return "ozon" if payload.source in (SOURCE_TRANSACTIONS, SOURCE_ANALYTICS) else "wildberries"
+
+def payload_to_sales(payload: MarketplacePayload, rows: List[Dict]) -> List[Dict]:
+    """Преобразовать строки сохраненной страницы в продажи (формат get_sales клиентов API)"""
+    if payload.source in (SOURCE_TRANSACTIONS, SOURCE_ANALYTICS):
+        return OzonAPI.parse_payload(payload.source, rows)
+    if is_wb_source(payload.source):
+        # Для WB rows - все строки дней страницы (wb_day_rows), итог дня строится по ним
+        return WildberriesAPI.group_by_date(payload.source, rows)
+    raise ValueError(f"Неизвестный источник данных: {payload.source}")
+
+def _latest_rows(source: str, pages: List[Tuple[int, List[Dict]]], days: Optional[set] = None) -> List[Dict]:
+    """
+    Строки WB из страниц (id страницы, строки) без повторов (ключ WildberriesAPI.row_key):
+    остается версия строки с наибольшим lastChangeDate, при равенстве - из более поздней страницы.
+    days - учитывать только строки этих дат.
+    """
+    latest = {}
+    for _, page_rows in sorted(pages, key=lambda page: page[0]):
+        for row in page_rows:
+            if days is not None and WildberriesAPI.row_date(source, row) not in days:
+                continue
+            key = WildberriesAPI.row_key(row)
+            changed = parse_change_date(row.get("lastChangeDate")) or datetime.min
+            if key not in latest or changed >= latest[key][0]:
+                latest[key] = (changed, row)
+    return [row for _, row in latest.values()]
+
+def wb_day_rows(db: Session, payload: MarketplacePayload, rows: List[Dict]) -> List[Dict]:
+    """
+    Все сохраненные строки WB за даты страницы: из самой страницы и из страниц интеграции
+    того же источника, период которых пересекается с этими датами (без повторов, см. _latest_rows)
+    """
+    days = {WildberriesAPI.row_date(payload.source, row) for row in rows}
+    if not days:
+        return []
+    others = db.query(MarketplacePayload).filter(
+        MarketplacePayload.integration_id == payload.integration_id,
+        MarketplacePayload.source == payload.source,
+        MarketplacePayload.id != payload.id,
+        MarketplacePayload.window_start <= max(days),
+        MarketplacePayload.window_end >= min(days)
+    ).all()
+    pages = [(other.id, decode_rows(other)) for other in others] + [(payload.id, rows)]
+    return _latest_rows(payload.source, pages, days)
+
+def ozon_posting_rows(db: Session, payload: MarketplacePayload, rows: List[Dict]) -> List[Dict]:
+    """
+    Все сохраненные операции OZON по отправлениям страницы: из самой страницы и из страниц
+    интеграции того же источника, период которых пересекается с периодом страницы.
+    Повторы операции (страницы пересекающихся периодов) отбрасываются по operation_id -
+    остается версия из более поздней страницы.
+    """
+    keys = {OzonAPI.operation_key(row) for row in rows}
+    if not keys:
+        return rows
+    others = db.query(MarketplacePayload).filter(
+        MarketplacePayload.integration_id == payload.integration_id,
+        MarketplacePayload.source == payload.source,
+        MarketplacePayload.id != payload.id,
+        MarketplacePayload.window_start <= payload.window_end,
+        MarketplacePayload.window_end >= payload.window_start
+    ).all()
+    pages = [(other.id, decode_rows(other)) for other in others] + [(payload.id, rows)]
+    latest = {}
+    for _, page_rows in sorted(pages, key=lambda page: page[0]):
+        for row in page_rows:
+            if OzonAPI.operation_key(row) not in keys:
+                continue
+            operation_id = row.get("operation_id") or json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+            latest[operation_id] = row
+    return list(latest.values())
+
+def _delete_page_totals(db: Session, context: Dict, source: str, days: Iterable[date]) -> int:
+    """
+    Удалить итоги дней по отдельным инкрементальным страницам WB (wb:<вид>:<дата>:p<id страницы>),
+    которые записывались до перехода на общий итог дня, вместе с позициями и списаниями со склада
+    """
+    days = list(days)
+    if not days:
+        return 0
+    realization_ids = [row.id for row in db.query(Realization.id).filter(
+        Realization.company_id == context["company_id"],
+        Realization.date.in_(days),
+        Realization.external_id.like(f"wb:{REPORTS[source]['kind']}:%:p%")
+    ).all()]
+    if not realization_ids:
+        return 0
+    post_outcome_batch([], context["warehouse_id"], INVENTORY_DOCUMENT_TYPE, db, document_ids=realization_ids)
+    db.query(RealizationItem).filter(
+        RealizationItem.realization_id.in_(realization_ids)
+    ).delete(synchronize_session=False)
+    db.query(Realization).filter(Realization.id.in_(realization_ids)).delete(synchronize_session=False)
+    print(f"[SYNC] Удалено итогов инкрементальных страниц WB: {len(realization_ids)}")
+    return len(realization_ids)
+
+def get_sync_context(db: Session, integration: MarketplaceIntegration) -> Dict:
+    """
+    Канал продаж, покупатель и склад, к которым относятся синхронизированные реализации
+    (маркетплейс как покупатель и его склад). Создаются при первом обращении.
+    """
+    # Находим или создаем канал продаж в справочнике
+    sales_channel = db.query(SalesChannel).filter(
+        SalesChannel.name.ilike(f"%{integration.marketplace_name}%")
+    ).first()
+    if not sales_channel:
+        sales_channel = SalesChannel(
+            name=integration.marketplace_name,
+            description=f"Автоматически создан из интеграции",
+            is_active=True
+        )
+        db.add(sales_channel)
+
+    customer = db.query(Customer).filter(
+        Customer.company_id == integration.company_id,
+        Customer.name == integration.marketplace_name
+    ).first()
+    if not customer:
+        customer = Customer(
+            company_id=integration.company_id,
+            name=integration.marketplace_name,
+            type="company",
+            notes="Автоматически создан из интеграции"
+        )
+        db.add(customer)
+
+    warehouse_name = f"Склад {integration.marketplace_name}"
+    warehouse = db.query(Warehouse).filter(
+        Warehouse.company_id == integration.company_id,
+        Warehouse.name == warehouse_name
+    ).first()
+    if not warehouse:
+        warehouse = Warehouse(
+            company_id=integration.company_id,
+            name=warehouse_name,
+            description="Автоматически создан из интеграции"
+        )
+        db.add(warehouse)
+
+    db.commit()
+    return {
+        "company_id": integration.company_id,
+        "marketplace_name": integration.marketplace_name,
+        "sales_channel_id": sales_channel.id,
+        "customer_id": customer.id,
+        "warehouse_id": warehouse.id,
+        "post_inventory": bool(integration.post_inventory)
+    }
+
+def upsert_sales(db: Session, context: Dict, sales: List[Dict], marketplace: str = None) -> int:
+    """
+    Сохранить продажи пакетными INSERT ... ON CONFLICT по (company_id, external_id),
+    суммы существующих реализаций заменяются вместе с их позициями (если продажи
+    содержат items и указан marketplace). Возвращает количество вставленных или обновленных записей.
+    """
+    # Строки с одинаковым ключом - разные операции, складываем их (продажи должны содержать
+    # все операции ключа - см. ozon_posting_rows и wb_day_rows, конфликт заменяет сумму)
+    rows_by_key = {}
+    items_by_key = {}
+    for sale in sales:
+        key = sale["external_id"]
+        items_by_key.setdefault(key, []).extend(sale.get("items", []))
+        if key in rows_by_key:
+            rows_by_key[key]["revenue"] += float(sale["revenue"])
+            rows_by_key[key]["quantity"] += sale.get("quantity", 1)
+            continue
+        rows_by_key[key] = {
+            "date": sale["date"],
+            "company_id": context["company_id"],
+            "sales_channel_id": context["sales_channel_id"],
+            "customer_id": context["customer_id"],
+            "warehouse_id": context["warehouse_id"],
+            "revenue": float(sale["revenue"]),
+            "quantity": sale.get("quantity", 1),
+            "description": sale.get("description", f"Синхронизация с {context['marketplace_name']}"),
+            "external_id": key
+        }
+
+    # Товары ищем до записи реализаций: при конфликте создания товара откатывается только поиск
+    all_items = [item for items in items_by_key.values() for item in items]
+    products = resolve_products(db, context["company_id"], marketplace, all_items) if marketplace and all_items else {}
+    
+    rows = list(rows_by_key.values())
+    affected = 0
+    for batch_start in range(0, len(rows), SYNC_BATCH_SIZE):
+        stmt = dialect_insert(db, Realization).values(rows[batch_start:batch_start + SYNC_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["company_id", "external_id"],
+            set_={
+                "revenue": stmt.excluded.revenue,
+                "quantity": stmt.excluded.quantity,
+                "updated_at": func.now()
+            }
+        )
+        affected += db.execute(stmt).rowcount
+    
+    if products:
+        _replace_realization_items(db, context, rows_by_key, items_by_key, products)
+    if rows:
+        # Отметка для обновления рекомендаций сохраняется коммитом страницы
+        domains = (DOMAIN_SALES, DOMAIN_INVENTORY) if context.get("post_inventory") and products else (DOMAIN_SALES,)
+        mark_recommendations_dirty(db, context["company_id"], *domains)
+    return affected
+
+def _replace_realization_items(db: Session, context: Dict, rows_by_key: Dict, items_by_key: Dict, products: Dict):
+    """Заменить позиции реализаций страницы (и, при включенной опции, списания со склада)"""
+    realization_ids = {
+        row.external_id: row.id
+        for row in db.query(Realization.external_id, Realization.id).filter(
+            Realization.company_id == context["company_id"],
+            Realization.external_id.in_(list(rows_by_key))
+        ).all()
+    }
+    
+    cost_prices = product_cost_prices(db, products.values())
+    item_rows = []
+    for key, items in items_by_key.items():
+        # Одинаковые артикулы внутри реализации объединяем
+        quantities = {}
+        revenues = {}
+        for item in items:
+            product_id = products[item["article"]]
+            quantities[product_id] = quantities.get(product_id, 0) + item["quantity"]
+            revenues[product_id] = revenues.get(product_id, 0.0) + float(item["revenue"])
+        for product_id, quantity in quantities.items():
+            if quantity <= 0:
+                continue
+            item_rows.append({
+                "realization_id": realization_ids[key],
+                "product_id": product_id,
+                "quantity": quantity,
+                "price": round(revenues[product_id] / quantity, 2),
+                "cost_price": cost_prices.get(product_id, 0),
+                "date": rows_by_key[key]["date"]
+            })
+    
+    db.query(RealizationItem).filter(
+        RealizationItem.realization_id.in_(list(realization_ids.values()))
+    ).delete(synchronize_session=False)
+    if item_rows:
+        db.execute(RealizationItem.__table__.insert(), [
+            {column: value for column, value in row.items() if column != "date"} for row in item_rows
+        ])
+    
+    if context.get("post_inventory"):
+        post_outcome_batch([{
+            "document_id": row["realization_id"],
+            "product_id": row["product_id"],
+            "quantity": row["quantity"],
+            "cost_price": row["cost_price"],
+            "date": row["date"],
+            "description": f"Списание по реализации {context['marketplace_name']} #{row['realization_id']}"
+        } for row in item_rows], context["warehouse_id"], INVENTORY_DOCUMENT_TYPE, db)
+
+def process_payload(db: Session, payload: MarketplacePayload, context: Dict) -> int:
+    """Преобразовать сохраненную страницу в реализации и отметить ее обработанной"""
+    try:
+        rows = decode_rows(payload)
+        if is_wb_source(payload.source):
+            rows = wb_day_rows(db, payload, rows)
+        elif payload.source == SOURCE_TRANSACTIONS:
+            rows = ozon_posting_rows(db, payload, rows)
+        sales = payload_to_sales(payload, rows)
+        if is_wb_source(payload.source):
+            _delete_page_totals(db, context, payload.source, {sale["date"] for sale in sales})
+        affected = upsert_sales(db, context, sales, payload_marketplace(payload))
+        payload.processed_at = datetime.now()
+        payload.process_error = None
+        db.commit()
+        return affected
+    except Exception as e:
+        db.rollback()
+        payload.process_error = str(e)
+        db.commit()
+        raise
+
+def _process_payload_by_id(payload_id: int, context: Dict) -> int:
+    """Обработать одну страницу в собственной сессии (для параллельной обработки)"""
+    db = SessionLocal()
+    try:
+        payload = db.query(MarketplacePayload).filter(MarketplacePayload.id == payload_id).first()
+        return process_payload(db, payload, context) if payload else 0
+    finally:
+        db.close()
+
+def process_staged_payloads(
+    integration_id: int,
+    window_start: date = None,
+    window_end: date = None,
+    only_unprocessed: bool = False,
+    workers: int = REPLAY_WORKERS
+) -> Dict:
+    """
+    Повторно обработать сохраненные страницы интеграции без обращения к API.
+    Можно ограничить периодом (по пересечению с периодом загрузки страницы)
+    и только необработанными страницами. Страницы обрабатываются параллельно.
+    """
+    db = SessionLocal()
+    try:
+        integration = db.query(MarketplaceIntegration).filter(
+            MarketplaceIntegration.id == integration_id
+        ).first()
+        if not integration:
+            raise ValueError(f"Интеграция {integration_id} не найдена")
+        context = get_sync_context(db, integration)
+
+        query = db.query(MarketplacePayload.id).filter(MarketplacePayload.integration_id == integration_id)
+        if window_start:
+            query = query.filter(MarketplacePayload.window_end >= window_start)
+        if window_end:
+            query = query.filter(MarketplacePayload.window_start <= window_end)
+        if only_unprocessed:
+            query = query.filter(MarketplacePayload.processed_at.is_(None))
+        # Итоги дней WB пересчитываются по всем сохраненным строкам дня, поэтому порядок
+        # обработки не влияет на суммы; но страницы WB с общими днями заменяют позиции одной
+        # реализации - для их повторной обработки без гонок используйте workers=1
+        payload_ids = [row.id for row in query.order_by(MarketplacePayload.id).all()]
+    finally:
+        db.close()
+
+    result = {"payloads": len(payload_ids), "processed": 0, "failed": 0, "realizations": 0}
+    if not payload_ids:
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="payload-replay") as pool:
+        futures = {pool.submit(_process_payload_by_id, payload_id, context): payload_id for payload_id in payload_ids}
+        for future in as_completed(futures):
+            try:
+                result["realizations"] += future.result()
+                result["processed"] += 1
+            except Exception as e:
+                result["failed"] += 1
+                print(f"[SYNC] Ошибка обработки страницы {futures[future]}: {str(e)}")
+    return result
+
+def _archive_wb_payloads(db: Session, integration_id: int, source: str, payloads: List[MarketplacePayload]) -> int:
+    """Свернуть страницы WB в архивные страницы по месяцам дат строк; вернуть число архивных страниц"""
+    rows_by_month = {}
+    for payload in payloads:
+        for row in decode_rows(payload):
+            month_start = WildberriesAPI.row_date(source, row).replace(day=1)
+            rows_by_month.setdefault(month_start, []).append((payload.id, row))
+    
+    for month_start, month_rows in rows_by_month.items():
+        archive = db.query(MarketplacePayload).filter(
+            MarketplacePayload.integration_id == integration_id,
+            MarketplacePayload.source == source,
+            MarketplacePayload.page_key == archive_page_key(month_start)
+        ).first()
+        # Архивная страница старше сворачиваемых, поэтому при равном lastChangeDate побеждают их строки
+        pages = [(0, decode_rows(archive))] if archive else []
+        for payload_id, row in month_rows:
+            pages.append((payload_id, [row]))
+        rows = _latest_rows(source, pages)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        archive = stage_payload(
+            db, integration_id, source, archive_page_key(month_start),
+            month_start, next_month - timedelta(days=1), rows
+        )
+        # Строки архива уже учтены в итогах дней - повторная обработка не нужна
+        archive.processed_at = datetime.now()
+        db.commit()
+    return len(rows_by_month)
+
+def purge_staged_payloads(
+    db: Session,
+    retention_days: int = PAYLOAD_RETENTION_DAYS,
+    integration_id: int = None,
+    now: datetime = None
+) -> Dict:
+    """
+    Политика хранения сырых страниц: успешно обработанные страницы, загруженные раньше
+    retention_days дней назад, удаляются. Страницы WB не удаляются бесследно: итоги дней WB
+    пересчитываются по всем сохраненным строкам дня, поэтому их строки без повторов
+    переносятся в архивную страницу месяца. Необработанные страницы и страницы с ошибкой остаются.
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    query = db.query(MarketplacePayload).filter(
+        MarketplacePayload.processed_at.isnot(None),
+        MarketplacePayload.process_error.is_(None),
+        MarketplacePayload.fetched_at < cutoff,
+        ~MarketplacePayload.page_key.like("archive:%")
+    )
+    if integration_id:
+        query = query.filter(MarketplacePayload.integration_id == integration_id)
+    
+    result = {"deleted": 0, "archived_pages": 0}
+    wb_payloads = {}
+    for payload in query.filter(MarketplacePayload.source.in_([SOURCE_SALES, SOURCE_ORDERS])).order_by(MarketplacePayload.id).all():
+        wb_payloads.setdefault((payload.integration_id, payload.source), []).append(payload)
+    for (payload_integration_id, source), payloads in wb_payloads.items():
+        result["archived_pages"] += _archive_wb_payloads(db, payload_integration_id, source, payloads)
+        db.query(MarketplacePayload).filter(
+            MarketplacePayload.id.in_([payload.id for payload in payloads])
+        ).delete(synchronize_session=False)
+        result["deleted"] += len(payloads)
+    
+    result["deleted"] += query.filter(
+        MarketplacePayload.source.in_([SOURCE_TRANSACTIONS, SOURCE_ANALYTICS])
+    ).delete(synchronize_session=False)
+    db.commit()
+    print(f"[SYNC] Очистка сохраненных страниц старше {retention_days} дн.: {result}")
+    return result
@@ -1,10 +1,14 @@
 """
 Сервис для создания автоматических уведомлений
 """
+from typing import Iterable
+from sqlalchemy import and_, func, insert, or_
 from sqlalchemy.orm import Session
-from app.models.notification import Notification
+from app.models.notification import Notification, NotificationCheck, BudgetChangeMark
 from app.models.user import User
-from datetime import datetime
+from app.services.budget_actuals import budget_actual_amounts, budget_period_dates
+from app.utils.bulk import dialect_insert
+from datetime import date, datetime, timedelta
 
 def create_notification(
     db: Session,
@@ -28,106 +32,186 @@ def create_notification(
     db.commit()
     return notification
 
-def _get_period_dates(period_type, period_value):
-    """Получить начальную и конечную даты периода"""
-    from datetime import date, timedelta
-    
-    if period_type.value == "month":
-        # period_value = "2024-01"
-        year, month = map(int, period_value.split("-"))
-        start_date = date(year, month, 1)
-        if month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, month + 1, 1)
-        end_date = end_date - timedelta(days=1)
-    elif period_type.value == "quarter":
-        # period_value = "2024-Q1"
-        year, quarter = period_value.split("-Q")
-        year = int(year)
-        quarter = int(quarter)
-        start_month = (quarter - 1) * 3 + 1
-        end_month = quarter * 3
-        start_date = date(year, start_month, 1)
-        if end_month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, end_month + 1, 1)
-        end_date = end_date - timedelta(days=1)
-    else:  # YEAR
-        # period_value = "2024"
-        year = int(period_value)
-        start_date = date(year, 1, 1)
-        end_date = date(year, 12, 31)
-    
-    return start_date, end_date
+# Имя проверки отклонений в notification_checks
+BUDGET_DEVIATION_CHECK = "budget_deviations"
+# Порог отклонения факта от плана для уведомления, %
+BUDGET_DEVIATION_THRESHOLD = 20
+# Перекрытие окна изменений бюджетов: транзакции, начатые до прошлой проверки и завершенные после нее
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# Сколько отметок изменений снимать одним запросом
+MARKS_CHUNK_SIZE = 400
 
-def check_budget_deviations(db: Session):
-    """Проверить отклонения от бюджета и создать уведомления"""
-    from app.models.budget import Budget, BudgetPeriod, BudgetType
-    from app.models.input1 import MoneyMovement
-    from sqlalchemy import func as sql_func, and_
-    
-    # Получаем все активные бюджеты
-    budgets = db.query(Budget).all()
-    
-    notifications_created = []
-    
+def budget_change_key(movement) -> tuple:
+    """Ключ отметки изменения движения денег: (организация, тип, статья или 0, первое число месяца)"""
+    item_id = movement.income_item_id if movement.movement_type == "income" else movement.expense_item_id
+    return (movement.company_id, movement.movement_type, item_id or 0, date(movement.date.year, movement.date.month, 1))
+
+def mark_budget_changes(db: Session, keys: Iterable[tuple]):
+    """
+    Отметить месяцы движений денег как измененные для проверки отклонений от бюджета
+    (ключи - budget_change_key; без коммита - отметка сохраняется вместе с изменением)
+    """
+    now = datetime.now()
+    rows = [
+        {"company_id": company_id, "movement_type": movement_type, "item_id": item_id, "month": month, "marked_at": now}
+        for company_id, movement_type, item_id, month in set(keys)
+        if company_id
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(db, BudgetChangeMark).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["company_id", "movement_type", "item_id", "month"],
+        set_={"marked_at": stmt.excluded.marked_at}
+    )
+    db.execute(stmt)
+
+def _budget_periods_of_month(year: int, month: int) -> set:
+    """Значения периодов бюджета, содержащих месяц: "2024-01", "2024-Q1", "2024" """
+    return {f"{year}-{month:02d}", f"{year}-Q{(month - 1) // 3 + 1}", str(year)}
+
+def _budget_periods_ending(start: date, end: date) -> set:
+    """Значения периодов бюджета, закончившихся в интервале [start, end]"""
+    values = set()
+    current = start.replace(day=1)
+    while current <= end:
+        next_month = (current + timedelta(days=32)).replace(day=1)
+        if start <= next_month - timedelta(days=1) <= end:
+            values.add(f"{current.year}-{current.month:02d}")
+            if current.month % 3 == 0:
+                values.add(f"{current.year}-Q{current.month // 3}")
+            if current.month == 12:
+                values.add(str(current.year))
+        current = next_month
+    return values
+
+def _budget_months(budget) -> list:
+    """(год, месяц) периода бюджета"""
+    start_date, end_date = budget_period_dates(budget.period_type, budget.period_value)
+    return [(start_date.year, month) for month in range(start_date.month, end_date.month + 1)]
+
+def _changed_budgets(db: Session, since, today: date, marks: list) -> list:
+    """
+    Бюджеты закончившихся периодов, которые нужно проверить: период закончился после since,
+    бюджет изменен после since или есть отметки изменений движений денег (marks) по его
+    организации, типу, статье и месяцам периода. since=None - все закончившиеся бюджеты.
+    """
+    from app.models.budget import Budget, BudgetType
+
+    if since is None:
+        budgets = db.query(Budget).all()
+    else:
+        # (организация, тип, год, месяц) -> измененные статьи
+        changed = {}
+        for mark in marks:
+            key = (mark.company_id, mark.movement_type, mark.month.year, mark.month.month)
+            changed.setdefault(key, set()).add(mark.item_id)
+
+        # Бюджеты, измененные после since, и бюджеты периодов, закончившихся после since
+        budgets = db.query(Budget).filter(or_(
+            func.coalesce(Budget.updated_at, Budget.created_at) >= since,
+            Budget.period_value.in_(_budget_periods_ending(since.date(), today))
+        )).all()
+        selected = {budget.id for budget in budgets}
+
+        # Бюджеты с отметками изменений движений денег по их статьям и месяцам
+        if changed:
+            touched_periods = set()
+            for _, _, year, month in changed:
+                touched_periods |= _budget_periods_of_month(year, month)
+            candidates = db.query(Budget).filter(
+                Budget.company_id.in_({key[0] for key in changed}),
+                Budget.period_value.in_(touched_periods)
+            ).all()
+            for budget in candidates:
+                if budget.id in selected:
+                    continue
+                if budget.budget_type == BudgetType.INCOME:
+                    movement_type, item_id = "income", budget.income_item_id
+                else:
+                    movement_type, item_id = "expense", budget.expense_item_id
+                for year, month in _budget_months(budget):
+                    items = changed.get((budget.company_id, movement_type, year, month))
+                    if items and (item_id is None or item_id in items):
+                        budgets.append(budget)
+                        break
+
+    return [
+        budget for budget in budgets
+        if budget_period_dates(budget.period_type, budget.period_value)[1] <= today
+    ]
+
+def check_budget_deviations(db: Session, today: date = None) -> dict:
+    """
+    Проверить отклонения от бюджета и создать уведомления.
+    Проверяются только бюджеты, период или данные которых изменились с прошлой проверки:
+    бюджеты - по времени изменения после отметки в notification_checks, движения денег -
+    по отметкам budget_change_marks (включая удаления и прежние статью и месяц измененных
+    движений). Факт считается одним сгруппированным запросом, уведомления добавляются
+    одним пакетным INSERT. Уведомление с тем же текстом по бюджету повторно не создается.
+    Возвращает {"budgets_checked", "notifications_created"}.
+    """
+    today = today or datetime.now().date()
+    started_at = db.query(func.now()).scalar()
+    check = db.get(NotificationCheck, BUDGET_DEVIATION_CHECK)
+    since = check.checked_at - WATERMARK_OVERLAP if check else None
+    marks = db.query(BudgetChangeMark).all()
+    seen = [(mark.id, mark.marked_at) for mark in marks]
+
+    budgets = _changed_budgets(db, since, today, marks)
+    actuals = budget_actual_amounts(db, budgets)
+
+    deviations = []
     for budget in budgets:
-        start_date, end_date = _get_period_dates(budget.period_type, budget.period_value)
-        
-        # Проверяем, не истек ли период
-        if datetime.now().date() < end_date:
-            continue  # Период еще не закончился
-        
-        # Получаем фактические данные
-        actual_query = db.query(sql_func.coalesce(sql_func.sum(MoneyMovement.amount), 0))
-        
-        if budget.budget_type == BudgetType.INCOME:
-            actual_query = actual_query.filter(
-                and_(
-                    MoneyMovement.movement_type == "income",
-                    MoneyMovement.company_id == budget.company_id,
-                    MoneyMovement.date >= start_date,
-                    MoneyMovement.date <= end_date
-                )
-            )
-            if budget.income_item_id:
-                actual_query = actual_query.filter(MoneyMovement.income_item_id == budget.income_item_id)
-        else:
-            actual_query = actual_query.filter(
-                and_(
-                    MoneyMovement.movement_type == "expense",
-                    MoneyMovement.company_id == budget.company_id,
-                    MoneyMovement.date >= start_date,
-                    MoneyMovement.date <= end_date
-                )
-            )
-            if budget.expense_item_id:
-                actual_query = actual_query.filter(MoneyMovement.expense_item_id == budget.expense_item_id)
-        
-        actual_amount = float(actual_query.scalar() or 0)
+        actual_amount = actuals[budget.id]
         planned_amount = float(budget.planned_amount)
         deviation_percent = abs((actual_amount - planned_amount) / planned_amount * 100) if planned_amount > 0 else 0
-        
-        # Создаем уведомление, если отклонение больше 20%
-        if deviation_percent > 20:
-            # Получаем всех пользователей (в реальности можно фильтровать по правам доступа)
-            users = db.query(User).filter(User.is_active == True).all()
-            
-            for user in users:
-                notification = create_notification(
-                    db,
-                    user.id,
-                    "warning",
-                    f"Отклонение от бюджета: {budget.period_value}",
-                    f"Фактическое значение отклоняется от плана на {deviation_percent:.1f}%. План: {planned_amount:.2f} ₽, Факт: {actual_amount:.2f} ₽",
-                    "budgets",
-                    budget.id
-                )
-                notifications_created.append(notification)
-    
-    return notifications_created
+        if deviation_percent > BUDGET_DEVIATION_THRESHOLD:
+            deviations.append((
+                budget.id,
+                f"Отклонение от бюджета: {budget.period_value}",
+                f"Фактическое значение отклоняется от плана на {deviation_percent:.1f}%. План: {planned_amount:.2f} ₽, Факт: {actual_amount:.2f} ₽"
+            ))
+
+    rows = []
+    if deviations:
+        # Получаем всех пользователей (в реальности можно фильтровать по правам доступа)
+        user_ids = [row.id for row in db.query(User.id).filter(User.is_active == True)]
+        existing = set(db.query(Notification.user_id, Notification.related_id, Notification.message).filter(
+            Notification.related_table == "budgets",
+            Notification.related_id.in_([budget_id for budget_id, _, _ in deviations])
+        ).all())
+        rows = [
+            {
+                "user_id": user_id,
+                "type": "warning",
+                "title": title,
+                "message": message,
+                "related_table": "budgets",
+                "related_id": budget_id
+            }
+            for budget_id, title, message in deviations
+            for user_id in user_ids
+            if (user_id, budget_id, message) not in existing
+        ]
+        if rows:
+            db.execute(insert(Notification), rows)
+
+    # Снимаем только прочитанные отметки, не обновленные во время проверки
+    for chunk_start in range(0, len(seen), MARKS_CHUNK_SIZE):
+        done = [
+            and_(BudgetChangeMark.id == mark_id, BudgetChangeMark.marked_at <= marked_at)
+            for mark_id, marked_at in seen[chunk_start:chunk_start + MARKS_CHUNK_SIZE]
+        ]
+        db.query(BudgetChangeMark).filter(or_(*done)).delete(synchronize_session=False)
+
+    if check:
+        check.checked_at = started_at
+    else:
+        db.add(NotificationCheck(name=BUDGET_DEVIATION_CHECK, checked_at=started_at))
+    db.commit()
+    print(f"[NOTIFICATIONS] Проверено бюджетов: {len(budgets)}, создано уведомлений: {len(rows)}")
+    return {"budgets_checked": len(budgets), "notifications_created": len(rows)}
 
 def check_low_profitability(db: Session, threshold: float = 5.0):
     """Проверить низкую рентабельность и создать уведомления"""
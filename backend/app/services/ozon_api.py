@@ -2,81 +2,274 @@
 Сервис для работы с API OZON
 Документация: https://docs.ozon.ru/api/seller/
 """
+import asyncio
+import hashlib
+import threading
+import time
+import httpx
 import requests
 import json
 from datetime import date, datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 from decimal import Decimal
+from app.database import settings
+from app.services.http_client import get_http_client, retry_delay, RETRYABLE_STATUSES, REQUEST_TIMEOUT_SECONDS
+
+TRANSACTION_LIST_ENDPOINT = "/v3/finance/transaction/list"
+MAX_PAGE_SIZE = 1000  # Максимальный page_size для /v3/finance/transaction/list
+MAX_CONCURRENT_REQUESTS = 5
+MAX_REQUESTS_PER_SECOND = 10
+# Источники сырых данных (для промежуточного хранения ответов API)
+SOURCE_TRANSACTIONS = "ozon_transactions"
+SOURCE_ANALYTICS = "ozon_analytics"
+
+class _RequestPacer:
+    """Равномерно распределяет запросы во времени (не больше rate запросов в секунду)"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+        # Один клиент может использоваться из нескольких потоков (окна исторической загрузки)
+        self._lock = threading.Lock()
+    
+    async def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
 
 class OzonAPI:
-    def __init__(self, client_id: str, api_key: str):
+    def __init__(
+        self,
+        client_id: str,
+        api_key: str,
+        max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+        requests_per_second: float = MAX_REQUESTS_PER_SECOND,
+        base_url: str = None,
+        transport: httpx.AsyncBaseTransport = None
+    ):
         self.client_id = client_id
         self.api_key = api_key
-        self.base_url = "https://api-seller.ozon.ru"
+        self.max_concurrency = max(1, max_concurrency)
+        self._pacer = _RequestPacer(requests_per_second)
+        self.base_url = base_url or settings.ozon_api_url
+        # Транспорт асинхронного клиента страниц (в тестах - httpx.MockTransport)
+        self.transport = transport
         self.headers = {
             "Client-Id": client_id,
             "Api-Key": api_key,
             "Content-Type": "application/json"
         }
+        # Сессия общая для всех экземпляров с теми же учетными данными
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        self.http = get_http_client(f"ozon:{client_id}:{key_hash}", self.base_url, self.headers)
+        # Начало счетчиков этого экземпляра (одной синхронизации)
+        self._stats_since = self.http.snapshot()
     
     def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict:
-        """Выполнить запрос к API OZON"""
-        url = f"{self.base_url}{endpoint}"
+        """Выполнить запрос к API OZON (с повторами при 429/5xx)"""
         try:
             if method == "POST":
-                response = requests.post(url, headers=self.headers, json=data, timeout=30)
+                response = self.http.request("POST", endpoint, json=data)
             else:
-                response = requests.get(url, headers=self.headers, params=data, timeout=30)
-            
-            response.raise_for_status()
+                response = self.http.request("GET", endpoint, params=data)
             return response.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Ошибка запроса к OZON API: {str(e)}")
     
-    def get_sales(self, from_date: date, to_date: date, limit: int = 1000) -> List[Dict]:
+    def request_stats(self) -> Dict:
+        """Статистика запросов к API с момента создания экземпляра (одного запуска синхронизации)"""
+        return self.http.stats(since=self._stats_since)
+    
+    def _transaction_list_payload(self, from_date: date, to_date: date, page: int, page_size: int) -> Dict:
+        """Тело запроса /v3/finance/transaction/list для одной страницы"""
+        # OZON API требует даты в формате ISO 8601
+        return {
+            "filter": {
+                "date": {
+                    "from": from_date.isoformat() + "T00:00:00Z",
+                    "to": to_date.isoformat() + "T23:59:59Z"
+                },
+                "operation_type": ["operation_agent_delivery_to_customer", "operation_agent_delivery_return"]
+            },
+            "page": page,
+            "page_size": page_size
+        }
+    
+    @staticmethod
+    def operation_key(operation: Dict) -> str:
+        """external_id реализации транзакции: номер отправления (без него - id операции)"""
+        return f"ozon:{operation.get('posting_number') or operation.get('operation_id', '')}"
+    
+    @staticmethod
+    def parse_operations(operations: List[Dict]) -> List[Dict]:
+        """Преобразовать транзакции OZON в формат реализаций"""
+        sales = []
+        for operation in operations:
+            if operation.get("operation_type") == "operation_agent_delivery_to_customer":
+                # Это продажа; начисление делим поровну между товарами отправления
+                revenue = float(operation.get("accruals_for_sale", 0))
+                products = [product for product in operation.get("items", []) if product.get("sku")]
+                items = [{
+                    "article": str(product["sku"]),
+                    "name": product.get("name"),
+                    "seller_article": product.get("offer_id"),
+                    "quantity": 1,
+                    "revenue": revenue / len(products)
+                } for product in products]
+                sales.append({
+                    "date": datetime.fromisoformat(operation["date"].replace("Z", "+00:00")).date(),
+                    "revenue": revenue,
+                    "quantity": 1,  # OZON не возвращает количество в транзакциях
+                    "order_id": operation.get("posting_number", ""),
+                    "external_id": OzonAPI.operation_key(operation),
+                    "description": f"Заказ {operation.get('posting_number', '')}",
+                    "items": items
+                })
+        return sales
+    
+    @staticmethod
+    def parse_analytics(items: List[Dict]) -> List[Dict]:
+        """Преобразовать строки /v1/analytics/data в формат реализаций"""
+        sales = []
+        for item in items:
+            sales.append({
+                "date": datetime.fromisoformat(item["dimensions"]["date"]["id"]).date(),
+                "revenue": float(item.get("metrics", {}).get("revenue", 0)),
+                "quantity": int(item.get("metrics", {}).get("ordered_units", 0)),
+                "external_id": f"ozon:day:{item['dimensions']['date']['id']}",
+                "description": f"Продажи за {item['dimensions']['date']['id']}"
+            })
+        return sales
+    
+    @staticmethod
+    def parse_payload(source: str, rows: List[Dict]) -> List[Dict]:
+        """Преобразовать сырые строки ответа API (по источнику) в формат реализаций"""
+        if source == SOURCE_ANALYTICS:
+            return OzonAPI.parse_analytics(rows)
+        return OzonAPI.parse_operations(rows)
+    
+    async def _fetch_page_async(
+        self,
+        client: httpx.AsyncClient,
+        limiter: "_RequestPacer",
+        from_date: date,
+        to_date: date,
+        page: int,
+        page_size: int
+    ) -> Dict:
+        """Асинхронно загрузить одну страницу транзакций (с повторами при 429/5xx), вернуть result ответа"""
+        data = self._transaction_list_payload(from_date, to_date, page, page_size)
+        max_retries = self.http.max_retries
+        for attempt in range(max_retries + 1):
+            await limiter.wait()
+            started = time.monotonic()
+            try:
+                response = await client.post(TRANSACTION_LIST_ENDPOINT, json=data)
+            except httpx.TransportError as e:
+                self.http.record("POST", TRANSACTION_LIST_ENDPOINT, None, time.monotonic() - started, attempt)
+                if attempt == max_retries:
+                    raise Exception(f"Ошибка запроса к OZON API (страница {page}): {str(e)}")
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            
+            self.http.record("POST", TRANSACTION_LIST_ENDPOINT, response.status_code, time.monotonic() - started, attempt)
+            if response.status_code in RETRYABLE_STATUSES and attempt < max_retries:
+                await asyncio.sleep(retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            try:
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                raise Exception(f"Ошибка запроса к OZON API (страница {page}): {str(e)}")
+            return response.json().get("result", {})
+    
+    async def _fetch_pages_async(
+        self,
+        client: httpx.AsyncClient,
+        from_date: date,
+        to_date: date,
+        pages: List[int],
+        page_size: int
+    ) -> List[Dict]:
+        """Параллельно загрузить несколько страниц, соблюдая лимит запросов в секунду"""
+        return await asyncio.gather(*[
+            self._fetch_page_async(client, self._pacer, from_date, to_date, page, page_size)
+            for page in pages
+        ])
+    
+    def _async_client(self) -> httpx.AsyncClient:
+        """Асинхронный клиент страниц транзакций (keep-alive, не больше max_concurrency соединений)"""
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            transport=self.transport
+        )
+    
+    def iter_raw_pages(self, from_date: date, to_date: date, page_size: int = MAX_PAGE_SIZE) -> Iterator[Tuple[str, int, List[Dict]]]:
         """
-        Получить данные о продажах за период
-        Использует метод /v3/finance/transaction/list
+        Постранично получить сырые строки ответа API за период: (источник, номер страницы, строки).
+        Первая страница загружается отдельно и сообщает page_count, остальные
+        запрашиваются параллельно группами по max_concurrency страниц, поэтому
+        в памяти одновременно находится не больше одной группы.
+        Загрузка заканчивается на неполной (или пустой) странице, даже если
+        page_count больше; без page_count страницы запрашиваются до неполной.
         """
+        # Один цикл событий и один асинхронный клиент (keep-alive) на все страницы
+        loop = asyncio.new_event_loop()
+        client = self._async_client()
         try:
-            # OZON API требует даты в формате ISO 8601
-            from_iso = from_date.isoformat() + "T00:00:00Z"
-            to_iso = to_date.isoformat() + "T23:59:59Z"
-            
-            data = {
-                "filter": {
-                    "date": {
-                        "from": from_iso,
-                        "to": to_iso
-                    },
-                    "operation_type": ["operation_agent_delivery_to_customer", "operation_agent_delivery_return"]
-                },
-                "page": 1,
-                "page_size": limit
-            }
+            try:
+                first = loop.run_until_complete(
+                    self._fetch_page_async(client, self._pacer, from_date, to_date, 1, page_size)
+                )
+            except Exception:
+                first = None
+            if first is None:
+                # Если метод не работает, пробуем альтернативный через отчеты
+                yield SOURCE_ANALYTICS, 1, self._get_analytics_rows(from_date, to_date)
+                return
             
-            result = self._make_request("POST", "/v3/finance/transaction/list", data)
+            operations = first.get("operations", [])
+            yield SOURCE_TRANSACTIONS, 1, operations
+            # 0 - сервер не сообщил количество страниц
+            page_count = int(first.get("page_count") or 0)
+            if len(operations) < page_size or page_count == 1:
+                return
             
-            # Парсим транзакции и преобразуем в формат реализаций
-            sales = []
-            if "result" in result and "operations" in result["result"]:
-                for operation in result["result"]["operations"]:
-                    if operation.get("operation_type") == "operation_agent_delivery_to_customer":
-                        # Это продажа
-                        sales.append({
-                            "date": datetime.fromisoformat(operation["date"].replace("Z", "+00:00")).date(),
-                            "revenue": float(operation.get("accruals_for_sale", 0)),
-                            "quantity": 1,  # OZON не возвращает количество в транзакциях
-                            "order_id": operation.get("posting_number", ""),
-                            "description": f"Заказ {operation.get('posting_number', '')}"
-                        })
-            
-            return sales
-        except Exception as e:
-            # Если метод не работает, пробуем альтернативный через отчеты
-            return self._get_sales_alternative(from_date, to_date)
+            wave_start = 2
+            while not page_count or wave_start <= page_count:
+                wave_end = wave_start + self.max_concurrency
+                if page_count:
+                    wave_end = min(wave_end, page_count + 1)
+                pages = list(range(wave_start, wave_end))
+                wave = loop.run_until_complete(self._fetch_pages_async(client, from_date, to_date, pages, page_size))
+                for page, result in zip(pages, wave):
+                    operations = result.get("operations", [])
+                    yield SOURCE_TRANSACTIONS, page, operations
+                    if len(operations) < page_size:
+                        return
+                wave_start = wave_end
+        finally:
+            loop.run_until_complete(client.aclose())
+            loop.close()
     
-    def _get_sales_alternative(self, from_date: date, to_date: date) -> List[Dict]:
+    def iter_sales_pages(self, from_date: date, to_date: date, page_size: int = MAX_PAGE_SIZE) -> Iterator[List[Dict]]:
+        """Постранично получить продажи за период (генератор, по одному списку на страницу)"""
+        for source, page, rows in self.iter_raw_pages(from_date, to_date, page_size):
+            yield self.parse_payload(source, rows)
+    
+    def get_sales(self, from_date: date, to_date: date, limit: int = MAX_PAGE_SIZE) -> List[Dict]:
+        """
+        Получить данные о продажах за период (все страницы)
+        Использует метод /v3/finance/transaction/list
+        """
+        return [sale for page in self.iter_sales_pages(from_date, to_date, page_size=limit) for sale in page]
+    
+    def _get_analytics_rows(self, from_date: date, to_date: date) -> List[Dict]:
         """
         Альтернативный метод получения продаж через отчеты
         Использует /v1/analytics/data
@@ -89,21 +282,14 @@ class OzonAPI:
             }
             
             result = self._make_request("POST", "/v1/analytics/data", data)
-            
-            sales = []
-            if "result" in result and "data" in result["result"]:
-                for item in result["result"]["data"]:
-                    sales.append({
-                        "date": datetime.fromisoformat(item["dimensions"]["date"]["id"]).date(),
-                        "revenue": float(item.get("metrics", {}).get("revenue", 0)),
-                        "quantity": int(item.get("metrics", {}).get("ordered_units", 0)),
-                        "description": f"Продажи за {item['dimensions']['date']['id']}"
-                    })
-            
-            return sales
+            return result.get("result", {}).get("data", [])
         except Exception as e:
             raise Exception(f"Не удалось получить данные о продажах: {str(e)}")
     
+    def _get_sales_alternative(self, from_date: date, to_date: date) -> List[Dict]:
+        """Альтернативный метод получения продаж через отчеты"""
+        return self.parse_analytics(self._get_analytics_rows(from_date, to_date))
+    
     def test_connection(self) -> bool:
         """Проверить подключение к API"""
         try:
@@ -112,7 +298,8 @@ class OzonAPI:
             from datetime import date, timedelta
             today = date.today()
             yesterday = today - timedelta(days=1)
-            result = self.get_sales(yesterday, today, limit=1)
+            # Достаточно первой страницы
+            next(self.iter_sales_pages(yesterday, today, page_size=1))
             return True
         except Exception as e:
             print(f"Ошибка проверки подключения OZON: {str(e)}")
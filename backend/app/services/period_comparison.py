@@ -0,0 +1,108 @@
+"""
+Сравнение финансовых показателей за произвольный набор периодов
+
+Границы периодов передаются в запрос как подзапрос (UNION ALL строк
+номер/начало/конец), выручка и бизнес-расходы объединяются в один поток
+строк, и суммы по всем периодам считаются одним сгруппированным запросом
+(соединение строк с периодами по дате). Периоды могут пересекаться: строка
+учитывается в каждом периоде, в который попадает ее дата.
+"""
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Date, Integer, String, and_, func, literal, select, union_all
+from sqlalchemy.orm import Session
+from app.models.input1 import MoneyMovement
+from app.models.realization import Realization
+
+METRIC_REVENUE = "revenue"
+METRIC_EXPENSES = "expenses"
+
+def shift_year(day: date, years: int = -1) -> date:
+    """Та же дата в другом году (29 февраля - 28 февраля)"""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, day=28)
+
+def calc_change(old_val: float, new_val: float) -> float:
+    """Изменение показателя в процентах"""
+    if old_val == 0:
+        return 100 if new_val > 0 else 0
+    return ((new_val - old_val) / old_val) * 100
+
+def _periods_subquery(periods: List[Tuple[date, date]]):
+    """Подзапрос границ периодов: (idx, start, end)"""
+    rows = [
+        select(
+            literal(index, Integer).label("idx"),
+            literal(start, Date).label("start"),
+            literal(end, Date).label("end")
+        )
+        for index, (start, end) in enumerate(periods)
+    ]
+    return (union_all(*rows) if len(rows) > 1 else rows[0]).subquery("periods")
+
+def period_metrics(db: Session, company_ids: Optional[Iterable[int]], periods: List[Tuple[date, date]]) -> List[Dict]:
+    """
+    Выручка, бизнес-расходы, прибыль и маржа для каждого периода [start, end]
+    (company_ids=None - все организации). Порядок результата совпадает с periods.
+    """
+    if not periods:
+        return []
+    first = min(start for start, _ in periods)
+    last = max(end for _, end in periods)
+
+    revenue_rows = select(
+        literal(METRIC_REVENUE, String).label("metric"),
+        Realization.date.label("date"),
+        Realization.revenue.label("amount")
+    ).where(Realization.date >= first, Realization.date <= last)
+    expense_rows = select(
+        literal(METRIC_EXPENSES, String).label("metric"),
+        MoneyMovement.date.label("date"),
+        MoneyMovement.amount.label("amount")
+    ).where(
+        MoneyMovement.date >= first,
+        MoneyMovement.date <= last,
+        MoneyMovement.movement_type == 'expense',
+        MoneyMovement.is_business == True
+    )
+    if company_ids is not None:
+        company_ids = list(company_ids)
+        revenue_rows = revenue_rows.where(Realization.company_id.in_(company_ids))
+        expense_rows = expense_rows.where(MoneyMovement.company_id.in_(company_ids))
+    amounts = union_all(revenue_rows, expense_rows).subquery("amounts")
+    bounds = _periods_subquery(periods)
+
+    rows = db.execute(
+        select(bounds.c.idx, amounts.c.metric, func.sum(amounts.c.amount))
+        .select_from(amounts)
+        .join(bounds, and_(amounts.c.date >= bounds.c.start, amounts.c.date <= bounds.c.end))
+        .group_by(bounds.c.idx, amounts.c.metric)
+    ).all()
+
+    totals = [{METRIC_REVENUE: 0.0, METRIC_EXPENSES: 0.0} for _ in periods]
+    for index, metric, amount in rows:
+        totals[index][metric] = float(amount or 0)
+
+    result = []
+    for total in totals:
+        revenue = total[METRIC_REVENUE]
+        expenses = total[METRIC_EXPENSES]
+        profit = revenue - expenses
+        result.append({
+            "revenue": revenue,
+            "expenses": expenses,
+            "profit": profit,
+            "margin": (profit / revenue * 100) if revenue > 0 else 0
+        })
+    return result
+
+def metric_changes(base: Dict, current: Dict) -> Dict:
+    """Изменения показателей current относительно base (маржа - в процентных пунктах)"""
+    return {
+        "revenue": round(calc_change(base["revenue"], current["revenue"]), 2),
+        "expenses": round(calc_change(base["expenses"], current["expenses"]), 2),
+        "profit": round(calc_change(base["profit"], current["profit"]), 2),
+        "margin": round(current["margin"] - base["margin"], 2)
+    }
@@ -0,0 +1,137 @@
+"""
+Генерация рекомендаций по нескольким организациям
+
+Организации обрабатываются параллельно в ограниченном пуле потоков, у каждой
+своя сессия БД (сессию нельзя использовать из нескольких потоков). Результаты
+по организациям собираются в общий итог; ошибка одной организации не прерывает
+остальные.
+
+Фоновые задачи генерации хранятся в памяти процесса: прогресс доступен по id
+задачи в том же процессе API, завершенные задачи вытесняются после MAX_JOBS.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+from app.database import SessionLocal
+from app.services.recommendation_service import RecommendationService
+
+# Количество организаций, обрабатываемых одновременно
+RECOMMENDATION_WORKERS = 4
+# Сколько последних задач хранить в памяти
+MAX_JOBS = 100
+
+def _generate_for_company(company_id: int, user_id: Optional[int], domains: Optional[Set[str]] = None) -> int:
+    """Сгенерировать рекомендации одной организации в собственной сессии"""
+    db = SessionLocal()
+    try:
+        return RecommendationService(db).generate_recommendations(company_id, user_id=user_id, domains=domains)
+    finally:
+        db.close()
+
+def generate_for_companies(
+    company_ids: List[int],
+    user_id: Optional[int] = None,
+    workers: int = RECOMMENDATION_WORKERS,
+    on_company_done: Callable[[int, Optional[int], Optional[str]], None] = None,
+    domains_by_company: Dict[int, Set[str]] = None
+) -> Dict:
+    """
+    Сгенерировать рекомендации для списка организаций.
+    on_company_done(company_id, количество, ошибка) вызывается после каждой организации.
+    domains_by_company - только правила измененных областей данных по организациям (иначе все правила).
+    Возвращает {"generated": всего, "companies": {id: количество}, "errors": {id: ошибка}}.
+    """
+    result = {"generated": 0, "companies": {}, "errors": {}}
+
+    def finish(company_id: int, count: Optional[int], error: Optional[str]):
+        if error is None:
+            result["companies"][company_id] = count
+            result["generated"] += count
+        else:
+            result["errors"][company_id] = error
+            print(f"Error generating recommendations for company {company_id}: {error}")
+        if on_company_done:
+            on_company_done(company_id, count, error)
+
+    domains_by_company = domains_by_company or {}
+    workers = max(1, min(workers, len(company_ids)))
+    if workers == 1:
+        for company_id in company_ids:
+            try:
+                finish(company_id, _generate_for_company(company_id, user_id, domains_by_company.get(company_id)), None)
+            except Exception as e:
+                finish(company_id, None, str(e))
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recommendations") as pool:
+        futures = {
+            pool.submit(_generate_for_company, company_id, user_id, domains_by_company.get(company_id)): company_id
+            for company_id in company_ids
+        }
+        for future in as_completed(futures):
+            try:
+                finish(futures[future], future.result(), None)
+            except Exception as e:
+                finish(futures[future], None, str(e))
+    return result
+
+_jobs: "OrderedDict[str, Dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def create_generation_job(company_ids: List[int], requested_by: int) -> Dict:
+    """Зарегистрировать фоновую задачу генерации (запускается через run_generation_job)"""
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "pending",
+        "requested_by": requested_by,
+        "companies_total": len(company_ids),
+        "companies_done": 0,
+        "generated": 0,
+        "company_ids": list(company_ids),
+        "errors": {},
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None
+    }
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    return dict(job)
+
+def get_generation_job(job_id: str) -> Optional[Dict]:
+    """Состояние задачи генерации (копия) или None"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job, errors=dict(job["errors"])) if job else None
+
+def run_generation_job(job_id: str, workers: int = RECOMMENDATION_WORKERS):
+    """Выполнить фоновую задачу генерации, обновляя ее прогресс"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if not job:
+            return
+        job["status"] = "in_progress"
+        job["started_at"] = datetime.now().isoformat()
+        company_ids = list(job["company_ids"])
+
+    def on_company_done(company_id: int, count: Optional[int], error: Optional[str]):
+        with _jobs_lock:
+            job["companies_done"] += 1
+            if error is None:
+                job["generated"] += count
+            else:
+                job["errors"][company_id] = error
+
+    try:
+        generate_for_companies(company_ids, user_id=None, workers=workers, on_company_done=on_company_done)
+        status = "error" if job["errors"] and len(job["errors"]) == len(company_ids) else "success"
+    except Exception as e:
+        print(f"Error in recommendation generation job {job_id}: {str(e)}")
+        status = "error"
+    with _jobs_lock:
+        job["status"] = status
+        job["finished_at"] = datetime.now().isoformat()
@@ -0,0 +1,104 @@
+"""
+Инкрементальное обновление рекомендаций по измененным данным
+
+Операции записи (движения денег, реализации и отгрузки, склад, бюджеты, активы
+и пассивы, клиенты и поставщики) отмечают организацию и область данных
+в recommendation_dirty_marks в той же транзакции, что и сами изменения.
+Обновление перезапускает для каждой отмеченной организации только правила,
+зависящие от измененных областей (RULE_DOMAINS), и снимает отметки, поставленные
+до его начала; отметки, появившиеся во время обновления, остаются до следующего
+запуска.
+"""
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Union
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models.recommendation import RecommendationDirtyMark
+from app.services.recommendation_jobs import generate_for_companies, RECOMMENDATION_WORKERS
+from app.services.recommendation_service import RECOMMENDATION_DOMAINS
+from app.utils.bulk import dialect_insert
+
+def mark_recommendations_dirty(db: Session, company_ids: Union[int, Iterable[int]], *domains: str):
+    """
+    Отметить области данных организаций как измененные (без коммита - отметка
+    сохраняется вместе с изменением данных)
+    """
+    if isinstance(company_ids, int):
+        company_ids = [company_ids]
+    now = datetime.now()
+    rows = [
+        {"company_id": company_id, "domain": domain, "marked_at": now}
+        for company_id in set(company_ids) if company_id
+        for domain in domains
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(db, RecommendationDirtyMark).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["company_id", "domain"],
+        set_={"marked_at": stmt.excluded.marked_at}
+    )
+    db.execute(stmt)
+
+def pending_refresh(db: Session) -> Dict[int, list]:
+    """Отмеченные области по организациям: {company_id: [область, ...]}"""
+    pending = {}
+    for mark in db.query(RecommendationDirtyMark).order_by(RecommendationDirtyMark.company_id).all():
+        pending.setdefault(mark.company_id, []).append(mark.domain)
+    return pending
+
+def refresh_dirty_recommendations(workers: int = RECOMMENDATION_WORKERS) -> Dict:
+    """
+    Обновить рекомендации организаций с отмеченными изменениями.
+    Возвращает {"companies": число организаций, "generated": новых рекомендаций, "errors": {...}}.
+    """
+    db = SessionLocal()
+    try:
+        marks = db.query(RecommendationDirtyMark).all()
+        if not marks:
+            return {"companies": 0, "generated": 0, "errors": {}}
+        domains_by_company = {}
+        for mark in marks:
+            if mark.domain in RECOMMENDATION_DOMAINS:
+                domains_by_company.setdefault(mark.company_id, set()).add(mark.domain)
+        seen = [(mark.company_id, mark.domain, mark.marked_at) for mark in marks]
+        db.rollback()
+
+        started = time.perf_counter()
+        result = generate_for_companies(
+            list(domains_by_company), user_id=None, workers=workers, domains_by_company=domains_by_company
+        )
+
+        # Снимаем только обработанные отметки, не обновленные во время генерации
+        done = [
+            and_(
+                RecommendationDirtyMark.company_id == company_id,
+                RecommendationDirtyMark.domain == domain,
+                RecommendationDirtyMark.marked_at <= marked_at
+            )
+            for company_id, domain, marked_at in seen
+            if company_id not in result["errors"]
+        ]
+        if done:
+            db.query(RecommendationDirtyMark).filter(or_(*done)).delete(synchronize_session=False)
+            db.commit()
+
+        print(
+            f"[RECOMMENDATIONS] Обновлено организаций: {len(domains_by_company)}, "
+            f"новых рекомендаций: {result['generated']}, за {time.perf_counter() - started:.2f} с"
+        )
+        return {"companies": len(domains_by_company), "generated": result["generated"], "errors": result["errors"]}
+    finally:
+        db.close()
+
+def run_refresh_loop(interval_seconds: int = 300):
+    """Периодически обновлять рекомендации по отмеченным изменениям"""
+    print(f"[RECOMMENDATIONS] Обновление рекомендаций каждые {interval_seconds} с")
+    while True:
+        try:
+            refresh_dirty_recommendations()
+        except Exception as e:
+            print(f"[RECOMMENDATIONS] Ошибка обновления рекомендаций: {str(e)}")
+        time.sleep(interval_seconds)
@@ -1,25 +1,48 @@
 """
 Сервис для генерации бизнес-рекомендаций
 """
-from decimal import Decimal
-from datetime import date, timedelta, datetime
-from typing import List
+from datetime import date, timedelta
+from typing import Set
+import numpy as np
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
 from app.models.recommendation import (
     Recommendation, RecommendationType, RecommendationPriority, RecommendationCategory
 )
-from app.models.product import Product
-from app.models.input1 import MoneyMovement
-from app.models.realization import Realization, RealizationItem
-from app.models.shipment import Shipment
-from app.models.input2 import Asset, Liability
-from app.models.budget import Budget, BudgetType, BudgetPeriod
-from app.models.inventory import Inventory
-from app.models.warehouse import Warehouse
-from app.models.customer import Customer
-from app.models.supplier import Supplier
-from app.models.reference import SalesChannel, ExpenseItem, IncomeItem
+from app.models.budget import BudgetType, BudgetPeriod
+from app.services.recommendation_snapshot import CompanyMetricsSnapshot, previous_quarter, quarter_start
+from app.services.anomaly_detection import detect_anomalies, finite_or_none, Z_THRESHOLD, MAD_THRESHOLD
+
+# Области данных, изменения в которых отмечаются для инкрементального обновления
+DOMAIN_MONEY = "money"  # Движения денег (input1, bank_cash)
+DOMAIN_SALES = "sales"  # Реализации и отгрузки
+DOMAIN_INVENTORY = "inventory"  # Остатки и складские операции
+DOMAIN_BUDGET = "budget"  # Бюджеты
+DOMAIN_BALANCE = "balance"  # Активы и пассивы (input2)
+DOMAIN_PARTNERS = "partners"  # Клиенты и поставщики
+RECOMMENDATION_DOMAINS = (
+    DOMAIN_MONEY, DOMAIN_SALES, DOMAIN_INVENTORY, DOMAIN_BUDGET, DOMAIN_BALANCE, DOMAIN_PARTNERS
+)
+
+# От каких областей данных зависит каждое правило. Правила по справочнику товаров
+# (маржинальность, цены) не зависят ни от одной и выполняются только при полной генерации.
+RULE_DOMAINS = {
+    "_generate_margin_recommendations": set(),
+    "_generate_expense_recommendations": {DOMAIN_MONEY},
+    "_generate_cash_flow_recommendations": {DOMAIN_MONEY},
+    "_generate_profitability_analysis": {DOMAIN_MONEY, DOMAIN_SALES},
+    "_generate_turnover_recommendations": {DOMAIN_SALES, DOMAIN_INVENTORY},
+    "_generate_product_recommendations": set(),
+    "_generate_product_performance_analysis": {DOMAIN_SALES},
+    "_generate_trend_recommendations": {DOMAIN_SALES},
+    "_generate_statistical_anomalies": {DOMAIN_SALES},
+    "_generate_period_comparison_recommendations": {DOMAIN_MONEY, DOMAIN_SALES},
+    "_generate_sales_recommendations": {DOMAIN_SALES},
+    "_generate_budget_recommendations": {DOMAIN_MONEY, DOMAIN_BUDGET},
+    "_generate_assets_liabilities_recommendations": {DOMAIN_SALES, DOMAIN_BALANCE},
+    "_generate_inventory_recommendations": {DOMAIN_INVENTORY, DOMAIN_SALES},
+    "_generate_customers_suppliers_recommendations": {DOMAIN_MONEY, DOMAIN_SALES, DOMAIN_BALANCE, DOMAIN_PARTNERS},
+}
 
 class RecommendationService:
     def __init__(self, db: Session):
@@ -30,10 +53,31 @@ class RecommendationService:
         self.HIGH_EXPENSE_GROWTH = 30  # Высокий рост расходов (%)
         self.MIN_CASH_DAYS = 30  # Минимальный остаток денежных средств (дней)
         self.SLOW_TURNOVER_DAYS = 90  # Медленная оборачиваемость (дней)
+        self.MAX_ANOMALIES = 10  # Максимум рекомендаций об аномалиях по статьям/товарам за запуск
+        # Снимок показателей компании текущего запуска (общий для всех генераторов)
+        self.snapshot = None
+        # Ключи существующих рекомендаций компании и новые рекомендации, ожидающие записи
+        self._existing_company_id = None
+        self._existing_titles = set()  # (title, is_dismissed)
+        self._existing_keys = set()  # (category, related_table, related_id, is_dismissed), части могут быть None
+        self._pending = []
     
-    def generate_recommendations(self, company_id: int, user_id: int = None) -> int:
-        """Генерирует все типы рекомендаций для компании на основе анализа данных"""
+    def _get_snapshot(self, company_id: int) -> CompanyMetricsSnapshot:
+        """Снимок показателей компании; строится один раз на компанию"""
+        if self.snapshot is None or self.snapshot.company_id != company_id:
+            self.snapshot = CompanyMetricsSnapshot(self.db, company_id)
+        return self.snapshot
+    
+    def generate_recommendations(self, company_id: int, user_id: int = None, domains: Set[str] = None) -> int:
+        """
+        Генерирует рекомендации для компании на основе анализа данных.
+        domains - только правила, зависящие от измененных областей данных (см. RULE_DOMAINS);
+        по умолчанию выполняются все правила.
+        """
         count = 0
+        # Данные для всех генераторов загружаются один раз
+        self.snapshot = CompanyMetricsSnapshot(self.db, company_id)
+        self._load_existing(company_id)
         
         # Список методов генерации рекомендаций
         generation_methods = [
@@ -69,6 +113,12 @@ class RecommendationService:
             ("_generate_customers_suppliers_recommendations", self._generate_customers_suppliers_recommendations),
         ]
         
+        if domains is not None:
+            generation_methods = [
+                (method_name, method_func) for method_name, method_func in generation_methods
+                if RULE_DOMAINS[method_name] & set(domains)
+            ]
+        
         # Выполняем каждый метод с обработкой ошибок
         for method_name, method_func in generation_methods:
             try:
@@ -81,33 +131,61 @@ class RecommendationService:
                 # Продолжаем выполнение других методов
                 continue
         
+        self._flush_recommendations()
         return count
     
+    def _load_existing(self, company_id: int):
+        """Загружает ключи существующих рекомендаций компании для проверки дублей в памяти"""
+        self._existing_company_id = company_id
+        self._existing_titles = set()
+        self._existing_keys = set()
+        self._pending = []
+        rows = self.db.query(
+            Recommendation.title,
+            Recommendation.category,
+            Recommendation.related_table,
+            Recommendation.related_id,
+            Recommendation.is_dismissed
+        ).filter(Recommendation.company_id == company_id).all()
+        for row in rows:
+            self._remember_keys(row.title, row.category, row.related_table, row.related_id, bool(row.is_dismissed))
+    
+    def _remember_keys(self, title, category, related_table, related_id, is_dismissed: bool):
+        """
+        Добавляет ключи рекомендации в множества для проверки дублей.
+        Ключ по связанной записи добавляется и с None вместо каждой части, чтобы проверка
+        без категории, таблицы или id оставалась одним поиском в множестве.
+        """
+        if title:
+            self._existing_titles.add((title, is_dismissed))
+        for key_category in {category, None}:
+            for key_table in {related_table, None}:
+                for key_id in {related_id, None}:
+                    self._existing_keys.add((key_category, key_table, key_id, is_dismissed))
+    
+    def _flush_recommendations(self) -> int:
+        """Записывает накопленные рекомендации одним пакетным INSERT и одним коммитом"""
+        pending, self._pending = self._pending, []
+        if pending:
+            self.db.execute(insert(Recommendation.__table__), pending)
+            self.db.commit()
+        return len(pending)
+    
     def _check_existing_recommendation(
         self, company_id: int, category: RecommendationCategory,
         related_table: str = None, related_id: int = None,
         is_dismissed: bool = False, title: str = None
     ) -> bool:
-        """Проверяет, существует ли уже такая рекомендация"""
-        query = self.db.query(Recommendation).filter(
-            Recommendation.company_id == company_id,
-            Recommendation.is_dismissed == is_dismissed
-        )
+        """Проверяет, существует ли уже такая рекомендация (по загруженным ключам)"""
+        if self._existing_company_id != company_id:
+            self._flush_recommendations()
+            self._load_existing(company_id)
         
         # Всегда проверяем по title (он уникален для каждой рекомендации)
         # Если title не передан, используем комбинацию category + related_table + related_id
         if title:
-            query = query.filter(Recommendation.title == title)
-        else:
-            # Без title проверяем по комбинации
-            if category:
-                query = query.filter(Recommendation.category == category)
-            if related_table:
-                query = query.filter(Recommendation.related_table == related_table)
-            if related_id:
-                query = query.filter(Recommendation.related_id == related_id)
-        
-        return query.first() is not None
+            return (title, is_dismissed) in self._existing_titles
+        return (category or None, related_table or None, related_id or None, is_dismissed) in self._existing_keys
     
     def _create_recommendation(
         self, company_id: int, type: RecommendationType,
@@ -116,39 +194,38 @@ class RecommendationService:
         meta_data: dict = None, related_table: str = None,
         related_id: int = None, user_id: int = None
     ):
-        """Создает рекомендацию, если она еще не существует"""
-        # Проверяем по title (уникален для каждой рекомендации)
-        # Временно упрощаем: проверяем только по title для избежания дублей
-        if title:
-            existing = self.db.query(Recommendation).filter(
-                Recommendation.company_id == company_id,
-                Recommendation.title == title,
-                Recommendation.is_dismissed == False
-            ).first()
-            if existing:
-                return False
-        
-        recommendation = Recommendation(
-            company_id=company_id,
-            user_id=user_id,
-            type=type,
-            category=category,
-            priority=priority,
-            title=title,
-            description=description,
-            action=action,
-            meta_data=meta_data,
-            related_table=related_table,
-            related_id=related_id
-        )
-        self.db.add(recommendation)
-        self.db.commit()
+        """
+        Добавляет рекомендацию в пакет записи, если она еще не существует.
+        Пакет записывается в _flush_recommendations (в конце generate_recommendations).
+        """
+        if self._existing_company_id != company_id:
+            self._flush_recommendations()
+            self._load_existing(company_id)
+        
+        # Проверяем по title (уникален для каждой рекомендации) среди активных и уже добавленных
+        if title and (title, False) in self._existing_titles:
+            return False
+        self._remember_keys(title, category, related_table, related_id, False)
+        
+        self._pending.append({
+            "company_id": company_id,
+            "user_id": user_id,
+            "type": type,
+            "category": category,
+            "priority": priority,
+            "title": title,
+            "description": description,
+            "action": action,
+            "meta_data": meta_data,
+            "related_table": related_table,
+            "related_id": related_id
+        })
         return True
     
     def _generate_margin_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по маржинальности товаров"""
         count = 0
-        products = self.db.query(Product).filter(Product.is_active == True).all()
+        products = self._get_snapshot(company_id).active_products
         
         for product in products:
             if product.cost_price and product.selling_price:
@@ -192,84 +269,77 @@ class RecommendationService:
         return count
     
     def _generate_expense_recommendations(self, company_id: int, user_id: int = None) -> int:
-        """Генерирует рекомендации по расходам"""
+        """Генерирует рекомендации по расходам: рост и аномальные суммы по статьям за последний месяц"""
         count = 0
-        today = date.today()
-        last_month = today - timedelta(days=30)
-        two_months_ago = today - timedelta(days=60)
-        
-        # Анализ роста расходов по статьям
-        expense_items = self.db.query(MoneyMovement.expense_item_id).filter(
-            MoneyMovement.movement_type == "expense",
-            MoneyMovement.company_id == company_id,
-            MoneyMovement.is_business == True
-        ).distinct().all()
+        snapshot = self._get_snapshot(company_id)
+        matrix = snapshot.expense_matrix
+        metrics = detect_anomalies(matrix)
+        
+        # Рост расходов по статьям к предыдущему месяцу (сначала самый сильный)
+        growth = metrics["growth_percent"]
+        growing = np.flatnonzero(growth > self.HIGH_EXPENSE_GROWTH)
+        for index in growing[np.argsort(-growth[growing])]:
+            expense_item_id = matrix.keys[index]
+            growth_percent = float(growth[index])
+            if self._create_recommendation(
+                company_id=company_id,
+                type=RecommendationType.FINANCIAL,
+                category=RecommendationCategory.EXPENSES,
+                priority=RecommendationPriority.IMPORTANT,
+                title=f"Высокий рост расходов",
+                description=f"Расходы по статье увеличились на {growth_percent:.1f}% за последний месяц.",
+                action="Проанализируйте причины роста расходов и рассмотрите возможность оптимизации.",
+                meta_data={"expense_item_id": expense_item_id, "growth_percent": growth_percent},
+                related_table="expense_items",
+                related_id=expense_item_id,
+                user_id=user_id
+            ):
+                count += 1
         
-        for (expense_item_id,) in expense_items:
-            if not expense_item_id:
-                continue
-            
-            # Сумма расходов за последний месяц
-            last_month_total = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                MoneyMovement.expense_item_id == expense_item_id,
-                MoneyMovement.company_id == company_id,
-                MoneyMovement.date >= last_month,
-                MoneyMovement.date < today
-            ).scalar() or 0
-            
-            # Сумма расходов за предыдущий месяц
-            prev_month_total = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                MoneyMovement.expense_item_id == expense_item_id,
-                MoneyMovement.company_id == company_id,
-                MoneyMovement.date >= two_months_ago,
-                MoneyMovement.date < last_month
-            ).scalar() or 0
-            
-            if prev_month_total > 0 and last_month_total > 0:
-                growth_percent = ((last_month_total - prev_month_total) / prev_month_total) * 100
-                
-                if growth_percent > self.HIGH_EXPENSE_GROWTH:
-                    if self._create_recommendation(
-                        company_id=company_id,
-                        type=RecommendationType.FINANCIAL,
-                        category=RecommendationCategory.EXPENSES,
-                        priority=RecommendationPriority.IMPORTANT,
-                        title=f"Высокий рост расходов",
-                        description=f"Расходы по статье увеличились на {growth_percent:.1f}% за последний месяц.",
-                        action="Проанализируйте причины роста расходов и рассмотрите возможность оптимизации.",
-                        meta_data={"expense_item_id": expense_item_id, "growth_percent": float(growth_percent)},
-                        related_table="expense_items",
-                        related_id=expense_item_id,
-                        user_id=user_id
-                    ):
-                        count += 1
+        # Статьи с аномально высокими расходами (с учетом сезонности или по медиане)
+        anomalous = np.flatnonzero((metrics["z_score"] > Z_THRESHOLD) | (metrics["mad_score"] > MAD_THRESHOLD))
+        severity = np.fmax(metrics["z_score"], metrics["mad_score"] / MAD_THRESHOLD * Z_THRESHOLD)
+        month = matrix.months[-1].strftime("%m.%Y") if matrix.months else ""
+        for index in anomalous[np.argsort(-severity[anomalous])][:self.MAX_ANOMALIES]:
+            expense_item_id = matrix.keys[index]
+            item = snapshot.expense_items.get(expense_item_id)
+            item_name = item.name if item else f"#{expense_item_id}"
+            if self._create_recommendation(
+                company_id=company_id,
+                type=RecommendationType.ANALYTICAL,
+                category=RecommendationCategory.ANOMALY,
+                priority=RecommendationPriority.IMPORTANT,
+                title=f"Аномальные расходы по статье '{item_name}'",
+                description=f"Расходы по статье '{item_name}' за {month} ({metrics['value'][index]:.0f} ₽) значительно выше обычного уровня (в среднем {metrics['mean'][index]:.0f} ₽ в месяц).",
+                action=f"Проверьте операции по статье '{item_name}' за {month}: разовые платежи, ошибки учета или рост цен поставщиков.",
+                meta_data={
+                    "expense_item_id": expense_item_id,
+                    "month": matrix.months[-1].isoformat(),
+                    "z_score": finite_or_none(metrics["z_score"][index]),
+                    "mad_score": finite_or_none(metrics["mad_score"][index])
+                },
+                related_table="expense_items",
+                related_id=expense_item_id,
+                user_id=user_id
+            ):
+                count += 1
         
         return count
     
     def _generate_cash_flow_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по денежным средствам"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         
         # Рассчитываем остаток денежных средств
-        total_income = self.db.query(func.sum(MoneyMovement.amount)).filter(
-            MoneyMovement.movement_type == "income",
-            MoneyMovement.company_id == company_id,
-            MoneyMovement.is_business == True
-        ).scalar() or 0
-        
-        total_expense = self.db.query(func.sum(MoneyMovement.amount)).filter(
-            MoneyMovement.movement_type == "expense",
-            MoneyMovement.company_id == company_id,
-            MoneyMovement.is_business == True
-        ).scalar() or 0
+        total_income = snapshot.money_total("income")
+        total_expense = snapshot.money_total("expense")
         
         cash_balance = total_income - total_expense
         
         # Рассчитываем средние ежедневные расходы
-        first_movement = self.db.query(func.min(MoneyMovement.date)).filter(
-            MoneyMovement.company_id == company_id
-        ).scalar()
+        first_movement = snapshot.first_movement_date
         
         if first_movement:
             days_count = (today - first_movement).days
@@ -312,24 +382,16 @@ class RecommendationService:
     def _generate_turnover_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по оборачиваемости товаров"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         cutoff_date = today - timedelta(days=self.SLOW_TURNOVER_DAYS)
         
         # Товары, которые не продавались долгое время
-        products_with_sales = self.db.query(Shipment.product_id).filter(
-            Shipment.company_id == company_id,
-            Shipment.date >= cutoff_date
-        ).distinct().all()
-        
-        products_with_sales_ids = [p[0] for p in products_with_sales]
-        
-        if products_with_sales_ids:
-            slow_products = self.db.query(Product).filter(
-                Product.is_active == True,
-                ~Product.id.in_(products_with_sales_ids)
-            ).all()
-        else:
-            slow_products = self.db.query(Product).filter(Product.is_active == True).all()
+        products_with_sales_ids = set(snapshot.shipments_by_product(cutoff_date, today))
+        slow_products = [
+            product for product in snapshot.active_products
+            if product.id not in products_with_sales_ids
+        ]
         
         for product in slow_products:
             if self._create_recommendation(
@@ -354,10 +416,10 @@ class RecommendationService:
         count = 0
         
         # Товары без цены продажи
-        products_without_price = self.db.query(Product).filter(
-            Product.is_active == True,
-            or_(Product.selling_price.is_(None), Product.selling_price == 0)
-        ).all()
+        products_without_price = [
+            product for product in self._get_snapshot(company_id).active_products
+            if not product.selling_price
+        ]
         
         for product in products_without_price:
             if self._create_recommendation(
@@ -380,22 +442,14 @@ class RecommendationService:
     def _generate_trend_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует аналитические рекомендации на основе трендов"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_month = today - timedelta(days=30)
         two_months_ago = today - timedelta(days=60)
         
         # Анализ динамики продаж
-        last_month_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-            Realization.company_id == company_id,
-            Realization.date >= last_month,
-            Realization.date < today
-        ).scalar() or 0
-        
-        prev_month_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-            Realization.company_id == company_id,
-            Realization.date >= two_months_ago,
-            Realization.date < last_month
-        ).scalar() or 0
+        last_month_revenue = snapshot.revenue(last_month, today - timedelta(days=1))
+        prev_month_revenue = snapshot.revenue(two_months_ago, last_month - timedelta(days=1))
         
         if prev_month_revenue > 0:
             revenue_change = ((last_month_revenue - prev_month_revenue) / prev_month_revenue) * 100
@@ -432,31 +486,18 @@ class RecommendationService:
     def _generate_profitability_analysis(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации на основе анализа рентабельности"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_3_months = today - timedelta(days=90)
         
         # Выручка за последние 3 месяца
-        revenue = self.db.query(func.sum(Realization.revenue)).filter(
-            Realization.company_id == company_id,
-            Realization.date >= last_3_months,
-            Realization.date <= today
-        ).scalar() or 0
+        revenue = snapshot.revenue(last_3_months, today)
         
         # Себестоимость
-        cost_of_goods = self.db.query(func.sum(Shipment.cost_price * Shipment.quantity)).filter(
-            Shipment.company_id == company_id,
-            Shipment.date >= last_3_months,
-            Shipment.date <= today
-        ).scalar() or 0
+        cost_of_goods = snapshot.shipment_cost(last_3_months, today)
         
         # Расходы
-        expenses = self.db.query(func.sum(MoneyMovement.amount)).filter(
-            MoneyMovement.movement_type == "expense",
-            MoneyMovement.company_id == company_id,
-            MoneyMovement.date >= last_3_months,
-            MoneyMovement.date <= today,
-            MoneyMovement.is_business == True
-        ).scalar() or 0
+        expenses = snapshot.money("expense", last_3_months, today)
         
         if revenue > 0:
             # Валовая рентабельность
@@ -514,27 +555,20 @@ class RecommendationService:
     def _generate_product_performance_analysis(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации на основе анализа эффективности товаров"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_90_days = today - timedelta(days=90)
         
         # Анализ продаж по товарам за последние 90 дней
-        product_sales = self.db.query(
-            Shipment.product_id,
-            func.sum(Shipment.quantity).label('total_quantity'),
-            func.sum(Shipment.cost_price * Shipment.quantity).label('total_cost')
-        ).filter(
-            Shipment.company_id == company_id,
-            Shipment.date >= last_90_days,
-            Shipment.date <= today
-        ).group_by(Shipment.product_id).all()
+        product_sales = snapshot.shipments_by_product(last_90_days, today)
         
         if product_sales:
             # Находим товары с наименьшими продажами
-            sorted_sales = sorted(product_sales, key=lambda x: float(x.total_quantity or 0))
+            sorted_sales = sorted(product_sales.items(), key=lambda x: float(x[1]["total_quantity"] or 0))
             bottom_20_percent = sorted_sales[:max(1, len(sorted_sales) // 5)]
             
-            for product_sale in bottom_20_percent:
-                product = self.db.query(Product).filter(Product.id == product_sale.product_id).first()
+            for product_id, product_sale in bottom_20_percent:
+                product = snapshot.products.get(product_id)
                 if product and product.is_active:
                     if self._create_recommendation(
                         company_id=company_id,
@@ -542,9 +576,9 @@ class RecommendationService:
                         category=RecommendationCategory.PRODUCT,
                         priority=RecommendationPriority.IMPORTANT,
                         title=f"Товар '{product.name}' в числе наименее продаваемых",
-                        description=f"Товар '{product.name}' находится в нижних 20% по продажам за последние 90 дней ({product_sale.total_quantity or 0} единиц).",
+                        description=f"Товар '{product.name}' находится в нижних 20% по продажам за последние 90 дней ({product_sale['total_quantity'] or 0} единиц).",
                         action=f"Рассмотрите возможность акций, улучшения позиционирования или прекращения продаж товара '{product.name}'.",
-                        meta_data={"product_id": product.id, "sales_quantity": float(product_sale.total_quantity or 0)},
+                        meta_data={"product_id": product.id, "sales_quantity": float(product_sale["total_quantity"] or 0)},
                         related_table="products",
                         related_id=product.id,
                         user_id=user_id
@@ -554,106 +588,84 @@ class RecommendationService:
         return count
     
     def _generate_statistical_anomalies(self, company_id: int, user_id: int = None) -> int:
-        """Выявляет аномалии в данных на основе статистического анализа"""
+        """Выявляет аномалии выручки и продаж товаров за последний завершенный месяц"""
         count = 0
-        today = date.today()
-        last_6_months = today - timedelta(days=180)
-        
-        # Собираем месячные данные о выручке за последние 6 месяцев
-        monthly_revenues = []
-        current = last_6_months.replace(day=1)
+        snapshot = self._get_snapshot(company_id)
+        
+        # Общая выручка: падение более чем на 2 стандартных отклонения с учетом сезонности
+        revenue = snapshot.revenue_matrix
+        metrics = detect_anomalies(revenue)
+        if revenue.keys and metrics["z_score"][0] < -Z_THRESHOLD:
+            z_score = float(metrics["z_score"][0])
+            last_month_revenue = float(metrics["value"][0])
+            avg_revenue = float(metrics["mean"][0])
+            if self._create_recommendation(
+                company_id=company_id,
+                type=RecommendationType.ANALYTICAL,
+                category=RecommendationCategory.ANOMALY,
+                priority=RecommendationPriority.CRITICAL,
+                title="Аномальное падение выручки",
+                description=f"Выручка за {revenue.months[-1].strftime('%m.%Y')} ({last_month_revenue:.0f} ₽) отклоняется от среднего значения более чем на 2 стандартных отклонения с учетом сезонности. Это статистически значимое отклонение.",
+                action="Проанализируйте причины аномального падения и примите срочные меры по восстановлению продаж.",
+                meta_data={"z_score": z_score, "avg_revenue": avg_revenue, "last_revenue": last_month_revenue},
+                user_id=user_id
+            ):
+                count += 1
         
-        while current <= today:
-            month_end = (current + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-            if month_end > today:
-                month_end = today
-            
-            month_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-                Realization.company_id == company_id,
-                Realization.date >= current,
-                Realization.date <= month_end
-            ).scalar() or 0
-            
-            if month_revenue > 0:
-                monthly_revenues.append(float(month_revenue))
-            
-            if current.month == 12:
-                current = current.replace(year=current.year + 1, month=1)
-            else:
-                current = current.replace(month=current.month + 1)
-        
-        if len(monthly_revenues) >= 3:
-            # Вычисляем среднее и стандартное отклонение
-            avg_revenue = sum(monthly_revenues) / len(monthly_revenues)
-            variance = sum((x - avg_revenue) ** 2 for x in monthly_revenues) / len(monthly_revenues)
-            std_dev = variance ** 0.5
-            
-            # Последний месяц
-            last_month_revenue = monthly_revenues[-1]
-            
-            # Выявляем аномалии (отклонение более 2 стандартных отклонений)
-            if std_dev > 0:
-                z_score = (last_month_revenue - avg_revenue) / std_dev
-                
-                if abs(z_score) > 2:
-                    if z_score < -2:  # Сильное падение
-                        if self._create_recommendation(
-                            company_id=company_id,
-                            type=RecommendationType.ANALYTICAL,
-                            category=RecommendationCategory.ANOMALY,
-                            priority=RecommendationPriority.CRITICAL,
-                            title="Аномальное падение выручки",
-                            description=f"Выручка в текущем месяце ({last_month_revenue:.0f} ₽) отклоняется от среднего значения более чем на 2 стандартных отклонения. Это статистически значимое отклонение.",
-                            action="Проанализируйте причины аномального падения и примите срочные меры по восстановлению продаж.",
-                            meta_data={"z_score": float(z_score), "avg_revenue": float(avg_revenue), "last_revenue": float(last_month_revenue)},
-                            user_id=user_id
-                        ):
-                            count += 1
+        # Товары с аномальным падением продаж
+        products = snapshot.product_matrix
+        metrics = detect_anomalies(products)
+        dropped = np.flatnonzero((metrics["z_score"] < -Z_THRESHOLD) | (metrics["mad_score"] < -MAD_THRESHOLD))
+        severity = np.fmin(metrics["z_score"], metrics["mad_score"] / MAD_THRESHOLD * Z_THRESHOLD)
+        month = products.months[-1].strftime("%m.%Y") if products.months else ""
+        reported = 0
+        for index in dropped[np.argsort(severity[dropped])]:
+            if reported >= self.MAX_ANOMALIES:
+                break
+            product = snapshot.products.get(products.keys[index])
+            if not product or not product.is_active:
+                continue
+            reported += 1
+            if self._create_recommendation(
+                company_id=company_id,
+                type=RecommendationType.ANALYTICAL,
+                category=RecommendationCategory.ANOMALY,
+                priority=RecommendationPriority.IMPORTANT,
+                title=f"Аномальное падение продаж товара '{product.name}'",
+                description=f"Продажи товара '{product.name}' за {month} ({metrics['value'][index]:.0f} ₽) значительно ниже обычного уровня (в среднем {metrics['mean'][index]:.0f} ₽ в месяц).",
+                action=f"Проверьте наличие товара '{product.name}' на складах и маркетплейсах, цены и активность конкурентов.",
+                meta_data={
+                    "product_id": product.id,
+                    "month": products.months[-1].isoformat(),
+                    "z_score": finite_or_none(metrics["z_score"][index]),
+                    "mad_score": finite_or_none(metrics["mad_score"][index])
+                },
+                related_table="products",
+                related_id=product.id,
+                user_id=user_id
+            ):
+                count += 1
         
         return count
     
     def _generate_period_comparison_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации на основе сравнения периодов"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         
         # Сравнение текущего квартала с предыдущим
-        current_quarter_start = date(today.year, ((today.month - 1) // 3) * 3 + 1, 1)
-        prev_quarter_start = date(current_quarter_start.year, current_quarter_start.month - 3, 1) if current_quarter_start.month > 3 else date(current_quarter_start.year - 1, 10, 1)
-        prev_quarter_end = (current_quarter_start - timedelta(days=1))
-        
-        # Выручка текущего квартала
-        current_quarter_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-            Realization.company_id == company_id,
-            Realization.date >= current_quarter_start,
-            Realization.date <= today
-        ).scalar() or 0
-        
-        # Выручка предыдущего квартала
-        prev_quarter_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-            Realization.company_id == company_id,
-            Realization.date >= prev_quarter_start,
-            Realization.date <= prev_quarter_end
-        ).scalar() or 0
+        current_quarter_start = quarter_start(today)
+        prev_quarter_start, prev_quarter_end = previous_quarter(today)
+        
+        # Выручка текущего и предыдущего квартала
+        current_quarter_revenue = snapshot.revenue(current_quarter_start, today)
+        prev_quarter_revenue = snapshot.revenue(prev_quarter_start, prev_quarter_end)
         
         if prev_quarter_revenue > 0:
-            # Расходы текущего квартала
-            current_quarter_expenses = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                MoneyMovement.movement_type == "expense",
-                MoneyMovement.company_id == company_id,
-                MoneyMovement.date >= current_quarter_start,
-                MoneyMovement.date <= today,
-                MoneyMovement.is_business == True
-            ).scalar() or 0
-            
-            # Расходы предыдущего квартала
-            prev_quarter_expenses = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                MoneyMovement.movement_type == "expense",
-                MoneyMovement.company_id == company_id,
-                MoneyMovement.date >= prev_quarter_start,
-                MoneyMovement.date <= prev_quarter_end,
-                MoneyMovement.is_business == True
-            ).scalar() or 0
+            # Расходы текущего и предыдущего квартала
+            current_quarter_expenses = snapshot.money("expense", current_quarter_start, today)
+            prev_quarter_expenses = snapshot.money("expense", prev_quarter_start, prev_quarter_end)
             
             revenue_change = ((current_quarter_revenue - prev_quarter_revenue) / prev_quarter_revenue) * 100
             expenses_change = ((current_quarter_expenses - prev_quarter_expenses) / prev_quarter_expenses) * 100 if prev_quarter_expenses > 0 else 0
@@ -678,33 +690,25 @@ class RecommendationService:
     def _generate_sales_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по продажам и каналам продаж"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_month = today - timedelta(days=30)
         two_months_ago = today - timedelta(days=60)
         last_90_days = today - timedelta(days=90)
         
         # Анализ эффективности каналов продаж
-        channel_sales = self.db.query(
-            Realization.sales_channel_id,
-            func.sum(Realization.revenue).label('total_revenue'),
-            func.sum(Realization.quantity).label('total_quantity'),
-            func.count(Realization.id).label('transaction_count')
-        ).filter(
-            Realization.company_id == company_id,
-            Realization.date >= last_90_days,
-            Realization.date <= today
-        ).group_by(Realization.sales_channel_id).all()
+        channel_sales = snapshot.channel_sales(last_90_days, today)
         
         if len(channel_sales) > 1:
             # Находим каналы с низкими продажами
-            total_revenue = sum(float(sale.total_revenue or 0) for sale in channel_sales)
+            total_revenue = sum(float(sale["total_revenue"] or 0) for sale in channel_sales)
             avg_revenue_per_channel = total_revenue / len(channel_sales) if len(channel_sales) > 0 else 0
             
             for sale in channel_sales:
-                channel_revenue = float(sale.total_revenue or 0)
+                channel_revenue = float(sale["total_revenue"] or 0)
                 if channel_revenue > 0 and channel_revenue < avg_revenue_per_channel * 0.5:
                     # Канал продаж работает менее чем на 50% от среднего
-                    channel = self.db.query(SalesChannel).filter(SalesChannel.id == sale.sales_channel_id).first()
+                    channel = snapshot.sales_channels.get(sale["sales_channel_id"])
                     if channel:
                         if self._create_recommendation(
                             company_id=company_id,
@@ -723,31 +727,19 @@ class RecommendationService:
         
         # Анализ динамики продаж по каналам
         for sale in channel_sales:
-            channel_id = sale.sales_channel_id
+            channel_id = sale["sales_channel_id"]
             if not channel_id:
                 continue
             
-            # Продажи за последний месяц
-            last_month_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-                Realization.company_id == company_id,
-                Realization.sales_channel_id == channel_id,
-                Realization.date >= last_month,
-                Realization.date < today
-            ).scalar() or 0
-            
-            # Продажи за предыдущий месяц
-            prev_month_revenue = self.db.query(func.sum(Realization.revenue)).filter(
-                Realization.company_id == company_id,
-                Realization.sales_channel_id == channel_id,
-                Realization.date >= two_months_ago,
-                Realization.date < last_month
-            ).scalar() or 0
+            # Продажи за последний и предыдущий месяц
+            last_month_revenue = snapshot.revenue(last_month, today - timedelta(days=1), channel_id)
+            prev_month_revenue = snapshot.revenue(two_months_ago, last_month - timedelta(days=1), channel_id)
             
             if prev_month_revenue > 0 and last_month_revenue > 0:
                 change_percent = ((last_month_revenue - prev_month_revenue) / prev_month_revenue) * 100
                 
                 if change_percent < -30:  # Падение более чем на 30%
-                    channel = self.db.query(SalesChannel).filter(SalesChannel.id == channel_id).first()
+                    channel = snapshot.sales_channels.get(channel_id)
                     if channel:
                         if self._create_recommendation(
                             company_id=company_id,
@@ -765,24 +757,16 @@ class RecommendationService:
                             count += 1
         
         # Анализ товаров с низкими продажами в реализации
-        product_sales = self.db.query(
-            RealizationItem.product_id,
-            func.sum(RealizationItem.quantity).label('total_quantity'),
-            func.sum(RealizationItem.price * RealizationItem.quantity).label('total_revenue')
-        ).join(Realization).filter(
-            Realization.company_id == company_id,
-            Realization.date >= last_90_days,
-            Realization.date <= today
-        ).group_by(RealizationItem.product_id).all()
+        product_sales = snapshot.item_sales_by_product(last_90_days, today)
         
         if product_sales:
-            sorted_sales = sorted(product_sales, key=lambda x: float(x.total_revenue or 0))
+            sorted_sales = sorted(product_sales.items(), key=lambda x: float(x[1]["total_revenue"] or 0))
             bottom_products = sorted_sales[:max(1, len(sorted_sales) // 5)]
             
-            for product_sale in bottom_products:
-                product = self.db.query(Product).filter(Product.id == product_sale.product_id).first()
+            for product_id, product_sale in bottom_products:
+                product = snapshot.products.get(product_id)
                 if product and product.is_active:
-                    revenue = float(product_sale.total_revenue or 0)
+                    revenue = float(product_sale["total_revenue"] or 0)
                     if revenue > 0:  # Только если были продажи
                         if self._create_recommendation(
                             company_id=company_id,
@@ -804,12 +788,11 @@ class RecommendationService:
     def _generate_budget_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по бюджету"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         
         # Получаем все активные бюджеты
-        budgets = self.db.query(Budget).filter(
-            Budget.company_id == company_id
-        ).all()
+        budgets = snapshot.budgets
         
         for budget in budgets:
             try:
@@ -845,47 +828,17 @@ class RecommendationService:
                 if end_date < today or start_date > today:
                     continue
                 
-                # Рассчитываем фактические суммы
+                # Рассчитываем фактические суммы (по статье бюджета или общие)
                 if budget.budget_type == BudgetType.INCOME:
-                    # Для доходов
-                    if budget.income_item_id:
-                        actual = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                            MoneyMovement.movement_type == "income",
-                            MoneyMovement.company_id == company_id,
-                            MoneyMovement.income_item_id == budget.income_item_id,
-                            MoneyMovement.date >= start_date,
-                            MoneyMovement.date <= min(end_date, today),
-                            MoneyMovement.is_business == True
-                        ).scalar() or 0
-                    else:
-                        # Общий доход
-                        actual = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                            MoneyMovement.movement_type == "income",
-                            MoneyMovement.company_id == company_id,
-                            MoneyMovement.date >= start_date,
-                            MoneyMovement.date <= min(end_date, today),
-                            MoneyMovement.is_business == True
-                        ).scalar() or 0
+                    actual = snapshot.money(
+                        "income", start_date, min(end_date, today),
+                        income_item_id=budget.income_item_id or None
+                    )
                 else:
-                    # Для расходов
-                    if budget.expense_item_id:
-                        actual = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                            MoneyMovement.movement_type == "expense",
-                            MoneyMovement.company_id == company_id,
-                            MoneyMovement.expense_item_id == budget.expense_item_id,
-                            MoneyMovement.date >= start_date,
-                            MoneyMovement.date <= min(end_date, today),
-                            MoneyMovement.is_business == True
-                        ).scalar() or 0
-                    else:
-                        # Общий расход
-                        actual = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                            MoneyMovement.movement_type == "expense",
-                            MoneyMovement.company_id == company_id,
-                            MoneyMovement.date >= start_date,
-                            MoneyMovement.date <= min(end_date, today),
-                            MoneyMovement.is_business == True
-                        ).scalar() or 0
+                    actual = snapshot.money(
+                        "expense", start_date, min(end_date, today),
+                        expense_item_id=budget.expense_item_id or None
+                    )
                 
                 planned = float(budget.planned_amount)
                 actual_float = float(actual)
@@ -898,7 +851,7 @@ class RecommendationService:
                     if budget.budget_type == BudgetType.EXPENSE and deviation_percent > 10:
                         item_name = "расходов"
                         if budget.expense_item_id:
-                            expense_item = self.db.query(ExpenseItem).filter(ExpenseItem.id == budget.expense_item_id).first()
+                            expense_item = snapshot.expense_items.get(budget.expense_item_id)
                             if expense_item:
                                 item_name = f"расходов по статье '{expense_item.name}'"
                         
@@ -921,7 +874,7 @@ class RecommendationService:
                     elif budget.budget_type == BudgetType.INCOME and deviation_percent < -15:
                         item_name = "доходов"
                         if budget.income_item_id:
-                            income_item = self.db.query(IncomeItem).filter(IncomeItem.id == budget.income_item_id).first()
+                            income_item = snapshot.income_items.get(budget.income_item_id)
                             if income_item:
                                 item_name = f"доходов по статье '{income_item.name}'"
                         
@@ -948,47 +901,20 @@ class RecommendationService:
     def _generate_assets_liabilities_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по активам и пассивам"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         
         # Суммируем активы по категориям
-        current_assets = self.db.query(func.sum(Asset.value)).filter(
-            Asset.company_id == company_id,
-            Asset.category == "current",
-            Asset.date <= today
-        ).scalar() or 0
-        
-        receivable_assets = self.db.query(func.sum(Asset.value)).filter(
-            Asset.company_id == company_id,
-            Asset.category == "receivable",
-            Asset.date <= today
-        ).scalar() or 0
-        
-        fixed_assets = self.db.query(func.sum(Asset.value)).filter(
-            Asset.company_id == company_id,
-            Asset.category == "fixed",
-            Asset.date <= today
-        ).scalar() or 0
+        current_assets = snapshot.asset_total("current")
+        receivable_assets = snapshot.asset_total("receivable")
+        fixed_assets = snapshot.asset_total("fixed")
         
         total_assets = float(current_assets) + float(receivable_assets) + float(fixed_assets)
         
         # Суммируем обязательства
-        short_term_liabilities = self.db.query(func.sum(Liability.value)).filter(
-            Liability.company_id == company_id,
-            Liability.category == "short_term",
-            Liability.date <= today
-        ).scalar() or 0
-        
-        payable_liabilities = self.db.query(func.sum(Liability.value)).filter(
-            Liability.company_id == company_id,
-            Liability.category == "payable",
-            Liability.date <= today
-        ).scalar() or 0
-        
-        long_term_liabilities = self.db.query(func.sum(Liability.value)).filter(
-            Liability.company_id == company_id,
-            Liability.category == "long_term",
-            Liability.date <= today
-        ).scalar() or 0
+        short_term_liabilities = snapshot.liability_total("short_term")
+        payable_liabilities = snapshot.liability_total("payable")
+        long_term_liabilities = snapshot.liability_total("long_term")
         
         total_liabilities = float(short_term_liabilities) + float(payable_liabilities) + float(long_term_liabilities)
         
@@ -1033,11 +959,7 @@ class RecommendationService:
         if float(receivable_assets) > 0:
             # Сравниваем с выручкой за последние 3 месяца
             last_3_months = today - timedelta(days=90)
-            revenue = self.db.query(func.sum(Realization.revenue)).filter(
-                Realization.company_id == company_id,
-                Realization.date >= last_3_months,
-                Realization.date <= today
-            ).scalar() or 0
+            revenue = snapshot.revenue(last_3_months, today)
             
             if float(revenue) > 0:
                 receivable_to_revenue_ratio = (float(receivable_assets) / float(revenue)) * 100
@@ -1062,19 +984,15 @@ class RecommendationService:
     def _generate_inventory_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по складам и остаткам"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_90_days = today - timedelta(days=90)
         
         # Анализ остатков товаров на складах
-        # Фильтруем через Warehouse, так как Product не имеет company_id
-        inventory_items = self.db.query(Inventory).join(
-            Product, Inventory.product_id == Product.id
-        ).join(
-            Warehouse, Inventory.warehouse_id == Warehouse.id
-        ).filter(
-            Warehouse.company_id == company_id,
-            Product.is_active == True
-        ).all()
+        inventory_items = snapshot.inventory_items
+        # Продажи по товарам за последние 90 дней (и с учетом реализаций будущими датами)
+        sales_to_date = snapshot.item_sales_by_product(last_90_days, today)
+        sales_since = snapshot.item_sales_by_product(last_90_days)
         
         for inv in inventory_items:
             quantity = float(inv.quantity or 0)
@@ -1087,9 +1005,9 @@ class RecommendationService:
                     type=RecommendationType.OPERATIONAL,
                     category=RecommendationCategory.PRODUCT,
                     priority=RecommendationPriority.IMPORTANT,
-                    title=f"Низкий остаток товара '{inv.product.name}' на складе",
-                    description=f"Остаток товара '{inv.product.name}' на складе ({quantity:.0f}) ниже минимального уровня ({min_stock:.0f}).",
-                    action=f"Необходимо пополнить остаток товара '{inv.product.name}' для обеспечения бесперебойных продаж.",
+                    title=f"Низкий остаток товара '{inv.product_name}' на складе",
+                    description=f"Остаток товара '{inv.product_name}' на складе ({quantity:.0f}) ниже минимального уровня ({min_stock:.0f}).",
+                    action=f"Необходимо пополнить остаток товара '{inv.product_name}' для обеспечения бесперебойных продаж.",
                     meta_data={"product_id": inv.product_id, "warehouse_id": inv.warehouse_id, "quantity": quantity, "min_stock": min_stock},
                     related_table="inventory",
                     related_id=inv.id,
@@ -1098,15 +1016,9 @@ class RecommendationService:
                     count += 1
             
             # Избыточный остаток (более 180 дней оборачиваемости)
-            if quantity > 0 and inv.product.selling_price:
+            if quantity > 0 and inv.selling_price:
                 # Рассчитываем общее количество продаж за последние 90 дней
-                total_sales = self.db.query(func.sum(RealizationItem.quantity)).filter(
-                    RealizationItem.product_id == inv.product_id
-                ).join(Realization).filter(
-                    Realization.company_id == company_id,
-                    Realization.date >= last_90_days,
-                    Realization.date <= today
-                ).scalar() or 0
+                total_sales = sales_to_date.get(inv.product_id, {}).get("total_quantity", 0)
                 
                 if total_sales and float(total_sales) > 0:
                     avg_daily_sales = float(total_sales) / 90
@@ -1118,9 +1030,9 @@ class RecommendationService:
                             type=RecommendationType.OPERATIONAL,
                             category=RecommendationCategory.TURNOVER,
                             priority=RecommendationPriority.IMPORTANT,
-                            title=f"Избыточный остаток товара '{inv.product.name}'",
-                            description=f"Остаток товара '{inv.product.name}' на складе достаточен на {days_of_stock:.0f} дней при текущих темпах продаж, что указывает на избыточные запасы.",
-                            action=f"Рассмотрите возможность проведения распродажи или снижения закупок товара '{inv.product.name}' для оптимизации оборотных средств.",
+                            title=f"Избыточный остаток товара '{inv.product_name}'",
+                            description=f"Остаток товара '{inv.product_name}' на складе достаточен на {days_of_stock:.0f} дней при текущих темпах продаж, что указывает на избыточные запасы.",
+                            action=f"Рассмотрите возможность проведения распродажи или снижения закупок товара '{inv.product_name}' для оптимизации оборотных средств.",
                             meta_data={"product_id": inv.product_id, "warehouse_id": inv.warehouse_id, "quantity": quantity, "days_of_stock": float(days_of_stock)},
                             related_table="inventory",
                             related_id=inv.id,
@@ -1130,11 +1042,7 @@ class RecommendationService:
             
             # Товары без продаж, но с остатками
             if quantity > 0:
-                has_sales = self.db.query(RealizationItem).join(Realization).filter(
-                    RealizationItem.product_id == inv.product_id,
-                    Realization.company_id == company_id,
-                    Realization.date >= last_90_days
-                ).first()
+                has_sales = inv.product_id in sales_since
                 
                 if not has_sales:
                     if self._create_recommendation(
@@ -1142,9 +1050,9 @@ class RecommendationService:
                         type=RecommendationType.OPERATIONAL,
                         category=RecommendationCategory.TURNOVER,
                         priority=RecommendationPriority.IMPORTANT,
-                        title=f"Товар '{inv.product.name}' не продавался, но есть остатки",
-                        description=f"Товар '{inv.product.name}' имеет остаток на складе ({quantity:.0f} единиц), но не продавался за последние 90 дней.",
-                        action=f"Рассмотрите возможность распродажи или списания неликвидного товара '{inv.product.name}'.",
+                        title=f"Товар '{inv.product_name}' не продавался, но есть остатки",
+                        description=f"Товар '{inv.product_name}' имеет остаток на складе ({quantity:.0f} единиц), но не продавался за последние 90 дней.",
+                        action=f"Рассмотрите возможность распродажи или списания неликвидного товара '{inv.product_name}'.",
                         meta_data={"product_id": inv.product_id, "warehouse_id": inv.warehouse_id, "quantity": quantity},
                         related_table="inventory",
                         related_id=inv.id,
@@ -1157,15 +1065,13 @@ class RecommendationService:
     def _generate_customers_suppliers_recommendations(self, company_id: int, user_id: int = None) -> int:
         """Генерирует рекомендации по клиентам и поставщикам"""
         count = 0
-        today = date.today()
+        snapshot = self._get_snapshot(company_id)
+        today = snapshot.today
         last_90_days = today - timedelta(days=90)
         last_180_days = today - timedelta(days=180)
         
         # Анализ клиентов
-        customers = self.db.query(Customer).filter(
-            Customer.company_id == company_id,
-            Customer.is_active == True
-        ).all()
+        customers = snapshot.active_customers
         
         # Клиенты без покупок более 90 дней
         for customer in customers:
@@ -1189,22 +1095,11 @@ class RecommendationService:
                         count += 1
         
         # Анализ дебиторской задолженности через активы
-        receivable_assets = self.db.query(Asset).filter(
-            Asset.company_id == company_id,
-            Asset.category == "receivable",
-            Asset.date <= today
-        ).all()
-        
-        # Группируем по клиентам (если есть связь через имя или метаданные)
-        total_receivable = sum(float(asset.value) for asset in receivable_assets)
+        total_receivable = float(snapshot.asset_total("receivable"))
         
         if total_receivable > 0:
             # Сравниваем с выручкой
-            revenue = self.db.query(func.sum(Realization.revenue)).filter(
-                Realization.company_id == company_id,
-                Realization.date >= last_180_days,
-                Realization.date <= today
-            ).scalar() or 0
+            revenue = snapshot.revenue(last_180_days, today)
             
             if float(revenue) > 0:
                 receivable_ratio = (total_receivable / float(revenue)) * 100
@@ -1224,10 +1119,7 @@ class RecommendationService:
                         count += 1
         
         # Анализ поставщиков
-        suppliers = self.db.query(Supplier).filter(
-            Supplier.company_id == company_id,
-            Supplier.is_active == True
-        ).all()
+        suppliers = snapshot.active_suppliers
         
         # Поставщики с низким рейтингом
         for supplier in suppliers:
@@ -1248,23 +1140,11 @@ class RecommendationService:
                     count += 1
         
         # Анализ кредиторской задолженности через обязательства
-        payable_liabilities = self.db.query(Liability).filter(
-            Liability.company_id == company_id,
-            Liability.category == "payable",
-            Liability.date <= today
-        ).all()
-        
-        total_payable = sum(float(liability.value) for liability in payable_liabilities)
+        total_payable = float(snapshot.liability_total("payable"))
         
         if total_payable > 0:
             # Сравниваем с расходами за последние 3 месяца
-            expenses = self.db.query(func.sum(MoneyMovement.amount)).filter(
-                MoneyMovement.movement_type == "expense",
-                MoneyMovement.company_id == company_id,
-                MoneyMovement.date >= last_90_days,
-                MoneyMovement.date <= today,
-                MoneyMovement.is_business == True
-            ).scalar() or 0
+            expenses = snapshot.money("expense", last_90_days, today)
             
             if float(expenses) > 0:
                 payable_ratio = (total_payable / float(expenses)) * 100
@@ -0,0 +1,357 @@
+"""
+Снимок показателей компании для генерации рекомендаций
+
+Снимок строится один раз на компанию за запуск генерации: выручка, движения денег,
+отгрузки и продажи по товарам загружаются несколькими сгруппированными запросами
+(по дням, каналам, статьям и товарам), а суммы за любые периоды внутри горизонта
+считаются в памяти. Справочники (товары, бюджеты, остатки, клиенты, поставщики)
+и месячные матрицы для поиска аномалий загружаются при первом обращении.
+"""
+from datetime import date, timedelta
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.product import Product
+from app.models.input1 import MoneyMovement
+from app.models.realization import Realization, RealizationItem
+from app.models.shipment import Shipment
+from app.models.input2 import Asset, Liability
+from app.models.budget import Budget
+from app.models.inventory import Inventory
+from app.models.warehouse import Warehouse
+from app.models.customer import Customer
+from app.models.supplier import Supplier
+from app.models.reference import SalesChannel, ExpenseItem, IncomeItem
+from app.services.anomaly_detection import (
+    SeriesMatrix, load_expense_matrix, load_product_matrix, load_revenue_matrix
+)
+
+# Глубина детальных данных снимка (дней); горизонт дополнительно расширяется
+# до начала года и предыдущего квартала
+SNAPSHOT_DAYS = 180
+# Период анализа продаж по товарам (дней)
+PRODUCT_SALES_DAYS = 90
+
+def quarter_start(day: date) -> date:
+    """Первый день квартала"""
+    return date(day.year, ((day.month - 1) // 3) * 3 + 1, 1)
+
+def previous_quarter(day: date) -> Tuple[date, date]:
+    """Начало и конец квартала, предшествующего кварталу даты"""
+    current_start = quarter_start(day)
+    if current_start.month > 3:
+        start = date(current_start.year, current_start.month - 3, 1)
+    else:
+        start = date(current_start.year - 1, 10, 1)
+    return start, current_start - timedelta(days=1)
+
+def _sum(values):
+    """Сумма как у SQL SUM(...) or 0: Decimal для непустого набора, иначе 0"""
+    total = 0
+    for value in values:
+        total += value or 0
+    return total
+
+class CompanyMetricsSnapshot:
+    """Показатели одной компании на дату today (см. описание модуля)"""
+
+    def __init__(self, db: Session, company_id: int, today: date = None):
+        self.db = db
+        self.company_id = company_id
+        self.today = today or date.today()
+        self.horizon = min(
+            date(self.today.year, 1, 1),
+            (self.today - timedelta(days=SNAPSHOT_DAYS)).replace(day=1),
+            previous_quarter(self.today)[0]
+        )
+        self.product_sales_start = self.today - timedelta(days=PRODUCT_SALES_DAYS)
+        self._load_series()
+        self._load_balances()
+
+    def _load_series(self):
+        """Дневные ряды выручки, движений денег, отгрузок и продаж по товарам"""
+        company_id = self.company_id
+
+        # Выручка по дням и каналам продаж
+        self.revenue_rows = self.db.query(
+            Realization.date,
+            Realization.sales_channel_id,
+            func.sum(Realization.revenue).label('revenue'),
+            func.sum(Realization.quantity).label('quantity'),
+            func.count(Realization.id).label('transactions')
+        ).filter(
+            Realization.company_id == company_id,
+            Realization.date >= self.horizon,
+            Realization.date <= self.today
+        ).group_by(Realization.date, Realization.sales_channel_id).all()
+
+        # Движения денег по дням, типам и статьям
+        self.money_rows = self.db.query(
+            MoneyMovement.date,
+            MoneyMovement.movement_type,
+            MoneyMovement.is_business,
+            MoneyMovement.expense_item_id,
+            MoneyMovement.income_item_id,
+            func.sum(MoneyMovement.amount).label('amount')
+        ).filter(
+            MoneyMovement.company_id == company_id,
+            MoneyMovement.date >= self.horizon,
+            MoneyMovement.date <= self.today
+        ).group_by(
+            MoneyMovement.date,
+            MoneyMovement.movement_type,
+            MoneyMovement.is_business,
+            MoneyMovement.expense_item_id,
+            MoneyMovement.income_item_id
+        ).all()
+
+        # Итоги движений денег за все время (для остатка и статей расходов)
+        self.money_total_rows = self.db.query(
+            MoneyMovement.movement_type,
+            MoneyMovement.is_business,
+            MoneyMovement.expense_item_id,
+            func.sum(MoneyMovement.amount).label('amount'),
+            func.min(MoneyMovement.date).label('first_date')
+        ).filter(
+            MoneyMovement.company_id == company_id
+        ).group_by(
+            MoneyMovement.movement_type,
+            MoneyMovement.is_business,
+            MoneyMovement.expense_item_id
+        ).all()
+
+        # Отгрузки по дням и товарам
+        self.shipment_rows = self.db.query(
+            Shipment.date,
+            Shipment.product_id,
+            func.sum(Shipment.quantity).label('quantity'),
+            func.sum(Shipment.cost_price * Shipment.quantity).label('cost')
+        ).filter(
+            Shipment.company_id == company_id,
+            Shipment.date >= self.horizon,
+            Shipment.date <= self.today
+        ).group_by(Shipment.date, Shipment.product_id).all()
+
+        # Продажи по товарам (позиции реализаций); без верхней границы даты,
+        # чтобы учитывались и реализации, проведенные будущей датой
+        self.item_rows = self.db.query(
+            Realization.date,
+            RealizationItem.product_id,
+            func.sum(RealizationItem.quantity).label('quantity'),
+            func.sum(RealizationItem.price * RealizationItem.quantity).label('revenue')
+        ).join(Realization).filter(
+            Realization.company_id == company_id,
+            Realization.date >= self.product_sales_start
+        ).group_by(Realization.date, RealizationItem.product_id).all()
+
+    def _load_balances(self):
+        """Суммы активов и пассивов по категориям на дату"""
+        asset_rows = self.db.query(Asset.category, func.sum(Asset.value)).filter(
+            Asset.company_id == self.company_id,
+            Asset.date <= self.today
+        ).group_by(Asset.category).all()
+        liability_rows = self.db.query(Liability.category, func.sum(Liability.value)).filter(
+            Liability.company_id == self.company_id,
+            Liability.date <= self.today
+        ).group_by(Liability.category).all()
+        self.assets = {category: value or 0 for category, value in asset_rows}
+        self.liabilities = {category: value or 0 for category, value in liability_rows}
+
+    # --- Выручка ---
+
+    def revenue(self, start: date, end: date, sales_channel_id: int = None):
+        """Выручка за период [start, end] (по всем каналам или по одному)"""
+        return _sum(
+            row.revenue for row in self.revenue_rows
+            if start <= row.date <= end
+            and (sales_channel_id is None or row.sales_channel_id == sales_channel_id)
+        )
+
+    def channel_sales(self, start: date, end: date) -> List[Dict]:
+        """Продажи по каналам за период: выручка, количество и число реализаций"""
+        channels = {}
+        for row in self.revenue_rows:
+            if not start <= row.date <= end:
+                continue
+            channel = channels.setdefault(row.sales_channel_id, {
+                "sales_channel_id": row.sales_channel_id,
+                "total_revenue": 0,
+                "total_quantity": 0,
+                "transaction_count": 0
+            })
+            channel["total_revenue"] += row.revenue or 0
+            channel["total_quantity"] += row.quantity or 0
+            channel["transaction_count"] += row.transactions
+        return list(channels.values())
+
+    def monthly_revenue(self, start: date, end: date = None) -> List[Tuple[date, object]]:
+        """Выручка по календарным месяцам от месяца start до end: [(начало месяца, выручка)]"""
+        end = end or self.today
+        months = []
+        current = start.replace(day=1)
+        while current <= end:
+            next_month = (current + timedelta(days=32)).replace(day=1)
+            months.append((current, self.revenue(current, min(next_month - timedelta(days=1), end))))
+            current = next_month
+        return months
+
+    # --- Деньги ---
+
+    def money(
+        self, movement_type: Optional[str], start: date, end: date,
+        business_only: bool = True, expense_item_id: int = None, income_item_id: int = None
+    ):
+        """Сумма движений денег за период [start, end] с отбором по типу и статье"""
+        return _sum(
+            row.amount for row in self.money_rows
+            if start <= row.date <= end
+            and (movement_type is None or row.movement_type == movement_type)
+            and (not business_only or row.is_business)
+            and (expense_item_id is None or row.expense_item_id == expense_item_id)
+            and (income_item_id is None or row.income_item_id == income_item_id)
+        )
+
+    def money_total(self, movement_type: str):
+        """Сумма бизнес-движений денег указанного типа за все время"""
+        return _sum(
+            row.amount for row in self.money_total_rows
+            if row.movement_type == movement_type and row.is_business
+        )
+
+    @property
+    def first_movement_date(self) -> Optional[date]:
+        """Дата первого движения денег компании"""
+        dates = [row.first_date for row in self.money_total_rows if row.first_date]
+        return min(dates) if dates else None
+
+    def business_expense_item_ids(self) -> List[int]:
+        """Статьи, по которым были бизнес-расходы"""
+        return list(dict.fromkeys(
+            row.expense_item_id for row in self.money_total_rows
+            if row.movement_type == "expense" and row.is_business and row.expense_item_id
+        ))
+
+    # --- Отгрузки и продажи по товарам ---
+
+    def shipment_cost(self, start: date, end: date):
+        """Себестоимость отгрузок за период"""
+        return _sum(row.cost for row in self.shipment_rows if start <= row.date <= end)
+
+    def shipments_by_product(self, start: date, end: date) -> Dict[int, Dict]:
+        """Отгрузки за период по товарам: {product_id: {total_quantity, total_cost}}"""
+        products = {}
+        for row in self.shipment_rows:
+            if not start <= row.date <= end:
+                continue
+            product = products.setdefault(row.product_id, {"total_quantity": 0, "total_cost": 0})
+            product["total_quantity"] += row.quantity or 0
+            product["total_cost"] += row.cost or 0
+        return products
+
+    def item_sales_by_product(self, start: date, end: date = None) -> Dict[int, Dict]:
+        """
+        Продажи по товарам за период (не раньше product_sales_start):
+        {product_id: {total_quantity, total_revenue}}; end=None - без верхней границы
+        """
+        products = {}
+        for row in self.item_rows:
+            if row.date < start or (end is not None and row.date > end):
+                continue
+            product = products.setdefault(row.product_id, {"total_quantity": 0, "total_revenue": 0})
+            product["total_quantity"] += row.quantity or 0
+            product["total_revenue"] += row.revenue or 0
+        return products
+
+    # --- Остатки балансовых статей ---
+
+    def asset_total(self, category: str):
+        return self.assets.get(category, 0)
+
+    def liability_total(self, category: str):
+        return self.liabilities.get(category, 0)
+
+    # --- Справочники (загружаются при первом обращении) ---
+    # Загружаются строки с нужными колонками, а не объекты ORM: коммиты при сохранении
+    # рекомендаций не сбрасывают их, и повторных запросов к БД не возникает.
+
+    @cached_property
+    def products(self) -> Dict[int, Any]:
+        """Все товары по id"""
+        rows = self.db.query(
+            Product.id, Product.name, Product.cost_price, Product.selling_price, Product.is_active
+        ).all()
+        return {row.id: row for row in rows}
+
+    @property
+    def active_products(self) -> List[Any]:
+        return [product for product in self.products.values() if product.is_active]
+
+    @cached_property
+    def sales_channels(self) -> Dict[int, Any]:
+        return {row.id: row for row in self.db.query(SalesChannel.id, SalesChannel.name).all()}
+
+    @cached_property
+    def expense_items(self) -> Dict[int, Any]:
+        return {row.id: row for row in self.db.query(ExpenseItem.id, ExpenseItem.name).all()}
+
+    @cached_property
+    def income_items(self) -> Dict[int, Any]:
+        return {row.id: row for row in self.db.query(IncomeItem.id, IncomeItem.name).all()}
+
+    @cached_property
+    def budgets(self) -> List[Any]:
+        return self.db.query(
+            Budget.id, Budget.period_type, Budget.period_value, Budget.budget_type,
+            Budget.income_item_id, Budget.expense_item_id, Budget.planned_amount
+        ).filter(Budget.company_id == self.company_id).all()
+
+    @cached_property
+    def inventory_items(self) -> List[Any]:
+        """Остатки активных товаров на складах компании (с названием и ценой товара)"""
+        # Фильтруем через Warehouse, так как Product не имеет company_id
+        return self.db.query(
+            Inventory.id, Inventory.product_id, Inventory.warehouse_id,
+            Inventory.quantity, Inventory.min_stock_level,
+            Product.name.label('product_name'), Product.selling_price
+        ).join(
+            Product, Inventory.product_id == Product.id
+        ).join(
+            Warehouse, Inventory.warehouse_id == Warehouse.id
+        ).filter(
+            Warehouse.company_id == self.company_id,
+            Product.is_active == True
+        ).all()
+
+    @cached_property
+    def active_customers(self) -> List[Any]:
+        return self.db.query(
+            Customer.id, Customer.name, Customer.last_purchase_date, Customer.ltv
+        ).filter(
+            Customer.company_id == self.company_id,
+            Customer.is_active == True
+        ).all()
+
+    @cached_property
+    def active_suppliers(self) -> List[Any]:
+        return self.db.query(Supplier.id, Supplier.name, Supplier.rating).filter(
+            Supplier.company_id == self.company_id,
+            Supplier.is_active == True
+        ).all()
+
+    # --- Месячные матрицы для поиска аномалий (см. app.services.anomaly_detection) ---
+
+    @cached_property
+    def expense_matrix(self) -> SeriesMatrix:
+        """Бизнес-расходы: статьи × месяцы"""
+        return load_expense_matrix(self.db, self.company_id, self.today)
+
+    @cached_property
+    def product_matrix(self) -> SeriesMatrix:
+        """Выручка по товарам: товары × месяцы"""
+        return load_product_matrix(self.db, self.company_id, self.today)
+
+    @cached_property
+    def revenue_matrix(self) -> SeriesMatrix:
+        """Общая выручка по месяцам"""
+        return load_revenue_matrix(self.db, self.company_id, self.today)
@@ -0,0 +1,247 @@
+"""
+Прогноз выручки по месяцам (экспоненциальное сглаживание Холта-Винтерса)
+
+Месячные ряды выручки по организациям и каналам продаж строятся одним
+сгруппированным запросом. Для каждой организации прогнозируются ряды каналов
+и общий ряд; все ряды всех организаций подбираются одновременно: рекурсия
+сглаживания идет по месяцам, а ряды и варианты параметров (сетка alpha/beta/gamma)
+обрабатываются векторно средствами NumPy, для каждого ряда выбирается вариант
+с минимальной ошибкой прогноза на шаг вперед.
+
+Сезонная модель (аддитивная, период 12 месяцев) применяется, если у ряда есть
+два полных сезона истории, иначе - модель Холта с трендом без сезонности.
+Доверительные интервалы строятся по дисперсии ошибок на шаг вперед
+с накоплением на горизонте прогноза.
+
+Подобранные прогнозы кешируются в памяти процесса по организациям и
+пересчитываются, только если изменился месячный ряд организации (новые или
+исправленные реализации, наступление нового месяца).
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import product as param_grid
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import func, extract
+from sqlalchemy.orm import Session
+from app.models.realization import Realization
+from app.services.anomaly_detection import SeriesMatrix, evaluation_months
+
+# Глубина истории (завершенных месяцев)
+FORECAST_HISTORY_MONTHS = 36
+# Максимальный горизонт прогноза (месяцев)
+MAX_HORIZON = 12
+# Период сезонности (месяцев)
+SEASON_LENGTH = 12
+# Минимум месяцев истории ряда для прогноза
+MIN_FORECAST_MONTHS = 3
+# Сетка параметров сглаживания: уровень, тренд, сезонность
+ALPHAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.0, 0.1, 0.3)
+GAMMAS = (0.0, 0.1, 0.3)
+# Квантили нормального распределения для доверительных интервалов
+CONFIDENCE_Z = {0.8: 1.2816, 0.9: 1.6449, 0.95: 1.96}
+# Сколько организаций хранить в кеше
+MAX_CACHED_COMPANIES = 500
+
+# Ключ общего ряда организации (по всем каналам)
+TOTAL = None
+
+_cache: "OrderedDict[int, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def forecast_months(today: date, horizon: int = MAX_HORIZON) -> List[date]:
+    """Месяцы прогноза: начиная с текущего (первого незавершенного)"""
+    months = [today.replace(day=1)]
+    while len(months) < horizon:
+        months.append((months[-1] + timedelta(days=32)).replace(day=1))
+    return months
+
+def load_revenue_series(db: Session, company_ids: Optional[Iterable[int]], months: List[date]) -> Dict[int, SeriesMatrix]:
+    """
+    Месячная выручка по организациям: {company_id: матрица "канал × месяц"}
+    с дополнительным общим рядом (ключ TOTAL). company_ids=None - все организации.
+    """
+    year = extract('year', Realization.date)
+    month = extract('month', Realization.date)
+    next_month = (months[-1] + timedelta(days=32)).replace(day=1)
+    query = db.query(
+        Realization.company_id, Realization.sales_channel_id, year, month, func.sum(Realization.revenue)
+    ).filter(
+        Realization.date >= months[0],
+        Realization.date < next_month
+    )
+    if company_ids is not None:
+        query = query.filter(Realization.company_id.in_(list(company_ids)))
+    rows = query.group_by(Realization.company_id, Realization.sales_channel_id, year, month).all()
+
+    rows_by_company = {}
+    for company_id, channel_id, row_year, row_month, revenue in rows:
+        company_rows = rows_by_company.setdefault(company_id, [])
+        company_rows.append((channel_id, row_year, row_month, revenue))
+        company_rows.append((TOTAL, row_year, row_month, revenue))
+    return {company_id: SeriesMatrix.from_rows(company_rows, months) for company_id, company_rows in rows_by_company.items()}
+
+def _initial_state(values: np.ndarray, start: np.ndarray, seasonal: np.ndarray):
+    """Начальные уровень, тренд и сезонные отклонения; индекс месяца, с которого идет сглаживание"""
+    n_series, n_months = values.shape
+    offsets = np.arange(SEASON_LENGTH)
+    first_idx = np.minimum(start[:, None] + offsets, n_months - 1)
+    second_idx = np.minimum(first_idx + SEASON_LENGTH, n_months - 1)
+    first_season = values[np.arange(n_series)[:, None], first_idx]
+    second_season = values[np.arange(n_series)[:, None], second_idx]
+
+    level = np.where(seasonal, first_season.mean(axis=1), values[np.arange(n_series), start])
+    trend = np.where(seasonal, (second_season.mean(axis=1) - first_season.mean(axis=1)) / SEASON_LENGTH, 0.0)
+    season = np.zeros((n_series, SEASON_LENGTH))
+    # Отклонения первого сезона раскладываются по позициям месяцев (t mod SEASON_LENGTH)
+    positions = first_idx % SEASON_LENGTH
+    deviations = np.where(seasonal[:, None], first_season - level[:, None], 0.0)
+    season[np.arange(n_series)[:, None], positions] = deviations
+    smoothing_start = np.where(seasonal, start + SEASON_LENGTH, start + 1)
+    return level, trend, season, smoothing_start
+
+def fit_holt_winters(values: np.ndarray, horizon: int = MAX_HORIZON) -> Dict[str, np.ndarray]:
+    """
+    Подобрать модели для всех рядов матрицы (ряды × месяцы) и построить прогноз.
+    Возвращает массивы: forecast и std (ряды × горизонт), method ("holt_winters",
+    "holt" или "insufficient_data"), alpha, beta, gamma.
+    """
+    n_series, n_months = values.shape
+    observed = np.cumsum(values > 0, axis=1) > 0
+    start = np.argmax(observed, axis=1)
+    available = observed.sum(axis=1)
+    enough = available >= MIN_FORECAST_MONTHS
+    seasonal = available >= 2 * SEASON_LENGTH
+
+    grid = np.array(list(param_grid(ALPHAS, BETAS, GAMMAS)))
+    n_grid = len(grid)
+    # Варианты параметров разворачиваются в дополнительные "ряды": вариант × ряд
+    alpha = np.repeat(grid[:, 0], n_series)
+    beta = np.repeat(grid[:, 1], n_series)
+    gamma = np.repeat(grid[:, 2], n_series) * np.tile(seasonal, n_grid)
+    y = np.tile(values, (n_grid, 1))
+
+    level, trend, season, smoothing_start = (
+        np.tile(part, (n_grid, 1)) if part.ndim == 2 else np.tile(part, n_grid)
+        for part in _initial_state(values, start, seasonal)
+    )
+    sse = np.zeros(len(y))
+    errors = np.zeros(len(y))
+    for t in range(n_months):
+        active = t >= smoothing_start
+        position = t % SEASON_LENGTH
+        season_t = season[:, position]
+        error = y[:, t] - (level + trend + season_t)
+        new_level = alpha * (y[:, t] - season_t) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        new_season = gamma * (y[:, t] - new_level) + (1 - gamma) * season_t
+        sse += np.where(active, error ** 2, 0.0)
+        errors += active
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+        season[:, position] = np.where(active, new_season, season_t)
+
+    # Лучший вариант параметров для каждого ряда
+    best = np.argmin(sse.reshape(n_grid, n_series), axis=0)
+    chosen = best * n_series + np.arange(n_series)
+    sigma = np.sqrt(sse[chosen] / np.maximum(errors[chosen], 1))
+
+    steps = np.arange(1, horizon + 1)
+    positions = (n_months - 1 + steps) % SEASON_LENGTH
+    forecast = (
+        level[chosen][:, None]
+        + trend[chosen][:, None] * steps
+        + season[chosen][:, positions]
+    )
+    # Дисперсия ошибки на h шагов: sigma^2 * (1 + sum c_j^2), c_j = alpha * (1 + j * beta) + gamma * [j кратно сезону]
+    j = steps[:-1]
+    c = (
+        alpha[chosen][:, None] * (1 + j * beta[chosen][:, None])
+        + gamma[chosen][:, None] * (j % SEASON_LENGTH == 0)
+    )
+    variance_factor = np.concatenate([np.ones((n_series, 1)), 1 + np.cumsum(c ** 2, axis=1)], axis=1)
+    std = sigma[:, None] * np.sqrt(variance_factor)
+
+    method = np.where(~enough, "insufficient_data", np.where(seasonal, "holt_winters", "holt"))
+    forecast = np.where(enough[:, None], np.maximum(forecast, 0.0), np.nan)
+    std = np.where(enough[:, None], std, np.nan)
+    return {
+        "forecast": forecast,
+        "std": std,
+        "method": method,
+        "alpha": alpha[chosen],
+        "beta": beta[chosen],
+        "gamma": gamma[chosen]
+    }
+
+def _fit_companies(series: Dict[int, SeriesMatrix]) -> Dict[int, Dict]:
+    """Подобрать модели всех рядов всех организаций одним проходом"""
+    company_ids = list(series)
+    if not company_ids:
+        return {}
+    values = np.vstack([series[company_id].values for company_id in company_ids])
+    fitted = fit_holt_winters(values)
+
+    results = {}
+    offset = 0
+    for company_id in company_ids:
+        matrix = series[company_id]
+        models = {}
+        for index, key in enumerate(matrix.keys):
+            row = offset + index
+            models[key] = {
+                "history": matrix.values[index],
+                "forecast": fitted["forecast"][row],
+                "std": fitted["std"][row],
+                "method": str(fitted["method"][row]),
+                "params": {
+                    "alpha": float(fitted["alpha"][row]),
+                    "beta": float(fitted["beta"][row]),
+                    "gamma": float(fitted["gamma"][row])
+                }
+            }
+        results[company_id] = {"months": matrix.months, "models": models}
+        offset += len(matrix.keys)
+    return results
+
+def _fingerprint(matrix: SeriesMatrix) -> tuple:
+    """Отпечаток месячного ряда организации: меняется при новых данных или новом месяце"""
+    return (matrix.months[-1], tuple(matrix.keys), matrix.values.tobytes())
+
+def get_company_forecasts(db: Session, company_ids: Optional[Iterable[int]], today: date = None) -> Dict[int, Dict]:
+    """
+    Прогнозы выручки организаций: {company_id: {"months": месяцы истории, "models": {канал или TOTAL: модель}}}.
+    Модель: history, forecast и std на MAX_HORIZON месяцев, method, params.
+    Пересчитываются только организации, месячный ряд которых изменился.
+    """
+    months = evaluation_months(today or date.today(), FORECAST_HISTORY_MONTHS)
+    series = load_revenue_series(db, company_ids, months)
+
+    results = {}
+    stale = {}
+    with _cache_lock:
+        for company_id, matrix in series.items():
+            cached = _cache.get(company_id)
+            if cached and cached["fingerprint"] == _fingerprint(matrix):
+                _cache.move_to_end(company_id)
+                results[company_id] = cached["result"]
+            else:
+                stale[company_id] = matrix
+
+    if stale:
+        fitted = _fit_companies(stale)
+        with _cache_lock:
+            for company_id, result in fitted.items():
+                _cache[company_id] = {"fingerprint": _fingerprint(stale[company_id]), "result": result}
+                _cache.move_to_end(company_id)
+            while len(_cache) > MAX_CACHED_COMPANIES:
+                _cache.popitem(last=False)
+        results.update(fitted)
+    return results
+
+def clear_forecast_cache():
+    """Сбросить кеш подобранных моделей"""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,121 @@
+"""
+Аренда (lease) синхронизации интеграции с маркетплейсом
+
+Перед синхронизацией процесс захватывает аренду интеграции одним условным UPDATE:
+запись обновляется, только если аренды нет, она истекла или уже принадлежит этому
+владельцу. Пока синхронизация идет, фоновый поток продлевает аренду (heartbeat).
+Если процесс упал, аренда истекает сама и интеграцию подхватит следующий запуск,
+поэтому планировщики и API могут работать в нескольких процессах и на разных хостах.
+
+Планировщик ограничивает длительность синхронизации: по истечении времени он
+выставляет событие отмены, синхронизация проверяет его между страницами и
+прерывается исключением SyncCancelled (аренда при этом освобождается).
+"""
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models.marketplace_integration import MarketplaceIntegration
+
+# Срок аренды без продления
+LEASE_SECONDS = 5 * 60
+# Интервал продления аренды во время синхронизации
+HEARTBEAT_SECONDS = 60
+
+class SyncCancelled(Exception):
+    """Синхронизация остановлена по событию отмены (превышено время)"""
+
+def new_lease_owner() -> str:
+    """Уникальный идентификатор владельца аренды: хост, процесс и случайный суффикс"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_available(now: datetime = None):
+    """Условие SQL: аренды интеграции нет или она истекла"""
+    now = now or datetime.now()
+    return or_(
+        MarketplaceIntegration.sync_lease_owner.is_(None),
+        MarketplaceIntegration.sync_lease_expires_at.is_(None),
+        MarketplaceIntegration.sync_lease_expires_at < now
+    )
+
+def acquire_lease(db: Session, integration_id: int, owner: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """
+    Захватить аренду интеграции. Возвращает False, если синхронизацию уже выполняет
+    другой владелец с действующей арендой. При успехе статус становится in_progress.
+    """
+    now = datetime.now()
+    updated = db.query(MarketplaceIntegration).filter(
+        MarketplaceIntegration.id == integration_id,
+        or_(lease_available(now), MarketplaceIntegration.sync_lease_owner == owner)
+    ).update({
+        MarketplaceIntegration.sync_lease_owner: owner,
+        MarketplaceIntegration.sync_lease_expires_at: now + timedelta(seconds=lease_seconds),
+        MarketplaceIntegration.last_sync_status: "in_progress",
+        MarketplaceIntegration.last_sync_error: None
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def renew_lease(db: Session, integration_id: int, owner: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Продлить аренду; False, если она уже перешла к другому владельцу"""
+    updated = db.query(MarketplaceIntegration).filter(
+        MarketplaceIntegration.id == integration_id,
+        MarketplaceIntegration.sync_lease_owner == owner
+    ).update({
+        MarketplaceIntegration.sync_lease_expires_at: datetime.now() + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def release_lease(db: Session, integration_id: int, owner: str):
+    """Освободить аренду (только свою)"""
+    db.query(MarketplaceIntegration).filter(
+        MarketplaceIntegration.id == integration_id,
+        MarketplaceIntegration.sync_lease_owner == owner
+    ).update({
+        MarketplaceIntegration.sync_lease_owner: None,
+        MarketplaceIntegration.sync_lease_expires_at: None
+    }, synchronize_session=False)
+    db.commit()
+
+class LeaseHeartbeat:
+    """
+    Фоновое продление аренды на время синхронизации (используется как контекстный менеджер).
+    lost становится True, если продлить аренду не удалось - синхронизацию нужно прервать.
+    """
+
+    def __init__(self, integration_id: int, owner: str, interval_seconds: int = HEARTBEAT_SECONDS, lease_seconds: int = LEASE_SECONDS):
+        self.integration_id = integration_id
+        self.owner = owner
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"sync-lease-{integration_id}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            db = SessionLocal()
+            try:
+                if not renew_lease(db, self.integration_id, self.owner, self.lease_seconds):
+                    self.lost = True
+                    print(f"[SYNC] Аренда интеграции {self.integration_id} перешла к другому процессу")
+                    return
+            except Exception as e:
+                # Временная ошибка БД: аренда еще действует, пробуем на следующем цикле
+                print(f"[SYNC] Не удалось продлить аренду интеграции {self.integration_id}: {str(e)}")
+            finally:
+                db.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
@@ -1,69 +1,270 @@
 """
 Сервис для автоматической синхронизации данных с маркетплейсами
 Можно запускать как отдельный процесс или через планировщик задач
+
+Интеграции синхронизируются параллельно в ограниченном пуле потоков:
+для каждого маркетплейса действует свой лимит одновременных синхронизаций
+и token bucket на частоту их запуска, чтобы медленный аккаунт одной
+организации не задерживал остальные.
+
+Каждая синхронизация выполняется под арендой интеграции (app.services.sync_lease),
+поэтому планировщик можно запускать в нескольких процессах и на разных хостах:
+интеграцию с действующей арендой пропускают, а зависшую после сбоя
+(аренда истекла) подхватывает следующий цикл.
+
+Поток синхронизации нельзя прервать извне, поэтому по истечении времени
+планировщик выставляет событие отмены: синхронизация останавливается перед
+следующей страницей (heartbeat аренды останавливается, аренда освобождается),
+и только после этого слот освобождается и запуск учитывается как timeout.
 """
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from app.database import SessionLocal
 from app.models.marketplace_integration import MarketplaceIntegration
 from app.api.marketplace_integration import perform_sync
+from app.services.sync_lease import lease_available, SyncCancelled
 
-def check_and_sync_integrations():
-    """Проверить все активные интеграции и запустить синхронизацию при необходимости"""
+# Общее количество потоков синхронизации
+MAX_WORKERS = 8
+# Максимальная длительность синхронизации одной интеграции
+SYNC_TIMEOUT_SECONDS = 30 * 60
+# Сколько ждать остановки синхронизации после отмены, прежде чем освободить слот
+CANCEL_GRACE_SECONDS = 5 * 60
+# Лимиты по маркетплейсам: одновременные синхронизации и запуски в минуту
+MARKETPLACE_LIMITS = {
+    "ozon": {"concurrency": 3, "starts_per_minute": 20},
+    "wildberries": {"concurrency": 2, "starts_per_minute": 10},
+}
+DEFAULT_LIMITS = {"concurrency": 2, "starts_per_minute": 10}
+
+def marketplace_key(marketplace_name: str) -> str:
+    """Ключ маркетплейса для лимитов и метрик"""
+    name = marketplace_name.lower()
+    if "ozon" in name:
+        return "ozon"
+    if "wildberries" in name or "wb" in name:
+        return "wildberries"
+    return name
+
+class TokenBucket:
+    """Token bucket: не больше capacity запусков подряд, далее rate_per_second в среднем"""
+    
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class MarketplaceLimiter:
+    """Лимит одновременных синхронизаций и частоты запусков для одного маркетплейса"""
+    
+    def __init__(self, concurrency: int, starts_per_minute: float):
+        self.concurrency = concurrency
+        self.running = 0
+        self.bucket = TokenBucket(starts_per_minute / 60.0, capacity=max(1, concurrency))
+    
+    def try_start(self) -> bool:
+        if self.running >= self.concurrency or not self.bucket.try_acquire():
+            return False
+        self.running += 1
+        return True
+    
+    def finish(self):
+        self.running = max(0, self.running - 1)
+
+class SyncMetrics:
+    """Метрики планировщика: длительность синхронизаций и глубина очереди"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.by_marketplace: Dict[str, Dict] = {}
+    
+    def set_queue(self, queue_depth: int, in_flight: int):
+        with self._lock:
+            self.queue_depth = queue_depth
+            self.in_flight = in_flight
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+    
+    def record_run(self, marketplace: str, duration: float, status: str):
+        with self._lock:
+            stats = self.by_marketplace.setdefault(marketplace, {
+                "runs": 0, "success": 0, "error": 0, "timeout": 0, "skipped": 0,
+                "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0
+            })
+            stats["runs"] += 1
+            stats[status] += 1
+            stats["total_seconds"] += duration
+            stats["max_seconds"] = max(stats["max_seconds"], duration)
+            stats["last_seconds"] = duration
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "marketplaces": {
+                    name: {
+                        **stats,
+                        "avg_seconds": round(stats["total_seconds"] / stats["runs"], 2) if stats["runs"] else 0.0
+                    }
+                    for name, stats in self.by_marketplace.items()
+                }
+            }
+
+metrics = SyncMetrics()
+
+def get_sync_metrics() -> Dict:
+    """Текущие метрики планировщика синхронизации"""
+    return metrics.snapshot()
+
+def _collect_due_integrations() -> List[Dict]:
+    """Найти активные интеграции, которым пора синхронизироваться"""
     db = SessionLocal()
     try:
-        # Получаем все активные интеграции с автосинхронизацией
+        # Получаем все активные интеграции с автосинхронизацией, которые сейчас никто не синхронизирует
+        # (статус in_progress с истекшей арендой означает, что прошлый запуск упал)
         integrations = db.query(MarketplaceIntegration).filter(
             MarketplaceIntegration.is_active == True,
-            MarketplaceIntegration.auto_sync == True
+            MarketplaceIntegration.auto_sync == True,
+            lease_available()
         ).all()
         
-        synced_count = 0
+        jobs = []
         for integration in integrations:
             # Проверяем, нужно ли синхронизировать
-            should_sync = False
+            if integration.last_sync_at:
+                next_sync_time = integration.last_sync_at + timedelta(hours=integration.sync_interval_hours)
+                if datetime.now() < next_sync_time:
+                    continue
             
-            if not integration.last_sync_at:
-                # Никогда не синхронизировалось
-                should_sync = True
+            # Определяем период синхронизации (последние 7 дней или с последней синхронизации)
+            if integration.last_sync_at:
+                start_date = integration.last_sync_at.date()
             else:
-                # Проверяем интервал
-                next_sync_time = integration.last_sync_at + timedelta(hours=integration.sync_interval_hours)
-                if datetime.now() >= next_sync_time:
-                    should_sync = True
+                start_date = datetime.now().date() - timedelta(days=7)
+            
+            jobs.append({
+                "integration_id": integration.id,
+                "marketplace_name": integration.marketplace_name,
+                "marketplace": marketplace_key(integration.marketplace_name),
+                "start_date": start_date,
+                "end_date": datetime.now().date()
+            })
+        return jobs
+    finally:
+        db.close()
+
+def _run_sync_job(job: Dict, cancel_event: threading.Event) -> Optional[float]:
+    """
+    Выполнить синхронизацию одной интеграции, вернуть длительность в секундах
+    или None, если ее уже синхронизирует другой процесс
+    """
+    print(f"[SYNC] Запуск синхронизации для {job['marketplace_name']} (ID: {job['integration_id']})")
+    started = time.monotonic()
+    synced = perform_sync(
+        job["integration_id"],
+        job["marketplace_name"].lower(),
+        job["start_date"],
+        job["end_date"],
+        cancel_event=cancel_event
+    )
+    return time.monotonic() - started if synced else None
+
+def check_and_sync_integrations(
+    max_workers: int = MAX_WORKERS,
+    timeout_seconds: float = SYNC_TIMEOUT_SECONDS,
+    cancel_grace_seconds: float = CANCEL_GRACE_SECONDS
+):
+    """Проверить все активные интеграции и запустить синхронизацию при необходимости"""
+    pending = deque(_collect_due_integrations())
+    if not pending:
+        print(f"[SYNC] Нет интеграций для синхронизации")
+        return
+    
+    limiters = {}
+    for job in pending:
+        if job["marketplace"] not in limiters:
+            limits = MARKETPLACE_LIMITS.get(job["marketplace"], DEFAULT_LIMITS)
+            limiters[job["marketplace"]] = MarketplaceLimiter(limits["concurrency"], limits["starts_per_minute"])
+    
+    synced_count = 0
+    # future -> (задача, время запуска, событие отмены)
+    running = {}
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="marketplace-sync")
+    try:
+        while pending or running:
+            # Запускаем все задачи, которые позволяют лимиты
+            for _ in range(len(pending)):
+                job = pending.popleft()
+                if len(running) < max_workers and limiters[job["marketplace"]].try_start():
+                    cancel_event = threading.Event()
+                    running[pool.submit(_run_sync_job, job, cancel_event)] = (job, time.monotonic(), cancel_event)
+                else:
+                    pending.append(job)
+            metrics.set_queue(len(pending), len(running))
             
-            # Не синхронизируем, если уже идет процесс
-            if integration.last_sync_status == "in_progress":
+            if not running:
+                # Все задачи ждут токенов rate limit
+                time.sleep(1)
                 continue
+            done, _ = wait(list(running), timeout=1, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
             
-            if should_sync:
-                try:
-                    # Определяем период синхронизации (последние 7 дней или с последней синхронизации)
-                    if integration.last_sync_at:
-                        start_date = integration.last_sync_at.date()
-                    else:
-                        start_date = datetime.now().date() - timedelta(days=7)
-                    
-                    end_date = datetime.now().date()
-                    
-                    print(f"[SYNC] Запуск синхронизации для {integration.marketplace_name} (ID: {integration.id})")
-                    perform_sync(
-                        integration.id,
-                        integration.marketplace_name.lower(),
-                        start_date,
-                        end_date
-                    )
-                    synced_count += 1
-                except Exception as e:
-                    print(f"[ERROR] Ошибка синхронизации для интеграции {integration.id}: {str(e)}")
-        
-        if synced_count > 0:
-            print(f"[SYNC] Синхронизировано интеграций: {synced_count}")
-        else:
-            print(f"[SYNC] Нет интеграций для синхронизации")
-    
+            for future, (job, started, cancel_event) in list(running.items()):
+                if future in done:
+                    try:
+                        duration = future.result()
+                        if duration is None:
+                            metrics.record_run(job["marketplace"], 0.0, "skipped")
+                        else:
+                            metrics.record_run(job["marketplace"], duration, "success")
+                            synced_count += 1
+                    except SyncCancelled:
+                        metrics.record_run(job["marketplace"], now - started, "timeout")
+                        print(f"[ERROR] Превышено время синхронизации для интеграции {job['integration_id']}, синхронизация остановлена")
+                    except Exception as e:
+                        metrics.record_run(job["marketplace"], now - started, "error")
+                        print(f"[ERROR] Ошибка синхронизации для интеграции {job['integration_id']}: {str(e)}")
+                elif not cancel_event.is_set():
+                    if now - started > timeout_seconds:
+                        # Синхронизация остановится перед следующей страницей, слот занят до остановки
+                        cancel_event.set()
+                        print(f"[SYNC] Синхронизация интеграции {job['integration_id']} превысила {timeout_seconds} с, останавливаем")
+                    continue
+                elif now - started > timeout_seconds + cancel_grace_seconds:
+                    # Поток завис внутри запроса к API: освобождаем слот, статус запишет сам поток при остановке
+                    metrics.record_run(job["marketplace"], now - started, "timeout")
+                    print(f"[ERROR] Синхронизация интеграции {job['integration_id']} не остановилась после отмены")
+                else:
+                    continue
+                del running[future]
+                limiters[job["marketplace"]].finish()
+        metrics.set_queue(0, 0)
     finally:
-        db.close()
+        # Не ждем зависшие синхронизации, чтобы не блокировать следующий цикл
+        pool.shutdown(wait=False)
+    
+    print(f"[SYNC] Синхронизировано интеграций: {synced_count}")
+    print(f"[SYNC] Метрики: {metrics.snapshot()}")
 
 def run_scheduler(interval_minutes: int = 60):
     """Запустить планировщик синхронизации (работает в бесконечном цикле)"""
@@ -81,4 +282,3 @@ def run_scheduler(interval_minutes: int = 60):
 if __name__ == "__main__":
     # Запуск планировщика с интервалом 1 час
     run_scheduler(interval_minutes=60)
-
@@ -2,132 +2,255 @@
 Сервис для работы с API Wildberries
 Документация: https://openapi.wildberries.ru/
 """
+import hashlib
 import requests
 import json
-from datetime import date, datetime, timedelta
-from typing import List, Dict, Any
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from decimal import Decimal
+from app.database import settings
+from app.services.http_client import get_http_client
+
+SALES_ENDPOINT = "/api/v1/supplier/sales"
+ORDERS_ENDPOINT = "/api/v1/supplier/orders"
+# Сколько строк API отдает за один ответ; если пришло меньше - изменения закончились
+MAX_ROWS_PER_RESPONSE = 80000
+# Источники сырых данных (для промежуточного хранения ответов API)
+SOURCE_SALES = "wb_sales"
+SOURCE_ORDERS = "wb_orders"
+# Параметры отчетов: эндпоинт, поле даты, поля цены по приоритету, подпись, ключ для external_id
+REPORTS = {
+    SOURCE_SALES: {
+        "endpoint": SALES_ENDPOINT,
+        "date_field": "saleDate",
+        "price_fields": ("priceWithDisc", "totalPrice"),  # Цена продажи с учетом комиссии
+        "label": "Продажи",
+        "kind": "sales",
+        "error": "Не удалось получить данные о продажах"
+    },
+    SOURCE_ORDERS: {
+        "endpoint": ORDERS_ENDPOINT,
+        "date_field": "date",
+        "price_fields": ("totalPrice",),
+        "label": "Заказы",
+        "kind": "orders",
+        "error": "Не удалось получить данные о заказах"
+    },
+}
+
+# Время в отчетах статистики WB - московское; курсор хранится в нем же, без часового пояса
+WB_TIMEZONE = timezone(timedelta(hours=3))
+
+def parse_change_date(value: Optional[str]) -> Optional[datetime]:
+    """
+    Разобрать lastChangeDate (RFC3339 с часовым поясом или без, с долями секунды или без)
+    в московское время без часового пояса. None - поле отсутствует или не разбирается.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(WB_TIMEZONE).replace(tzinfo=None)
+    return parsed
 
 class WildberriesAPI:
-    def __init__(self, api_key: str, stat_api_key: str = None):
+    def __init__(self, api_key: str, stat_api_key: str = None, base_url: str = None, max_rows_per_response: int = MAX_ROWS_PER_RESPONSE):
         self.api_key = api_key
         self.stat_api_key = stat_api_key or api_key
-        self.base_url = "https://statistics-api.wildberries.ru"
+        self.base_url = base_url or settings.wb_statistics_api_url
+        self.max_rows_per_response = max_rows_per_response
         self.headers = {
             "Authorization": api_key,
             "Content-Type": "application/json"
         }
+        # Сессия общая для всех экземпляров с тем же ключом
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        self.http = get_http_client(f"wb:{key_hash}", self.base_url, self.headers)
+        # Начало счетчиков этого экземпляра (одной синхронизации)
+        self._stats_since = self.http.snapshot()
     
     def _make_request(self, method: str, endpoint: str, params: Dict = None) -> Dict:
-        """Выполнить запрос к API Wildberries"""
-        url = f"{self.base_url}{endpoint}"
+        """Выполнить запрос к API Wildberries (с повторами при 429/5xx)"""
         try:
             if method == "POST":
-                response = requests.post(url, headers=self.headers, json=params, timeout=30)
+                response = self.http.request("POST", endpoint, json=params)
             else:
-                response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            
-            response.raise_for_status()
+                response = self.http.request("GET", endpoint, params=params)
             return response.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Ошибка запроса к Wildberries API: {str(e)}")
     
-    def get_sales(self, from_date: date, to_date: date) -> List[Dict]:
+    def request_stats(self) -> Dict:
+        """Статистика запросов к API с момента создания экземпляра (одного запуска синхронизации)"""
+        return self.http.stats(since=self._stats_since)
+    
+    @staticmethod
+    def row_date(source: str, row: Dict) -> date:
+        """Дата строки отчета (продажи или заказа)"""
+        return datetime.fromisoformat(row[REPORTS[source]["date_field"]].replace("Z", "+00:00")).date()
+    
+    @staticmethod
+    def row_key(row: Dict) -> Tuple:
         """
-        Получить данные о продажах за период
-        Использует метод /api/v1/supplier/sales
+        Ключ строки отчета для устранения повторов: srid заказа и saleID
+        (продажа и возврат по одному заказу - разные строки с общим srid).
+        Для строки без srid - ее содержимое.
         """
-        try:
-            # WB API требует даты в формате RFC3339
-            from_rfc = from_date.isoformat() + "T00:00:00Z"
-            to_rfc = to_date.isoformat() + "T23:59:59Z"
-            
-            params = {
-                "dateFrom": from_rfc,
-                "dateTo": to_rfc
-            }
-            
-            result = self._make_request("GET", "/api/v1/supplier/sales", params)
+        if row.get("srid"):
+            return row["srid"], row.get("saleID")
+        return None, json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+    
+    @staticmethod
+    def group_by_date(source: str, rows: List[Dict]) -> List[Dict]:
+        """
+        Сгруппировать строки отчета по датам, внутри даты - позиции по артикулу WB (nmId).
+        Итог дня имеет ключ wb:<вид>:<дата> и должен строиться по всем строкам дня
+        (без повторов по row_key), иначе он заменит итог, посчитанный по полным данным.
+        """
+        report = REPORTS[source]
+        rows_by_date = {}
+        for row in rows:
+            row_date = WildberriesAPI.row_date(source, row)
+            if row_date not in rows_by_date:
+                rows_by_date[row_date] = {
+                    "date": row_date,
+                    "revenue": 0.0,
+                    "quantity": 0,
+                    "orders": [],
+                    "items": {}
+                }
             
-            # Группируем продажи по датам
-            sales_by_date = {}
-            for sale in result:
-                sale_date = datetime.fromisoformat(sale["saleDate"].replace("Z", "+00:00")).date()
-                if sale_date not in sales_by_date:
-                    sales_by_date[sale_date] = {
-                        "date": sale_date,
-                        "revenue": 0.0,
-                        "quantity": 0,
-                        "orders": []
-                    }
-                
-                # Цена продажи с учетом комиссии
-                price = float(sale.get("priceWithDisc", sale.get("totalPrice", 0)))
-                sales_by_date[sale_date]["revenue"] += price
-                sales_by_date[sale_date]["quantity"] += sale.get("quantity", 1)
-                sales_by_date[sale_date]["orders"].append(sale.get("srid", ""))
+            price = float(next((row[field] for field in report["price_fields"] if field in row), 0))
+            quantity = row.get("quantity", 1)
+            rows_by_date[row_date]["revenue"] += price
+            rows_by_date[row_date]["quantity"] += quantity
+            rows_by_date[row_date]["orders"].append(row.get("srid", ""))
             
-            # Преобразуем в список
-            sales = []
-            for date_key, data in sales_by_date.items():
-                sales.append({
-                    "date": data["date"],
-                    "revenue": data["revenue"],
-                    "quantity": data["quantity"],
-                    "order_id": ", ".join(data["orders"][:5]),  # Первые 5 заказов
-                    "description": f"Продажи за {date_key.isoformat()}"
+            if row.get("nmId"):
+                article = str(row["nmId"])
+                item = rows_by_date[row_date]["items"].setdefault(article, {
+                    "article": article,
+                    "name": row.get("subject") or row.get("supplierArticle"),
+                    "seller_article": row.get("supplierArticle"),
+                    "quantity": 0,
+                    "revenue": 0.0
                 })
-            
-            return sales
+                item["quantity"] += quantity
+                item["revenue"] += price
+        
+        # Преобразуем в список
+        result = []
+        for date_key, data in rows_by_date.items():
+            result.append({
+                "date": data["date"],
+                "revenue": data["revenue"],
+                "quantity": data["quantity"],
+                "order_id": ", ".join(data["orders"][:5]),  # Первые 5 заказов
+                "external_id": f"wb:{report['kind']}:{date_key.isoformat()}",
+                "description": f"{report['label']} за {date_key.isoformat()}",
+                "items": list(data["items"].values())
+            })
+        return result
+    
+    def iter_changes(self, source: str, cursor: str, include_cursor: bool = False) -> Iterator[Tuple[List[Dict], str]]:
+        """
+        Постранично получить сырые строки отчета, измененные после cursor (lastChangeDate);
+        include_cursor=True - начиная с cursor включительно (первый запуск, курсора еще нет).
+        Следующая страница запрашивается с lastChangeDate последней полученной строки;
+        строки на границе страниц приходят повторно и отбрасываются по row_key (srid и saleID:
+        продажа и возврат по одному заказу - разные строки). Если строка за запуск изменилась
+        несколько раз, остается версия с наибольшим lastChangeDate.
+        Даты сравниваются как время, а не как строки (формат и точность в ответах различаются).
+        Отдает пары (новые строки, курсор после страницы).
+        """
+        endpoint = REPORTS[source]["endpoint"]
+        start = parse_change_date(cursor)
+        if start is None:
+            raise ValueError(f"Некорректный курсор Wildberries: {cursor!r}")
+        # Ключ строки -> lastChangeDate отданной версии
+        latest = {}
+        date_from = start
+        try:
+            while True:
+                rows = self._make_request("GET", endpoint, {"dateFrom": date_from.isoformat(), "flag": 0}) or []
+                if not rows:
+                    return
+                
+                new_rows = {}
+                next_cursor = date_from
+                for row in rows:
+                    changed = parse_change_date(row.get("lastChangeDate"))
+                    if changed is not None:
+                        next_cursor = max(next_cursor, changed)
+                        # Строки с курсором, равным стартовому, уже обработаны в прошлый запуск
+                        if changed < start or (changed == start and not include_cursor):
+                            continue
+                    # Строку без lastChangeDate не с чем сравнить: берем ее первую версию
+                    key = self.row_key(row)
+                    version = changed or datetime.min
+                    if key in latest and version <= latest[key]:
+                        # Повтор на границе страниц или более старая версия строки
+                        continue
+                    latest[key] = version
+                    new_rows[key] = row
+                
+                yield list(new_rows.values()), next_cursor.isoformat()
+                
+                if len(rows) < self.max_rows_per_response:
+                    return
+                if next_cursor <= date_from:
+                    # Полная страница строк с одним lastChangeDate: следующий запрос вернет ее же
+                    raise Exception(
+                        f"ответ из {len(rows)} строк не продвинул курсор {date_from.isoformat()}, остальные строки не получить"
+                    )
+                date_from = next_cursor
         except Exception as e:
-            raise Exception(f"Не удалось получить данные о продажах: {str(e)}")
+            raise Exception(f"{REPORTS[source]['error']}: {str(e)}")
+    
+    def iter_sales_since(self, cursor: str) -> Iterator[Tuple[List[Dict], str]]:
+        """
+        Инкрементально получить продажи, измененные после cursor (lastChangeDate в формате RFC3339).
+        Отдает пары (продажи страницы, сгруппированные по датам; новый курсор).
+        """
+        for rows, next_cursor in self.iter_changes(SOURCE_SALES, cursor):
+            yield self.group_by_date(SOURCE_SALES, rows), next_cursor
+    
+    def iter_orders_since(self, cursor: str) -> Iterator[Tuple[List[Dict], str]]:
+        """Инкрементально получить заказы, измененные после cursor (см. iter_sales_since)"""
+        for rows, next_cursor in self.iter_changes(SOURCE_ORDERS, cursor):
+            yield self.group_by_date(SOURCE_ORDERS, rows), next_cursor
+    
+    def fetch_window(self, source: str, from_date: date, to_date: date) -> List[Dict]:
+        """
+        Получить сырые строки отчета за период.
+        Ответ ограничен max_rows_per_response строками, поэтому период загружается постранично
+        по lastChangeDate (iter_changes) - полная страница не обрезает период; из версий строки
+        остается последняя. API может вернуть и строки после to_date (отбор идет только по dateFrom) -
+        они отбрасываются, чтобы итоги соседних периодов не перезаписывались неполными данными.
+        """
+        latest = {}
+        for rows, _ in self.iter_changes(source, from_date.isoformat() + "T00:00:00", include_cursor=True):
+            for row in rows:
+                # iter_changes повторно отдает строку только в более новой версии
+                latest[self.row_key(row)] = row
+        return [row for row in latest.values() if from_date <= self.row_date(source, row) <= to_date]
+    
+    def get_sales(self, from_date: date, to_date: date) -> List[Dict]:
+        """
+        Получить данные о продажах за период
+        Использует метод /api/v1/supplier/sales
+        """
+        return self.group_by_date(SOURCE_SALES, self.fetch_window(SOURCE_SALES, from_date, to_date))
     
     def get_orders(self, from_date: date, to_date: date) -> List[Dict]:
         """
         Получить данные о заказах за период
         Использует метод /api/v1/supplier/orders
         """
-        try:
-            from_rfc = from_date.isoformat() + "T00:00:00Z"
-            to_rfc = to_date.isoformat() + "T23:59:59Z"
-            
-            params = {
-                "dateFrom": from_rfc,
-                "dateTo": to_rfc
-            }
-            
-            result = self._make_request("GET", "/api/v1/supplier/orders", params)
-            
-            # Группируем заказы по датам
-            orders_by_date = {}
-            for order in result:
-                order_date = datetime.fromisoformat(order["date"].replace("Z", "+00:00")).date()
-                if order_date not in orders_by_date:
-                    orders_by_date[order_date] = {
-                        "date": order_date,
-                        "revenue": 0.0,
-                        "quantity": 0,
-                        "orders": []
-                    }
-                
-                price = float(order.get("totalPrice", 0))
-                orders_by_date[order_date]["revenue"] += price
-                orders_by_date[order_date]["quantity"] += order.get("quantity", 1)
-                orders_by_date[order_date]["orders"].append(order.get("srid", ""))
-            
-            orders = []
-            for date_key, data in orders_by_date.items():
-                orders.append({
-                    "date": data["date"],
-                    "revenue": data["revenue"],
-                    "quantity": data["quantity"],
-                    "order_id": ", ".join(data["orders"][:5]),
-                    "description": f"Заказы за {date_key.isoformat()}"
-                })
-            
-            return orders
-        except Exception as e:
-            raise Exception(f"Не удалось получить данные о заказах: {str(e)}")
+        return self.group_by_date(SOURCE_ORDERS, self.fetch_window(SOURCE_ORDERS, from_date, to_date))
     
     def test_connection(self) -> bool:
         """Проверить подключение к API"""
@@ -135,7 +258,7 @@ class WildberriesAPI:
             # Простой запрос для проверки
             today = date.today()
             week_ago = today - timedelta(days=7)
-            result = self._make_request("GET", "/api/v1/supplier/orders", {
+            result = self._make_request("GET", ORDERS_ENDPOINT, {
                 "dateFrom": week_ago.isoformat() + "T00:00:00Z",
                 "dateTo": today.isoformat() + "T23:59:59Z"
             })
@@ -143,4 +266,3 @@ class WildberriesAPI:
         except Exception as e:
             print(f"Ошибка проверки подключения Wildberries: {str(e)}")
             return False
-
@@ -0,0 +1,18 @@
+"""
+Массовые операции с учетом диалекта БД
+"""
+from sqlalchemy.orm import Session
+
+def dialect_insert(db: Session, model):
+    """
+    INSERT с поддержкой ON CONFLICT (on_conflict_do_nothing / on_conflict_do_update)
+    для текущего диалекта: PostgreSQL в рабочей БД, SQLite в тестах
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT не поддерживается для диалекта {dialect}")
+    return insert(model)
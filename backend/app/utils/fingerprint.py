@@ -0,0 +1,44 @@
+"""
+Вычисление отпечатков (fingerprint) импортируемых строк для идемпотентного импорта
+"""
+import hashlib
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+def normalize_text(value: Optional[str]) -> str:
+    """Нормализация текста: пустые значения, регистр и лишние пробелы не влияют на отпечаток"""
+    if value is None:
+        return ""
+    text = str(value).strip()
+    if text.lower() == "nan":
+        return ""
+    return " ".join(text.lower().split())
+
+def movement_fingerprint(
+    company_id: Optional[int],
+    movement_date: date,
+    amount,
+    movement_type: str,
+    item_id: Optional[int],
+    payment_place_id: Optional[int],
+    description: Optional[str],
+    occurrence: int = 0
+) -> str:
+    """
+    Отпечаток движения денег по нормализованным ключевым полям.
+    occurrence - порядковый номер одинаковой строки в файле, чтобы
+    одинаковые платежи за один день не схлопывались в один.
+    """
+    normalized_amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    parts = [
+        str(company_id or ""),
+        movement_date.isoformat(),
+        str(normalized_amount),
+        movement_type,
+        str(item_id or ""),
+        str(payment_place_id or ""),
+        normalize_text(description),
+        str(occurrence),
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
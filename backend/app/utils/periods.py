@@ -0,0 +1,71 @@
+"""
+Номера периодов (недель, месяцев) для группировки по датам в SQL с учетом диалекта БД
+"""
+from datetime import date, timedelta
+from typing import List, Tuple
+from sqlalchemy import Integer, cast, extract, func, literal
+from sqlalchemy.orm import Session
+
+PERIOD_WEEK = "week"
+PERIOD_MONTH = "month"
+PERIODS = (PERIOD_WEEK, PERIOD_MONTH)
+
+def _days_since(db: Session, date_column, origin: date):
+    """Число дней от origin до даты (PostgreSQL в рабочей БД, SQLite в тестах)"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return date_column - literal(origin)
+    if dialect == "sqlite":
+        return func.julianday(date_column) - func.julianday(origin.isoformat())
+    raise NotImplementedError(f"Разница дат не поддерживается для диалекта {dialect}")
+
+def period_index(db: Session, date_column, origin: date, period: str):
+    """
+    SQL-выражение номера периода даты, считая от периода origin (0, 1, 2, ...):
+    недели - 7-дневные интервалы от origin, месяцы - календарные месяцы.
+    Даты не раньше origin: номер недели - целочисленное деление числа дней на 7
+    (как // в Python; приведение дробного частного к INTEGER в PostgreSQL округляет)
+    """
+    if period == PERIOD_WEEK:
+        return cast(_days_since(db, date_column, origin), Integer) // 7
+    if period == PERIOD_MONTH:
+        return (
+            (cast(extract('year', date_column), Integer) - origin.year) * 12
+            + cast(extract('month', date_column), Integer) - origin.month
+        )
+    raise ValueError(f"Неизвестный период: {period}")
+
+def period_count(start: date, end: date, period: str) -> int:
+    """Количество периодов в интервале [start, end]"""
+    if period == PERIOD_WEEK:
+        return (end - start).days // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+def period_starts(start: date, end: date, period: str) -> List[date]:
+    """Даты начала периодов интервала [start, end] (для месяцев - первые числа)"""
+    if period == PERIOD_WEEK:
+        return [start + timedelta(days=7 * index) for index in range(period_count(start, end, period))]
+    months = []
+    current = start.replace(day=1)
+    while current <= end:
+        months.append(current)
+        current = (current + timedelta(days=32)).replace(day=1)
+    return months
+
+def period_days(start: date, end: date, period: str) -> List[int]:
+    """
+    Число дней каждого периода, попадающих в интервал [start, end]: у крайних
+    периодов (неполная последняя неделя, первый и последний месяц) их меньше полного
+    """
+    starts = period_starts(start, end, period)
+    days = []
+    for index, period_start in enumerate(starts):
+        next_start = starts[index + 1] if index + 1 < len(starts) else end + timedelta(days=1)
+        days.append((next_start - max(period_start, start)).days)
+    return days
+
+def whole_months(end: date, months: int) -> Tuple[date, date]:
+    """Интервал из months полных календарных месяцев, последний из которых содержит end"""
+    last_day = (end.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    first_month = end.year * 12 + end.month - 1 - (months - 1)
+    return date(first_month // 12, first_month % 12 + 1, 1), last_day
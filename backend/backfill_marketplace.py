@@ -0,0 +1,37 @@
+"""
+Историческая загрузка данных маркетплейса по окнам с контрольными точками
+Повторный запуск с тем же периодом продолжает загрузку с незавершенных окон.
+Использование:
+    python backfill_marketplace.py 3 --start-date 2023-01-01
+    python backfill_marketplace.py 3 --start-date 2023-01-01 --end-date 2024-12-31 --window-days 14 --workers 4
+"""
+import argparse
+from datetime import date
+import app.main  # noqa: F401 - регистрирует все модели
+from app.database import SessionLocal
+from app.services.marketplace_backfill import create_backfill, run_backfill, BACKFILL_WINDOW_DAYS
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Историческая загрузка данных маркетплейса")
+    parser.add_argument("integration_id", type=int)
+    parser.add_argument("--start-date", type=date.fromisoformat, required=True)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None,
+                        help="По умолчанию - сегодня, для Wildberries - день до курсора инкрементальной синхронизации")
+    parser.add_argument("--window-days", type=int, default=BACKFILL_WINDOW_DAYS)
+    parser.add_argument("--workers", type=int, default=None, help="Параллельных окон (по умолчанию - лимит маркетплейса)")
+    parser.add_argument("--windows-per-minute", type=float, default=None, help="Запусков окон в минуту")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        backfill = create_backfill(db, args.integration_id, args.start_date, args.end_date, args.window_days)
+        backfill_id = backfill.id
+    finally:
+        db.close()
+    
+    try:
+        run_backfill(backfill_id, workers=args.workers, windows_per_minute=args.windows_per_minute)
+    except KeyboardInterrupt:
+        print(f"\n[INFO] Загрузка прервана. Продолжить: повторите команду с тем же периодом")
@@ -0,0 +1,17 @@
+"""
+Проверка отклонений факта от бюджета и создание уведомлений
+Использование:
+    python check_budget_deviations.py
+Проверяются только бюджеты, период или данные которых изменились с прошлого запуска;
+запускается планировщиком после загрузки данных (после refresh_budget_actuals.py).
+"""
+import app.main  # noqa: F401 - регистрирует все модели
+from app.database import SessionLocal
+from app.services.notification_service import check_budget_deviations
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        check_budget_deviations(db)
+    finally:
+        db.close()
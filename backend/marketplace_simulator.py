@@ -0,0 +1,224 @@
+"""
+Локальный симулятор API маркетплейсов для нагрузочного тестирования синхронизации
+Имитирует контракты:
+- OZON POST /v3/finance/transaction/list (постраничная выдача, page_count/row_count)
+- Wildberries GET /api/v1/supplier/sales (курсор lastChangeDate, лимит строк в ответе)
+с ограничением частоты запросов (429 + Retry-After) и случайными сбоями (503).
+
+Данные генерируются детерминированно по номеру строки, поэтому объем истории
+не влияет на потребление памяти.
+
+Использование:
+    python marketplace_simulator.py --port 8081 --rows-per-day 2000 --fail-rate 0.02
+    OZON_API_URL=http://127.0.0.1:8081 WB_STATISTICS_API_URL=http://127.0.0.1:8081 uvicorn app.main:app
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+from fastapi import FastAPI, Request, Body
+from fastapi.responses import JSONResponse
+
+WB_MAX_ROWS_PER_RESPONSE = 80000
+
+class SimulatorConfig:
+    """Параметры генерируемых данных и поведения симулятора"""
+
+    def __init__(
+        self,
+        days: int = 30,
+        rows_per_day: int = 1000,
+        requests_per_second: float = 20,
+        fail_rate: float = 0.0,
+        wb_max_rows: int = WB_MAX_ROWS_PER_RESPONSE,
+        latency_ms: int = 0,
+        seed: int = 42
+    ):
+        self.end_date = date.today()
+        self.start_date = self.end_date - timedelta(days=days - 1)
+        self.rows_per_day = rows_per_day
+        self.requests_per_second = requests_per_second
+        self.fail_rate = fail_rate
+        self.wb_max_rows = wb_max_rows
+        self.latency_ms = latency_ms
+        self.seed = seed
+
+    @property
+    def total_rows(self) -> int:
+        return ((self.end_date - self.start_date).days + 1) * self.rows_per_day
+
+class _ClientBucket:
+    """Token bucket на одного клиента API"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Взять токен; вернуть 0 или сколько секунд ждать следующего"""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+def _row_timestamp(config: SimulatorConfig, index: int) -> datetime:
+    """Время строки с номером index: строки равномерно распределены внутри дня"""
+    day = config.start_date + timedelta(days=index // config.rows_per_day)
+    seconds = (index % config.rows_per_day) * 86400 // config.rows_per_day
+    return datetime.combine(day, datetime.min.time()) + timedelta(seconds=seconds)
+
+def _row_price(config: SimulatorConfig, index: int) -> float:
+    return round(random.Random(config.seed * 1_000_003 + index).uniform(100, 5000), 2)
+
+def _day_index_range(config: SimulatorConfig, from_day: date, to_day: date) -> range:
+    """Номера строк за дни from_day..to_day"""
+    first = max(0, (from_day - config.start_date).days) * config.rows_per_day
+    last = min(config.total_rows, ((to_day - config.start_date).days + 1) * config.rows_per_day)
+    return range(first, max(first, last))
+
+def ozon_operation(config: SimulatorConfig, index: int) -> Dict:
+    timestamp = _row_timestamp(config, index)
+    return {
+        "operation_id": 10_000_000 + index,
+        "operation_type": "operation_agent_delivery_to_customer",
+        "operation_date": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        "date": timestamp.isoformat() + "Z",
+        "posting_number": f"SIM-{index // 3:08d}-{index % 3 + 1}",
+        "accruals_for_sale": _row_price(config, index),
+        "amount": _row_price(config, index),
+        "items": [{"name": f"Товар {index % 500}", "sku": 100000 + index % 500}]
+    }
+
+def wb_sale(config: SimulatorConfig, index: int) -> Dict:
+    timestamp = _row_timestamp(config, index).isoformat()
+    price = _row_price(config, index)
+    return {
+        "srid": f"sim.{index}",
+        "saleID": f"S{index}",
+        "date": timestamp,
+        "saleDate": timestamp,
+        "lastChangeDate": timestamp,
+        "supplierArticle": f"ART-{index % 500}",
+        "nmId": 200000 + index % 500,
+        "barcode": f"46000000{index % 500:05d}",
+        "totalPrice": price,
+        "priceWithDisc": round(price * 0.9, 2),
+        "forPay": round(price * 0.75, 2)
+    }
+
+def create_app(config: SimulatorConfig) -> FastAPI:
+    app = FastAPI(title="Marketplace API simulator")
+    buckets: Dict[str, _ClientBucket] = {}
+    lock = threading.Lock()
+    rng = random.Random(config.seed)
+    app.state.stats = {"requests": 0, "throttled": 0, "failed": 0, "rows": 0}
+
+    def _guard(client_key: str):
+        """Лимит частоты и инъекция сбоев; вернуть ответ-ошибку или None"""
+        with lock:
+            app.state.stats["requests"] += 1
+            bucket = buckets.setdefault(client_key, _ClientBucket(config.requests_per_second))
+            wait_seconds = bucket.take()
+            if wait_seconds > 0:
+                app.state.stats["throttled"] += 1
+                return JSONResponse(
+                    status_code=429,
+                    content={"code": 8, "message": "You have reached request rate limit per second"},
+                    headers={"Retry-After": str(math.ceil(wait_seconds))}
+                )
+            if config.fail_rate and rng.random() < config.fail_rate:
+                app.state.stats["failed"] += 1
+                return JSONResponse(status_code=503, content={"message": "Service temporarily unavailable"})
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000)
+        return None
+
+    @app.post("/v3/finance/transaction/list")
+    def ozon_transaction_list(request: Request, body: dict = Body(...)):
+        error = _guard("ozon:" + request.headers.get("Client-Id", ""))
+        if error:
+            return error
+        date_filter = body.get("filter", {}).get("date", {})
+        from_day = datetime.fromisoformat(date_filter["from"].replace("Z", "+00:00")).date()
+        to_day = datetime.fromisoformat(date_filter["to"].replace("Z", "+00:00")).date()
+        page = int(body.get("page", 1))
+        page_size = min(int(body.get("page_size", 1000)), 1000)
+
+        indexes = _day_index_range(config, from_day, to_day)
+        page_indexes = indexes[(page - 1) * page_size:page * page_size]
+        with lock:
+            app.state.stats["rows"] += len(page_indexes)
+        return {
+            "result": {
+                "operations": [ozon_operation(config, index) for index in page_indexes],
+                "page_count": max(1, math.ceil(len(indexes) / page_size)),
+                "row_count": len(indexes)
+            }
+        }
+
+    @app.get("/api/v1/supplier/sales")
+    def wb_sales(request: Request, dateFrom: str, flag: int = 0):
+        error = _guard("wb:" + request.headers.get("Authorization", ""))
+        if error:
+            return error
+        date_from = datetime.fromisoformat(dateFrom.replace("Z", ""))
+        if flag:
+            # flag=1: все продажи за день dateFrom
+            indexes = _day_index_range(config, date_from.date(), date_from.date())
+        else:
+            # flag=0: строки с lastChangeDate >= dateFrom
+            start = datetime.combine(config.start_date, datetime.min.time())
+            offset = max(0.0, (date_from - start).total_seconds())
+            first = math.ceil(offset * config.rows_per_day / 86400)
+            indexes = range(min(first, config.total_rows), min(first + config.wb_max_rows, config.total_rows))
+        with lock:
+            app.state.stats["rows"] += len(indexes)
+        return [wb_sale(config, index) for index in indexes]
+
+    @app.get("/simulator/stats")
+    def simulator_stats():
+        return {**app.state.stats, "total_rows": config.total_rows}
+
+    return app
+
+def run_in_thread(config: SimulatorConfig, port: int):
+    """Запустить симулятор в фоновом потоке, вернуть сервер uvicorn (остановка: server.should_exit = True)"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Симулятор API OZON и Wildberries")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--days", type=int, default=30, help="Глубина истории в днях")
+    parser.add_argument("--rows-per-day", type=int, default=1000, help="Операций в день")
+    parser.add_argument("--rps", type=float, default=20, help="Лимит запросов в секунду на клиента")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument("--latency-ms", type=int, default=0, help="Искусственная задержка ответа")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    import uvicorn
+    args = parse_args()
+    config = SimulatorConfig(
+        days=args.days,
+        rows_per_day=args.rows_per_day,
+        requests_per_second=args.rps,
+        fail_rate=args.fail_rate,
+        latency_ms=args.latency_ms,
+        seed=args.seed
+    )
+    print(f"Симулятор маркетплейсов: {config.total_rows} строк за {config.start_date} - {config.end_date}")
+    uvicorn.run(create_app(config), host="127.0.0.1", port=args.port)
@@ -0,0 +1,37 @@
+"""
+Миграция для проверки отклонений от бюджета по отметкам изменений:
+- таблица budget_change_marks (организация + тип + статья + месяц измененных движений денег)
+
+Отметки ставятся при создании, изменении и удалении движений денег; проверка
+отклонений читает их вместо времени изменения движений, поэтому учитывает
+удаленные движения и прежние статью и месяц измененных.
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS budget_change_marks (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL REFERENCES companies(id),
+                movement_type VARCHAR(20) NOT NULL,
+                item_id INTEGER NOT NULL,
+                month DATE NOT NULL,
+                marked_at TIMESTAMP NOT NULL
+            )
+        """))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_budget_change_marks_key
+            ON budget_change_marks(company_id, movement_type, item_id, month)
+        """))
+        print("✅ Таблица budget_change_marks создана")
+        
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Проверка отклонений: python check_budget_deviations.py")
+
+if __name__ == "__main__":
+    migrate()
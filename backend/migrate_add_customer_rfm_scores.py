@@ -0,0 +1,37 @@
+"""
+Миграция для оценок RFM клиентов:
+- r_score, f_score, m_score (квинтили 1-5 по организации) и rfm_segment в customers
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+COLUMNS = {
+    "r_score": "INTEGER",
+    "f_score": "INTEGER",
+    "m_score": "INTEGER",
+    "rfm_segment": "VARCHAR(3)",
+}
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        for column, column_type in COLUMNS.items():
+            result = conn.execute(text("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name = 'customers' AND column_name = :column
+            """), {"column": column})
+
+            if result.fetchone():
+                print(f"⚠️  Поле {column} уже существует")
+            else:
+                conn.execute(text(f"ALTER TABLE customers ADD COLUMN {column} {column_type}"))
+                print(f"✅ Добавлено поле {column}")
+
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Рассчитайте метрики клиентов: python recompute_customer_metrics.py")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,56 @@
+"""
+Миграция для исторической загрузки маркетплейсов:
+- таблица marketplace_backfills (задачи загрузки и прогресс)
+- таблица marketplace_backfill_windows (контрольные точки по окнам)
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS marketplace_backfills (
+                id SERIAL PRIMARY KEY,
+                integration_id INTEGER NOT NULL REFERENCES marketplace_integrations(id) ON DELETE CASCADE,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL,
+                window_days INTEGER NOT NULL,
+                status VARCHAR NOT NULL DEFAULT 'pending',
+                windows_total INTEGER DEFAULT 0,
+                windows_done INTEGER DEFAULT 0,
+                rows_fetched INTEGER DEFAULT 0,
+                last_error TEXT,
+                started_at TIMESTAMP WITH TIME ZONE,
+                finished_at TIMESTAMP WITH TIME ZONE,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP WITH TIME ZONE
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_backfills_integration_id ON marketplace_backfills(integration_id)"))
+        
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS marketplace_backfill_windows (
+                id SERIAL PRIMARY KEY,
+                backfill_id INTEGER NOT NULL REFERENCES marketplace_backfills(id) ON DELETE CASCADE,
+                window_start DATE NOT NULL,
+                window_end DATE NOT NULL,
+                status VARCHAR NOT NULL DEFAULT 'pending',
+                rows_fetched INTEGER DEFAULT 0,
+                pages INTEGER DEFAULT 0,
+                error TEXT,
+                finished_at TIMESTAMP WITH TIME ZONE
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_backfill_windows_backfill_id ON marketplace_backfill_windows(backfill_id)"))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_marketplace_backfill_windows_backfill_start
+            ON marketplace_backfill_windows(backfill_id, window_start)
+        """))
+        
+        conn.commit()
+        print("✅ Таблицы marketplace_backfills и marketplace_backfill_windows созданы")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,43 @@
+"""
+Миграция для промежуточного хранения сырых ответов API маркетплейсов:
+- таблица marketplace_payloads (сжатые страницы ответов, отметка обработки)
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS marketplace_payloads (
+                id SERIAL PRIMARY KEY,
+                integration_id INTEGER NOT NULL REFERENCES marketplace_integrations(id) ON DELETE CASCADE,
+                source VARCHAR NOT NULL,
+                page_key VARCHAR NOT NULL,
+                window_start DATE NOT NULL,
+                window_end DATE NOT NULL,
+                next_cursor VARCHAR,
+                row_count INTEGER DEFAULT 0,
+                payload BYTEA NOT NULL,
+                fetched_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                processed_at TIMESTAMP WITH TIME ZONE,
+                process_error TEXT
+            )
+        """))
+        
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_payloads_integration_id ON marketplace_payloads(integration_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_payloads_window_start ON marketplace_payloads(window_start)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_payloads_window_end ON marketplace_payloads(window_end)"))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_marketplace_payloads_integration_source_page
+            ON marketplace_payloads(integration_id, source, page_key)
+        """))
+        
+        conn.commit()
+        print("✅ Таблица marketplace_payloads создана")
+        print("Инкрементальные итоги Wildberries теперь хранятся по загруженным страницам;")
+        print("для пересчета старых данных выполните полную синхронизацию периода (с указанием start_date).")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,50 @@
+"""
+Миграция для позиционной синхронизации маркетплейсов:
+- таблица marketplace_products (артикул маркетплейса -> товар)
+- post_inventory в marketplace_integrations (списание проданных товаров со склада)
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS marketplace_products (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL REFERENCES companies(id),
+                marketplace VARCHAR NOT NULL,
+                article VARCHAR NOT NULL,
+                seller_article VARCHAR,
+                name VARCHAR,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP WITH TIME ZONE
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_products_company_id ON marketplace_products(company_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_marketplace_products_product_id ON marketplace_products(product_id)"))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_marketplace_products_company_marketplace_article
+            ON marketplace_products(company_id, marketplace, article)
+        """))
+        print("✅ Таблица marketplace_products создана")
+        
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'marketplace_integrations' AND column_name = 'post_inventory'
+        """))
+        if not result.fetchone():
+            conn.execute(text("ALTER TABLE marketplace_integrations ADD COLUMN post_inventory BOOLEAN DEFAULT FALSE"))
+            print("✅ Добавлено поле post_inventory")
+        else:
+            print("⚠️  Поле post_inventory уже существует")
+        
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Позиции по уже загруженным реализациям: python replay_marketplace_payloads.py <id интеграции>")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,32 @@
+"""
+Миграция для идемпотентного импорта движения денег:
+- fingerprint в money_movements (хеш ключевых полей строки) с индексом
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'money_movements' AND column_name = 'fingerprint'
+        """))
+
+        if result.fetchone():
+            print("⚠️  Поле fingerprint уже существует")
+        else:
+            print("Добавляем fingerprint в money_movements...")
+            conn.execute(text("ALTER TABLE money_movements ADD COLUMN fingerprint VARCHAR(64)"))
+            print("✅ Добавлено поле fingerprint")
+
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_money_movements_fingerprint ON money_movements(fingerprint)"))
+
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Ранее импортированные записи не имеют отпечатка и не участвуют в проверке дубликатов.")
+
+if __name__ == "__main__":
+    migrate()
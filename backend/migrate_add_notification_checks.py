@@ -0,0 +1,36 @@
+"""
+Миграция для инкрементальной проверки отклонений от бюджета:
+- таблица notification_checks (время последнего запуска проверки)
+- индексы по времени изменения движений денег и бюджетов
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS notification_checks (
+                name VARCHAR(100) PRIMARY KEY,
+                checked_at TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        """))
+        print("✅ Таблица notification_checks создана")
+
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_money_movements_changed_at
+            ON money_movements ((COALESCE(updated_at, created_at)))
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_budgets_changed_at
+            ON budgets ((COALESCE(updated_at, created_at)))
+        """))
+        print("✅ Индексы по времени изменения созданы")
+        
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Проверка отклонений: python check_budget_deviations.py")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,114 @@
+"""
+Миграция для пакетной синхронизации реализаций с маркетплейсами:
+- external_id в realizations (маркетплейс + номер отправления или день)
+- external_id ранее синхронизированных реализаций - в том же формате, что формирует
+  синхронизация (ozon:<отправление>, ozon:day:<дата>, wb:sales|orders:<дата>), иначе
+  повторная синхронизация добавит к ним новые строки и выручка удвоится;
+  строки с одинаковым ключом объединяются в одну (суммы складываются)
+- уникальный индекс (company_id, external_id) для INSERT ... ON CONFLICT
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def synced_key(channel_name: str, description: str):
+    """
+    external_id ранее синхронизированной реализации по каналу продаж (маркетплейс)
+    и описанию, которое записывала синхронизация; None - реализация не из синхронизации
+    """
+    channel_name = (channel_name or "").lower()
+    description = description or ""
+    if "ozon" in channel_name:
+        if description.startswith("Заказ ") and description[len("Заказ "):].strip():
+            return f"ozon:{description[len('Заказ '):].strip()}"
+        if description.startswith("Продажи за "):
+            return f"ozon:day:{description[len('Продажи за '):].strip()}"
+    elif "wildberries" in channel_name or "wb" in channel_name:
+        if description.startswith("Продажи за "):
+            return f"wb:sales:{description[len('Продажи за '):].strip()}"
+        if description.startswith("Заказы за "):
+            return f"wb:orders:{description[len('Заказы за '):].strip()}"
+    return None
+
+def backfill_external_ids(conn) -> tuple:
+    """Заполнить external_id синхронизированных реализаций; вернуть (заполнено, объединено строк)"""
+    rows = conn.execute(text("""
+        SELECT r.id, r.company_id, sc.name, r.description, r.revenue, r.quantity
+        FROM realizations r
+        JOIN sales_channels sc ON sc.id = r.sales_channel_id
+        WHERE r.external_id IS NULL
+        ORDER BY r.id
+    """)).fetchall()
+    existing = {
+        (company_id, external_id)
+        for company_id, external_id in conn.execute(text(
+            "SELECT company_id, external_id FROM realizations WHERE external_id IS NOT NULL"
+        ))
+    }
+
+    groups = {}
+    for realization_id, company_id, channel_name, description, revenue, quantity in rows:
+        key = synced_key(channel_name, description)
+        if key:
+            groups.setdefault((company_id, key), []).append((realization_id, revenue or 0, quantity or 0))
+
+    filled = merged = 0
+    for (company_id, key), group in groups.items():
+        ids = [realization_id for realization_id, _, _ in group]
+        if (company_id, key) in existing:
+            # Уже загружено синхронизацией с ключом - старые строки только удваивают выручку
+            keep_id, duplicate_ids = None, ids
+        else:
+            keep_id, duplicate_ids = ids[0], ids[1:]
+            conn.execute(text("""
+                UPDATE realizations SET external_id = :external_id, revenue = :revenue, quantity = :quantity
+                WHERE id = :id
+            """), {
+                "id": keep_id,
+                "external_id": key,
+                "revenue": sum(revenue for _, revenue, _ in group),
+                "quantity": sum(quantity for _, _, quantity in group)
+            })
+            filled += 1
+        if duplicate_ids:
+            if keep_id is not None:
+                conn.execute(text(
+                    "UPDATE realization_items SET realization_id = :keep_id WHERE realization_id = ANY(:ids)"
+                ), {"keep_id": keep_id, "ids": duplicate_ids})
+            else:
+                conn.execute(text("DELETE FROM realization_items WHERE realization_id = ANY(:ids)"), {"ids": duplicate_ids})
+            conn.execute(text("DELETE FROM realizations WHERE id = ANY(:ids)"), {"ids": duplicate_ids})
+            merged += len(duplicate_ids)
+    return filled, merged
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'realizations' AND column_name = 'external_id'
+        """))
+
+        if result.fetchone():
+            print("⚠️  Поле external_id уже существует")
+        else:
+            print("Добавляем external_id в realizations...")
+            conn.execute(text("ALTER TABLE realizations ADD COLUMN external_id VARCHAR"))
+            print("✅ Добавлено поле external_id")
+
+        filled, merged = backfill_external_ids(conn)
+        print(f"✅ Заполнен external_id ранее синхронизированных реализаций: {filled}")
+        print(f"✅ Удалено повторяющихся строк (объединены по ключу): {merged}")
+
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_realizations_company_external_id
+            ON realizations(company_id, external_id)
+        """))
+        print("✅ Создан уникальный индекс (company_id, external_id)")
+
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,32 @@
+"""
+Миграция для инкрементального обновления рекомендаций:
+- таблица recommendation_dirty_marks (организация + измененная область данных)
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS recommendation_dirty_marks (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL REFERENCES companies(id),
+                domain VARCHAR(50) NOT NULL,
+                marked_at TIMESTAMP NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recommendation_dirty_marks_company_id ON recommendation_dirty_marks(company_id)"))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_recommendation_dirty_marks_company_domain
+            ON recommendation_dirty_marks(company_id, domain)
+        """))
+        print("✅ Таблица recommendation_dirty_marks создана")
+        
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Обновление рекомендаций: python refresh_recommendations.py --interval 300")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,37 @@
+"""
+Миграция для аренды синхронизации маркетплейсов:
+- sync_lease_owner и sync_lease_expires_at в marketplace_integrations
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+COLUMNS = {
+    'sync_lease_owner': 'VARCHAR',
+    'sync_lease_expires_at': 'TIMESTAMP',
+}
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'marketplace_integrations' AND column_name IN ('sync_lease_owner', 'sync_lease_expires_at')
+        """))
+        existing_columns = {row[0] for row in result}
+
+        for column, column_type in COLUMNS.items():
+            if column not in existing_columns:
+                print(f"Добавляем {column} в marketplace_integrations...")
+                conn.execute(text(f"ALTER TABLE marketplace_integrations ADD COLUMN {column} {column_type}"))
+                print(f"✅ Добавлено поле {column}")
+            else:
+                print(f"⚠️  Поле {column} уже существует")
+
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Интеграции, зависшие в статусе in_progress, будут синхронизированы в следующем цикле планировщика.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,32 @@
+"""
+Миграция для инкрементальной синхронизации Wildberries:
+- wb_sales_cursor и wb_orders_cursor в marketplace_integrations (lastChangeDate последней загруженной строки)
+"""
+from sqlalchemy import create_engine, text
+from app.database import settings
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'marketplace_integrations' AND column_name IN ('wb_sales_cursor', 'wb_orders_cursor')
+        """))
+        existing_columns = {row[0] for row in result}
+
+        for column in ('wb_sales_cursor', 'wb_orders_cursor'):
+            if column not in existing_columns:
+                print(f"Добавляем {column} в marketplace_integrations...")
+                conn.execute(text(f"ALTER TABLE marketplace_integrations ADD COLUMN {column} VARCHAR"))
+                print(f"✅ Добавлено поле {column}")
+            else:
+                print(f"⚠️  Поле {column} уже существует")
+
+        conn.commit()
+        print("\n✅ Миграция успешно выполнена!")
+        print("Первая синхронизация после миграции загрузит данные с начала периода, дальше - только изменения.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,43 @@
+"""
+Миграция для общих итогов дня Wildberries:
+- период сохраненных инкрементальных страниц WB (page_key cursor:...) заменяется
+  диапазоном дат их строк, чтобы при пересчете итога дня находились все страницы с этим днем
+
+Итоги отдельных страниц (wb:<вид>:<дата>:p<id>) удаляются при повторной обработке:
+    python replay_marketplace_payloads.py <id интеграции> --workers 1
+"""
+import gzip
+import json
+from sqlalchemy import create_engine, text
+from app.database import settings
+from app.services.wb_api import WildberriesAPI
+
+def migrate():
+    engine = create_engine(settings.database_url)
+
+    with engine.connect() as conn:
+        payloads = conn.execute(text("""
+            SELECT id, source, payload
+            FROM marketplace_payloads
+            WHERE source IN ('wb_sales', 'wb_orders') AND page_key LIKE 'cursor:%'
+        """)).fetchall()
+
+        updated = 0
+        for payload_id, source, payload in payloads:
+            rows = json.loads(gzip.decompress(payload).decode("utf-8"))
+            if not rows:
+                continue
+            days = [WildberriesAPI.row_date(source, row) for row in rows]
+            conn.execute(text("""
+                UPDATE marketplace_payloads SET window_start = :window_start, window_end = :window_end
+                WHERE id = :id
+            """), {"id": payload_id, "window_start": min(days), "window_end": max(days)})
+            updated += 1
+
+        conn.commit()
+        print(f"✅ Обновлен период инкрементальных страниц WB: {updated}")
+        print("\n✅ Миграция успешно выполнена!")
+        print("Пересчет итогов дней: python replay_marketplace_payloads.py <id интеграции> --workers 1")
+
+if __name__ == "__main__":
+    migrate()
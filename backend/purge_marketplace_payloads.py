@@ -0,0 +1,29 @@
+"""
+Очистка сохраненных ответов API маркетплейсов (marketplace_payloads) по сроку хранения
+Использование:
+    python purge_marketplace_payloads.py                   # все интеграции, срок по умолчанию
+    python purge_marketplace_payloads.py --days 30 --integration-id 3
+Обработанные страницы старше срока удаляются, страницы Wildberries сворачиваются
+в архивные страницы по месяцам. Запускается планировщиком раз в сутки.
+"""
+import argparse
+import time
+import app.main  # noqa: F401 - регистрирует все модели
+from app.database import SessionLocal
+from app.services.marketplace_staging import purge_staged_payloads, PAYLOAD_RETENTION_DAYS
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Очистка сохраненных страниц API маркетплейсов")
+    parser.add_argument("--days", type=int, default=PAYLOAD_RETENTION_DAYS, help="Срок хранения обработанных страниц")
+    parser.add_argument("--integration-id", type=int, default=None, help="Только указанная интеграция")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = purge_staged_payloads(db, retention_days=args.days, integration_id=args.integration_id)
+        print(f"[SYNC] Очистка завершена за {time.perf_counter() - started:.2f} с: {result}")
+    finally:
+        db.close()
@@ -0,0 +1,32 @@
+"""
+Пакетный пересчет метрик и RFM-оценок клиентов
+Использование:
+    python recompute_customer_metrics.py                 # все организации
+    python recompute_customer_metrics.py --company-id 1
+"""
+import argparse
+import time
+import app.main  # noqa: F401 - регистрирует все модели
+from app.database import SessionLocal
+from app.models.reference import Company
+from app.services.customer_metrics import recompute_customer_metrics
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пересчет метрик и RFM-оценок клиентов")
+    parser.add_argument("--company-id", type=int, default=None, help="Только указанная организация")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        company_ids = [args.company_id] if args.company_id else [row.id for row in db.query(Company.id).all()]
+        for company_id in company_ids:
+            started = time.perf_counter()
+            result = recompute_customer_metrics(db, company_id=company_id)
+            print(
+                f"[CUSTOMERS] Организация {company_id}: клиентов {result['customers']}, "
+                f"с покупками {result['with_purchases']}, за {time.perf_counter() - started:.2f} с"
+            )
+    finally:
+        db.close()
@@ -0,0 +1,28 @@
+"""
+Пакетный пересчет фактических сумм бюджетов (budgets.actual_amount)
+Использование:
+    python refresh_budget_actuals.py                       # все бюджеты
+    python refresh_budget_actuals.py --company-id 1 --period 2024-01
+Запускается планировщиком после загрузки данных (импорт, синхронизация маркетплейсов).
+"""
+import argparse
+import time
+import app.main  # noqa: F401 - регистрирует все модели
+from app.database import SessionLocal
+from app.services.budget_actuals import refresh_budget_actuals
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пересчет фактических сумм бюджетов")
+    parser.add_argument("--company-id", type=int, default=None, help="Только указанная организация")
+    parser.add_argument("--period", default=None, help="Только бюджеты периода (2024-01, 2024-Q1, 2024)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        updated = refresh_budget_actuals(db, company_id=args.company_id, period_value=args.period)
+        print(f"[BUDGET] Обновлено бюджетов: {updated}, за {time.perf_counter() - started:.2f} с")
+    finally:
+        db.close()
@@ -0,0 +1,28 @@
+"""
+Инкрементальное обновление рекомендаций по измененным данным
+Использование:
+    python refresh_recommendations.py              # один проход
+    python refresh_recommendations.py --interval 300
+Перезапускаются только правила, зависящие от измененных областей данных
+(движения денег, продажи, склад, бюджеты) отмеченных организаций.
+"""
+import argparse
+import app.main  # noqa: F401 - регистрирует все модели
+from app.services.recommendation_jobs import RECOMMENDATION_WORKERS
+from app.services.recommendation_refresh import refresh_dirty_recommendations, run_refresh_loop
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обновление рекомендаций по измененным данным")
+    parser.add_argument("--interval", type=int, default=None, help="Повторять каждые N секунд")
+    parser.add_argument("--workers", type=int, default=RECOMMENDATION_WORKERS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.interval:
+        try:
+            run_refresh_loop(args.interval)
+        except KeyboardInterrupt:
+            print("\n[INFO] Обновление рекомендаций остановлено пользователем")
+    else:
+        print(f"[RECOMMENDATIONS] {refresh_dirty_recommendations(workers=args.workers)}")
@@ -0,0 +1,33 @@
+"""
+Повторная обработка сохраненных ответов API маркетплейсов без сетевых запросов
+Использование:
+    python replay_marketplace_payloads.py 3
+    python replay_marketplace_payloads.py 3 --start-date 2024-01-01 --end-date 2024-01-31 --workers 8
+    python replay_marketplace_payloads.py 3 --only-unprocessed
+"""
+import argparse
+import time
+from datetime import date
+import app.main  # noqa: F401 - регистрирует все модели
+from app.services.marketplace_staging import process_staged_payloads, REPLAY_WORKERS
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Повторная обработка сохраненных страниц API маркетплейсов")
+    parser.add_argument("integration_id", type=int)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=None)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None)
+    parser.add_argument("--only-unprocessed", action="store_true", help="Только страницы, которые не удалось обработать")
+    parser.add_argument("--workers", type=int, default=REPLAY_WORKERS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    started = time.perf_counter()
+    result = process_staged_payloads(
+        args.integration_id,
+        args.start_date,
+        args.end_date,
+        only_unprocessed=args.only_unprocessed,
+        workers=args.workers
+    )
+    print(f"[SYNC] Повторная обработка завершена за {time.perf_counter() - started:.2f} с: {result}")
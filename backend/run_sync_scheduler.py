@@ -1,6 +1,8 @@
 """
 Скрипт для запуска планировщика автоматической синхронизации
 Использование: python run_sync_scheduler.py
+Можно запускать несколько экземпляров (в том числе на разных хостах):
+каждая интеграция синхронизируется только под арендой одного процесса.
 """
 from app.services.sync_scheduler import run_scheduler
 
@@ -0,0 +1,254 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import pytest
+from app.models.reference import Company, SalesChannel
+from app.models.user_company import UserCompany
+from app.models.customer import Customer
+from app.models.warehouse import Warehouse
+from app.models.realization import Realization, RealizationItem
+from app.models.product import Product
+from app.services import revenue_forecast
+from app.services.anomaly_detection import evaluation_months
+
+@pytest.fixture
+def sales_history(db, test_user):
+    """Создает организацию с месячной выручкой за 30 месяцев (рост + сезонность)"""
+    company = Company(name="Тестовая организация")
+    channel = SalesChannel(name="Розница")
+    db.add_all([company, channel])
+    db.commit()
+    customer = Customer(company_id=company.id, name="Покупатель")
+    warehouse = Warehouse(company_id=company.id, name="Основной склад")
+    db.add_all([customer, warehouse, UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN")])
+    db.commit()
+
+    for index, month in enumerate(evaluation_months(date.today(), 30)):
+        revenue = 100000 + 2000 * index + (15000 if month.month == 12 else 0) + 1000 * (index % 4)
+        db.add(Realization(
+            date=month, company_id=company.id, sales_channel_id=channel.id, customer_id=customer.id,
+            warehouse_id=warehouse.id, revenue=Decimal(revenue), quantity=1
+        ))
+    db.commit()
+    revenue_forecast.clear_forecast_cache()
+    return company
+
+def test_forecast_revenue_with_intervals(client, auth_headers, db, sales_history):
+    """Тест прогноза выручки: сезонная модель, интервалы и кеш до появления новых данных"""
+    response = client.get(f"/api/analytics/forecast/revenue?months=3&company_id={sales_history.id}", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["method"] == "holt_winters"
+    assert len(data["forecast"]) == 3
+    assert len(data["channels"]) == 1
+    for row in data["forecast"]:
+        assert row["lower_bound"] <= row["forecasted_revenue"] <= row["upper_bound"]
+        assert row["forecasted_revenue"] > 100000
+
+    cached = revenue_forecast._cache[sales_history.id]["result"]
+    client.get(f"/api/analytics/forecast/revenue?company_id={sales_history.id}", headers=auth_headers)
+    assert revenue_forecast._cache[sales_history.id]["result"] is cached
+
+    # Новая реализация за завершенный месяц меняет ряд - модель подбирается заново
+    realization = db.query(Realization).first()
+    realization.revenue += 5000
+    db.commit()
+    client.get(f"/api/analytics/forecast/revenue?company_id={sales_history.id}", headers=auth_headers)
+    assert revenue_forecast._cache[sales_history.id]["result"] is not cached
+
+def test_abc_xyz_uses_demand_variability(client, auth_headers, db, sales_history):
+    """Тест ABC/XYZ: стабильный спрос - X, продажи одной неделей - Z"""
+    steady = Product(name="Стабильный", sku="ST-1", cost_price=Decimal("10"), selling_price=Decimal("100"))
+    burst = Product(name="Разовый", sku="BR-1", cost_price=Decimal("10"), selling_price=Decimal("100"))
+    db.add_all([steady, burst])
+    db.commit()
+
+    start = date.today() - timedelta(days=27)
+    realization = db.query(Realization).first()
+    for week in range(4):
+        sale = Realization(
+            date=start + timedelta(days=7 * week), company_id=sales_history.id,
+            sales_channel_id=realization.sales_channel_id, customer_id=realization.customer_id,
+            warehouse_id=realization.warehouse_id, revenue=Decimal("1000"), quantity=10
+        )
+        sale.items.append(RealizationItem(product_id=steady.id, quantity=10, price=Decimal("100"), cost_price=Decimal("10")))
+        if week == 2:
+            sale.items.append(RealizationItem(product_id=burst.id, quantity=3, price=Decimal("100"), cost_price=Decimal("10")))
+        db.add(sale)
+    db.commit()
+
+    response = client.get(
+        f"/api/analytics/abc-xyz-analysis?company_id={sales_history.id}&start_date={start.isoformat()}&end_date={date.today().isoformat()}",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["periods"] == 4
+    classes = {row["sku"]: row for row in data["analysis"]}
+    assert classes["ST-1"]["abc_xyz"] == "AX"
+    assert classes["ST-1"]["coefficient_of_variation"] == 0
+    assert classes["BR-1"]["xyz_class"] == "Z"
+
+def test_abc_xyz_normalizes_partial_months(client, auth_headers, db, sales_history):
+    """Тест XYZ по месяцам: ежедневные продажи остаются X, хотя крайние месяцы захвачены не целиком"""
+    daily = Product(name="Ежедневный", sku="DL-1", cost_price=Decimal("10"), selling_price=Decimal("100"))
+    db.add(daily)
+    db.commit()
+
+    realization = db.query(Realization).first()
+    start, end = date(2023, 1, 20), date(2023, 4, 10)
+    day = start - timedelta(days=30)
+    while day <= end + timedelta(days=30):
+        sale = Realization(
+            date=day, company_id=sales_history.id, sales_channel_id=realization.sales_channel_id,
+            customer_id=realization.customer_id, warehouse_id=realization.warehouse_id,
+            revenue=Decimal("100"), quantity=1
+        )
+        sale.items.append(RealizationItem(product_id=daily.id, quantity=1, price=Decimal("100"), cost_price=Decimal("10")))
+        db.add(sale)
+        day += timedelta(days=1)
+    db.commit()
+
+    response = client.get(
+        f"/api/analytics/abc-xyz-analysis?company_id={sales_history.id}&start_date={start.isoformat()}&end_date={end.isoformat()}&period=month",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = response.json()
+    # Январь с 20-го, февраль, март и апрель до 10-го: 12, 28, 31 и 10 продаж
+    assert data["periods"] == 4
+    row = next(row for row in data["analysis"] if row["sku"] == "DL-1")
+    assert row["quantity"] == 81
+    assert row["coefficient_of_variation"] == 0
+    assert row["xyz_class"] == "X"
+
+    # Окно по умолчанию для месяцев - три полных прошедших месяца
+    last_month_end = date.today().replace(day=1) - timedelta(days=1)
+    sale = Realization(
+        date=last_month_end, company_id=sales_history.id, sales_channel_id=realization.sales_channel_id,
+        customer_id=realization.customer_id, warehouse_id=realization.warehouse_id, revenue=Decimal("100"), quantity=1
+    )
+    sale.items.append(RealizationItem(product_id=daily.id, quantity=1, price=Decimal("100"), cost_price=Decimal("10")))
+    db.add(sale)
+    db.commit()
+    response = client.get(f"/api/analytics/abc-xyz-analysis?company_id={sales_history.id}&period=month", headers=auth_headers)
+    data = response.json()
+    assert data["periods"] == 3
+    assert data["period"]["end"] == last_month_end.isoformat()
+    assert date.fromisoformat(data["period"]["start"]).day == 1
+
+def test_week_index_is_floor_division(db):
+    """Тест номера недели в SQL: целочисленное деление без округления, в том числе в PostgreSQL"""
+    from types import SimpleNamespace
+    from sqlalchemy import Date, column, literal, select
+    from sqlalchemy.dialects import postgresql
+    from app.utils.periods import period_index, PERIOD_WEEK
+
+    origin = date(2024, 1, 1)
+    postgres = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=postgresql.dialect()))
+    sql = str(period_index(postgres, column("day", Date), origin, PERIOD_WEEK).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    ))
+    # Разность дат приводится к INTEGER до деления: INTEGER / INTEGER в PostgreSQL отбрасывает остаток
+    assert sql == "CAST(day - '2024-01-01' AS INTEGER) / 7"
+    assert "NUMERIC" not in sql
+
+    # Дни 4-6 недели остаются в своей неделе
+    for offset in range(15):
+        day = origin + timedelta(days=offset)
+        assert db.execute(select(period_index(db, literal(day, Date), origin, PERIOD_WEEK))).scalar() == offset // 7
+
+def test_compare_many_periods_with_previous_year(client, auth_headers, db, sales_history):
+    """Тест сравнения N периодов: помесячная выручка и те же месяцы прошлого года"""
+    months = evaluation_months(date.today(), 3)
+    periods = [
+        {"start": month.isoformat(), "end": ((month + timedelta(days=32)).replace(day=1) - timedelta(days=1)).isoformat()}
+        for month in months
+    ]
+    response = client.post("/api/analytics/comparison/periods", json={
+        "periods": periods,
+        "company_id": sales_history.id,
+        "previous_year": True
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()["periods"]
+    assert len(data) == 3
+
+    revenue = {
+        realization.date: float(realization.revenue)
+        for realization in db.query(Realization).filter(Realization.company_id == sales_history.id)
+    }
+    for row, month in zip(data, months):
+        assert row["revenue"] == revenue[month]
+        assert row["previous_year"]["revenue"] == revenue[month.replace(year=month.year - 1)]
+        assert row["previous_year_changes"]["revenue"] > 0
+    assert data[0]["changes"]["revenue"] == 0
+
+    response = client.get(
+        f"/api/analytics/comparison/periods?period1_start={periods[0]['start']}&period1_end={periods[0]['end']}"
+        f"&period2_start={periods[1]['start']}&period2_end={periods[1]['end']}",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["period2"]["revenue"] == revenue[months[1]]
+
+def test_cohort_retention(client, auth_headers, db, sales_history):
+    """Тест когорт: клиент фикстуры покупает каждый месяц, новый клиент - только в первый месяц"""
+    realization = db.query(Realization).first()
+    newcomer = Customer(company_id=sales_history.id, name="Новый покупатель")
+    db.add(newcomer)
+    db.commit()
+    months = evaluation_months(date.today(), 3)
+    db.add(Realization(
+        date=months[0], company_id=sales_history.id, sales_channel_id=realization.sales_channel_id,
+        customer_id=newcomer.id, warehouse_id=realization.warehouse_id, revenue=Decimal("500"), quantity=1
+    ))
+    db.commit()
+
+    response = client.get(f"/api/analytics/cohorts?company_id={sales_history.id}&cohorts=2", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    oldest, newest = data["cohorts"]
+    # Последняя когорта - месяц первой покупки нового клиента (3 завершенных месяца + текущий)
+    assert newest["cohort"] == months[0].isoformat()
+    assert newest["customers"] == 1
+    assert newest["retention"] == [100.0, 0.0, 0.0, 0.0]
+    assert newest["revenue"][0] == 500.0
+    # Когорта клиента фикстуры: 30 месяцев назад, активен каждый завершенный месяц
+    assert oldest["customers"] == 1
+    assert oldest["retention"][:30] == [100.0] * 30
+    assert oldest["retention"][30] == 0.0
+
+def test_weekly_cohorts_keep_late_week_days(db):
+    """Тест недельных когорт: покупки в пятницу-воскресенье относятся к своей неделе, а не к следующей"""
+    from app.services.cohorts import cohort_analysis, load_activity, period_number, PERIOD_WEEK
+
+    company = Company(name="Недельная организация")
+    channel = SalesChannel(name="Розница")
+    db.add_all([company, channel])
+    db.commit()
+    first, second = Customer(company_id=company.id, name="Первый"), Customer(company_id=company.id, name="Второй")
+    warehouse = Warehouse(company_id=company.id, name="Основной склад")
+    db.add_all([first, second, warehouse])
+    db.commit()
+
+    monday = date(2024, 3, 4)
+    purchases = [
+        (first, monday + timedelta(days=5)),   # суббота первой недели
+        (first, monday + timedelta(days=13)),  # воскресенье второй недели
+        (second, monday + timedelta(days=11)), # пятница второй недели
+    ]
+    for customer, day in purchases:
+        db.add(Realization(
+            date=day, company_id=company.id, sales_channel_id=channel.id, customer_id=customer.id,
+            warehouse_id=warehouse.id, revenue=Decimal("100"), quantity=1
+        ))
+    db.commit()
+
+    # Номер недели в SQL совпадает с номером, по которому строятся подписи когорт
+    activity = load_activity(db, company.id, period=PERIOD_WEEK)
+    assert sorted(activity["period"].tolist()) == sorted(period_number(day, PERIOD_WEEK) for _, day in purchases)
+
+    data = cohort_analysis(db, company.id, period=PERIOD_WEEK, today=monday + timedelta(days=13))
+    assert [row["cohort"] for row in data["cohorts"]] == [monday.isoformat(), (monday + timedelta(days=7)).isoformat()]
+    assert data["cohorts"][0]["retention"] == [100.0, 100.0]
+    assert data["cohorts"][1]["retention"] == [100.0]
@@ -0,0 +1,255 @@
+from datetime import date, datetime
+from decimal import Decimal
+import pytest
+from app.models.reference import Company, ExpenseItem, IncomeItem, PaymentPlace, SalesChannel
+from app.models.customer import Customer
+from app.models.warehouse import Warehouse
+from app.models.realization import Realization
+from app.models.input1 import MoneyMovement
+from app.models.budget import Budget, BudgetPeriod, BudgetType
+from app.models.budget_scenario import BudgetScenario
+from app.models.user_company import UserCompany
+from app.models.notification import Notification, NotificationCheck, BudgetChangeMark
+from app.services.notification_service import check_budget_deviations, budget_change_key, mark_budget_changes
+
+@pytest.fixture
+def budget_data(db, test_user):
+    """Организация с бюджетами 2024 года и движениями денег по статьям"""
+    company = Company(name="Тестовая организация")
+    rent = ExpenseItem(name="Аренда")
+    salary = ExpenseItem(name="Зарплата")
+    sales = IncomeItem(name="Продажи")
+    payment_place = PaymentPlace(name="Расчетный счет")
+    db.add_all([company, rent, salary, sales, payment_place])
+    db.commit()
+    db.add(UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN"))
+
+    movements = [
+        (date(2024, 1, 10), "1000", "expense", rent),
+        (date(2024, 1, 31), "500", "expense", rent),
+        (date(2024, 2, 1), "700", "expense", rent),
+        (date(2024, 1, 15), "3000", "expense", salary),
+        (date(2024, 3, 20), "9000", "income", sales),
+        (date(2023, 12, 31), "100", "expense", rent),
+    ]
+    for day, amount, movement_type, item in movements:
+        db.add(MoneyMovement(
+            date=day, amount=Decimal(amount), movement_type=movement_type, company_id=company.id,
+            payment_place_id=payment_place.id,
+            income_item_id=item.id if movement_type == "income" else None,
+            expense_item_id=item.id if movement_type == "expense" else None
+        ))
+
+    budgets = {
+        "rent_january": Budget(company_id=company.id, period_type=BudgetPeriod.MONTH, period_value="2024-01",
+                               budget_type=BudgetType.EXPENSE, expense_item_id=rent.id, planned_amount=Decimal("1000")),
+        "expenses_january": Budget(company_id=company.id, period_type=BudgetPeriod.MONTH, period_value="2024-01",
+                                   budget_type=BudgetType.EXPENSE, planned_amount=Decimal("5000")),
+        "rent_q1": Budget(company_id=company.id, period_type=BudgetPeriod.QUARTER, period_value="2024-Q1",
+                          budget_type=BudgetType.EXPENSE, expense_item_id=rent.id, planned_amount=Decimal("3000")),
+        "income_2024": Budget(company_id=company.id, period_type=BudgetPeriod.YEAR, period_value="2024",
+                              budget_type=BudgetType.INCOME, income_item_id=sales.id, planned_amount=Decimal("10000")),
+    }
+    db.add_all(budgets.values())
+    db.commit()
+    return company, budgets
+
+def test_budget_comparison_actuals(client, auth_headers, budget_data):
+    """Тест план-факта: факт по статье, по всем статьям типа и по кварталу/году"""
+    company, budgets = budget_data
+    response = client.get(f"/api/budget/comparison?company_id={company.id}", headers=auth_headers)
+    assert response.status_code == 200
+    rows = {row["budget_id"]: row for row in response.json()}
+    assert len(rows) == 4
+
+    assert rows[budgets["rent_january"].id]["actual_amount"] == 1500
+    assert rows[budgets["rent_january"].id]["item_name"] == "Аренда"
+    assert rows[budgets["rent_january"].id]["deviation_percent"] == 50
+    assert rows[budgets["expenses_january"].id]["actual_amount"] == 4500
+    assert rows[budgets["rent_q1"].id]["actual_amount"] == 2200
+    assert rows[budgets["income_2024"].id]["actual_amount"] == 9000
+    assert rows[budgets["income_2024"].id]["item_name"] == "Продажи"
+
+    response = client.get(f"/api/budget/?company_id={company.id}", headers=auth_headers)
+    assert response.status_code == 200
+    assert {row["company_name"] for row in response.json()} == {"Тестовая организация"}
+
+def test_calculate_actuals_updates_all_budgets(client, auth_headers, db, budget_data):
+    """Тест пакетного пересчета: факт сохраняется в budgets.actual_amount для всех бюджетов"""
+    company, budgets = budget_data
+    response = client.post(f"/api/budget-calculation/calculate-actuals?company_id={company.id}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["updated_count"] == 4
+
+    db.expire_all()
+    assert float(db.get(Budget, budgets["rent_january"].id).actual_amount) == 1500
+    assert float(db.get(Budget, budgets["expenses_january"].id).actual_amount) == 4500
+    assert float(db.get(Budget, budgets["rent_q1"].id).actual_amount) == 2200
+
+    response = client.get(f"/api/budget/?company_id={company.id}", headers=auth_headers)
+    actuals = {row["id"]: row["actual_amount"] for row in response.json()}
+    assert actuals[budgets["income_2024"].id] == 9000
+
+def test_simulate_scenarios(client, auth_headers, db, budget_data):
+    """Тест моделирования: базовый вариант из бюджетов, рост расходов и множитель статьи"""
+    company, budgets = budget_data
+    rent_id = budgets["rent_january"].expense_item_id
+    scenario = BudgetScenario(company_id=company.id, name="Пессимистичный")
+    # Расходы без статьи за май: бюджетов статей в мае нет, бюджет учитывается
+    db.add_all([scenario, Budget(company_id=company.id, period_type=BudgetPeriod.MONTH, period_value="2024-05",
+                                 budget_type=BudgetType.EXPENSE, planned_amount=Decimal("400"))])
+    db.commit()
+
+    response = client.post("/api/budget-scenarios/simulate", json={
+        "company_id": company.id,
+        "year": 2024,
+        "scenarios": [
+            {"scenario_id": scenario.id, "expense_growth_percent": 10},
+            {"name": "Дорогая аренда", "item_multipliers": [{"budget_type": "expense", "item_id": rent_id, "multiplier": 2}]}
+        ]
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+
+    # База: аренда за январь - из бюджета месяца (1000), за февраль и март - из бюджета квартала (по 1000);
+    # расходы без статьи за январь (5000) не учитываются - в январе есть бюджет статьи, за май (400) - учитываются;
+    # доход 10000 за год
+    base = data["base"]["cash_flow"]
+    assert base["expenses"] == 3400
+    assert base["income"] == 10000
+    assert base["monthly_net"][0] == round(10000 / 12 - 1000, 2)
+    assert base["monthly_net"][4] == round(10000 / 12 - 400, 2)
+    assert base["cumulative"][-1] == 6600
+
+    pessimistic, expensive_rent = data["scenarios"]
+    assert pessimistic["name"] == "Пессимистичный"
+    assert pessimistic["cash_flow"]["expenses"] == 3740
+    # Множитель статьи применяется к аренде всех месяцев (3000 -> 6000)
+    assert expensive_rent["cash_flow"]["expenses"] == 6400
+
+def test_simulate_channel_shares(client, auth_headers, db, budget_data):
+    """Тест целевых долей каналов: выручка не теряется, доли вне 0-100% и остаток без свободных каналов отклоняются"""
+    company, _ = budget_data
+    retail, online, wholesale = SalesChannel(name="Розница"), SalesChannel(name="Интернет"), SalesChannel(name="Опт")
+    customer = Customer(company_id=company.id, name="Покупатель")
+    warehouse = Warehouse(company_id=company.id, name="Основной склад")
+    db.add_all([retail, online, wholesale, customer, warehouse])
+    db.commit()
+    # Январь 2023: розница 1600, интернет 800; февраль - только розница 1000
+    for day, channel, revenue in ((date(2023, 1, 10), retail, "1600"), (date(2023, 1, 20), online, "800"),
+                                  (date(2023, 2, 10), retail, "1000")):
+        db.add(Realization(date=day, company_id=company.id, sales_channel_id=channel.id, customer_id=customer.id,
+                           warehouse_id=warehouse.id, revenue=Decimal(revenue), quantity=1))
+    db.commit()
+
+    def simulate(*shares):
+        return client.post("/api/budget-scenarios/simulate", json={
+            "company_id": company.id, "year": 2024,
+            "scenarios": [{"channel_shares": channel_shares} for channel_shares in shares]
+        }, headers=auth_headers)
+
+    response = simulate({retail.id: 50}, {retail.id: 50, online.id: 50}, {wholesale.id: 25})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["base"]["profit_loss"]["revenue"] == 3400
+    half, even, new_channel = data["scenarios"]
+    # Розница - половина выручки каждого месяца; в феврале у интернета продаж не было - остаток по доле за год
+    assert half["profit_loss"]["revenue"] == 3400
+    assert half["profit_loss"]["monthly_revenue"][:2] == [2400, 1000]
+    assert {row["sales_channel_id"]: row["revenue"] for row in half["channels"]} == {retail.id: 1700, online.id: 1700, wholesale.id: 0}
+    assert even["profit_loss"]["revenue"] == 3400
+    # Новый канал забирает четверть, остальные каналы делят остаток в своих пропорциях
+    channels = {row["sales_channel_id"]: row["revenue"] for row in new_channel["channels"]}
+    assert channels == {retail.id: 1950, online.id: 600, wholesale.id: 850}
+
+    # Все каналы с выручкой получили доли, в сумме меньше 100% - остаток некуда отнести
+    response = simulate({retail.id: 50, online.id: 30})
+    assert response.status_code == 400
+    assert "меньше 100%" in response.json()["detail"]
+    assert simulate({retail.id: 70, online.id: 40}).status_code == 400
+    assert simulate({retail.id: -10}).status_code == 422
+    assert simulate({retail.id: 150}).status_code == 422
+
+def test_budget_deviation_check_is_incremental(db, test_user, budget_data):
+    """Тест проверки отклонений: первый запуск - все закончившиеся бюджеты, затем только измененные"""
+    company, budgets = budget_data
+    today = date(2025, 1, 15)
+    result = check_budget_deviations(db, today=today)
+    assert result["budgets_checked"] == 4
+    # Аренда за январь (+50%) и расходы за январь (-10% - без уведомления), аренда за квартал (-27%), доход (-10%)
+    assert result["notifications_created"] == 2
+    notified = {row.related_id for row in db.query(Notification).filter(Notification.related_table == "budgets")}
+    assert notified == {budgets["rent_january"].id, budgets["rent_q1"].id}
+
+    # Данные фикстуры старше окна проверки - без изменений проверять нечего
+    assert db.get(NotificationCheck, "budget_deviations") is not None
+    for model in (Budget, MoneyMovement):
+        db.query(model).update({model.created_at: datetime(2024, 6, 1), model.updated_at: datetime(2024, 6, 1)})
+    db.commit()
+    assert check_budget_deviations(db, today=today) == {"budgets_checked": 0, "notifications_created": 0}
+
+    # Новое движение по зарплате за январь затрагивает только бюджет расходов января без статьи
+    salary_id = db.query(ExpenseItem.id).filter(ExpenseItem.name == "Зарплата").scalar()
+    movement = MoneyMovement(
+        date=date(2024, 1, 20), amount=Decimal("2000"), movement_type="expense", company_id=company.id,
+        payment_place_id=db.query(PaymentPlace.id).scalar(), expense_item_id=salary_id
+    )
+    db.add(movement)
+    mark_budget_changes(db, [budget_change_key(movement)])
+    db.commit()
+    result = check_budget_deviations(db, today=today)
+    assert result == {"budgets_checked": 1, "notifications_created": 1}
+    assert db.query(Notification).filter(Notification.related_id == budgets["expenses_january"].id).count() == 1
+    assert db.query(BudgetChangeMark).count() == 0
+
+def test_actuals_refresh_keeps_deviation_check_incremental(client, auth_headers, db, budget_data):
+    """Тест пересчета факта: budgets.updated_at не меняется, проверка отклонений остается инкрементальной"""
+    company, budgets = budget_data
+    today = date(2025, 1, 15)
+    check_budget_deviations(db, today=today)
+    for model in (Budget, MoneyMovement):
+        db.query(model).update({model.created_at: datetime(2024, 6, 1), model.updated_at: datetime(2024, 6, 1)})
+    db.commit()
+
+    response = client.post(f"/api/budget-calculation/calculate-actuals?company_id={company.id}", headers=auth_headers)
+    assert response.json()["updated_count"] == 4
+    db.expire_all()
+    budget = db.get(Budget, budgets["rent_january"].id)
+    assert float(budget.actual_amount) == 1500
+    assert budget.updated_at.replace(tzinfo=None) == datetime(2024, 6, 1)
+    assert check_budget_deviations(db, today=today) == {"budgets_checked": 0, "notifications_created": 0}
+
+def test_budget_deviation_check_sees_deletes_and_moves(client, auth_headers, db, budget_data):
+    """Тест проверки отклонений: удаление движения и перенос в другой месяц отмечают прежний месяц"""
+    company, budgets = budget_data
+    today = date(2025, 1, 15)
+    check_budget_deviations(db, today=today)
+    for model in (Budget, MoneyMovement):
+        db.query(model).update({model.created_at: datetime(2024, 6, 1), model.updated_at: datetime(2024, 6, 1)})
+    db.commit()
+    rent_id = budgets["rent_january"].expense_item_id
+
+    # Удаление аренды за 31 января: затронуты бюджеты аренды за январь и квартал и расходов за январь
+    movement = db.query(MoneyMovement).filter(MoneyMovement.date == date(2024, 1, 31)).one()
+    response = client.delete(f"/api/input1/{movement.id}", headers=auth_headers)
+    assert response.status_code == 200
+    marks = [(mark.movement_type, mark.item_id, mark.month) for mark in db.query(BudgetChangeMark)]
+    assert marks == [("expense", rent_id, date(2024, 1, 1))]
+    assert check_budget_deviations(db, today=today)["budgets_checked"] == 3
+    # Аренда за январь теперь по плану (1000) - новое уведомление только по кварталу (-43%)
+    rent_january = db.query(Notification).filter(Notification.related_id == budgets["rent_january"].id).count()
+
+    # Перенос аренды из февраля в апрель: прежний месяц (февраль) отмечен вместе с новым
+    movement = db.query(MoneyMovement).filter(MoneyMovement.date == date(2024, 2, 1)).one()
+    response = client.put(f"/api/bank-cash/{movement.id}", json={
+        "date": "2024-04-02", "amount": 700, "movement_type": "expense", "company_id": company.id,
+        "expense_item_id": rent_id, "payment_place_id": movement.payment_place_id
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    months = {mark.month for mark in db.query(BudgetChangeMark)}
+    assert months == {date(2024, 2, 1), date(2024, 4, 1)}
+    result = check_budget_deviations(db, today=today)
+    # Февраль входит только в бюджет аренды за квартал: 1000 вместо 1700 при плане 3000
+    assert result["budgets_checked"] == 1
+    assert db.query(Notification).filter(Notification.related_id == budgets["rent_january"].id).count() == rent_january
+    assert db.query(BudgetChangeMark).count() == 0
@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from app.models.reference import Company
+from app.models.user_company import UserCompany
+from app.models.customer import Customer, CustomerPurchase
+
+def test_recompute_metrics_for_company(client, auth_headers, db, test_user):
+    """Тест пакетного пересчета: итоги покупок и квинтильные RFM-оценки всех клиентов организации"""
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    db.add(UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN"))
+    customers = [Customer(company_id=company.id, name=f"Клиент {index}") for index in range(6)]
+    db.add_all(customers)
+    db.commit()
+
+    today = date.today()
+    # Клиент i: i покупок по 100 * i, последняя - i * 10 дней назад (клиент 0 без покупок)
+    for index, customer in enumerate(customers):
+        for number in range(index):
+            db.add(CustomerPurchase(
+                customer_id=customer.id,
+                purchase_date=today - timedelta(days=index * 10 + number),
+                amount=Decimal(100 * index)
+            ))
+    db.commit()
+
+    response = client.post(f"/api/customers/recompute-metrics?company_id={company.id}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["customers"] == 6
+    assert response.json()["with_purchases"] == 5
+
+    db.expire_all()
+    inactive, *buyers = sorted(customers, key=lambda customer: customer.name)
+    assert inactive.purchase_count == 0 and inactive.rfm_segment is None
+    best, worst = buyers[-1], buyers[0]
+    assert best.purchase_count == 5
+    assert best.total_purchases == Decimal("2500")
+    assert best.average_check == Decimal("500")
+    assert best.last_purchase_date == today - timedelta(days=50)
+    assert best.recency == 50
+    # Клиент 5 - самый давний, но самый частый и крупный
+    assert best.rfm_segment == "155"
+    assert worst.rfm_segment == "511"
@@ -0,0 +1,51 @@
+import pytest
+from app.models.reference import Company, IncomeItem, ExpenseItem, PaymentPlace
+from app.models.input1 import MoneyMovement
+
+CSV_CONTENT = (
+    "Дата,Тип,Сумма,Статья дохода,Статья расхода,Место оплаты,Описание\n"
+    "2024-01-10,Поступление,1000.00,Продажи,,Расчетный счет,Оплата по счету 1\n"
+    "2024-01-11,Оплата,250.50,,Аренда,Расчетный счет,Аренда офиса\n"
+    "2024-01-11,Оплата,250.50,,Аренда,Расчетный счет,Аренда офиса\n"
+)
+
+@pytest.fixture
+def import_references(db):
+    """Создает организацию и справочники для импорта"""
+    company = Company(name="Тестовая организация")
+    db.add_all([
+        company,
+        IncomeItem(name="Продажи"),
+        ExpenseItem(name="Аренда"),
+        PaymentPlace(name="Расчетный счет"),
+    ])
+    db.commit()
+    return company
+
+def _upload(client, auth_headers, company_id, content):
+    return client.post(
+        f"/api/import/money-movements?company_id={company_id}",
+        files={"file": ("bank.csv", content.encode("utf-8"), "text/csv")},
+        headers=auth_headers
+    )
+
+def test_import_money_movements(client, auth_headers, db, import_references):
+    """Тест импорта движения денег: одинаковые строки в одном файле сохраняются"""
+    response = _upload(client, auth_headers, import_references.id, CSV_CONTENT)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported"] == 3
+    assert data["skipped"] == 0
+    assert db.query(MoneyMovement).count() == 3
+
+def test_reimport_money_movements_skips_known_rows(client, auth_headers, db, import_references):
+    """Тест повторного импорта с пересекающимся периодом"""
+    _upload(client, auth_headers, import_references.id, CSV_CONTENT)
+
+    overlapping = CSV_CONTENT + "2024-01-12,Поступление,500,Продажи,,Расчетный счет,Оплата по счету 2\n"
+    response = _upload(client, auth_headers, import_references.id, overlapping)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["skipped"] == 3
+    assert db.query(MoneyMovement).count() == 4
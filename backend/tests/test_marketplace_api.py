@@ -0,0 +1,267 @@
+import asyncio
+import json
+import pytest
+from datetime import date
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+from app.services.ozon_api import OzonAPI, SOURCE_TRANSACTIONS
+from app.services.wb_api import WildberriesAPI, SOURCE_SALES, parse_change_date
+
+PERIOD = (date(2024, 3, 1), date(2024, 3, 31))
+
+class OzonStub:
+    """Заглушка /v3/finance/transaction/list: страницы заданной длины, журнал запросов и параллельности"""
+
+    def __init__(self, page_sizes, page_count=None, failures=None):
+        self.page_sizes = page_sizes
+        self.page_count = page_count
+        # Номер страницы -> сколько первых запросов к ней ответить 429
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.events = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        page = json.loads(request.content)["page"]
+        self.requests.append(page)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.events.append(("start", page))
+        try:
+            await asyncio.sleep(0.01)
+            if self.failures.get(page):
+                self.failures[page] -= 1
+                return httpx.Response(429, headers={"Retry-After": "0"})
+            size = self.page_sizes[page - 1] if page <= len(self.page_sizes) else 0
+            result = {"operations": [{"operation_id": f"{page}-{index}"} for index in range(size)]}
+            if self.page_count is not None:
+                result["page_count"] = self.page_count
+            return httpx.Response(200, json={"result": result})
+        finally:
+            self.in_flight -= 1
+            self.events.append(("end", page))
+
+def ozon_client(stub: OzonStub, api_key: str, max_concurrency: int = 2) -> OzonAPI:
+    return OzonAPI("client", api_key, max_concurrency=max_concurrency, requests_per_second=1000,
+                   base_url="http://ozon.test", transport=httpx.MockTransport(stub))
+
+def test_ozon_pages_first_alone_then_parallel_waves():
+    """Тест загрузки страниц OZON: первая страница отдельно, остальные группами по max_concurrency"""
+    stub = OzonStub([2, 2, 2, 2, 1], page_count=5)
+    pages = list(ozon_client(stub, "waves").iter_raw_pages(*PERIOD, page_size=2))
+
+    assert [(source, page, len(rows)) for source, page, rows in pages] == [
+        (SOURCE_TRANSACTIONS, 1, 2), (SOURCE_TRANSACTIONS, 2, 2), (SOURCE_TRANSACTIONS, 3, 2),
+        (SOURCE_TRANSACTIONS, 4, 2), (SOURCE_TRANSACTIONS, 5, 1)
+    ]
+    assert sorted(stub.requests) == [1, 2, 3, 4, 5]
+    # Первая страница завершилась до запуска остальных, дальше - не больше двух запросов одновременно
+    assert stub.events[:2] == [("start", 1), ("end", 1)]
+    assert stub.max_in_flight == 2
+
+def test_ozon_pages_stop_on_short_page():
+    """Тест остановки на неполной странице, хотя page_count обещает больше"""
+    stub = OzonStub([2, 2, 1, 2, 2], page_count=5)
+    pages = list(ozon_client(stub, "short").iter_raw_pages(*PERIOD, page_size=2))
+
+    assert [page for _, page, _ in pages] == [1, 2, 3]
+    assert sorted(stub.requests) == [1, 2, 3]
+
+def test_ozon_pages_without_page_count_stop_on_empty_page():
+    """Тест загрузки без page_count: страницы запрашиваются до пустой"""
+    stub = OzonStub([2, 2])
+    pages = list(ozon_client(stub, "empty", max_concurrency=3).iter_raw_pages(*PERIOD, page_size=2))
+
+    assert [(page, len(rows)) for _, page, rows in pages] == [(1, 2), (2, 2), (3, 0)]
+    # Последняя группа (2-4) запрошена целиком, следующей группы нет
+    assert sorted(stub.requests) == [1, 2, 3, 4]
+
+def test_ozon_pages_retry_inside_wave():
+    """Тест повтора запроса страницы внутри группы после 429"""
+    stub = OzonStub([2, 2, 1], page_count=3, failures={3: 1})
+    api = ozon_client(stub, "retry")
+    pages = list(api.iter_raw_pages(*PERIOD, page_size=2))
+
+    assert [(page, len(rows)) for _, page, rows in pages] == [(1, 2), (2, 2), (3, 1)]
+    assert sorted(stub.requests) == [1, 2, 3, 3]
+    assert api.request_stats()["retries"] == 1
+
+class WBStub(BaseAdapter):
+    """
+    Транспорт requests для отчета продаж WB: строки с lastChangeDate не раньше dateFrom,
+    не больше max_rows за ответ (как flag=0 в API статистики)
+    """
+
+    def __init__(self, rows, max_rows):
+        super().__init__()
+        self.rows = rows
+        self.max_rows = max_rows
+        self.date_from = []
+
+    def send(self, request, **kwargs):
+        params = dict(item.split("=", 1) for item in request.path_url.split("?", 1)[1].split("&"))
+        date_from = parse_change_date(requests.utils.unquote(params["dateFrom"]))
+        self.date_from.append(date_from)
+        rows = sorted(
+            (row for row in self.rows if parse_change_date(row["lastChangeDate"]) >= date_from),
+            key=lambda row: parse_change_date(row["lastChangeDate"])
+        )[:self.max_rows]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(rows).encode("utf-8")
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+# Время изменения в разных форматах: без пояса, с долями секунды, в UTC и со смещением
+WB_CHANGES = [
+    {"srid": "a", "lastChangeDate": "2024-03-01T10:00:00"},
+    {"srid": "b", "lastChangeDate": "2024-03-01T10:00:00.5"},
+    {"srid": "c", "lastChangeDate": "2024-03-01T08:00:01Z"},
+    {"srid": "d", "lastChangeDate": "2024-03-01T11:30:00+03:00"},
+    {"srid": "e", "lastChangeDate": "2024-03-01T12:00:00"},
+]
+
+def wb_client(stub: WBStub, api_key: str, max_rows: int) -> WildberriesAPI:
+    api = WildberriesAPI(api_key, base_url="http://wb.test", max_rows_per_response=max_rows)
+    api.http.session.mount("http://", stub)
+    return api
+
+def test_parse_change_date_normalizes_formats():
+    """Тест разбора lastChangeDate: пояс приводится к московскому времени, пустое значение - None"""
+    assert parse_change_date("2024-03-01T08:00:01Z") == parse_change_date("2024-03-01T11:00:01")
+    assert parse_change_date("2024-03-01T10:00:00.5") > parse_change_date("2024-03-01T10:00:00")
+    assert parse_change_date("") is None
+    assert parse_change_date(None) is None
+
+def test_wb_changes_paging_by_parsed_cursor():
+    """Тест постраничной загрузки изменений WB: курсор растет по времени, граничные строки не повторяются"""
+    stub = WBStub(WB_CHANGES, max_rows=2)
+    pages = list(wb_client(stub, "wb-paging", max_rows=2).iter_changes(SOURCE_SALES, "2024-03-01T00:00:00"))
+
+    srids = [row["srid"] for rows, _ in pages for row in rows]
+    assert srids == ["a", "b", "c", "d", "e"]
+    cursors = [cursor for _, cursor in pages]
+    # 08:00:01Z - это 11:00:01 по Москве: строка c идет после b, хотя как строка меньше
+    assert cursors == ["2024-03-01T10:00:00.500000", "2024-03-01T11:00:01", "2024-03-01T11:30:00",
+                       "2024-03-01T12:00:00", "2024-03-01T12:00:00"]
+    # Каждая следующая страница запрашивается с курсора предыдущей
+    assert stub.date_from[1:] == [parse_change_date(cursor) for cursor in cursors[:len(stub.date_from) - 1]]
+
+def test_wb_changes_stop_on_short_page():
+    """Тест остановки: ответ короче max_rows_per_response - изменения закончились"""
+    stub = WBStub(WB_CHANGES, max_rows=10)
+    pages = list(wb_client(stub, "wb-short", max_rows=10).iter_changes(SOURCE_SALES, "2024-03-01T00:00:00"))
+
+    assert len(pages) == 1
+    assert len(stub.date_from) == 1
+    assert pages[0][1] == "2024-03-01T12:00:00"
+
+def test_wb_changes_first_run_includes_cursor_rows():
+    """Тест первого запуска: строки с lastChangeDate, равным начальному курсору, не теряются"""
+    stub = WBStub(WB_CHANGES, max_rows=10)
+    api = wb_client(stub, "wb-first-run", max_rows=10)
+
+    assert [row["srid"] for rows, _ in api.iter_changes(SOURCE_SALES, "2024-03-01T10:00:00") for row in rows] == ["b", "c", "d", "e"]
+    rows = [row["srid"] for rows, _ in api.iter_changes(SOURCE_SALES, "2024-03-01T10:00:00", include_cursor=True) for row in rows]
+    assert rows == ["a", "b", "c", "d", "e"]
+
+def test_wb_changes_keep_returns_and_latest_versions():
+    """Тест устранения повторов по srid и saleID: возврат не теряется, из двух версий строки остается новая"""
+    rows = [
+        {"srid": "a", "saleID": "S1", "lastChangeDate": "2024-03-01T10:00:00", "priceWithDisc": 100},
+        {"srid": "a", "saleID": "R1", "lastChangeDate": "2024-03-01T11:00:00", "priceWithDisc": -100},
+        {"srid": "b", "saleID": "S2", "lastChangeDate": "2024-03-01T12:00:00", "priceWithDisc": 200},
+        {"srid": "b", "saleID": "S2", "lastChangeDate": "2024-03-01T13:00:00", "priceWithDisc": 150},
+    ]
+    stub = WBStub(rows, max_rows=10)
+    pages = list(wb_client(stub, "wb-versions", max_rows=10).iter_changes(SOURCE_SALES, "2024-03-01T00:00:00"))
+
+    assert [(row["srid"], row["saleID"], row["priceWithDisc"]) for rows, _ in pages for row in rows] == [
+        ("a", "S1", 100), ("a", "R1", -100), ("b", "S2", 150)
+    ]
+
+    # По страницам: повторы на границе отбрасываются, новая версия строки из следующей страницы отдается еще раз
+    # (итог дня строится по версии с наибольшим lastChangeDate)
+    stub = WBStub(rows, max_rows=2)
+    pages = list(wb_client(stub, "wb-versions-paged", max_rows=2).iter_changes(SOURCE_SALES, "2024-03-01T00:00:00"))
+    keys = [(row["srid"], row["saleID"], row["priceWithDisc"]) for rows, _ in pages for row in rows]
+    assert keys == [("a", "S1", 100), ("a", "R1", -100), ("b", "S2", 200), ("b", "S2", 150)]
+
+def test_wb_window_is_paged_by_change_date():
+    """Тест загрузки периода: строк больше, чем в одном ответе, - период догружается страницами, а не обрезается"""
+    rows = [
+        {"srid": srid, "saleID": f"S{index}", "saleDate": sale_date, "lastChangeDate": f"2024-03-0{index + 1}T10:00:00"}
+        for index, (srid, sale_date) in enumerate([
+            ("a", "2024-03-01T09:00:00"), ("b", "2024-03-01T12:00:00"), ("c", "2024-03-02T08:00:00"),
+            ("d", "2024-03-02T09:00:00"), ("e", "2024-03-05T10:00:00")
+        ])
+    ]
+    stub = WBStub(rows, max_rows=2)
+    window = wb_client(stub, "wb-window", max_rows=2).fetch_window(SOURCE_SALES, date(2024, 3, 1), date(2024, 3, 2))
+
+    # Строка e - после конца периода; остальные загружены за несколько запросов
+    assert sorted(row["srid"] for row in window) == ["a", "b", "c", "d"]
+    assert len(stub.date_from) > 1
+
+def test_wb_changes_fail_when_cursor_cannot_advance():
+    """Тест полной страницы с одинаковым lastChangeDate: загрузка завершается ошибкой, а не обрезается"""
+    rows = [{"srid": srid, "saleDate": "2024-03-01T09:00:00", "lastChangeDate": "2024-03-01T10:00:00"} for srid in "abc"]
+    stub = WBStub(rows, max_rows=2)
+    with pytest.raises(Exception, match="не продвинул курсор"):
+        wb_client(stub, "wb-stuck", max_rows=2).fetch_window(SOURCE_SALES, date(2024, 3, 1), date(2024, 3, 1))
+
+def test_wb_changes_resume_from_stored_cursor(db):
+    """Тест продолжения с сохраненного курсора: строки до курсора включительно не загружаются повторно"""
+    from app.models.reference import Company
+    from app.models.marketplace_integration import MarketplaceIntegration
+    from app.services.marketplace_staging import iter_wb_pages, cursor_page_key
+
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    # Курсор в UTC: 08:00:01Z - это 11:00:01 по Москве, строки a-c уже загружены
+    integration = MarketplaceIntegration(marketplace_name="Wildberries", company_id=company.id,
+                                         wb_sales_cursor="2024-03-01T08:00:01Z")
+    db.add(integration)
+    db.commit()
+
+    stub = WBStub(WB_CHANGES, max_rows=10)
+    pages = list(iter_wb_pages(wb_client(stub, "wb-resume", max_rows=10), integration,
+                               date(2024, 3, 1), date(2024, 3, 1), incremental=True))
+
+    assert len(pages) == 1
+    source, page_key, rows, cursors = pages[0]
+    assert source == SOURCE_SALES
+    assert page_key == cursor_page_key("2024-03-01T08:00:01Z")
+    assert [row["srid"] for row in rows] == ["d", "e"]
+    assert cursors == {"wb_sales_cursor": "2024-03-01T12:00:00"}
+
+def test_request_stats_are_per_run():
+    """Тест статистики запросов: общий клиент по учетным данным, но статистика - только своего запуска"""
+    first_run = ozon_client(OzonStub([2, 2, 1], page_count=3, failures={2: 1}), "shared")
+    list(first_run.iter_raw_pages(*PERIOD, page_size=2))
+    assert first_run.request_stats()["requests"] == 4
+    assert first_run.request_stats()["retries"] == 1
+
+    second_run = ozon_client(OzonStub([1], page_count=1), "shared")
+    assert second_run.http is first_run.http
+    list(second_run.iter_raw_pages(*PERIOD, page_size=2))
+    stats = second_run.request_stats()
+    assert (stats["requests"], stats["retries"]) == (1, 0)
+
+def test_idle_http_clients_are_evicted():
+    """Тест вытеснения общих HTTP-клиентов, которые давно не использовались"""
+    from app.services import http_client
+
+    idle = http_client.get_http_client("test:idle", "http://idle.test", {})
+    active = http_client.get_http_client("test:active", "http://active.test", {})
+    idle.last_used -= http_client.CLIENT_IDLE_SECONDS + 1
+
+    assert http_client.get_http_client("test:active", "http://active.test", {}) is active
+    assert "test:idle" not in http_client._clients
+    assert http_client.get_http_client("test:idle", "http://idle.test", {}) is not idle
@@ -0,0 +1,399 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models.reference import Company
+from app.models.marketplace_integration import MarketplaceIntegration
+from app.services.sync_lease import acquire_lease, release_lease
+
+@pytest.fixture
+def integration(db):
+    """Создает интеграцию без учетных данных (синхронизация завершится ошибкой без запросов к API)"""
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    integration = MarketplaceIntegration(marketplace_name="OZON", company_id=company.id)
+    db.add(integration)
+    db.commit()
+    db.refresh(integration)
+    return integration
+
+def test_lease_is_exclusive_until_expired(db, integration):
+    """Тест аренды синхронизации: второй владелец получает ее только после истечения"""
+    assert acquire_lease(db, integration.id, "host-a:1:aaaa")
+    assert not acquire_lease(db, integration.id, "host-b:2:bbbb")
+
+    # Процесс упал, не освободив аренду: статус остался in_progress, срок истек
+    integration.sync_lease_expires_at = datetime.now() - timedelta(seconds=1)
+    db.commit()
+    assert acquire_lease(db, integration.id, "host-b:2:bbbb")
+
+    release_lease(db, integration.id, "host-b:2:bbbb")
+    db.refresh(integration)
+    assert integration.sync_lease_owner is None
+
+def test_sync_rejected_while_leased(client, auth_headers, db, integration):
+    """Тест запуска синхронизации, которую уже выполняет другой процесс"""
+    acquire_lease(db, integration.id, "scheduler:1:aaaa")
+
+    response = client.post(
+        "/api/marketplace-integration/sync",
+        json={"integration_id": integration.id},
+        headers=auth_headers
+    )
+    assert response.status_code == 409
+
+WB_ROWS = [
+    {"srid": "s1", "saleDate": "2024-03-01T10:00:00", "lastChangeDate": "2024-03-01T10:00:00",
+     "nmId": 101, "supplierArticle": "ART-1", "priceWithDisc": 300.0},
+    {"srid": "s2", "saleDate": "2024-03-01T11:00:00", "lastChangeDate": "2024-03-01T11:00:00",
+     "nmId": 101, "supplierArticle": "ART-1", "priceWithDisc": 300.0},
+    {"srid": "s3", "saleDate": "2024-03-01T12:00:00", "lastChangeDate": "2024-03-01T12:00:00",
+     "nmId": 202, "supplierArticle": "ART-2", "priceWithDisc": 150.0},
+]
+
+def test_item_level_sync_is_replayable(db, integration):
+    """Тест позиционной синхронизации: товары сопоставляются по артикулу, повторная обработка не дублирует строки и списания"""
+    from decimal import Decimal
+    from app.models.product import Product
+    from app.models.inventory import Inventory
+    from app.models.realization import RealizationItem
+    from app.models.marketplace_product import MarketplaceProduct
+    from app.services.marketplace_staging import stage_payload, process_payload, get_sync_context, window_page_key
+    from app.services.marketplace_products import clear_product_cache
+    from app.services.wb_api import SOURCE_SALES
+
+    clear_product_cache()
+    existing = Product(name="Товар 1", sku="ART-1", cost_price=Decimal("100"))
+    other = Product(name="Товар 2", sku="ART-2", cost_price=Decimal("50"))
+    db.add_all([existing, other])
+    integration.post_inventory = True
+    db.commit()
+    context = get_sync_context(db, integration)
+    db.add_all([
+        Inventory(product_id=existing.id, warehouse_id=context["warehouse_id"], quantity=Decimal("10")),
+        Inventory(product_id=other.id, warehouse_id=context["warehouse_id"], quantity=Decimal("10")),
+    ])
+    db.commit()
+
+    day = datetime(2024, 3, 1).date()
+    payload = stage_payload(db, integration.id, SOURCE_SALES, window_page_key(day, day), day, day, WB_ROWS)
+    process_payload(db, payload, context)
+    process_payload(db, payload, context)
+
+    items = {item.product_id: item for item in db.query(RealizationItem).all()}
+    assert len(items) == 2
+    assert items[existing.id].quantity == 2
+    assert float(items[existing.id].price) == 300.0
+    assert float(items[existing.id].cost_price) == 100.0
+    assert db.query(MarketplaceProduct).count() == 2
+    assert db.query(Product).count() == 2
+
+    inventory = db.query(Inventory).filter(Inventory.product_id == existing.id).first()
+    db.refresh(inventory)
+    assert inventory.quantity == Decimal("8")
+
+def test_backfill_windows_and_resume(db, integration):
+    """Тест исторической загрузки: период делится на окна, незавершенная задача переиспользуется"""
+    from datetime import date
+    from app.services.marketplace_backfill import create_backfill
+
+    backfill = create_backfill(db, integration.id, date(2024, 1, 1), date(2024, 1, 31), window_days=7)
+    windows = sorted(backfill.windows, key=lambda window: window.window_start)
+    assert backfill.windows_total == 5
+    assert windows[0].window_end == date(2024, 1, 7)
+    assert windows[-1].window_start == date(2024, 1, 29)
+    assert windows[-1].window_end == date(2024, 1, 31)
+
+    assert create_backfill(db, integration.id, date(2024, 1, 1), date(2024, 1, 31)).id == backfill.id
+
+def test_wb_day_total_is_shared_by_cursor_and_window_pages(db, integration):
+    """Тест итога дня WB: инкрементальные страницы и выгрузка за период пишут одну реализацию без повторов по srid"""
+    from app.models.realization import Realization
+    from app.services.marketplace_staging import (
+        stage_payload, process_payload, get_sync_context, window_page_key, cursor_page_key
+    )
+    from app.services.marketplace_products import clear_product_cache
+    from app.services.wb_api import SOURCE_SALES
+
+    clear_product_cache()
+    context = get_sync_context(db, integration)
+    day = datetime(2024, 3, 1).date()
+    # Итог страницы, сохраненный прежней версией синхронизации
+    db.add(Realization(date=day, company_id=integration.company_id, sales_channel_id=context["sales_channel_id"],
+                       customer_id=context["customer_id"], warehouse_id=context["warehouse_id"],
+                       revenue=300, quantity=1, external_id="wb:sales:2024-03-01:p99"))
+    db.commit()
+
+    first = stage_payload(db, integration.id, SOURCE_SALES, cursor_page_key("2024-03-01T00:00:00"),
+                          day, datetime(2024, 3, 31).date(), WB_ROWS[:2])
+    # Страница изменений сохраняется с периодом по датам строк
+    assert (first.window_start, first.window_end) == (day, day)
+    process_payload(db, first, context)
+
+    changed = dict(WB_ROWS[1], lastChangeDate="2024-03-02T09:00:00")
+    second = stage_payload(db, integration.id, SOURCE_SALES, cursor_page_key("2024-03-01T11:00:00"),
+                           day, day, [changed, WB_ROWS[2]])
+    process_payload(db, second, context)
+
+    window = stage_payload(db, integration.id, SOURCE_SALES, window_page_key(day, day), day, day, WB_ROWS)
+    process_payload(db, window, context)
+    # Повторная обработка старой страницы не уменьшает итог дня
+    process_payload(db, first, context)
+
+    realizations = db.query(Realization).filter(Realization.company_id == integration.company_id).all()
+    assert [row.external_id for row in realizations] == ["wb:sales:2024-03-01"]
+    assert float(realizations[0].revenue) == 750.0
+    assert realizations[0].quantity == 3
+
+def test_ozon_posting_split_across_pages(db, integration):
+    """Тест отправления OZON на двух страницах: реализация - сумма операций обеих страниц, повторная обработка ее не меняет"""
+    from app.models.realization import Realization
+    from app.services.marketplace_staging import stage_payload, process_payload, get_sync_context, window_page_key
+    from app.services.marketplace_products import clear_product_cache
+    from app.services.ozon_api import SOURCE_TRANSACTIONS
+
+    def operation(operation_id, posting, amount, day="2024-03-01T10:00:00Z"):
+        return {"operation_id": operation_id, "operation_type": "operation_agent_delivery_to_customer",
+                "posting_number": posting, "accruals_for_sale": amount, "date": day, "items": []}
+
+    clear_product_cache()
+    context = get_sync_context(db, integration)
+    start, end = datetime(2024, 3, 1).date(), datetime(2024, 3, 7).date()
+    first = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(start, end, 1), start, end,
+                          [operation(1, "P-1", 100), operation(2, "P-2", 50)])
+    second = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(start, end, 2), start, end,
+                           [operation(3, "P-1", 40)])
+    # Страница пересекающегося периода с той же операцией не удваивает сумму
+    overlap = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(start, start, 1), start, start,
+                            [operation(1, "P-1", 100)])
+    for payload in (first, second, overlap, first):
+        process_payload(db, payload, context)
+
+    revenue = {row.external_id: float(row.revenue) for row in db.query(Realization).filter(
+        Realization.company_id == integration.company_id
+    )}
+    assert revenue == {"ozon:P-1": 140.0, "ozon:P-2": 50.0}
+
+@pytest.fixture
+def simulator(monkeypatch):
+    """Симулятор API маркетплейсов (marketplace_simulator.py) на свободном порту"""
+    import socket
+    from app.database import settings
+    from marketplace_simulator import SimulatorConfig, run_in_thread
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = SimulatorConfig(days=3, rows_per_day=20, requests_per_second=1000)
+    server = run_in_thread(config, port)
+    monkeypatch.setattr(settings, "ozon_api_url", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(settings, "wb_statistics_api_url", f"http://127.0.0.1:{port}")
+    try:
+        yield config, server
+    finally:
+        server.should_exit = True
+
+def test_sync_against_simulator(db, integration, simulator):
+    """Тест полной синхронизации с симулятором: все строки загружены, повторный запуск не дублирует реализации"""
+    from app.models.realization import Realization
+    from app.models.marketplace_payload import MarketplacePayload
+    from app.api.marketplace_integration import perform_sync
+    from app.services.marketplace_products import clear_product_cache
+    from marketplace_simulator import ozon_operation, wb_sale
+
+    config, server = simulator
+    clear_product_cache()
+    integration.ozon_client_id = "simulator"
+    integration.ozon_api_key = "simulator-key"
+    wb_integration = MarketplaceIntegration(marketplace_name="Wildberries", company_id=integration.company_id,
+                                            wb_api_key="simulator-key")
+    db.add(wb_integration)
+    db.commit()
+
+    for _ in range(2):
+        assert perform_sync(integration.id, "ozon", config.start_date, config.end_date)
+    ozon_rows = db.query(Realization).filter(Realization.external_id.like("ozon:%")).all()
+    assert len(ozon_rows) == config.total_rows
+    expected = sum(ozon_operation(config, index)["accruals_for_sale"] for index in range(config.total_rows))
+    assert round(sum(float(row.revenue) for row in ozon_rows), 2) == round(expected, 2)
+
+    # Инкрементальная загрузка WB по курсору: итоги по дням, повторный запуск ничего не добавляет
+    for _ in range(2):
+        assert perform_sync(wb_integration.id, "wildberries", config.start_date, config.end_date)
+    assert db.query(MarketplacePayload).filter(MarketplacePayload.integration_id == wb_integration.id).count() == 1
+    wb_rows = db.query(Realization).filter(Realization.external_id.like("wb:%")).all()
+    assert len(wb_rows) == 3
+    expected = sum(wb_sale(config, index)["priceWithDisc"] for index in range(config.total_rows))
+    assert round(sum(float(row.revenue) for row in wb_rows), 2) == round(expected, 2)
+
+    db.refresh(wb_integration)
+    assert wb_integration.last_sync_status == "success"
+    assert wb_integration.wb_sales_cursor == wb_sale(config, config.total_rows - 1)["lastChangeDate"]
+    assert server.config.app.state.stats["requests"] > 0
+
+OZON_OPERATIONS = [
+    {"operation_id": 1, "operation_type": "operation_agent_delivery_to_customer", "date": "2024-03-01T10:00:00Z",
+     "posting_number": "P-1", "accruals_for_sale": 500.0, "items": []},
+    {"operation_id": 2, "operation_type": "operation_agent_delivery_to_customer", "date": "2024-03-02T10:00:00Z",
+     "posting_number": "P-2", "accruals_for_sale": 700.0, "items": []},
+]
+
+def test_restage_and_reprocess_payloads(db, integration):
+    """Тест сохранения страницы: повторная загрузка того же page_key заменяет строки, повторная обработка не дублирует реализации"""
+    from app.models.realization import Realization
+    from app.models.marketplace_payload import MarketplacePayload
+    from app.services.marketplace_staging import (
+        stage_payload, process_payload, process_staged_payloads, get_sync_context, window_page_key, decode_rows
+    )
+    from app.services.ozon_api import SOURCE_TRANSACTIONS
+
+    context = get_sync_context(db, integration)
+    start, end = datetime(2024, 3, 1).date(), datetime(2024, 3, 2).date()
+    page_key = window_page_key(start, end, 1)
+    payload = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, page_key, start, end, OZON_OPERATIONS[:1])
+    process_payload(db, payload, context)
+    assert payload.processed_at is not None
+
+    restaged = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, page_key, start, end, OZON_OPERATIONS)
+    assert restaged.id == payload.id
+    assert restaged.processed_at is None
+    assert restaged.row_count == 2
+    assert [row["posting_number"] for row in decode_rows(restaged)] == ["P-1", "P-2"]
+    assert db.query(MarketplacePayload).count() == 1
+
+    assert process_staged_payloads(integration.id, only_unprocessed=True)["processed"] == 1
+    assert process_staged_payloads(integration.id, only_unprocessed=True)["payloads"] == 0
+    result = process_staged_payloads(integration.id, start, end, workers=2)
+    assert (result["payloads"], result["processed"], result["failed"]) == (1, 1, 0)
+
+    db.expire_all()
+    revenues = {row.external_id: float(row.revenue) for row in db.query(Realization).all()}
+    assert revenues == {"ozon:P-1": 500.0, "ozon:P-2": 700.0}
+
+def test_purge_staged_payloads(db, integration):
+    """Тест срока хранения: старые страницы OZON удаляются, страницы WB сворачиваются в архив месяца без потери итогов"""
+    from app.models.realization import Realization
+    from app.models.marketplace_payload import MarketplacePayload
+    from app.services.marketplace_staging import (
+        stage_payload, process_payload, get_sync_context, window_page_key, cursor_page_key,
+        archive_page_key, decode_rows, purge_staged_payloads
+    )
+    from app.services.ozon_api import SOURCE_TRANSACTIONS
+    from app.services.wb_api import SOURCE_SALES
+
+    context = get_sync_context(db, integration)
+    day = datetime(2024, 3, 1).date()
+    old_ozon = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(day, day, 1), day, day, OZON_OPERATIONS[:1])
+    failed_ozon = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(day, day, 2), day, day, OZON_OPERATIONS[1:])
+    wb_window = stage_payload(db, integration.id, SOURCE_SALES, window_page_key(day, day), day, day, WB_ROWS[:2])
+    wb_cursor = stage_payload(db, integration.id, SOURCE_SALES, cursor_page_key("2024-03-01T10:30:00"), day, day, WB_ROWS[1:])
+    for payload in (old_ozon, wb_window, wb_cursor):
+        process_payload(db, payload, context)
+    failed_ozon.process_error = "Ошибка маппинга"
+    fresh_ozon = stage_payload(db, integration.id, SOURCE_TRANSACTIONS, window_page_key(day, day, 3), day, day, OZON_OPERATIONS[1:])
+    process_payload(db, fresh_ozon, context)
+    for payload in (old_ozon, failed_ozon, wb_window, wb_cursor):
+        payload.fetched_at = datetime(2024, 3, 2)
+    db.commit()
+
+    result = purge_staged_payloads(db, retention_days=30, now=datetime(2024, 6, 1))
+    assert result == {"deleted": 3, "archived_pages": 1}
+    assert {payload.page_key for payload in db.query(MarketplacePayload).all()} == {
+        window_page_key(day, day, 2), window_page_key(day, day, 3), archive_page_key(day)
+    }
+    archive = db.query(MarketplacePayload).filter(MarketplacePayload.page_key == archive_page_key(day)).one()
+    assert sorted(row["srid"] for row in decode_rows(archive)) == ["s1", "s2", "s3"]
+    assert archive.processed_at is not None
+
+    # Новое изменение за архивный день пересчитывает итог с учетом строк архива
+    late_return = {"srid": "s4", "saleDate": "2024-03-01T18:00:00", "lastChangeDate": "2024-05-31T10:00:00",
+                   "nmId": 101, "supplierArticle": "ART-1", "priceWithDisc": -300.0}
+    late = stage_payload(db, integration.id, SOURCE_SALES, cursor_page_key("2024-05-31T00:00:00"), day, day, [late_return])
+    process_payload(db, late, context)
+    total = db.query(Realization).filter(Realization.external_id == "wb:sales:2024-03-01").one()
+    assert float(total.revenue) == 450.0
+
+def wb_sale_row(srid: str, article: str, nm_id: int, price: float = 300.0) -> dict:
+    return {"srid": srid, "saleDate": "2024-03-01T10:00:00", "lastChangeDate": "2024-03-01T10:00:00",
+            "nmId": nm_id, "supplierArticle": article, "priceWithDisc": price}
+
+def test_reprocess_refills_batches_and_skips_shortages(db, integration):
+    """Тест списаний: себестоимость берется из справочника, уменьшение продаж возвращает товар в партии, нехватка одного товара не срывает страницу"""
+    from decimal import Decimal
+    from app.models.product import Product
+    from app.models.product_cost import ProductCost
+    from app.models.inventory import Inventory
+    from app.models.realization import RealizationItem
+    from app.services.inventory_service import add_inventory_transaction
+    from app.services.marketplace_staging import stage_payload, process_payload, get_sync_context, window_page_key
+    from app.services.marketplace_products import clear_product_cache
+    from app.services.wb_api import SOURCE_SALES
+
+    clear_product_cache()
+    stocked = Product(name="Товар 1", sku="ART-1", cost_price=Decimal("100"))
+    missing = Product(name="Товар 2", sku="ART-2", cost_price=Decimal("50"))
+    db.add_all([stocked, missing])
+    integration.post_inventory = True
+    db.commit()
+    context = get_sync_context(db, integration)
+    warehouse_id = context["warehouse_id"]
+    add_inventory_transaction("INCOME", stocked.id, warehouse_id, Decimal("2"), Decimal("90"), datetime(2024, 1, 1).date(), db)
+    add_inventory_transaction("INCOME", stocked.id, warehouse_id, Decimal("10"), Decimal("110"), datetime(2024, 2, 1).date(), db)
+
+    day = datetime(2024, 3, 1).date()
+    rows = [wb_sale_row(f"s{index}", "ART-1", 101) for index in range(3)] + [wb_sale_row("m1", "ART-2", 202, 150.0)]
+    payload = stage_payload(db, integration.id, SOURCE_SALES, window_page_key(day, day), day, day, rows)
+    process_payload(db, payload, context)
+
+    def stock(product_id):
+        db.expire_all()
+        inventory = db.query(Inventory).filter(Inventory.product_id == product_id).first()
+        batches = db.query(ProductCost).filter(ProductCost.product_id == product_id).order_by(ProductCost.date).all()
+        return inventory.quantity if inventory else None, [batch.quantity for batch in batches]
+
+    # Товара 2 нет на складе: его списание пропущено, товар 1 списан по FIFO
+    assert stock(stocked.id) == (Decimal("9"), [Decimal("0"), Decimal("9")])
+    assert stock(missing.id)[0] == Decimal("0")
+    assert db.query(RealizationItem).count() == 2
+
+    # Себестоимость изменили в справочнике - повторная обработка берет новую (кэш хранит только id)
+    stocked.cost_price = Decimal("150")
+    db.commit()
+    # Повторная загрузка: продаж товара 1 стало меньше - разница возвращается в новые партии первыми
+    payload = stage_payload(db, integration.id, SOURCE_SALES, window_page_key(day, day), day, day, rows[:1] + rows[3:])
+    process_payload(db, payload, context)
+
+    assert stock(stocked.id) == (Decimal("11"), [Decimal("1"), Decimal("10")])
+    item = db.query(RealizationItem).filter(RealizationItem.product_id == stocked.id).one()
+    assert item.quantity == 1
+    assert float(item.cost_price) == 150.0
+
+def test_backfill_resumes_after_crash_and_respects_wb_cursor(client, auth_headers, db, integration):
+    """Тест запуска исторической загрузки: занятость определяется арендой, период WB заканчивается до курсора"""
+    from app.models.marketplace_backfill import MarketplaceBackfill
+    from app.services.marketplace_backfill import create_backfill
+
+    # Загрузка упала: статус остался in_progress, аренды нет - ее можно продолжить
+    backfill = create_backfill(db, integration.id, datetime(2024, 1, 1).date(), datetime(2024, 1, 14).date())
+    backfill.status = "in_progress"
+    db.commit()
+    url = f"/api/marketplace-integration/{integration.id}/backfill?start_date=2024-01-01&end_date=2024-01-14"
+    response = client.post(url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == backfill.id
+
+    # Пока аренда действует, загрузку выполняет другой процесс
+    acquire_lease(db, integration.id, "scheduler:1:aaaa")
+    assert client.post(url, headers=auth_headers).status_code == 409
+    release_lease(db, integration.id, "scheduler:1:aaaa")
+
+    wb_integration = MarketplaceIntegration(marketplace_name="Wildberries", company_id=integration.company_id,
+                                            wb_sales_cursor="2024-03-10T12:00:00")
+    db.add(wb_integration)
+    db.commit()
+    base_url = f"/api/marketplace-integration/{wb_integration.id}/backfill?start_date=2024-03-01"
+    response = client.post(f"{base_url}&end_date=2024-03-15", headers=auth_headers)
+    assert response.status_code == 400
+    response = client.post(base_url, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["end_date"] == "2024-03-09"
+    assert db.query(MarketplaceBackfill).filter(MarketplaceBackfill.integration_id == wb_integration.id).count() == 1
@@ -0,0 +1,404 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import pytest
+from sqlalchemy import func
+from app.models.reference import Company, ExpenseItem, IncomeItem, PaymentPlace, SalesChannel
+from app.models.input1 import MoneyMovement
+from app.models.input2 import Asset, Liability
+from app.models.recommendation import (
+    Recommendation, RecommendationDirtyMark, RecommendationType, RecommendationPriority, RecommendationCategory
+)
+from app.models.user_company import UserCompany
+from app.models.product import Product
+from app.models.realization import Realization, RealizationItem
+from app.models.shipment import Shipment
+from app.models.warehouse import Warehouse
+from app.models.inventory import Inventory
+from app.models.customer import Customer
+from app.models.supplier import Supplier
+from app.models.budget import Budget, BudgetPeriod, BudgetType
+from app.services.recommendation_refresh import refresh_dirty_recommendations
+from app.services.recommendation_service import RecommendationService
+from app.services.recommendation_snapshot import CompanyMetricsSnapshot
+from app.services.anomaly_detection import evaluation_months
+
+def test_generation_job_reports_progress(client, auth_headers, db, test_user):
+    """Тест фоновой генерации рекомендаций: задача завершается и отдает итог по организациям"""
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    db.add(UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN"))
+    # Товар без цены продажи дает рекомендацию
+    db.add(Product(name="Товар", cost_price=Decimal("10"), selling_price=None, is_active=True))
+    db.commit()
+
+    response = client.post("/api/recommendations/generate/jobs", headers=auth_headers)
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    # TestClient выполняет фоновые задачи до возврата ответа
+    response = client.get(f"/api/recommendations/generate/jobs/{job_id}", headers=auth_headers)
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "success"
+    assert job["companies_done"] == job["companies_total"] == 1
+    assert job["generated"] > 0
+
+    # Повторная генерация не создает дублей
+    response = client.post("/api/recommendations/generate", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["count"] == 0
+
+def test_refresh_runs_only_changed_domains(client, auth_headers, db, test_user):
+    """Тест инкрементального обновления: изменение бюджета отмечает организацию, обновление снимает отметку"""
+    company = Company(name="Тестовая организация")
+    expense_item = ExpenseItem(name="Аренда")
+    db.add_all([company, expense_item])
+    db.commit()
+    db.add(UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN"))
+    # Правило товаров без цены не зависит от бюджетов и не должно запускаться
+    db.add(Product(name="Товар", cost_price=Decimal("10"), selling_price=None, is_active=True))
+    db.commit()
+
+    response = client.post("/api/budget/", json={
+        "company_id": company.id,
+        "period_type": "month",
+        "period_value": date.today().strftime("%Y-%m"),
+        "budget_type": "expense",
+        "expense_item_id": expense_item.id,
+        "planned_amount": 1000
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    marks = db.query(RecommendationDirtyMark).filter(RecommendationDirtyMark.company_id == company.id).all()
+    assert [mark.domain for mark in marks] == ["budget"]
+
+    result = refresh_dirty_recommendations(workers=1)
+    assert result["companies"] == 1
+    assert result["errors"] == {}
+    assert db.query(RecommendationDirtyMark).count() == 0
+    assert db.query(Recommendation).filter(Recommendation.related_table == "products").count() == 0
+
+def test_shipment_balance_and_supplier_writes_mark_domains(client, auth_headers, db, test_user):
+    """Тест отметок: отгрузки, активы и поставщики отмечают свои области, обновление запускает зависящие правила"""
+    company = Company(name="Тестовая организация")
+    channel = SalesChannel(name="Маркетплейс")
+    db.add_all([company, channel])
+    db.commit()
+    db.add(UserCompany(user_id=test_user.id, company_id=company.id, role="ADMIN"))
+    db.commit()
+
+    def marked():
+        domains = {mark.domain for mark in db.query(RecommendationDirtyMark).filter(RecommendationDirtyMark.company_id == company.id)}
+        db.query(RecommendationDirtyMark).delete()
+        db.commit()
+        return domains
+
+    response = client.post("/api/shipment/", json={
+        "date": date.today().isoformat(), "company_id": company.id, "sales_channel_id": channel.id,
+        "quantity": 3, "cost_price": 100
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    assert marked() == {"sales"}
+    response = client.delete(f"/api/shipment/{response.json()['id']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert marked() == {"sales"}
+
+    response = client.post("/api/suppliers/", json={"company_id": company.id, "name": "Поставщик", "rating": 2}, headers=auth_headers)
+    assert response.status_code == 200
+    assert marked() == {"partners"}
+
+    # Обязательства больше активов: обновление по области активов и пассивов дает рекомендацию
+    for path, category, value in (("assets", "current", 1000), ("liabilities", "short_term", 5000)):
+        response = client.post(f"/api/input2/{path}", json={
+            "name": category, "category": category, "value": value,
+            "date": date.today().isoformat(), "company_id": company.id
+        }, headers=auth_headers)
+        assert response.status_code == 200
+    assert marked() == {"balance"}
+    response = client.put(f"/api/input2/liabilities/{response.json()['id']}", json={
+        "name": "Кредит", "category": "short_term", "value": 6000,
+        "date": date.today().isoformat(), "company_id": company.id
+    }, headers=auth_headers)
+    assert response.status_code == 200
+    assert [mark.domain for mark in db.query(RecommendationDirtyMark)] == ["balance"]
+
+    result = refresh_dirty_recommendations(workers=1)
+    assert result["errors"] == {}
+    titles = {title for title, in db.query(Recommendation.title).filter(Recommendation.company_id == company.id)}
+    assert "Высокое соотношение долга к активам" in titles
+    # Правило поставщиков зависит от активов и пассивов (дебиторская и кредиторская задолженность)
+    assert "Низкий рейтинг поставщика 'Поставщик'" in titles
+
+def test_existing_recommendation_lookup(db):
+    """Тест проверки дублей: по названию или по связанной записи, с учетом скрытых и еще не записанных"""
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    db.add(Recommendation(
+        company_id=company.id, type=RecommendationType.OPERATIONAL, category=RecommendationCategory.PRODUCT,
+        priority=RecommendationPriority.INFO, title="Скрытая", description="", related_table="products",
+        related_id=7, is_dismissed=True
+    ))
+    db.commit()
+
+    service = RecommendationService(db)
+    check = service._check_existing_recommendation
+    assert check(company.id, None, title="Скрытая", is_dismissed=True)
+    assert not check(company.id, None, title="Скрытая")
+    assert check(company.id, RecommendationCategory.PRODUCT, "products", 7, is_dismissed=True)
+    assert check(company.id, None, "products", is_dismissed=True)
+    assert not check(company.id, RecommendationCategory.PRODUCT, "products", 8, is_dismissed=True)
+
+    # Добавленная в пакет рекомендация сразу учитывается при проверке
+    assert service._create_recommendation(
+        company.id, RecommendationType.FINANCIAL, RecommendationCategory.MARGIN, RecommendationPriority.INFO,
+        title="Новая", description="", related_table="products", related_id=8
+    )
+    assert check(company.id, RecommendationCategory.MARGIN, related_id=8)
+    assert check(company.id, None, title="Новая")
+    assert not service._create_recommendation(
+        company.id, RecommendationType.FINANCIAL, RecommendationCategory.MARGIN, RecommendationPriority.INFO,
+        title="Новая", description=""
+    )
+    assert service._flush_recommendations() == 1
+
+def test_expense_anomaly_detected_for_item(db):
+    """Тест поиска аномалий: всплеск расходов по статье за последний месяц дает рекомендацию"""
+    company = Company(name="Тестовая организация")
+    rent = ExpenseItem(name="Аренда")
+    payment_place = PaymentPlace(name="Расчетный счет")
+    db.add_all([company, rent, payment_place])
+    db.commit()
+
+    months = evaluation_months(date.today())
+    for index, month in enumerate(months):
+        amount = Decimal("50000") if month == months[-1] else Decimal(1000 + 10 * (index % 3))
+        db.add(MoneyMovement(
+            date=month, amount=amount, movement_type="expense", company_id=company.id,
+            expense_item_id=rent.id, payment_place_id=payment_place.id, is_business=True
+        ))
+    db.commit()
+
+    RecommendationService(db).generate_recommendations(company.id)
+    titles = {title for title, in db.query(Recommendation.title).filter(Recommendation.company_id == company.id)}
+    assert "Аномальные расходы по статье 'Аренда'" in titles
+    assert "Высокий рост расходов" in titles
+
+# Дата расчета для сравнения со старыми генераторами (текущий квартал - 2024-Q2)
+PARITY_TODAY = date(2024, 5, 15)
+
+# Правила, перенесенные на снимок показателей без изменения логики
+# (рост расходов и аномалии выручки позже переведены на месячные матрицы)
+PARITY_RULES = [
+    "_generate_margin_recommendations",
+    "_generate_cash_flow_recommendations",
+    "_generate_profitability_analysis",
+    "_generate_turnover_recommendations",
+    "_generate_product_recommendations",
+    "_generate_product_performance_analysis",
+    "_generate_trend_recommendations",
+    "_generate_period_comparison_recommendations",
+    "_generate_sales_recommendations",
+    "_generate_budget_recommendations",
+    "_generate_assets_liabilities_recommendations",
+    "_generate_inventory_recommendations",
+    "_generate_customers_suppliers_recommendations",
+]
+
+# Рекомендации, которые на данных recommendation_data давали генераторы до снимка
+# (отдельный запрос к БД на каждый показатель) при date.today() == PARITY_TODAY
+PER_QUERY_RECOMMENDATIONS = [
+    ("Критически низкая маржинальность товара 'Дешевый'", "CRITICAL", "products", 1, "Маржинальность товара 'Дешевый' составляет 5.0%, что ниже минимального порога 10%."),
+    ("Низкая маржинальность товара 'Средний'", "IMPORTANT", "products", 2, "Маржинальность товара 'Средний' составляет 13.0%, что ниже рекомендуемого значения 15%."),
+    ("Низкий остаток денежных средств", "IMPORTANT", None, None, "Остаток денежных средств достаточен только на 15 дней при текущих расходах (минимум 30 дней)."),
+    ("Убыточность бизнеса", "CRITICAL", None, None, "Чистая рентабельность отрицательная (-24.8%). Бизнес работает в убыток."),
+    ("Товар 'Без цены' не продавался более 90 дней", "IMPORTANT", "products", 4, "Товар 'Без цены' не имеет продаж за последние 90 дней, что указывает на медленную оборачиваемость."),
+    ("Товар 'Залежавшийся' не продавался более 90 дней", "IMPORTANT", "products", 5, "Товар 'Залежавшийся' не имеет продаж за последние 90 дней, что указывает на медленную оборачиваемость."),
+    ("Товар 'Без цены' без цены продажи", "IMPORTANT", "products", 4, "Товар 'Без цены' не имеет установленной цены продажи."),
+    ("Товар 'Средний' в числе наименее продаваемых", "IMPORTANT", "products", 2, "Товар 'Средний' находится в нижних 20% по продажам за последние 90 дней (85 единиц)."),
+    ("Снижение выручки", "IMPORTANT", None, None, "Выручка снизилась на 74.3% по сравнению с предыдущим месяцем."),
+    ("Низкая эффективность канала продаж 'Розница'", "IMPORTANT", "sales_channels", 2, "Канал продаж 'Розница' показывает низкие результаты: 13200 ₽ за последние 90 дней, что ниже среднего по всем каналам."),
+    ("Резкое падение продаж в канале 'Маркетплейс'", "IMPORTANT", "sales_channels", 1, "Продажи в канале 'Маркетплейс' упали на 83.1% по сравнению с предыдущим месяцем."),
+    ("Превышение бюджета расходов по статье 'Аренда'", "CRITICAL", "budgets", 1, "Фактические расходов по статье 'Аренда' (7200 ₽) превышают запланированные (2000 ₽) на 260.0% за период 2024-05."),
+    ("Недостижение бюджета доходов по статье 'Продажи'", "IMPORTANT", "budgets", 2, "Фактические доходов по статье 'Продажи' (25200 ₽) ниже запланированных (500000 ₽) на 95.0% за период 2024-Q2."),
+    ("Превышение бюджета расходов", "CRITICAL", "budgets", 3, "Фактические расходов (75150 ₽) превышают запланированные (10000 ₽) на 651.5% за период 2024."),
+    ("Высокое соотношение долга к активам", "CRITICAL", None, None, "Соотношение обязательств к активам составляет 158.7%, что указывает на высокую долговую нагрузку."),
+    ("Низкий коэффициент текущей ликвидности", "CRITICAL", None, None, "Коэффициент текущей ликвидности составляет 0.03, что ниже рекомендуемого значения 1.0. Оборотные активы недостаточны для покрытия краткосрочных обязательств."),
+    ("Высокая дебиторская задолженность", "IMPORTANT", None, None, "Дебиторская задолженность составляет 40.5% от выручки за последние 3 месяца, что указывает на проблемы с взысканием платежей."),
+    ("Низкий остаток товара 'Дешевый' на складе", "IMPORTANT", "inventory", 1, "Остаток товара 'Дешевый' на складе (2) ниже минимального уровня (10)."),
+    ("Избыточный остаток товара 'Ходовой'", "IMPORTANT", "inventory", 2, "Остаток товара 'Ходовой' на складе достаточен на 998 дней при текущих темпах продаж, что указывает на избыточные запасы."),
+    ("Товар 'Залежавшийся' не продавался, но есть остатки", "IMPORTANT", "inventory", 3, "Товар 'Залежавшийся' имеет остаток на складе (40 единиц), но не продавался за последние 90 дней."),
+    ("Клиент 'Ушедший' не совершал покупок более 90 дней", "INFO", "customers", 2, "Клиент 'Ушедший' не совершал покупок 120 дней. Последняя покупка: 2024-01-16."),
+    ("Низкий рейтинг поставщика 'Ненадежный'", "INFO", "suppliers", 2, "Поставщик 'Ненадежный' имеет низкий рейтинг (2.5/5.0), что может указывать на проблемы с качеством или сроками поставок."),
+    ("Высокая кредиторская задолженность", "IMPORTANT", None, None, "Общая кредиторская задолженность составляет 60000 ₽, что составляет 109.3% от расходов за последние 3 месяца."),
+]
+
+@pytest.fixture
+def recommendation_data(db):
+    """
+    Организация с полугодом продаж, денег и отгрузок до PARITY_TODAY: падение продаж маркетплейса
+    за последние 30 дней, рост расходов, товары с низкой маржой и без продаж, остатки, бюджеты,
+    активы и пассивы, клиенты и поставщики. Идентификаторы - в порядке создания.
+    """
+    company = Company(name="Тестовая организация")
+    rent, salary = ExpenseItem(name="Аренда"), ExpenseItem(name="Зарплата")
+    sales_item = IncomeItem(name="Продажи")
+    place = PaymentPlace(name="Расчетный счет")
+    market, shop = SalesChannel(name="Маркетплейс"), SalesChannel(name="Розница")
+    products = {
+        "critical": Product(name="Дешевый", cost_price=Decimal("95"), selling_price=Decimal("100"), is_active=True),
+        "low": Product(name="Средний", cost_price=Decimal("87"), selling_price=Decimal("100"), is_active=True),
+        "good": Product(name="Ходовой", cost_price=Decimal("40"), selling_price=Decimal("100"), is_active=True),
+        "no_price": Product(name="Без цены", cost_price=Decimal("10"), selling_price=None, is_active=True),
+        "idle": Product(name="Залежавшийся", cost_price=Decimal("50"), selling_price=Decimal("100"), is_active=True),
+        "inactive": Product(name="Снятый", cost_price=Decimal("99"), selling_price=Decimal("100"), is_active=False),
+    }
+    db.add_all([company, rent, salary, sales_item, place, market, shop, *products.values()])
+    db.commit()
+    warehouse = Warehouse(name="Основной", company_id=company.id)
+    customers = [
+        Customer(company_id=company.id, name="Постоянный", last_purchase_date=PARITY_TODAY - timedelta(days=5), ltv=Decimal("50000")),
+        Customer(company_id=company.id, name="Ушедший", last_purchase_date=PARITY_TODAY - timedelta(days=120), ltv=Decimal("9000")),
+        Customer(company_id=company.id, name="Неактивный", last_purchase_date=PARITY_TODAY - timedelta(days=300), is_active=False),
+    ]
+    db.add_all([
+        warehouse, *customers,
+        Supplier(company_id=company.id, name="Надежный", rating=Decimal("4.5")),
+        Supplier(company_id=company.id, name="Ненадежный", rating=Decimal("2.5"))
+    ])
+    db.commit()
+
+    # Продажи и отгрузки с ноября (и несколько дней после PARITY_TODAY);
+    # продажи маркетплейса за последние 30 дней падают в 6 раз
+    day = date(2023, 11, 1)
+    while day < PARITY_TODAY + timedelta(days=3):
+        recent = day >= PARITY_TODAY - timedelta(days=30)
+        for channel, base in ((market, 6), (shop, 2)):
+            if day.day % 3 and channel is shop:
+                continue
+            quantity = 1 if recent and channel is market else base
+            for key in ("critical", "low", "good"):
+                if key == "low" and day.day % 5:
+                    continue
+                realization = Realization(
+                    date=day, company_id=company.id, sales_channel_id=channel.id, customer_id=customers[0].id,
+                    warehouse_id=warehouse.id, revenue=Decimal(100 * quantity), quantity=quantity
+                )
+                db.add(realization)
+                db.flush()
+                db.add(RealizationItem(realization_id=realization.id, product_id=products[key].id, quantity=quantity,
+                                       price=Decimal("100"), cost_price=products[key].cost_price))
+                db.add(Shipment(date=day, company_id=company.id, product_id=products[key].id,
+                                sales_channel_id=channel.id, quantity=quantity, cost_price=products[key].cost_price))
+        day += timedelta(days=1)
+
+    # Деньги: ежедневные поступления и расходы, расходы за последние 30 дней вдвое выше,
+    # плюс небизнес-расходы раз в месяц
+    day = date(2023, 11, 1)
+    while day <= PARITY_TODAY:
+        recent = day >= PARITY_TODAY - timedelta(days=30)
+        db.add(MoneyMovement(date=day, amount=Decimal("560"), movement_type="income", company_id=company.id,
+                             income_item_id=sales_item.id, payment_place_id=place.id, is_business=True))
+        db.add(MoneyMovement(date=day, amount=Decimal("900" if recent else "450"), movement_type="expense",
+                             company_id=company.id, expense_item_id=rent.id if day.day % 2 else salary.id,
+                             payment_place_id=place.id, is_business=True))
+        if day.day == 10:
+            db.add(MoneyMovement(date=day, amount=Decimal("5000"), movement_type="expense", company_id=company.id,
+                                 expense_item_id=salary.id, payment_place_id=place.id, is_business=False))
+        day += timedelta(days=1)
+
+    db.add_all([
+        Inventory(product_id=products["critical"].id, warehouse_id=warehouse.id, quantity=Decimal("2"), min_stock_level=Decimal("10")),
+        Inventory(product_id=products["good"].id, warehouse_id=warehouse.id, quantity=Decimal("5000"), min_stock_level=Decimal("10")),
+        Inventory(product_id=products["idle"].id, warehouse_id=warehouse.id, quantity=Decimal("40"), min_stock_level=Decimal("0")),
+        Asset(name="Касса", category="current", value=Decimal("3000"), date=PARITY_TODAY - timedelta(days=10), company_id=company.id),
+        Asset(name="Долги покупателей", category="receivable", value=Decimal("40000"), date=PARITY_TODAY - timedelta(days=10), company_id=company.id),
+        Asset(name="Оборудование", category="fixed", value=Decimal("20000"), date=PARITY_TODAY - timedelta(days=200), company_id=company.id),
+        # Актив будущей датой не учитывается
+        Asset(name="Будущий", category="fixed", value=Decimal("99999"), date=PARITY_TODAY + timedelta(days=10), company_id=company.id),
+        Liability(name="Кредит", category="short_term", value=Decimal("30000"), date=PARITY_TODAY - timedelta(days=20), company_id=company.id),
+        Liability(name="Поставщики", category="payable", value=Decimal("60000"), date=PARITY_TODAY - timedelta(days=20), company_id=company.id),
+        Liability(name="Лизинг", category="long_term", value=Decimal("10000"), date=PARITY_TODAY - timedelta(days=20), company_id=company.id),
+        Budget(company_id=company.id, period_type=BudgetPeriod.MONTH, period_value="2024-05", budget_type=BudgetType.EXPENSE,
+               expense_item_id=rent.id, planned_amount=Decimal("2000")),
+        Budget(company_id=company.id, period_type=BudgetPeriod.QUARTER, period_value="2024-Q2", budget_type=BudgetType.INCOME,
+               income_item_id=sales_item.id, planned_amount=Decimal("500000")),
+        Budget(company_id=company.id, period_type=BudgetPeriod.YEAR, period_value="2024", budget_type=BudgetType.EXPENSE,
+               planned_amount=Decimal("10000")),
+        # Закончившийся бюджет не проверяется
+        Budget(company_id=company.id, period_type=BudgetPeriod.MONTH, period_value="2024-04", budget_type=BudgetType.EXPENSE,
+               planned_amount=Decimal("1")),
+    ])
+    db.commit()
+    return company
+
+def test_snapshot_generators_match_per_query_version(db, recommendation_data):
+    """Тест генераторов на снимке показателей: те же рекомендации, что у прежних запросов по каждому показателю"""
+    company = recommendation_data
+    service = RecommendationService(db)
+    service._load_existing(company.id)
+    service.snapshot = CompanyMetricsSnapshot(db, company.id, today=PARITY_TODAY)
+    for rule in PARITY_RULES:
+        getattr(service, rule)(company.id)
+    service._flush_recommendations()
+
+    generated = [
+        (row.title, row.priority.name, row.related_table, row.related_id, row.description)
+        for row in db.query(Recommendation).filter(Recommendation.company_id == company.id)
+    ]
+    assert sorted(generated) == sorted(PER_QUERY_RECOMMENDATIONS)
+
+def test_snapshot_sums_match_queries(db, recommendation_data):
+    """Тест снимка: суммы за периоды генераторов совпадают с агрегатными запросами по тем же условиям"""
+    company = recommendation_data
+    snapshot = CompanyMetricsSnapshot(db, company.id, today=PARITY_TODAY)
+    periods = [
+        (PARITY_TODAY - timedelta(days=30), PARITY_TODAY - timedelta(days=1)),
+        (PARITY_TODAY - timedelta(days=60), PARITY_TODAY - timedelta(days=31)),
+        (PARITY_TODAY - timedelta(days=90), PARITY_TODAY),
+        (PARITY_TODAY - timedelta(days=180), PARITY_TODAY),
+        (date(2024, 1, 1), date(2024, 3, 31)),
+        (date(2024, 4, 1), PARITY_TODAY),
+    ]
+    for start, end in periods:
+        revenue = db.query(func.sum(Realization.revenue)).filter(
+            Realization.company_id == company.id, Realization.date >= start, Realization.date <= end
+        ).scalar() or 0
+        assert snapshot.revenue(start, end) == revenue
+        for channel_id in (1, 2):
+            channel_revenue = db.query(func.sum(Realization.revenue)).filter(
+                Realization.company_id == company.id, Realization.sales_channel_id == channel_id,
+                Realization.date >= start, Realization.date <= end
+            ).scalar() or 0
+            assert snapshot.revenue(start, end, channel_id) == channel_revenue
+
+        for movement_type in ("income", "expense"):
+            business = db.query(func.sum(MoneyMovement.amount)).filter(
+                MoneyMovement.company_id == company.id, MoneyMovement.movement_type == movement_type,
+                MoneyMovement.is_business == True, MoneyMovement.date >= start, MoneyMovement.date <= end
+            ).scalar() or 0
+            assert snapshot.money(movement_type, start, end) == business
+        salary = db.query(func.sum(MoneyMovement.amount)).filter(
+            MoneyMovement.company_id == company.id, MoneyMovement.expense_item_id == 2,
+            MoneyMovement.date >= start, MoneyMovement.date <= end
+        ).scalar() or 0
+        assert snapshot.money(None, start, end, business_only=False, expense_item_id=2) == salary
+
+        cost = db.query(func.sum(Shipment.cost_price * Shipment.quantity)).filter(
+            Shipment.company_id == company.id, Shipment.date >= start, Shipment.date <= end
+        ).scalar() or 0
+        assert snapshot.shipment_cost(start, end) == cost
+
+    # Продажи по товарам за 90 дней - без верхней границы даты, как в прежнем запросе
+    start = PARITY_TODAY - timedelta(days=90)
+    item_sales = db.query(
+        RealizationItem.product_id,
+        func.sum(RealizationItem.quantity),
+        func.sum(RealizationItem.price * RealizationItem.quantity)
+    ).join(Realization).filter(
+        Realization.company_id == company.id, Realization.date >= start
+    ).group_by(RealizationItem.product_id).all()
+    assert {
+        product_id: (sales["total_quantity"], sales["total_revenue"])
+        for product_id, sales in snapshot.item_sales_by_product(start).items()
+    } == {product_id: (quantity, revenue) for product_id, quantity, revenue in item_sales}
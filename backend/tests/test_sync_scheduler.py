@@ -0,0 +1,118 @@
+import threading
+import time
+from datetime import date
+import pytest
+from app.models.reference import Company
+from app.models.marketplace_integration import MarketplaceIntegration
+from app.services import sync_scheduler
+from app.services.sync_lease import SyncCancelled
+from app.services.sync_scheduler import TokenBucket, MarketplaceLimiter, SyncMetrics, check_and_sync_integrations
+
+def test_token_bucket_burst_and_refill():
+    """Тест token bucket: не больше capacity запусков подряд, затем пополнение со скоростью rate"""
+    bucket = TokenBucket(rate_per_second=1.0, capacity=2)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    # Прошло 1.5 секунды - накопился один токен
+    bucket.updated_at -= 1.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    # Долгий простой не дает больше capacity токенов
+    bucket.updated_at -= 100
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+def test_marketplace_limiter_concurrency():
+    """Тест лимита одновременных синхронизаций маркетплейса"""
+    limiter = MarketplaceLimiter(concurrency=2, starts_per_minute=600)
+    assert limiter.try_start()
+    assert limiter.try_start()
+    assert not limiter.try_start()
+    limiter.finish()
+    assert limiter.running == 1
+
+def test_sync_metrics_snapshot():
+    """Тест метрик: счетчики по статусам, средняя и максимальная длительность, максимум очереди"""
+    metrics = SyncMetrics()
+    metrics.set_queue(5, 2)
+    metrics.set_queue(1, 3)
+    metrics.record_run("ozon", 2.0, "success")
+    metrics.record_run("ozon", 4.0, "timeout")
+    metrics.record_run("wildberries", 0.0, "skipped")
+
+    snapshot = metrics.snapshot()
+    assert snapshot["queue_depth"] == 1
+    assert snapshot["max_queue_depth"] == 5
+    assert snapshot["in_flight"] == 3
+    ozon = snapshot["marketplaces"]["ozon"]
+    assert (ozon["runs"], ozon["success"], ozon["timeout"]) == (2, 1, 1)
+    assert ozon["avg_seconds"] == 3.0
+    assert ozon["max_seconds"] == 4.0
+    assert snapshot["marketplaces"]["wildberries"]["skipped"] == 1
+
+def test_scheduler_cancels_timed_out_sync(monkeypatch):
+    """Тест планировщика: зависшая синхронизация получает отмену и учитывается как timeout только после остановки"""
+    jobs = [
+        {"integration_id": 1, "marketplace_name": "OZON", "marketplace": "ozon"},
+        {"integration_id": 2, "marketplace_name": "OZON", "marketplace": "ozon"},
+        {"integration_id": 3, "marketplace_name": "Wildberries", "marketplace": "wildberries"},
+        {"integration_id": 4, "marketplace_name": "Wildberries", "marketplace": "wildberries"},
+    ]
+    for job in jobs:
+        job.update(start_date=date(2024, 3, 1), end_date=date(2024, 3, 2))
+    stopped = threading.Event()
+
+    def fake_sync(integration_id, marketplace_name, start_date, end_date, cancel_event=None):
+        if integration_id == 1:
+            return True
+        if integration_id == 2:
+            # Длинная синхронизация: проверяет отмену между "страницами"
+            while not cancel_event.wait(0.05):
+                pass
+            stopped.set()
+            raise SyncCancelled("остановлена")
+        if integration_id == 3:
+            return False
+        raise Exception("Нет учетных данных")
+
+    metrics = SyncMetrics()
+    monkeypatch.setattr(sync_scheduler, "metrics", metrics)
+    monkeypatch.setattr(sync_scheduler, "_collect_due_integrations", lambda: [dict(job) for job in jobs])
+    monkeypatch.setattr(sync_scheduler, "perform_sync", fake_sync)
+
+    started = time.monotonic()
+    check_and_sync_integrations(max_workers=4, timeout_seconds=0.2, cancel_grace_seconds=30)
+    assert time.monotonic() - started < 10
+    assert stopped.is_set()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["marketplaces"]["ozon"]["success"] == 1
+    assert snapshot["marketplaces"]["ozon"]["timeout"] == 1
+    assert snapshot["marketplaces"]["wildberries"]["skipped"] == 1
+    assert snapshot["marketplaces"]["wildberries"]["error"] == 1
+    assert snapshot["in_flight"] == 0
+
+def test_perform_sync_stops_on_cancel(db):
+    """Тест отмены синхронизации: страницы не запрашиваются, аренда освобождается, статус - ошибка"""
+    from app.api.marketplace_integration import perform_sync
+
+    company = Company(name="Тестовая организация")
+    db.add(company)
+    db.commit()
+    integration = MarketplaceIntegration(marketplace_name="OZON", company_id=company.id,
+                                         ozon_client_id="client", ozon_api_key="cancel-key")
+    db.add(integration)
+    db.commit()
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(SyncCancelled):
+        perform_sync(integration.id, "ozon", date(2024, 3, 1), date(2024, 3, 2), cancel_event=cancel_event)
+
+    db.refresh(integration)
+    assert integration.last_sync_status == "error"
+    assert "превышено время" in integration.last_sync_error
+    assert integration.sync_lease_owner is None
+    assert integration.last_sync_at is None